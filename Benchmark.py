@@ -0,0 +1,327 @@
+from collections import Counter
+from contextlib import redirect_stdout
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import QueryEngine
+from GenerateData import RecordGenerator, WriteImportFile, WriteRecordsFile, WriteTestsFile
+from Project2 import (AbnormalRows, CalculateTurnaroundTimes, ExportMedicalRecordsToCSV, FilterByPatientId,
+                      FilterByStatus, FilterByTestName, FilterRecordsByAbnormalTests, FilterRecordsByDates,
+                      FilterRecordsByQuery, GenerateSLAReport, GenerateSummaryReport, ImportCSVToMedicalRecord,
+                      ReadMedicalTests)
+from QueryEngine import Query, ScanRows
+from RecordFiles import (OffsetIndexFileOf, ReadMedicalRecordsFromFile, ReadPatientRecords, SnapshotFileOf,
+                         UpdateOffsetIndex)
+from RecordStore import RecordStore
+from StorageBackends import ConvertMedicalRecordFile, FlatFileBackend
+
+
+# Function to write seeded synthetic MedicalRecord.txt and MedicalTests.txt files into Directory
+def WriteSampleFiles(Directory: str, Rows: int, Seed: int = 1, MalformedRate: float = 0.0) -> Tuple[str, str]:
+    RecordsFile = os.path.join(Directory, 'MedicalRecord.txt')
+    TestsFile = os.path.join(Directory, 'MedicalTests.txt')
+    WriteRecordsFile(RecordsFile, Rows, RecordGenerator(Seed, Rows=Rows, MalformedRate=MalformedRate))
+    WriteTestsFile(TestsFile)
+    return RecordsFile, TestsFile
+
+
+# The layout used before RecordStore: one dictionary of strings per record
+def ReadLegacyLayout(RecordsFile: str) -> Dict[str, List[Dict[str, str]]]:
+    MedicalRecords = {}
+    with open(RecordsFile, 'r') as file:
+        for Line in file:
+            parts = Line.strip().split(': ', 1)
+            if len(parts) != 2:
+                continue
+            RecordData = parts[1].split(', ')
+            record = {"TestName": RecordData[0], "DateTime": RecordData[1], "Result": RecordData[2],
+                      "Unit": RecordData[3], "Status": RecordData[4]}
+            if len(RecordData) == 6:
+                record["CompletionTime"] = RecordData[5]
+            MedicalRecords.setdefault(parts[0], []).append(record)
+    return MedicalRecords
+
+
+# Function to measure load time and memory held by a loader
+def MeasureLoad(Loader, RecordsFile: str):
+    tracemalloc.start()
+    Start = time.perf_counter()
+    Loaded = Loader(RecordsFile)
+    Elapsed = time.perf_counter() - Start
+    Current, Peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del Loaded
+    return Elapsed, Current, Peak
+
+
+def BenchmarkMemory(Rows: int):
+    with tempfile.TemporaryDirectory() as Directory:
+        RecordsFile, _ = WriteSampleFiles(Directory, Rows)
+        print(f"--------------------------\t{Rows} records\t--------------------------")
+        for Name, Loader in (("Dict layout", ReadLegacyLayout), ("RecordStore", ReadMedicalRecordsFromFile)):
+            Elapsed, Current, Peak = MeasureLoad(Loader, RecordsFile)
+            print(f" {Name:12}\t Load: {Elapsed:.2f} s\t Held: {Current / 2**20:.1f} MiB\t"
+                  f" Peak: {Peak / 2**20:.1f} MiB\t Per record: {Current / Rows:.0f} bytes")
+
+
+# Function to show how the load time scales with the number of loader processes
+def BenchmarkParallelLoad(Rows: int, WorkerCounts: List[int]):
+    with tempfile.TemporaryDirectory() as Directory:
+        RecordsFile, _ = WriteSampleFiles(Directory, Rows)
+        print(f"--------------------------\t{Rows} records, {os.cpu_count()} cores\t--------------------------")
+        Baseline = None
+        for Workers in WorkerCounts:
+            Start = time.perf_counter()
+            ReadMedicalRecordsFromFile(RecordsFile, Workers=Workers)
+            Elapsed = time.perf_counter() - Start
+            Baseline = Baseline or Elapsed
+            print(f" Workers: {Workers}\t Load: {Elapsed:.2f} s\t Speedup: {Baseline / Elapsed:.2f}x")
+
+
+# Function to show how the scans of an unloaded records file scale with the number of processes; the
+# output of every run is compared with the single process one
+def BenchmarkParallelScans(Rows: int, WorkerCounts: List[int]):
+    with tempfile.TemporaryDirectory() as Directory:
+        RecordsFile, TestsFile = WriteSampleFiles(Directory, Rows)
+        MedicalTests = ReadMedicalTests(TestsFile)
+        Storage = FlatFileBackend(RecordsFile)
+        print(f"--------------------------\t{Rows} records, {os.cpu_count()} cores, "
+              f"{len(Storage.Shards())} shards\t--------------------------")
+        Scans = (('FilterRecordsByAbnormalTests',
+                  lambda Parallel: FilterRecordsByAbnormalTests(Storage, MedicalTests, Parallel)),
+                 ('CalculateTurnaroundTimes', lambda Parallel: print(CalculateTurnaroundTimes(Storage, Parallel))),
+                 ('GenerateSummaryReport',
+                  lambda Parallel: GenerateSummaryReport(Storage, Monthly=True, Parallel=Parallel)))
+        for Name, Scan in Scans:
+            Baseline = Expected = None
+            for Workers in WorkerCounts:
+                Output = io.StringIO()
+                Start = time.perf_counter()
+                with redirect_stdout(Output):
+                    Scan(Workers)
+                Elapsed = time.perf_counter() - Start
+                Baseline = Baseline or Elapsed
+                Expected = Expected if Expected is not None else Output.getvalue()
+                Same = 'same output' if Output.getvalue() == Expected else 'OUTPUT DIFFERS'
+                print(f" {Name:30} Workers: {Workers}\t {Elapsed:.2f} s\t Speedup: {Baseline / Elapsed:.2f}x\t {Same}")
+
+
+# Function to compare size and cold load time of a records file as text, as text with its snapshot and
+# in the compact format; every loaded store is checked against the text one
+def BenchmarkFormats(Rows: int):
+    with tempfile.TemporaryDirectory() as Directory:
+        RecordsFile, _ = WriteSampleFiles(Directory, Rows)
+        Size = os.path.getsize(RecordsFile)
+        print(f"--------------------------\t{Rows} records, {Size / 2**20:.1f} MiB of text\t--------------------------")
+        Start = time.perf_counter()
+        Expected = ReadMedicalRecordsFromFile(RecordsFile)
+        print(f" {'text':14}\t Size: {Size / 2**20:7.1f} MiB\t Ratio: {1:5.1f}x\t"
+              f" Load: {time.perf_counter() - Start:.2f} s")
+        ReadMedicalRecordsFromFile(RecordsFile, UseSnapshot=True)  # Writes the snapshot
+        Start = time.perf_counter()
+        ReadMedicalRecordsFromFile(RecordsFile, UseSnapshot=True)
+        Elapsed = time.perf_counter() - Start
+        Snapshot = os.path.getsize(SnapshotFileOf(RecordsFile))
+        print(f" {'text+snapshot':14}\t Size: {(Size + Snapshot) / 2**20:7.1f} MiB\t"
+              f" Ratio: {Size / (Size + Snapshot):5.1f}x\t Load: {Elapsed:.2f} s")
+        Lines = [Expected.FormatLine(RowId) for RowId in range(Expected.RowCount)]
+        for Format in ('zlib', 'lzma'):
+            CompactFile = os.path.join(Directory, f'MedicalRecord.{Format}')
+            Start = time.perf_counter()
+            ConvertMedicalRecordFile(RecordsFile, CompactFile, Format)
+            Written = time.perf_counter() - Start
+            Start = time.perf_counter()
+            Loaded = ReadMedicalRecordsFromFile(CompactFile)
+            Elapsed = time.perf_counter() - Start
+            Same = 'same records' if [Loaded.FormatLine(RowId) for RowId in range(Loaded.RowCount)] == Lines \
+                else 'RECORDS DIFFER'
+            print(f" {Format:14}\t Size: {os.path.getsize(CompactFile) / 2**20:7.1f} MiB\t"
+                  f" Ratio: {Size / os.path.getsize(CompactFile):5.1f}x\t Load: {Elapsed:.2f} s\t"
+                  f" Convert: {Written:.2f} s\t {Same}")
+
+
+# The abnormal scan as it was written for the dictionary layout
+def LegacyAbnormalScan(MedicalRecords, medical_tests) -> int:
+    Found = 0
+    for PatientId, tests in MedicalRecords.items():
+        for test in tests:
+            TestName = test['TestName']
+            TestResult = float(test['Result'])
+            if TestName in medical_tests:
+                TestRange = medical_tests[TestName]['range']
+                if ('low' in TestRange and TestResult < TestRange['low']) or \
+                   ('high' in TestRange and TestResult > TestRange['high']):
+                    Found += 1
+    return Found
+
+
+# Function to time the abnormal-result scan: dictionary loop, column loop and NumPy
+def BenchmarkAbnormalScan(Rows: int):
+    with tempfile.TemporaryDirectory() as Directory:
+        RecordsFile, TestsFile = WriteSampleFiles(Directory, Rows)
+        MedicalTests = ReadMedicalTests(TestsFile)
+        print(f"--------------------------\t{Rows} records, abnormal scan\t--------------------------")
+
+        Legacy = ReadLegacyLayout(RecordsFile)
+        Start = time.perf_counter()
+        Found = LegacyAbnormalScan(Legacy, MedicalTests)
+        print(f" Dict loop   \t {time.perf_counter() - Start:.3f} s\t {Found} abnormal")
+        del Legacy
+
+        Store = ReadMedicalRecordsFromFile(RecordsFile)
+        NumPy = QueryEngine.np
+        QueryEngine.np = None
+        Start = time.perf_counter()
+        Found = len(ScanRows(Store, medical_tests=MedicalTests))
+        print(f" Column loop \t {time.perf_counter() - Start:.3f} s\t {Found} abnormal")
+        QueryEngine.np = NumPy
+        if NumPy is None:
+            print(" NumPy       \t not installed")
+            return
+        Start = time.perf_counter()
+        Found = len(ScanRows(Store, medical_tests=MedicalTests))
+        print(f" NumPy       \t {time.perf_counter() - Start:.3f} s\t {Found} abnormal")
+
+
+# Function to time Call() Repeat times, then measure its peak traced memory in one more run.
+# The first run starts without the store indexes the call builds, the later ones reuse them.
+def ProfileCall(Name: str, Rows: int, Call, Repeat: int) -> Dict:
+    Times = []
+    with open(os.devnull, 'w') as DevNull, redirect_stdout(DevNull):
+        for _ in range(Repeat):
+            Start = time.perf_counter()
+            Call()
+            Times.append(time.perf_counter() - Start)
+        tracemalloc.start()
+        Call()
+        _, Peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    Result = {'benchmark': Name, 'rows': Rows, 'first_seconds': Times[0], 'best_seconds': min(Times),
+              'peak_bytes': Peak}
+    print(f" {Name:28}\t First: {Times[0]:.3f} s\t Best: {min(Times):.3f} s\t Peak: {Peak / 2**20:.1f} MiB")
+    return Result
+
+
+# Function to time and memory-profile the public functions on seeded data of Rows records
+def BenchmarkSuite(Rows: int, Seed: int, Repeat: int) -> List[Dict]:
+    Results = []
+    with tempfile.TemporaryDirectory() as Directory:
+        RecordsFile, TestsFile = WriteSampleFiles(Directory, Rows, Seed, MalformedRate=0.0001)
+        print(f"--------------------------\t{Rows} records, suite\t--------------------------")
+        Quiet = lambda Offset, Line: None
+
+        Results.append(ProfileCall('ReadMedicalRecordsFromFile', Rows,
+                                   lambda: ReadMedicalRecordsFromFile(RecordsFile, Quiet), Repeat))
+        Results.append(ProfileCall('ReadMedicalTests', Rows, lambda: ReadMedicalTests(TestsFile), Repeat))
+        Store = ReadMedicalRecordsFromFile(RecordsFile, Quiet)
+        MedicalTests = ReadMedicalTests(TestsFile)
+        BusiestPatient = Store.Patients.Strings[Counter(Store.PatientCodes).most_common(1)[0][0]]
+        Criteria = Query(TestName='Hgb', StartDate=datetime(2024, 3, 1), EndDate=datetime(2024, 3, 31, 23, 59),
+                         Abnormal=True)
+        Cases = [
+            ('FilterByPatientId', lambda: FilterByPatientId(Store, BusiestPatient)),
+            ('FilterByTestName', lambda: FilterByTestName(Store, 'Hgb')),
+            ('FilterByStatus', lambda: FilterByStatus(Store, 'Completed')),
+            ('FilterRecordsByDates', lambda: FilterRecordsByDates(Store, datetime(2024, 3, 1), datetime(2024, 3, 31))),
+            ('FilterRecordsByQuery', lambda: FilterRecordsByQuery(Store, Criteria, MedicalTests)),
+            ('AbnormalRows', lambda: AbnormalRows(Store, MedicalTests)),
+            ('CalculateTurnaroundTimes', lambda: CalculateTurnaroundTimes(Store)),
+            ('GenerateSummaryReport', lambda: GenerateSummaryReport(Store)),
+            ('GenerateSLAReport', lambda: GenerateSLAReport(Store, MedicalTests)),
+        ]
+        for Name, Call in Cases:
+            Store.Indexes.clear()
+            Results.append(ProfileCall(Name, Rows, Call, Repeat))
+
+        # Lazy mode: build the patient offset index, then read one patient through it without loading
+        def BuildOffsetIndex():
+            if os.path.exists(OffsetIndexFileOf(RecordsFile)):
+                os.remove(OffsetIndexFileOf(RecordsFile))
+            UpdateOffsetIndex(RecordsFile)
+        Results.append(ProfileCall('UpdateOffsetIndex', Rows, BuildOffsetIndex, Repeat))
+        Results.append(ProfileCall('ReadPatientRecords', Rows,
+                                   lambda: ReadPatientRecords(RecordsFile, BusiestPatient), Repeat))
+
+        # CSV in and out: export everything, import a lab file of as many records into an empty records file
+        CSVFile = os.path.join(Directory, 'medical_records.csv')
+        LabFile = os.path.join(Directory, 'lab_results.csv')
+        ImportFile = os.path.join(Directory, 'Imported.txt')
+        Results.append(ProfileCall('ExportMedicalRecordsToCSV', Rows,
+                                   lambda: ExportMedicalRecordsToCSV(Store, CSVFile), Repeat))
+        WriteImportFile(LabFile, Rows, RecordGenerator(Seed + 1, Rows=Rows))
+
+        def ImportIntoEmptyFile():
+            open(ImportFile, 'w').close()
+            ImportCSVToMedicalRecord(LabFile, ImportFile, RecordStore(), MedicalTests)
+        Results.append(ProfileCall('ImportCSVToMedicalRecord', Rows, ImportIntoEmptyFile, Repeat))
+    return Results
+
+
+# Function to get the current git commit, None outside a git checkout
+def CurrentCommit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Function to print how the results compare with those of an earlier --json file
+def CompareResults(Results: List[Dict], BaselineFile: str):
+    with open(BaselineFile) as file:
+        Baseline = json.load(file)
+    Before = {(Result['benchmark'], Result['rows']): Result for Result in Baseline['results']}
+    print(f"--------------------------\tAgainst {Baseline.get('commit') or BaselineFile}\t--------------------------")
+    for Result in Results:
+        Old = Before.get((Result['benchmark'], Result['rows']))
+        if Old is None or not Old['best_seconds'] or not Old['peak_bytes']:
+            continue
+        print(f" {Result['benchmark']:28}\t {Result['rows']} rows\t"
+              f" Time: {Result['best_seconds'] / Old['best_seconds']:.2f}x\t"
+              f" Peak: {Result['peak_bytes'] / Old['peak_bytes']:.2f}x")
+
+
+if __name__ == "__main__":
+    Parser = argparse.ArgumentParser(description="Benchmarks for the Medical Record Management System")
+    Parser.add_argument('benchmarks', nargs='*', default=['memory'],
+                        help="memory, load, scan, format, abnormal, suite")
+    Parser.add_argument('--rows', type=int, nargs='+', default=[100000, 1000000])
+    Parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    Parser.add_argument('--seed', type=int, default=1, help="Seed of the generated data (suite)")
+    Parser.add_argument('--repeat', type=int, default=3, help="Timed runs of every function (suite)")
+    Parser.add_argument('--json', help="Write the suite results to this file")
+    Parser.add_argument('--compare', help="Compare the suite results with an earlier --json file")
+    Arguments = Parser.parse_args()
+
+    SuiteResults = []
+    for Rows in Arguments.rows:
+        if 'memory' in Arguments.benchmarks:
+            BenchmarkMemory(Rows)
+        if 'load' in Arguments.benchmarks:
+            BenchmarkParallelLoad(Rows, Arguments.workers)
+        if 'scan' in Arguments.benchmarks:
+            BenchmarkParallelScans(Rows, Arguments.workers)
+        if 'format' in Arguments.benchmarks:
+            BenchmarkFormats(Rows)
+        if 'abnormal' in Arguments.benchmarks:
+            BenchmarkAbnormalScan(Rows)
+        if 'suite' in Arguments.benchmarks:
+            SuiteResults.extend(BenchmarkSuite(Rows, Arguments.seed, Arguments.repeat))
+
+    if Arguments.json:
+        with open(Arguments.json, 'w') as file:
+            json.dump({'commit': CurrentCommit(), 'python': platform.python_version(),
+                       'numpy': QueryEngine.np.__version__ if QueryEngine.np is not None else None,
+                       'cpus': os.cpu_count(), 'seed': Arguments.seed, 'repeat': Arguments.repeat,
+                       'results': SuiteResults}, file, indent=2)
+    if Arguments.compare:
+        CompareResults(SuiteResults, Arguments.compare)
@@ -0,0 +1,344 @@
+from array import array
+from itertools import accumulate, chain, islice
+from typing import Dict, Iterator, List, Optional, Tuple
+import json
+import lzma
+import math
+import mmap
+import operator
+import os
+import struct
+import sys
+import tempfile
+import zlib
+
+from RecordColumns import MissingTime, StringTable
+from RecordStore import RecordStore
+from RecordJournal import ReplaceFile
+
+
+# Compact records file: MedicalRecord.txt in blocks of CompactBlockRows records, several times smaller
+# and loaded without parsing. Patients, tests, units and statuses are dictionary encoded (every block
+# brings the strings it adds, compressed on their own, so the dictionaries are read without the
+# records); DateTime is stored as the difference to the row before, CompletionTime as the difference
+# to DateTime and Result in hundredths when that is exact. Every column is split into byte planes
+# (all first bytes, then all second bytes, ...) so the compressor finds the runs of equal high bytes.
+# Fields whose text does not round trip keep it, so converting back gives the same lines.
+# Layout: a header, the blocks (dictionary additions, then the records, each compressed with zlib or
+# lzma), the block index as JSON (position, records and DateTime range of every block) and a footer
+# pointing to it. Appends write new blocks and a new index after the old ones, so an append cut short
+# leaves the index before it readable.
+
+CompactMagic = b'MRPACK'
+CompactVersion = 1
+CompactHeader = struct.Struct('<6sH')  # Magic, version
+CompactFooter = struct.Struct('<QQ6s')  # Offset and length of the block index, magic
+CompactSection = struct.Struct('<Q')  # Length of each section of a block
+CompactBlockRows = 65536
+CompactCodecs = {'zlib': (lambda Data: zlib.compress(Data, 6), zlib.decompress),
+                 'lzma': (lzma.compress, lzma.decompress)}
+CompactDictionaries = ('Patients', 'Tests', 'Units', 'Statuses')
+CompactColumns = (('PatientCodes', 'I'), ('TestCodes', 'H'), ('UnitCodes', 'H'), ('StatusCodes', 'H'))
+CompactShardRows = 2**18  # About as many records as a shard (ShardSize) of a text records file
+
+
+# Function to tell whether a records file is in the compact format
+def IsCompactRecordFile(RecordsFile: str) -> bool:
+    try:
+        with open(RecordsFile, 'rb') as file:
+            return file.read(len(CompactMagic)) == CompactMagic
+    except OSError:
+        return False
+
+
+# Function to get the codec of a compact records file, None for a text records file
+def CompactRecordCodec(RecordsFile: str) -> Optional[str]:
+    if not IsCompactRecordFile(RecordsFile):
+        return None
+    with open(RecordsFile, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as Mapped:
+        return ReadCompactIndex(Mapped)['Codec']
+
+
+# Function to store an array as its byte planes, little endian
+def SplitBytePlanes(Column: array) -> bytes:
+    if sys.byteorder != 'little':
+        Column = array(Column.typecode, Column)
+        Column.byteswap()
+    Data = Column.tobytes()
+    return b''.join(Data[Plane::Column.itemsize] for Plane in range(Column.itemsize))
+
+
+# Function to turn byte planes back into an array
+def JoinBytePlanes(Data: bytes, TypeCode: str) -> array:
+    Column = array(TypeCode)
+    Count = len(Data) // Column.itemsize
+    Joined = bytearray(len(Data))
+    for Plane in range(Column.itemsize):
+        Joined[Plane::Column.itemsize] = Data[Plane * Count:(Plane + 1) * Count]
+    Column.frombytes(Joined)
+    if sys.byteorder != 'little':
+        Column.byteswap()
+    return Column
+
+
+# Function to encode results as exact hundredths, None when one of them is not
+def ResultHundredths(Results: array) -> Optional[array]:
+    try:
+        Hundredths = array('q', [round(Value * 100) for Value in Results])
+    except (ValueError, OverflowError):  # NaN or infinite
+        return None
+    for Value, Hundredth in zip(Results, Hundredths):
+        if Hundredth / 100 != Value or Value == 0 and math.copysign(1, Value) < 0:
+            return None
+    return Hundredths
+
+
+# Function to get empty dictionaries, with the statuses every RecordStore starts with
+def CompactTables() -> Dict[str, StringTable]:
+    Store = RecordStore()
+    return {Name: getattr(Store, Name) for Name in CompactDictionaries}
+
+
+# Writer of compact records files. Add() takes records, every CompactBlockRows of them are written as a
+# block, AddRows() copies rows of a store without formatting them; Close() writes the block index and
+# the footer. Index and Tables continue an existing file.
+class CompactRecordWriter:
+    def __init__(self, file, Codec: str = 'zlib', Index: Optional[Dict] = None,
+                 Tables: Optional[Dict[str, StringTable]] = None):
+        self.File = file
+        if Index is None:
+            Index = {"Version": CompactVersion, "Codec": Codec, "Blocks": []}
+            file.write(CompactHeader.pack(CompactMagic, CompactVersion))
+        self.Index = Index
+        self.Compress = CompactCodecs[Index['Codec']][0]
+        self.Tables = Tables or CompactTables()
+        self.Pending = RecordStore()
+        self.Rows = 0
+
+    # Function to add one record (raises ValueError on bad values)
+    def Add(self, PatientId: str, record):
+        self.Pending.AppendRecord(PatientId, record)
+        if self.Pending.RowCount >= CompactBlockRows:
+            self.Flush()
+
+    # Function to add the given rows of a store, in order
+    def AddRows(self, Store: RecordStore, RowIds):
+        self.Flush()
+        Rows = iter(RowIds)
+        while True:
+            Block = array('I', islice(Rows, CompactBlockRows))
+            if not Block:
+                break
+            self.WriteBlock(Store, Block)
+
+    def Flush(self):
+        Block = self.Pending
+        if Block.RowCount:
+            self.Pending = RecordStore()
+            self.WriteBlock(Block, range(Block.RowCount))
+
+    # Function to write the given rows of a store as one block
+    def WriteBlock(self, Store: RecordStore, Rows):
+        self.Rows += len(Rows)
+
+        # Codes of the store -> codes of the file, the strings new to the file are written with the block
+        Added = {}
+        Columns = []
+        for Name, (Column, TypeCode) in zip(CompactDictionaries, CompactColumns):
+            Table = self.Tables[Name]
+            Strings = getattr(Store, Name).Strings
+            Known = len(Table)
+            Codes = array(TypeCode, map(getattr(Store, Column).__getitem__, Rows))
+            CodeMap = {Code: Table.Encode(Strings[Code]) for Code in sorted(set(Codes))}
+            Added[Name] = Table.Strings[Known:]
+            Columns.append(array(TypeCode, map(CodeMap.__getitem__, Codes)))
+
+        Results = array('d', map(Store.Results.__getitem__, Rows))
+        Hundredths = ResultHundredths(Results)
+        Columns.append(Hundredths if Hundredths is not None else Results)
+        DateTimes = array('q', map(Store.DateTimes.__getitem__, Rows))
+        Columns.append(array('q', map(operator.sub, DateTimes, chain((0,), DateTimes))))
+        Columns.append(array('q', (MissingTime if Store.CompletionTimes[RowId] == MissingTime
+                                   else Store.CompletionTimes[RowId] - DateTime
+                                   for RowId, DateTime in zip(Rows, DateTimes))))
+        Sections = [SplitBytePlanes(Column) for Column in Columns]
+        Overrides = {str(Position): Store.TextOverrides[RowId] for Position, RowId in enumerate(Rows)
+                     if RowId in Store.TextOverrides}
+        Sections.append(json.dumps(Overrides).encode())
+
+        Dictionary = self.Compress(json.dumps(Added).encode())
+        Data = self.Compress(b''.join(CompactSection.pack(len(Section)) + Section for Section in Sections))
+        self.Index['Blocks'].append({"Offset": self.File.tell(), "Dictionary": len(Dictionary), "Length": len(Data),
+                                     "Rows": len(Rows), "MinDateTime": min(DateTimes),
+                                     "MaxDateTime": max(DateTimes), "Hundredths": Hundredths is not None})
+        self.File.write(Dictionary)
+        self.File.write(Data)
+
+    def Close(self):
+        self.Flush()
+        Index = json.dumps(self.Index).encode()
+        Offset = self.File.tell()
+        self.File.write(Index)
+        self.File.write(CompactFooter.pack(Offset, len(Index), CompactMagic))
+
+
+# Function to read the block index of a mapped compact records file (raises ValueError when there is
+# none). When the last append was cut short, the footer before it is used.
+def ReadCompactIndex(Mapped) -> Dict:
+    Magic, Version = CompactHeader.unpack_from(Mapped)
+    if Magic != CompactMagic or Version != CompactVersion:
+        raise ValueError("Not a compact records file of a known version")
+    End = len(Mapped)
+    while End >= CompactHeader.size + CompactFooter.size:
+        if Mapped[End - len(CompactMagic):End] == CompactMagic:
+            Offset, Length, _ = CompactFooter.unpack_from(Mapped, End - CompactFooter.size)
+            if Offset + Length == End - CompactFooter.size:
+                try:
+                    return json.loads(Mapped[Offset:Offset + Length])
+                except ValueError:
+                    pass
+        End = Mapped.rfind(CompactMagic, CompactHeader.size, End - 1) + len(CompactMagic)
+    raise ValueError("The block index of the compact records file is missing")
+
+
+# Function to read the dictionaries of a mapped compact records file
+def ReadCompactDictionaries(Mapped, Index: Dict) -> Dict[str, StringTable]:
+    Decompress = CompactCodecs[Index['Codec']][1]
+    Tables = CompactTables()
+    for Block in Index['Blocks']:
+        Added = json.loads(Decompress(Mapped[Block['Offset']:Block['Offset'] + Block['Dictionary']]))
+        for Name, Strings in Added.items():
+            Tables[Name].Strings.extend(Strings)
+            Tables[Name].Codes.update((Value, Code) for Code, Value in enumerate(Strings, len(Tables[Name].Codes)))
+    return Tables
+
+
+# Function to decode the columns of a block: {column name: array} and the text overrides by row
+def DecodeCompactBlock(Mapped, Index: Dict, Block: Dict) -> Tuple[Dict[str, array], Dict[int, Dict[str, str]]]:
+    Start = Block['Offset'] + Block['Dictionary']
+    Data = CompactCodecs[Index['Codec']][1](Mapped[Start:Start + Block['Length']])
+    Sections = []
+    Offset = 0
+    while Offset < len(Data):
+        Length, = CompactSection.unpack_from(Data, Offset)
+        Offset += CompactSection.size
+        Sections.append(Data[Offset:Offset + Length])
+        Offset += Length
+
+    Columns = {Name: JoinBytePlanes(Section, TypeCode) for (Name, TypeCode), Section in zip(CompactColumns, Sections)}
+    if Block['Hundredths']:
+        Columns['Results'] = array('d', [Hundredth / 100 for Hundredth in JoinBytePlanes(Sections[4], 'q')])
+    else:
+        Columns['Results'] = JoinBytePlanes(Sections[4], 'd')
+    DateTimes = Columns['DateTimes'] = array('q', accumulate(JoinBytePlanes(Sections[5], 'q')))
+    Turnarounds = JoinBytePlanes(Sections[6], 'q')
+    Columns['CompletionTimes'] = array('q', [MissingTime if Turnaround == MissingTime else DateTime + Turnaround
+                                             for Turnaround, DateTime in zip(Turnarounds, DateTimes)])
+    for Name, Column in Columns.items():
+        if len(Column) != Block['Rows']:
+            raise ValueError(f"Block at {Block['Offset']} has {len(Column)} {Name} for {Block['Rows']} records")
+    return Columns, {int(RowId): Overrides for RowId, Overrides in json.loads(Sections[7]).items()}
+
+
+# Function to put decoded columns into a store that uses the dictionaries of the file
+def CompactStore(Tables: Dict[str, StringTable], Columns: Dict[str, array], TextOverrides: Dict) -> RecordStore:
+    Store = RecordStore()
+    for Name in CompactDictionaries:
+        setattr(Store, Name, Tables[Name])
+    for Name in RecordStore.ColumnNames:
+        setattr(Store, Name, Columns[Name])
+    Store.TextOverrides = TextOverrides
+    PatientRows = Store.PatientRows
+    for RowId, PatientCode in enumerate(Store.PatientCodes):
+        Rows = PatientRows.get(PatientCode)
+        if Rows is None:
+            Rows = PatientRows[PatientCode] = array('I')
+        Rows.append(RowId)
+    return Store
+
+
+# Function to walk the blocks of a compact records file that start within a byte range: yields the
+# dictionaries, the position of the first record of the block, its columns and text overrides
+def IterCompactBlocks(RecordsFile: str, Start: int = 0, End: Optional[int] = None):
+    with open(RecordsFile, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as Mapped:
+        Index = ReadCompactIndex(Mapped)
+        Tables = ReadCompactDictionaries(Mapped, Index)
+        Base = 0
+        for Block in Index['Blocks']:
+            if Start <= Block['Offset'] and (End is None or Block['Offset'] < End):
+                yield (Tables, Base, *DecodeCompactBlock(Mapped, Index, Block))
+            Base += Block['Rows']
+
+
+# Function to load the blocks of a compact records file that start within a byte range into a store
+def ReadCompactRecordFile(RecordsFile: str, Start: int = 0, End: Optional[int] = None) -> RecordStore:
+    Tables = CompactTables()
+    Columns = {Name: array(Column.typecode) for Name, Column in
+               ((Name, getattr(RecordStore(), Name)) for Name in RecordStore.ColumnNames)}
+    TextOverrides = {}
+    for Tables, _, BlockColumns, BlockOverrides in IterCompactBlocks(RecordsFile, Start, End):
+        Base = len(Columns['PatientCodes'])
+        for Name, Column in BlockColumns.items():
+            Columns[Name].extend(Column)
+        TextOverrides.update((Base + RowId, Overrides) for RowId, Overrides in BlockOverrides.items())
+    Store = CompactStore(Tables, Columns, TextOverrides)
+    for PatientCode in range(len(Store.Patients)):  # Patients of the blocks left out, for later appends
+        Store.PatientRows.setdefault(PatientCode, array('I'))
+    return Store
+
+
+# Function to stream the (PatientId, record) pairs of the blocks of a compact records file that start
+# within a byte range
+def IterCompactRecords(RecordsFile: str, Start: int = 0,
+                       End: Optional[int] = None) -> Iterator[Tuple[str, Dict[str, str]]]:
+    for Tables, _, Columns, TextOverrides in IterCompactBlocks(RecordsFile, Start, End):
+        Block = CompactStore(Tables, Columns, TextOverrides)
+        for RowId in range(Block.RowCount):
+            yield Block.PatientIdOf(RowId), Block.GetRecord(RowId)
+
+
+# Function to read one patient's records from a compact records file: a store of just those records
+# and the position of each of its rows (before the journal)
+def ReadCompactPatientRecords(RecordsFile: str, PatientId: str) -> Tuple[RecordStore, List[int]]:
+    Store = RecordStore()
+    Positions = []
+    for Tables, Base, Columns, TextOverrides in IterCompactBlocks(RecordsFile):
+        PatientCode = Tables['Patients'].Codes.get(PatientId)
+        if PatientCode is None:
+            break  # The dictionaries hold the patients of every block, none of them has records
+        Rows = [RowId for RowId, Code in enumerate(Columns['PatientCodes']) if Code == PatientCode]
+        if Rows:
+            Block = CompactStore(Tables, Columns, TextOverrides)
+            for RowId in Rows:
+                Store.AppendRecord(PatientId, Block.GetRecord(RowId))
+                Positions.append(Base + RowId)
+    return Store, Positions
+
+
+# Function to write records to a new compact records file through a temporary file; returns their number
+def WriteCompactRecordFile(Records, RecordsFile: str, Codec: str = 'zlib') -> int:
+    Directory = os.path.dirname(os.path.abspath(RecordsFile))
+    with tempfile.NamedTemporaryFile('wb', dir=Directory, prefix='.compact-', delete=False) as file:
+        Writer = CompactRecordWriter(file, Codec)
+        for PatientId, record in Records:
+            Writer.Add(PatientId, record)
+        Writer.Close()
+        file.flush()
+        os.fsync(file.fileno())
+    ReplaceFile(file.name, RecordsFile)
+    return Writer.Rows
+
+
+# Function to append records to a compact records file as new blocks and a new index
+def AppendCompactRecords(RecordsFile: str, Records: List[Tuple[str, Dict[str, str]]]):
+    with open(RecordsFile, 'r+b') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as Mapped:
+            Index = ReadCompactIndex(Mapped)
+            Tables = ReadCompactDictionaries(Mapped, Index)
+        file.seek(0, os.SEEK_END)
+        Writer = CompactRecordWriter(file, Index=Index, Tables=Tables)
+        for PatientId, record in Records:
+            Writer.Add(PatientId, record)
+        Writer.Close()
+        file.flush()
+        os.fsync(file.fileno())
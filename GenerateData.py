@@ -0,0 +1,145 @@
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from itertools import accumulate
+from typing import List, Optional
+import argparse
+import csv
+import os
+import random
+
+from Project2 import ImportColumns, FormatTestLine, ParseTestLine
+from RecordColumns import FormatResult
+
+
+# The tests written to MedicalTests.txt, with (mean, standard deviation) of their results
+SampleTests = [
+    ("Name: Hemoglobin (Hgb); Range: > 13.8, < 17.2; Unit: g/dL, 00-03-04", 15.0, 2.0),
+    ("Name: Blood Glucose Test (BGT); Range: > 70, < 99; Unit: mg/dL, 00-12-06", 92.0, 18.0),
+    ("Name: LDL Cholesterol Low-Density Lipoprotein (LDL); Range: < 100; Unit: mg/dL, 00-17-06", 105.0, 30.0),
+    ("Name: Systolic Blood Pressure (systole); Range: < 120; Unit: mm Hg, 00-08-04", 122.0, 15.0),
+    ("Name: Diastolic Blood Pressure (diastole); Range: < 80; Unit: mm Hg, 00-10-00", 78.0, 10.0),
+    ("Name: Red Blood Corpuscles (RBC); Range: > 140.0, < 160.0; Unit: g/L, 00-01-00", 150.0, 9.0),
+    ("Name: Thyroid Stimulating Hormone (TSH); Range: > 0.4, < 4.0; Unit: mIU/L, 01-00-00", 2.2, 1.4),
+    ("Name: Creatinine (Cr); Range: > 0.6, < 1.3; Unit: mg/dL, 00-06-00", 1.0, 0.3),
+]
+
+# Share of the generated records with each status
+StatusWeights = (('Pending', 0.25), ('Completed', 0.6), ('Reviewed', 0.15))
+
+# Lines the loader has to skip
+MalformedLines = ["", "garbage", "1300500 Hgb, 2024-01-01 14:10, 12, g/dL, Pending",
+                  "1300500: Hgb, 2024-01-01 14:10, 12, g/dL", "1300500: Hgb, 2024-13-45 14:10, 12, g/dL, Pending",
+                  "1300500: Hgb, 2024-01-01 14:10, twelve, g/dL, Pending"]
+
+
+# Seeded generator of realistic medical records. A few patients have many records (the patient
+# of each record is drawn from a Zipf-like distribution), results scatter around the normal
+# range of their test and completion times follow the test's turnaround time.
+class RecordGenerator:
+    def __init__(self, Seed: int = 1, Patients: Optional[int] = None, Rows: int = 100000,
+                 StartDate: datetime = datetime(2024, 1, 1), Days: int = 365, Skew: float = 0.8,
+                 MalformedRate: float = 0.0):
+        self.Random = random.Random(Seed)
+        self.Tests = [(ParseTestLine(Line), Mean, Deviation) for Line, Mean, Deviation in SampleTests]
+        self.Patients = Patients or max(Rows // 20, 1)
+        self.Days = Days
+        self.MalformedRate = MalformedRate
+        self.PatientIds = [str(1000000 + Number) for Number in self.Random.sample(range(9000000), self.Patients)]
+        # Cumulative weights 1 / rank ** Skew, a patient is drawn with one bisect
+        self.PatientWeights = list(accumulate(1 / Rank ** Skew for Rank in range(1, self.Patients + 1)))
+        self.StatusLimits = list(accumulate(Weight for _, Weight in StatusWeights))
+        # Formatting dates is the slow part, so every day and every time of day is formatted once.
+        # Completion times can fall up to about 30 days after the last test day.
+        self.DayStrings = [(StartDate + timedelta(days=Day)).strftime('%Y-%m-%d') for Day in range(Days + 31)]
+        self.TimeStrings = [f"{Minute // 60:02d}:{Minute % 60:02d}" for Minute in range(1440)]
+
+    # Function to turn minutes since StartDate into 'YYYY-MM-DD HH:MM'
+    def FormatMinutes(self, Minutes: int) -> str:
+        Day, Minute = divmod(Minutes, 1440)
+        return f"{self.DayStrings[Day]} {self.TimeStrings[Minute]}"
+
+    # Function to draw one (PatientId, record) pair
+    def Record(self):
+        Random = self.Random
+        PatientId = self.PatientIds[bisect_left(self.PatientWeights, Random.random() * self.PatientWeights[-1])]
+        test, Mean, Deviation = self.Tests[Random.randrange(len(self.Tests))]
+        DateTime = Random.randrange(self.Days * 1440)
+        Status = StatusWeights[bisect_left(self.StatusLimits, Random.random() * self.StatusLimits[-1])][0]
+        Precision = 2 if Deviation < 5 else 0
+        record = {"TestName": test['short_name'], "DateTime": self.FormatMinutes(DateTime),
+                  "Result": FormatResult(round(max(Random.gauss(Mean, Deviation), 0.0), Precision)),
+                  "Unit": test['unit'], "Status": Status}
+        if Status == 'Completed':  # Like the menu and ValidateRecord, only Completed records have one
+            # Most tests finish within their turnaround time, the log-normal tail runs late
+            Turnaround = max(test['turnaround_minutes'], 10)
+            Minutes = min(int(Turnaround * Random.lognormvariate(-0.4, 0.5)) + 1, 30 * 1440)
+            record["CompletionTime"] = self.FormatMinutes(DateTime + Minutes)
+        return PatientId, record
+
+    # Function to get one line of MedicalRecord.txt, now and then a malformed one
+    def Line(self) -> str:
+        if self.MalformedRate and self.Random.random() < self.MalformedRate:
+            return self.Random.choice(MalformedLines)
+        PatientId, record = self.Record()
+        Fields = [record["TestName"], record["DateTime"], record["Result"], record["Unit"], record["Status"]]
+        if "CompletionTime" in record:
+            Fields.append(record["CompletionTime"])
+        return f"{PatientId}: {', '.join(Fields)}"
+
+
+# Function to write the tests file that goes with the generated records
+def WriteTestsFile(TestsFile: str):
+    with open(TestsFile, 'w') as file:
+        for Line, _, _ in SampleTests:
+            file.write(FormatTestLine(ParseTestLine(Line)) + '\n')
+
+
+# Function to write Rows lines in the format of MedicalRecord.txt
+def WriteRecordsFile(RecordsFile: str, Rows: int, Generator: RecordGenerator):
+    with open(RecordsFile, 'w') as file:
+        Lines: List[str] = []
+        for _ in range(Rows):
+            Lines.append(Generator.Line())
+            if len(Lines) == 10000:
+                file.write('\n'.join(Lines) + '\n')
+                Lines = []
+        if Lines:
+            file.write('\n'.join(Lines) + '\n')
+
+
+# Function to write Rows records as a lab CSV file for import-csv
+def WriteImportFile(CSVFile: str, Rows: int, Generator: RecordGenerator):
+    with open(CSVFile, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(ImportColumns)
+        for _ in range(Rows):
+            PatientId, record = Generator.Record()
+            writer.writerow([PatientId, record["TestName"], record["DateTime"], record["Result"], record["Unit"],
+                             record["Status"], record.get("CompletionTime", "")])
+
+
+if __name__ == "__main__":
+    Parser = argparse.ArgumentParser(description="Write synthetic medical records and tests files")
+    Parser.add_argument('--rows', type=int, default=1000000)
+    Parser.add_argument('--seed', type=int, default=1)
+    Parser.add_argument('--patients', type=int, help="Number of patients (default: rows / 20)")
+    Parser.add_argument('--days', type=int, default=365, help="Days covered, from 2024-01-01 (default: 365)")
+    Parser.add_argument('--skew', type=float, default=0.8, help="Zipf exponent of records per patient (default: 0.8)")
+    Parser.add_argument('--malformed', type=float, default=0.0, help="Share of malformed lines (default: 0)")
+    # The defaults stay out of the way of the MedicalRecord.txt and MedicalTests.txt the program uses
+    Parser.add_argument('--records', default=os.path.join('generated', 'MedicalRecord.txt'),
+                        help="Records file to write (default: generated/MedicalRecord.txt)")
+    Parser.add_argument('--tests', default=os.path.join('generated', 'MedicalTests.txt'),
+                        help="Tests file to write (default: generated/MedicalTests.txt)")
+    Parser.add_argument('--csv', help="Also write --rows records to this CSV file, for import-csv")
+    Arguments = Parser.parse_args()
+    for FileName in (Arguments.records, Arguments.tests, Arguments.csv):
+        if FileName and os.path.dirname(FileName):
+            os.makedirs(os.path.dirname(FileName), exist_ok=True)
+
+    Generator = RecordGenerator(Arguments.seed, Arguments.patients, Arguments.rows, Days=Arguments.days,
+                                Skew=Arguments.skew, MalformedRate=Arguments.malformed)
+    WriteTestsFile(Arguments.tests)
+    WriteRecordsFile(Arguments.records, Arguments.rows, Generator)
+    if Arguments.csv:
+        WriteImportFile(Arguments.csv, Arguments.rows, Generator)
@@ -0,0 +1,150 @@
+from bisect import bisect_left
+from collections import Counter
+from functools import wraps
+from typing import Dict, List, Optional
+import cProfile
+import json
+import os
+import time
+import tracemalloc
+
+
+# Upper bounds (seconds) of the buckets of the operation time histograms, the last one is open
+HistogramBounds = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, float('inf'))
+
+
+# Statistics of one instrumented operation: calls, rows processed, wall and CPU time (totals and
+# histograms), and the largest memory peak seen while tracemalloc was tracing
+class OperationStats:
+    def __init__(self, Name: str):
+        self.Name = Name
+        self.Calls = 0
+        self.Rows = 0
+        self.WallTime = 0.0
+        self.CPUTime = 0.0
+        self.WallHistogram = [0] * len(HistogramBounds)
+        self.CPUHistogram = [0] * len(HistogramBounds)
+        self.PeakMemory: Optional[int] = None
+
+    def Record(self, Wall: float, CPU: float, Rows: int, Peak: Optional[int]):
+        self.Calls += 1
+        self.Rows += Rows
+        self.WallTime += Wall
+        self.CPUTime += CPU
+        self.WallHistogram[bisect_left(HistogramBounds, Wall)] += 1
+        self.CPUHistogram[bisect_left(HistogramBounds, CPU)] += 1
+        if Peak is not None and (self.PeakMemory is None or Peak > self.PeakMemory):
+            self.PeakMemory = Peak
+
+    def AsDict(self) -> Dict:
+        Bounds = [str(Bound) for Bound in HistogramBounds]
+        return {'calls': self.Calls, 'rows': self.Rows, 'wall_seconds': self.WallTime, 'cpu_seconds': self.CPUTime,
+                'wall_histogram': dict(zip(Bounds, self.WallHistogram)),
+                'cpu_histogram': dict(zip(Bounds, self.CPUHistogram)), 'peak_memory_bytes': self.PeakMemory}
+
+
+OperationStatistics: Dict[str, OperationStats] = {}  # Operation name -> statistics, for this run
+ProfileDirectory = os.environ.get('MEDICAL_RECORDS_PROFILE')  # Directory for one cProfile dump per operation
+_ActiveOperations: List['Operation'] = []  # Operations running now, innermost last
+_ProfileCount = Counter()  # Operation name -> dumps written
+QueryCacheStatistics = Counter()  # hits, misses, invalidations (stale entries found), evictions, for this run
+
+
+# Context manager that times a block as the named operation:
+#     with Operation('Parse') as Current:
+#         ...
+#         Current.Rows += len(Batch)
+# Memory peaks are measured when tracemalloc is tracing (MEDICAL_RECORDS_TRACEMALLOC=1 starts it), and
+# with MEDICAL_RECORDS_PROFILE=<directory> the outermost operation is run under cProfile.
+class Operation:
+    def __init__(self, Name: str):
+        self.Name = Name
+        self.Rows = 0
+        self.Profile = None
+
+    def __enter__(self) -> 'Operation':
+        self.Tracing = tracemalloc.is_tracing()
+        if self.Tracing:
+            Current, Peak = tracemalloc.get_traced_memory()
+            if _ActiveOperations:
+                Outer = _ActiveOperations[-1]
+                Outer.CarriedPeak = max(Outer.CarriedPeak, Peak)
+            tracemalloc.reset_peak()
+            self.StartMemory = Current
+            self.CarriedPeak = 0
+        if ProfileDirectory and not _ActiveOperations:
+            self.Profile = cProfile.Profile()
+            self.Profile.enable()
+        _ActiveOperations.append(self)
+        self.StartCPU = time.process_time()
+        self.StartWall = time.perf_counter()
+        return self
+
+    def __exit__(self, *Exception):
+        Wall = time.perf_counter() - self.StartWall
+        CPU = time.process_time() - self.StartCPU
+        _ActiveOperations.pop()
+        if self.Profile is not None:
+            self.Profile.disable()
+            _ProfileCount[self.Name] += 1
+            os.makedirs(ProfileDirectory, exist_ok=True)
+            self.Profile.dump_stats(os.path.join(ProfileDirectory, f"{self.Name}-{_ProfileCount[self.Name]:04d}.prof"))
+        Peak = None
+        if self.Tracing and tracemalloc.is_tracing():
+            Peak = max(tracemalloc.get_traced_memory()[1], self.CarriedPeak)
+            if _ActiveOperations:
+                Outer = _ActiveOperations[-1]
+                Outer.CarriedPeak = max(Outer.CarriedPeak, Peak)
+            Peak -= self.StartMemory
+        Stats = OperationStatistics.get(self.Name)
+        if Stats is None:
+            Stats = OperationStatistics[self.Name] = OperationStats(self.Name)
+        Stats.Record(Wall, CPU, self.Rows, Peak)
+        return False
+
+
+# Function to add processed rows to the innermost running operation
+def CountOperationRows(Count: int):
+    if _ActiveOperations:
+        _ActiveOperations[-1].Rows += Count
+
+
+# Decorator that runs the function (or method) as an Operation named after it. Rows(result), when given,
+# tells how many rows the call processed.
+def Instrumented(Rows=None):
+    def Decorate(Function):
+        @wraps(Function)
+        def Wrapper(*Args, **Kwargs):
+            with Operation(Function.__qualname__) as Current:
+                Result = Function(*Args, **Kwargs)
+                if Rows is not None:
+                    Current.Rows += Rows(Result)
+                return Result
+        return Wrapper
+    return Decorate
+
+
+# Function to print the operation statistics of this run
+def PrintOperationStats():
+    if not OperationStatistics:
+        print("No operations timed yet.")
+        return
+    print(f" {'Operation':30}{'Calls':>7}{'Rows':>12}{'Wall s':>10}{'CPU s':>10}{'Avg ms':>10}{'Peak MiB':>10}")
+    for Name, Stats in sorted(OperationStatistics.items(), key=lambda Item: -Item[1].WallTime):
+        Peak = f"{Stats.PeakMemory / 2**20:.1f}" if Stats.PeakMemory is not None else "-"
+        print(f" {Name:30}{Stats.Calls:>7}{Stats.Rows:>12}{Stats.WallTime:>10.3f}{Stats.CPUTime:>10.3f}"
+              f"{Stats.WallTime / Stats.Calls * 1000:>10.2f}{Peak:>10}")
+    if QueryCacheStatistics:
+        Lookups = QueryCacheStatistics['hits'] + QueryCacheStatistics['misses']
+        print(f" Query cache: {QueryCacheStatistics['hits']} hits, {QueryCacheStatistics['misses']} misses "
+              f"({QueryCacheStatistics['hits'] / Lookups:.0%} hit rate), {QueryCacheStatistics['invalidations']} "
+              f"invalidated, {QueryCacheStatistics['evictions']} evicted")
+
+
+# Function to write the operation statistics of this run as JSON
+def ExportOperationStats(OutputFile: str):
+    with open(OutputFile, 'w') as file:
+        Statistics = {Name: Stats.AsDict() for Name, Stats in OperationStatistics.items()}
+        if QueryCacheStatistics:
+            Statistics['query_cache'] = dict(QueryCacheStatistics)
+        json.dump(Statistics, file, indent=2)
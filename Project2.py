@@ -1,98 +1,196 @@
+from array import array
+from collections.abc import Mapping
 from datetime import datetime, timedelta
-from typing import Dict, List
+from itertools import chain, islice
+from typing import Dict, Iterator, List, Optional, Tuple
+import argparse
+import atexit
 import csv
+import gzip
+import heapq
+import io
+import json
+import os
 import re
+import sys
+import tracemalloc
+
+try:
+    import numpy as np
+except ImportError:  # Optional, the scans fall back to plain Python loops
+    np = None
+
+from OperationStats import CountOperationRows, ExportOperationStats, Instrumented, PrintOperationStats
+from RecordColumns import (ColumnView, DateTimeToMinutes, FormatRecord, MinutesSinceEpoch, MinutesToDateTime,
+                           MissingTime, RecordFields)
+from RecordIndexes import (QuantileIndex, QuantileSketch, ResultIndex, SummaryIndex, SummarySketchTable,
+                           TurnaroundIndex, UpdateRunningStats)
+from RecordStore import AsRecordStore, RecordStore, RecordView
+from QueryEngine import ExecuteQuery, Query
+from RecordFiles import MapReduce, MapShards, ReadMedicalRecordsFromFile
+from StorageBackends import (AsStorageBackend, ConvertMedicalRecordFile, FlatFileBackend, IterRecordPairs,
+                             PartitionMedicalRecordFile, PartitionedBackend, RecordFileFormats, SQLiteBackend,
+                             StorageBackend)
+
+
+# Function to parse one line of the medical tests file, None if it is malformed:
+# 'Name: Hemoglobin (Hgb); Range: > 13.8, < 17.2; Unit: g/dL, 00-03-04'
+# A test with an unreadable range or turnaround is kept without it ('range' empty, 'turnaround_minutes'
+# None), as the original reader ignored the turnaround; the text of both stays for writing it back.
+def ParseTestLine(line: str) -> Optional[Dict]:
+    parts = line.split(';')
+    if len(parts) < 3 or ':' not in parts[0] or ':' not in parts[1] or ':' not in parts[2]:
+        return None
+    NamePart = parts[0].split(':', 1)[1].strip()
+
+    # Extract the abbreviation inside the parentheses using regex
+    match = re.search(r'\((.*?)\)', NamePart)
+    ShortName = match.group(1) if match else NamePart #If no Short name found, the full name is used.
+    FullName = NamePart[:match.start()].strip() if match else NamePart
+
+    RangePart = parts[1].split(':', 1)[1].strip()
+    UnitPart, _, TurnaroundTime = parts[2].split(':', 1)[1].partition(',')
+    TurnaroundTime = TurnaroundTime.strip()
+
+    # Parse range
+    ranges = {}
+    try:
+        if '>' in RangePart and '<' in RangePart:
+            LowRange, HighRange = RangePart.split(',')
+            ranges['low'] = float(LowRange.replace('>', '').strip())
+            ranges['high'] = float(HighRange.replace('<', '').strip())
+        elif '>' in RangePart:
+            ranges['low'] = float(RangePart.replace('>', '').strip())
+        elif '<' in RangePart:
+            ranges['high'] = float(RangePart.replace('<', '').strip())
+    except ValueError:
+        ranges = {}
+    try:
+        TurnaroundMinutes = TurnaroundTimeToMinutes(TurnaroundTime) if TurnaroundTime else None
+    except ValueError:
+        TurnaroundMinutes = None
+
+    return {'name': FullName, 'short_name': ShortName, 'range': ranges, 'range_text': RangePart,
+            'unit': UnitPart.strip(), 'turnaround': TurnaroundTime, 'turnaround_minutes': TurnaroundMinutes}
+
+
+# Function to write a test back as a line of the medical tests file; a test without an abbreviation
+# or turnaround is written without one, as it was read
+def FormatTestLine(test: Dict) -> str:
+    Name = test['name'] if test['short_name'] == test['name'] else f"{test['name']} ({test['short_name']})"
+    Line = f"Name: {Name}; Range: {test['range_text']}; Unit: {test['unit']}"
+    return f"{Line}, {test['turnaround']}" if test['turnaround'] else Line
+
+
+# The medical tests file parsed once and shared by every function.
+# Behaves like a dictionary ShortName -> {'range': {'low', 'high'}, 'unit', 'turnaround', ...} and
+# also looks tests up by full name. Refresh() re-reads the file only when its size or mtime changed.
+class TestCatalog(Mapping):
+    def __init__(self, TestsFile: str):
+        self.TestsFile = TestsFile
+        self.Signature = None
+        self.Reload()
+
+    # Function to parse the file again
+    def Reload(self):
+        self.Lines: List[str] = []  # Non-empty lines of the file, in order
+        self.Entries: List[Optional[Dict]] = []  # Parsed test of every line, None when malformed
+        self.Tests: Dict[str, Dict] = {}  # ShortName -> test
+        self.ShortNames: Dict[str, str] = {}  # Full name -> ShortName
+        try:
+            Stat = os.stat(self.TestsFile)
+            with open(self.TestsFile, 'r') as file:
+                for line in file:
+                    line = line.strip()
+                    if line:
+                        test = ParseTestLine(line)
+                        self.Lines.append(line)
+                        self.Entries.append(test)
+                        if test is not None:
+                            self.Tests[test['short_name']] = test
+                            self.ShortNames[test['name']] = test['short_name']
+            self.Signature = (Stat.st_size, Stat.st_mtime_ns)
+        except FileNotFoundError:
+            self.Signature = None
 
+    # Function to reload the catalog when the file changed since it was read
+    def Refresh(self):
+        try:
+            Stat = os.stat(self.TestsFile)
+            Signature = (Stat.st_size, Stat.st_mtime_ns)
+        except FileNotFoundError:
+            Signature = None
+        if Signature != self.Signature:
+            self.Reload()
 
-# Function to read medical records from a file and load into Dictionary
-def ReadMedicalRecordsFromFile(RecordsFile: str) -> Dict[str, List[Dict[str, str]]]:
-    MedicalRecords = {} #Dictionary 
-    
-    with open(RecordsFile, 'r') as file:
-        for Line in file:
-            Line = Line.strip()
-            if Line:
-                # Split line into parts based on colon and comma separation
-                parts = Line.split(': ', 1)
-                if len(parts) != 2:
-                    continue
+    def HasName(self, FullName: str) -> bool:
+        return FullName in self.ShortNames
 
-                PatientId = parts[0]
-                RecordData = parts[1].split(', ')
+    def HasShortName(self, ShortName: str) -> bool:
+        return ShortName in self.Tests
 
-                record = {
-                    "TestName": RecordData[0],
-                    "DateTime": RecordData[1],
-                    "Result": RecordData[2],
-                    "Unit": RecordData[3],
-                    "Status": RecordData[4]
-                }
+    # Function to find a test by short name or full name
+    def Lookup(self, Name: str) -> Optional[Dict]:
+        test = self.Tests.get(Name)
+        if test is None and Name in self.ShortNames:
+            test = self.Tests[self.ShortNames[Name]]
+        return test
 
-                # Add CompletionTime if it exists
-                if len(RecordData) == 6:
-                    record["CompletionTime"] = RecordData[5]
+    # Function to rewrite the file from Lines and read it back
+    def Save(self):
+        with open(self.TestsFile, 'w') as file:
+            for line in self.Lines:
+                file.write(line + "\n")
+        self.Reload()
 
-                # Append to dictionary under corresponding PatientId
-                if PatientId not in MedicalRecords:
-                    MedicalRecords[PatientId] = []
-                MedicalRecords[PatientId].append(record)
+    # Function to append one test to the file
+    def Append(self, test: Dict):
+        with open(self.TestsFile, 'a') as file:
+            file.write(FormatTestLine(test) + "\n")
+        self.Reload()
 
-    return MedicalRecords
+    def __getitem__(self, ShortName: str) -> Dict:
+        return self.Tests[ShortName]
+
+    def __iter__(self):
+        return iter(self.Tests)
+
+    def __len__(self):
+        return len(self.Tests)
 
-#------------------------------
-# Function to parse medical tests file
-def ReadMedicalTests(TestsFile):
-    MedicalTests = {}
-    with open(TestsFile, 'r') as file:
-        for line in file:
-            line = line.strip()
-            if line:
-                # Extract test name, range, and unit
-                parts = line.split(';')
-                NamePart = parts[0].split(':')[1].strip()
-
-                # Extract the abbreviation inside the parentheses using regex
-                match = re.search(r'\((.*?)\)', NamePart)
-                ShortName = match.group(1) if match else NamePart #If no Short name found, the full name is used.
-
-                RangePart = parts[1].split(':')[1].strip()
-                UnitPart = parts[2].split(':')[1].strip().split(',')[0]
-
-                # Parse range
-                ranges = {}
-                if '>' in RangePart and '<' in RangePart:
-                    LowRange, HighRange = RangePart.split(',')
-                    ranges['low'] = float(LowRange.replace('>', '').strip())
-                    ranges['high'] = float(HighRange.replace('<', '').strip())
-                elif '>' in RangePart:
-                    ranges['low'] = float(RangePart.replace('>', '').strip())
-                elif '<' in RangePart:
-                    ranges['high'] = float(RangePart.replace('<', '').strip())
-
-                # Store test information
-                MedicalTests[ShortName] = {'range': ranges, 'unit': UnitPart}
 
+_Catalogs: Dict[str, TestCatalog] = {}  # Absolute path -> catalog shared by the functions given a file name
+
+
+# Function to get the shared catalog of a tests file (or the catalog itself), refreshed from disk
+def AsTestCatalog(MedicalTests) -> TestCatalog:
+    if not isinstance(MedicalTests, TestCatalog):
+        Path = os.path.abspath(MedicalTests)
+        if Path not in _Catalogs:
+            _Catalogs[Path] = TestCatalog(MedicalTests)
+        MedicalTests = _Catalogs[Path]
+    MedicalTests.Refresh()
     return MedicalTests
 
-def UpdateRecord(MedicalRecords: Dict[str, List[Dict[str, str]]], MedicalTestsFile: str, MedicalRecordFile: str):
-    # Read the test names from the MedicalTests file
-    test_names = set()
-    with open(MedicalTestsFile, 'r') as file:
-        for line in file:
-            line = line.strip()
-            if line:
-                parts = line.split(';')
-                name_part = parts[0].split(':')[1].strip()
-                # Extract the abbreviation inside the parentheses using regex
-                match = re.search(r'\((.*?)\)', name_part)
-                short_name = match.group(1) if match else name_part
-                test_names.add(short_name)
 
+# Function to parse medical tests file
+@Instrumented(Rows=len)
+def ReadMedicalTests(TestsFile) -> TestCatalog:
+    return AsTestCatalog(TestsFile)
+
+# MedicalRecordFile is the records file name or a StorageBackend.
+# Without MedicalRecords (lazy mode) only the chosen patient's records are read from the storage.
+def UpdateRecord(MedicalRecords: Optional[RecordStore], MedicalTests, MedicalRecordFile):
+    Storage = AsStorageBackend(MedicalRecordFile)
+    Store, RecordIds = MedicalRecords, None
     # Prompt user for Patient ID
     while True:
         PatientId = input("Enter Patient ID (7 digits) to update records: ").strip()
         if PatientId.isdigit() and len(PatientId) == 7:
-            if PatientId in MedicalRecords:
+            if MedicalRecords is None:
+                # RecordIds maps the rows of the patient's store to record ids
+                Store, RecordIds = Storage.LoadPatient(PatientId)
+            if PatientId in Store:
                 break
             else:
                 print("No records found for this Patient ID.")
@@ -102,7 +200,7 @@ def UpdateRecord(MedicalRecords: Dict[str, List[Dict[str, str]]], MedicalTestsFi
 
     # Display all records for the patient
     print(f"Existing records for Patient ID {PatientId}:")
-    for index, record in enumerate(MedicalRecords[PatientId], start=1):
+    for index, record in enumerate(Store[PatientId], start=1):
         # Format output
         RecordLine = (
             f"\n{index}: TestName: {record['TestName']} \t "
@@ -119,7 +217,7 @@ def UpdateRecord(MedicalRecords: Dict[str, List[Dict[str, str]]], MedicalTestsFi
     while True:
         try:
             RecordIndex = int(input("\nEnter the record number to update: ").strip()) - 1
-            if 0 <= RecordIndex < len(MedicalRecords[PatientId]):
+            if 0 <= RecordIndex < len(Store[PatientId]):
                 break
             else:
                 print("Invalid record number!")
@@ -127,7 +225,9 @@ def UpdateRecord(MedicalRecords: Dict[str, List[Dict[str, str]]], MedicalTestsFi
             print("Invalid input! Please enter a valid number.")
 
     # Selected record to update
-    record = MedicalRecords[PatientId][RecordIndex]
+    record = Store[PatientId][RecordIndex]
+    RecordId = Storage.RecordIdOf(record.RowId) if RecordIds is None else RecordIds[record.RowId]
+    OriginalRecord = dict(record)
 
     # Menu for updating fields
     print("Choose which field to update:")
@@ -135,9 +235,10 @@ def UpdateRecord(MedicalRecords: Dict[str, List[Dict[str, str]]], MedicalTestsFi
     print(" 2: Update Result")
     print(" 3: Update Status")
     print(" 4: Done Updating.")
+    print(" 5: Delete Record.")
     
     while True:
-        choice = input("Enter the number of the field to update (1-4): ").strip()
+        choice = input("Enter the number of the field to update (1-5): ").strip()
         if choice == '1':  # Update Date and Time
             while True:
                 DateTime = input(f" Current Date: {record['DateTime']} \n Enter new Date and Time (YYYY-MM-DD HH:MM: ").strip()
@@ -192,17 +293,24 @@ def UpdateRecord(MedicalRecords: Dict[str, List[Dict[str, str]]], MedicalTestsFi
         
         elif choice == '4':  # Done updating
             break
+        elif choice == '5':  # Delete record
+            if input("Delete this record? (Yes/No): ").strip().lower() == 'yes':
+                # The deletion is appended to the journal; the records file is only rewritten once the
+                # journal has grown past JournalCompactionSize, or by --compact
+                Storage.Delete([RecordId])
+                Store.DeleteRow(record.RowId)
+                Storage.Compact(MedicalRecords)
+                print("--Record deleted successfully!")
+                return
         else:
-            print("Invalid choice! Please enter a number between 1 and 4.")
+            print("Invalid choice! Please enter a number between 1 and 5.")
 
-    # Update the MedicalRecordFile with the modified records
-    with open(MedicalRecordFile, 'w') as file:
-        for PId, records in MedicalRecords.items():
-            for record in records:
-                RecordLine = f"{PId}: {record['TestName']}, {record['DateTime']}, {record['Result']}, {record['Unit']}, {record['Status']}"
-                if 'CompletionTime' in record:
-                    RecordLine += f", {record['CompletionTime']}"
-                file.write(RecordLine + "\n")
+    # Save only the changed fields (the flat file appends them to its journal)
+    Changes = {Field: record.get(Field, '') for Field in RecordFields
+               if record.get(Field, '') != OriginalRecord.get(Field, '')}
+    if Changes:
+        Storage.Update({RecordId: Changes})
+        Storage.Compact(MedicalRecords)  # Only once the journal is due, like a deletion
 
     print("--Record updated successfully!")
 
@@ -296,34 +404,17 @@ def ValidateTurnaroundTime(TurnaroundTime):
         return True
 
 #check it, maybe is best
-def AddTestToFile(TestsFile):
-    # Function to check if a test name or short name already exists
-    def TestNameExists(name):
-        try:
-            with open(TestsFile, 'r') as file:
-                for line in file:
-                    if f"Name: {name} (" in line:
-                        return True
-        except FileNotFoundError:
-            print(f"File {TestsFile} not found. A new file will be created.")
-        return False
-
-    def TestShortNameExists(short_name):
-        try:
-            with open(TestsFile, 'r') as file:
-                for line in file:
-                    if f"({short_name})" in line:
-                        return True
-        except FileNotFoundError:
-            print(f"File {TestsFile} not found. A new file will be created.")
-        return False
+def AddTestToFile(MedicalTests):
+    MedicalTests = AsTestCatalog(MedicalTests)
+    if MedicalTests.Signature is None:
+        print(f"File {MedicalTests.TestsFile} not found. A new file will be created.")
 
     while True:
         # Prompt for test details
         TestName = input("Enter the Full Test Name: ")
         TestName = ValidateString(TestName, "Test Name")
         
-        while TestNameExists(TestName):
+        while MedicalTests.HasName(TestName):
             print("  The test name already exists in the file.")
             choice = input("Do you want to enter a new Test Name? (Yes/No): ").strip().lower()
             if choice != 'Yes':
@@ -334,7 +425,7 @@ def AddTestToFile(TestsFile):
         ShortName = input("Enter the Short Name: ")
         ShortName = ValidateString(ShortName, "Short Name")
         
-        while TestShortNameExists(ShortName):
+        while MedicalTests.HasShortName(ShortName):
             print("  The short name already exists in the file.")
             choice = input("Do you want to enter a new short name? (Yes/No): ").strip().lower()
             if choice != 'Yes':
@@ -367,8 +458,8 @@ def AddTestToFile(TestsFile):
         
         # Append the new test to the file
         try:
-            with open(TestsFile, 'a') as file:
-                file.write(f"Name: {TestName} ({ShortName}); Range: {RangeStr}; Unit: {Unit}, {TurnaroundTime}\n")
+            MedicalTests.Append({'name': TestName, 'short_name': ShortName, 'range_text': RangeStr,
+                                 'unit': Unit, 'turnaround': TurnaroundTime})
             print("New test added successfully!")
         except IOError:
             print("Error writing to file. Please check the file path and permissions.")
@@ -378,23 +469,19 @@ def AddTestToFile(TestsFile):
             break
 
 #AddTestToFile('MedicalTests.txt')
-def UpdateTest(MedicalTestsFile: str):
-    # Read the tests from the MedicalTests file
-    MedicalTests = []
-    with open(MedicalTestsFile, 'r') as file:
-        for line in file:
-            MedicalTests.append(line.strip())
+def UpdateTest(MedicalTests):
+    MedicalTests = AsTestCatalog(MedicalTests)
 
     # Display the tests with indexes
     print("Available tests to update:")
-    for index, test in enumerate(MedicalTests, start=1):
+    for index, test in enumerate(MedicalTests.Lines, start=1):
         print(f"{index}. {test}")
 
     # Prompt the user to select a test to update
     while True:
         try:
             TestIndex = int(input("\nEnter the number of the test to update: ").strip()) - 1
-            if 0 <= TestIndex < len(MedicalTests):
+            if 0 <= TestIndex < len(MedicalTests.Lines):
                 break
             else:
                 print("Invalid test number!")
@@ -402,15 +489,15 @@ def UpdateTest(MedicalTestsFile: str):
             print("Invalid input! Please enter a valid number.")
 
     # Selected test to update
-    selected_test = MedicalTests[TestIndex]
-
-    # Parse the selected test into components
-    parts = selected_test.split(';')
-    NamePart = parts[0].split(': ')[1]
-    FullName, ShortName = NamePart.split('(')
-    ShortName = ShortName.strip(')')
-    RangePart = parts[1].split(': ')[1]
-    UnitPart, TurnaroundTime = parts[2].split(': ')[1].split(',')
+    selected_test = MedicalTests.Entries[TestIndex]
+    if selected_test is None:
+        print("This line of the tests file cannot be read, fix it in the file first.")
+        return
+    FullName = selected_test['name']
+    ShortName = selected_test['short_name']
+    RangePart = selected_test['range_text']
+    UnitPart = selected_test['unit']
+    TurnaroundTime = selected_test['turnaround']
 
     # Menu for updating fields
     print("\nChoose which field to update:")
@@ -425,12 +512,16 @@ def UpdateTest(MedicalTestsFile: str):
         choice = input("Enter the number of the field to update (1-6): ").strip()
         if choice == '1':  # Update Full Name
             NewFullName = input(f"Current Full Name: {FullName.strip()} \nEnter new Full Name: ").strip()
-            if NewFullName:
+            if NewFullName and NewFullName != FullName and MedicalTests.HasName(NewFullName):
+                print("  The test name already exists in the file.")
+            elif NewFullName:
                 FullName = ValidateString(NewFullName, "Full Name")
         
         elif choice == '2':  # Update Short Name
             NewShortName = input(f"Current Short Name: {ShortName} \nEnter new Short Name: ").strip()
-            if NewShortName:
+            if NewShortName and NewShortName != ShortName and MedicalTests.HasShortName(NewShortName):
+                print("  The short name already exists in the file.")
+            elif NewShortName:
                 ShortName = ValidateString(NewShortName, "Short Name")
         
         elif choice == '3':  # Update Range
@@ -463,64 +554,86 @@ def UpdateTest(MedicalTestsFile: str):
         else:
             print("Invalid choice! Please enter a number between 1 and 6.")
 
-    # Update the selected test in the list
-    UpdatedTest = f"Name: {FullName.strip()} ({ShortName}); Range: {RangePart}; Unit: {UnitPart.strip()}, {TurnaroundTime.strip()}"
-    MedicalTests[TestIndex] = UpdatedTest
-
-    # Write the updated tests back to the MedicalTests file
-    with open(MedicalTestsFile, 'w') as file:
-        for test in MedicalTests:
-            file.write(test + "\n")
+    # Update the selected test in the list and write the tests back to the MedicalTests file
+    MedicalTests.Lines[TestIndex] = FormatTestLine({'name': FullName.strip(), 'short_name': ShortName, 'range_text': RangePart,
+                                                    'unit': UnitPart.strip(), 'turnaround': TurnaroundTime.strip()})
+    MedicalTests.Save()
 
     print("--Test Updated Successfully!")
 
-# Function to format records
-def FormatRecord(PatientId, record):
-    FormattedRecord = (f"{PatientId}: {record['TestName']}, "
-                        f"{record['DateTime']}, "
-                        f"{record['Result']}, "
-                        f"{record['Unit']}, "
-                        f"{record['Status']}")
-    if 'CompletionTime' in record:
-        FormattedRecord += f", {record['CompletionTime']}"
-    return FormattedRecord
 
 # Function to filter by Patient ID and print formatted records
+@Instrumented(Rows=len)
 def FilterByPatientId(MedicalRecords, PatientId):
+    if isinstance(MedicalRecords, StorageBackend):
+        # Only the patient's lines are read
+        return MedicalRecords.LoadPatient(PatientId)[0].get(PatientId, [])
     return MedicalRecords.get(PatientId, [])
 
 
+# Function to turn row ids into (PatientId, record) pairs, patient by patient
+def RowsToRecordPairs(Store: RecordStore, Rows) -> List[Tuple[str, RecordView]]:
+    return [(Store.PatientIdOf(RowId), RecordView(Store, RowId)) for RowId in Store.InPatientOrder(Rows)]
+
+
+@Instrumented(Rows=len)
 def FilterByTestName(MedicalRecords, TestName):
-    FilteredRecords = []
-    for PatientId, records in MedicalRecords.items():
-        for record in records:
-            if record['TestName'] == TestName:
-                FilteredRecords.append((PatientId, record))
-    return FilteredRecords
+    Store = AsRecordStore(MedicalRecords)
+    return RowsToRecordPairs(Store, Store.RowsWithTest(TestName))
 
 
 # Function to filter by Status
+@Instrumented(Rows=len)
 def FilterByStatus(MedicalRecords, status):
-    FilteredRecords = []
-    for PatientId, records in MedicalRecords.items():
-        for record in records:
-            if record['Status'] == status:
-                FilteredRecords.append((PatientId, record))
-    return FilteredRecords
+    Store = AsRecordStore(MedicalRecords)
+    return RowsToRecordPairs(Store, Store.RowsWithStatus(status))
 
 
 # Function to filter by specific Period
+@Instrumented(Rows=len)
 def FilterRecordsByDates(MedicalRecords, StartDate, EndDate):
-    FilteredRecords = []
-    # Set EndDate to the end of the day
-    EndDate = EndDate + timedelta(days=1) - timedelta(seconds=1)
-
-    for PatientId, records in MedicalRecords.items():
-        for record in records:
-            RecordDate = datetime.strptime(record['DateTime'], "%Y-%m-%d %H:%M")
-            if StartDate <= RecordDate <= EndDate:
-                FilteredRecords.append((PatientId, record))
-    return FilteredRecords
+    if isinstance(MedicalRecords, StorageBackend):
+        # The backend reads only what covers the period (the months of a partitioned backend)
+        return FilterRecordsByQuery(MedicalRecords, Query(StartDate=StartDate,
+                                                          EndDate=EndDate + timedelta(days=1) - timedelta(seconds=1)))
+    Store = AsRecordStore(MedicalRecords)
+    # Records are kept to the minute, so the period ends at the last minute of EndDate
+    StartMinutes = MinutesSinceEpoch(StartDate)
+    EndMinutes = MinutesSinceEpoch(EndDate + timedelta(days=1)) - 1
+    return RowsToRecordPairs(Store, Store.RowsBetween(StartMinutes, EndMinutes))
+
+
+# Function to print a patient's chart: every test (or one test) with its latest result and the
+# records in the period, oldest first; Last keeps only the Last most recent records of each test
+@Instrumented()
+def PrintPatientHistory(MedicalRecords, PatientId: str, TestName: Optional[str] = None,
+                        StartDate: Optional[datetime] = None, EndDate: Optional[datetime] = None,
+                        Last: Optional[int] = None):
+    if isinstance(MedicalRecords, StorageBackend):
+        MedicalRecords = MedicalRecords.LoadPatient(PatientId)[0]
+    Store = AsRecordStore(MedicalRecords)
+    StartMinutes = MinutesSinceEpoch(StartDate) if StartDate is not None else MissingTime
+    EndMinutes = MinutesSinceEpoch(EndDate + timedelta(days=1)) - 1 if EndDate is not None else -MissingTime - 1
+    TestNames = [TestName] if TestName is not None else sorted(
+        {Store.Tests.Strings[Store.TestCodes[RowId]] for RowId in Store.RowsOf(PatientId)})
+    if all(Store.LatestRow(PatientId, Name) is None for Name in TestNames):
+        print(f"No {TestName + ' ' if TestName else ''}records found for Patient ID {PatientId}.")
+        return
+
+    print(f"--------------------------\t{PatientId}\t--------------------------")
+    for Name in TestNames:
+        LatestRow = Store.LatestRow(PatientId, Name)
+        if LatestRow is None:
+            continue
+        Latest = Store.GetRecord(LatestRow)
+        print(f" {Name}: latest {Latest['Result']} {Latest['Unit']} on {Latest['DateTime']} ({Latest['Status']})")
+        Rows = Store.PatientHistory(PatientId, Name, StartMinutes, EndMinutes, Last)
+        CountOperationRows(len(Rows))
+        for RowId in Rows:
+            record = Store.GetRecord(RowId)
+            Line = f"   {record['DateTime']}, {record['Result']}, {record['Unit']}, {record['Status']}"
+            print(Line + (f", {record['CompletionTime']}" if 'CompletionTime' in record else ""))
+    print()
 
 
 #--------------------------------------------
@@ -532,35 +645,160 @@ def TurnaroundTimeToMinutes(TurnaroundTime: str) -> int:
         return days * 24 * 60 + hours * 60 + minutes
     return 0
 
-def FilterRecordsByAbnormalTests(MedicalRecords, medical_tests):
+# Function to get the turnaround minutes of a completed row, None if it is not completed
+def RowTurnaroundMinutes(Store: RecordStore, RowId: int) -> Optional[int]:
+    CompletionTime = Store.CompletionTimes[RowId]
+    if CompletionTime == MissingTime or Store.StatusCodes[RowId] != Store.Statuses.Lookup('Completed'):
+        return None
+    return CompletionTime - Store.DateTimes[RowId]
+
+# Function to get the turnaround minutes of a completed record dictionary, None if it is not completed
+def RecordTurnaroundMinutes(record) -> Optional[int]:
+    if record['Status'] != 'Completed' or not record.get('CompletionTime'):
+        return None
+    return DateTimeToMinutes(record['CompletionTime']) - DateTimeToMinutes(record['DateTime'])
+
+# Function to check a record dictionary against the range of its test
+def IsAbnormalRecord(record, medical_tests) -> bool:
+    if record['TestName'] not in medical_tests:
+        return False
+    TestRange = medical_tests[record['TestName']]['range']
+    Result = float(record['Result'])
+    return ('low' in TestRange and Result < TestRange['low']) or ('high' in TestRange and Result > TestRange['high'])
+
+
+# Function to get the rows with a result outside the range of their test, patient by patient
+def AbnormalRows(MedicalRecords, medical_tests) -> List[int]:
+    return ExecuteQuery(AsRecordStore(MedicalRecords), Query(Abnormal=True), medical_tests)
+
+# Function to format the abnormal records of a record stream, the kernel of the sharded scan.
+# Returns the patients in the order of their first record and the abnormal lines of each patient.
+def AbnormalRecordLines(Records, medical_tests) -> Tuple[List[str], Dict[str, List[str]]]:
+    Patients = {}
+    Lines: Dict[str, List[str]] = {}
+    for PatientId, record in Records:
+        Patients.setdefault(PatientId)
+        if IsAbnormalRecord(record, medical_tests):
+            Lines.setdefault(PatientId, []).append(FormatRecord(PatientId, record))
+    return list(Patients), Lines
+
+# Function to merge the results of AbnormalRecordLines on consecutive parts of a stream into the
+# abnormal lines patient by patient, the order of a store loaded from the same records
+def MergeAbnormalRecordLines(Parts) -> Iterator[str]:
+    Grouped: Dict[str, List[str]] = {}
+    for Patients, Lines in Parts:
+        for PatientId in Patients:
+            if PatientId not in Grouped:
+                Grouped[PatientId] = []
+        for PatientId, PatientLines in Lines.items():
+            Grouped[PatientId].extend(PatientLines)
+    return chain.from_iterable(Grouped.values())
+
+# MedicalRecords can also be a record stream such as IterMedicalRecords(file) or a StorageBackend.
+# A backend that streams from records files is scanned shard by shard, Parallel > 1 in that many
+# processes. The lines come out patient by patient either way, as from the loaded records (a patient
+# whose first records are deleted in a journal not yet compacted can come later than there).
+@Instrumented()
+def FilterRecordsByAbnormalTests(MedicalRecords, medical_tests, Parallel: int = 1):
+    Shards = MedicalRecords.Shards() if isinstance(MedicalRecords, StorageBackend) else None
+    if isinstance(MedicalRecords, Mapping):
+        Store = AsRecordStore(MedicalRecords)
+        Lines = (Store.FormatLine(RowId) for RowId in AbnormalRows(Store, medical_tests))
+    elif Shards is not None:
+        Lines = MergeAbnormalRecordLines(MapShards(AbnormalRecordLines, Shards, (medical_tests,), Parallel))
+    else:
+        Lines = MergeAbnormalRecordLines([AbnormalRecordLines(IterRecordPairs(MedicalRecords), medical_tests)])
     while True:
         FoundAbnormal = False
         
-        for PatientId, tests in MedicalRecords.items():
-            for test in tests:
-                TestName = test['TestName']
-                TestResult = float(test['Result'])
-                TestStatus = test['Status']
-
-                if TestName in medical_tests:
-                    TestRange = medical_tests[TestName]['range']
-                    
-                    # Check if the test result is abnormal
-                    if ('low' in TestRange and TestResult < TestRange['low']) or \
-                       ('high' in TestRange and TestResult > TestRange['high']):
-                        
-                        if not FoundAbnormal:
-                            print("\n---------------------------- Abnormal Tests ---------------------------\n")
-                            FoundAbnormal = True
-                        
-                        print(FormatRecord(PatientId, test))
+        for Line in Lines:
+            if not FoundAbnormal:
+                print("\n---------------------------- Abnormal Tests ---------------------------\n")
+                FoundAbnormal = True
+
+            print(Line)
+            CountOperationRows(1)
         
         if not FoundAbnormal:
             print("No Abnormal Tests Found.")
         
         break
 
+# Function to get the records of a test with MinResult <= result <= MaxResult (either bound may be
+# None), by result value
+@Instrumented(Rows=len)
+def FilterRecordsByResultRange(MedicalRecords, TestName: str, MinResult: Optional[float] = None,
+                               MaxResult: Optional[float] = None) -> List[Tuple[str, RecordView]]:
+    Store = AsRecordStore(MedicalRecords)
+    TestCode = Store.Tests.Lookup(TestName)
+    if TestCode is None:
+        return []
+    Rows = Store.GetIndex('Result', ResultIndex).Rows(MinResult if MinResult is not None else float('-inf'),
+                                                      MaxResult if MaxResult is not None else float('inf'), TestCode)
+    return [(Store.PatientIdOf(RowId), RecordView(Store, RowId)) for RowId in Rows]
+
+# Function to measure how far a result is outside its range, relative to the bound it crosses
+def RangeDeviation(Result: float, Bound: float) -> float:
+    return abs(Result - Bound) / abs(Bound) if Bound else abs(Result - Bound)
+
+# Function to get the Count results furthest outside the range of their test (or of one test) as
+# (deviation, row id), most extreme first. Each test's sorted results have their lows at the front
+# and their highs at the back, so a heap over those ends finds the answer without sorting.
+def MostAbnormalRows(MedicalRecords, medical_tests, Count: int, TestName: Optional[str] = None) -> List[Tuple[float, int]]:
+    Store = AsRecordStore(MedicalRecords)
+    Index = Store.GetIndex('Result', ResultIndex)
+    Heap = []
+    # Entry: (-deviation, row id, test code, bound, step, position); step walks away from the end
+    for TestCode, Values in Index.Values.items():
+        Name = Store.Tests.Strings[TestCode]
+        if not Values or (TestName is not None and Name != TestName) or Name not in medical_tests:
+            continue
+        TestRange = medical_tests[Name]['range']
+        if 'low' in TestRange and Values[0] < TestRange['low']:
+            Heap.append((-RangeDeviation(Values[0], TestRange['low']), Index.RowIds[TestCode][0], TestCode,
+                         TestRange['low'], 1, 0))
+        if 'high' in TestRange and Values[-1] > TestRange['high']:
+            Last = len(Values) - 1
+            Heap.append((-RangeDeviation(Values[Last], TestRange['high']), Index.RowIds[TestCode][Last], TestCode,
+                         TestRange['high'], -1, Last))
+    heapq.heapify(Heap)
+
+    Extremes = []
+    while Heap and len(Extremes) < Count:
+        Deviation, RowId, TestCode, Bound, Step, Position = heapq.heappop(Heap)
+        Extremes.append((-Deviation, RowId))
+        Position += Step
+        Values = Index.Values[TestCode]
+        if 0 <= Position < len(Values) and (Values[Position] < Bound if Step == 1 else Values[Position] > Bound):
+            heapq.heappush(Heap, (-RangeDeviation(Values[Position], Bound), Index.RowIds[TestCode][Position],
+                                  TestCode, Bound, Step, Position))
+    return Extremes
+
+# Function to print the Count results furthest outside their test's range
+@Instrumented()
+def FilterMostAbnormalTests(MedicalRecords, medical_tests, Count: int = 100, TestName: Optional[str] = None):
+    Store = AsRecordStore(MedicalRecords)
+    Extremes = MostAbnormalRows(Store, medical_tests, Count, TestName)
+    if not Extremes:
+        print("No Abnormal Tests Found.")
+        return
+    print(f"\n---------------------- {len(Extremes)} Most Abnormal Tests ----------------------\n")
+    for Deviation, RowId in Extremes:
+        print(f"{Store.FormatLine(RowId)} ({Deviation:.0%} outside the range)")
+    CountOperationRows(len(Extremes))
+
+
+# Function to filter records with a Query, returns (PatientId, record) pairs
+@Instrumented(Rows=len)
+def FilterRecordsByQuery(MedicalRecords, Criteria: Query, MedicalTests=None) -> List[Tuple[str, RecordView]]:
+    if isinstance(MedicalRecords, StorageBackend):
+        return [(PatientId, record) for _, PatientId, record in MedicalRecords.QueryRecords(Criteria, MedicalTests)]
+    Store = AsRecordStore(MedicalRecords)
+    return RowsToRecordPairs(Store, ExecuteQuery(Store, Criteria, MedicalTests))
+
+# Interactive front end of FilterRecordsByQuery
 def FilterRecordsByMultipleCriteria(MedicalRecords, MedicalTests):
+    Store = AsRecordStore(MedicalRecords)
     while True:
         # Collect criteria from the user
         criteria = []
@@ -571,21 +809,15 @@ def FilterRecordsByMultipleCriteria(MedicalRecords, MedicalTests):
         print(" 4: Date Range")
         print(" 5: Abnormal Tests")
         print(" 6: Turnaround Time")
+        print(" 7: Result Range")
 
+        Choices = {'1': 'Patient ID', '2': 'Test Name', '3': 'Status',
+                   '4': 'Date Range', '5': 'Abnormal Tests', '6': 'Turnaround Time', '7': 'Result Range'}
         while True:
-            choice = input("Enter choice (1-6) or '0' to finish: ")
-            if choice == '1':
-                criteria.append('Patient ID')
-            elif choice == '2':
-                criteria.append('Test Name')
-            elif choice == '3':
-                criteria.append('Status')
-            elif choice == '4':
-                criteria.append('Date Range')
-            elif choice == '5':
-                criteria.append('Abnormal Tests')
-            elif choice == '6':
-                criteria.append('Turnaround Time')
+            choice = input("Enter choice (1-7) or '0' to finish: ")
+            if choice in Choices:
+                if Choices[choice] not in criteria:
+                    criteria.append(Choices[choice])
             elif choice == '0':
                 break
             else:
@@ -595,16 +827,16 @@ def FilterRecordsByMultipleCriteria(MedicalRecords, MedicalTests):
             print("No Criteria Selected.")
             break
 
-        # Apply selected criteria
-        Records = MedicalRecords.copy()
+        # Read the value of every selected criterion
+        Criteria = Query()
         
         for criterion in criteria:
             if criterion == 'Patient ID':
                 while True:
                     PatientId = input(" Enter Patient ID (7 digit): ").strip()
                     if PatientId.isdigit() and len(PatientId) == 7:
-                        if PatientId in MedicalRecords:
-                            Records = {pid: records for pid, records in Records.items() if pid == PatientId}
+                        if PatientId in Store:
+                            Criteria.PatientId = PatientId
                             break
                         else:
                             print(f"No records found for Patient ID {PatientId}.")
@@ -614,9 +846,9 @@ def FilterRecordsByMultipleCriteria(MedicalRecords, MedicalTests):
             elif criterion == 'Test Name':
                 while True:
                     TestName = input(" Enter Test Name: ").strip()
-                    if any(TestName in record['TestName'] for records in MedicalRecords.values() for record in records):
-                        Records = {pid: [record for record in records if record['TestName'] == TestName] for pid, records in Records.items()}
-                        if not any(Records.values()):
+                    if any(TestName in Name for Name in Store.Tests.Strings):
+                        Criteria.TestName = TestName
+                        if not Store.RowsWithTest(TestName):
                             print(f"No records found for Test Name '{TestName}'.")
                         break
                     else:
@@ -628,7 +860,7 @@ def FilterRecordsByMultipleCriteria(MedicalRecords, MedicalTests):
                 while status not in validStatuses:
                     print("Invalid status!")
                     status = input(" Enter Status (Pending, Completed, Reviewed): ").capitalize()
-                Records = {pid: [record for record in records if record['Status'] == status] for pid, records in Records.items()}
+                Criteria.Status = status
 
             elif criterion == 'Date Range':
                 while True:
@@ -647,15 +879,11 @@ def FilterRecordsByMultipleCriteria(MedicalRecords, MedicalTests):
                     except ValueError:
                         print("Invalid date. Please enter dates in YYYY-MM-DD format.")
 
-                Records = {pid: [record for record in records if StartDate <= datetime.strptime(record['DateTime'], "%Y-%m-%d %H:%M") <= EndDate] for pid, records in Records.items()}
+                Criteria.StartDate = StartDate
+                Criteria.EndDate = EndDate
 
             elif criterion == 'Abnormal Tests':
-                AbnormalTests = [record for pid, records in MedicalRecords.items() for record in records if
-                                  (record['TestName'] in MedicalTests and
-                                   (('low' in MedicalTests[record['TestName']]['range'] and float(record['Result']) < MedicalTests[record['TestName']]['range']['low']) or
-                                    ('high' in MedicalTests[record['TestName']]['range'] and float(record['Result']) > MedicalTests[record['TestName']]['range']['high'])))]
-
-                Records = {pid: [record for record in records if record in AbnormalTests] for pid, records in Records.items()}
+                Criteria.Abnormal = True
 
             elif criterion == 'Turnaround Time':
                 while True:
@@ -670,95 +898,373 @@ def FilterRecordsByMultipleCriteria(MedicalRecords, MedicalTests):
                             print("Maximum turnaround time must be greater than or equal to minimum turnaround time. Please re-enter.")
                             continue
 
-                        for PatientId, records in Records.items():
-                            filtered_records = []
-                            for record in records:
-                                if record['Status'] == 'Completed' and 'CompletionTime' in record:
-                                    TestDateTime = datetime.strptime(record['DateTime'], "%Y-%m-%d %H:%M")
-                                    CompletionTime = datetime.strptime(record['CompletionTime'], "%Y-%m-%d %H:%M")
-                                    TurnaroundTime = CompletionTime - TestDateTime
-                                    TurnaroundTimeMinutes = TurnaroundTime.days * 24 * 60 + TurnaroundTime.seconds // 60
-                                    if MinTurnaroundMinutes <= TurnaroundTimeMinutes <= MaxTurnaroundMinutes:
-                                        filtered_records.append(record)
-                            Records[PatientId] = filtered_records
+                        Criteria.MinTurnaround = MinTurnaroundMinutes
+                        Criteria.MaxTurnaround = MaxTurnaroundMinutes
                         break  # Exit the loop after processing
                     except ValueError:
                         print("Invalid turnaround time format! Please enter the time in DD-HH-MM format.")
 
+            elif criterion == 'Result Range':
+                while True:
+                    try:
+                        MinResult = input(" Enter Minimum Result (leave empty for no minimum): ").strip()
+                        MaxResult = input(" Enter Maximum Result (leave empty for no maximum): ").strip()
+                        Criteria.MinResult = float(MinResult) if MinResult else None
+                        Criteria.MaxResult = float(MaxResult) if MaxResult else None
+                    except ValueError:
+                        print("Invalid result! Please enter numbers.")
+                        continue
+                    if Criteria.MinResult is not None and Criteria.MaxResult is not None and \
+                            Criteria.MinResult > Criteria.MaxResult:
+                        print("Maximum result must be greater than or equal to minimum result. Please re-enter.")
+                        continue
+                    break
+
         # Print filtered records
+        Records = FilterRecordsByQuery(Store, Criteria, MedicalTests)
         if Records:
             print("\n---------------------------- Filtered Records ---------------------------\n")
-            for PatientId, records in Records.items():
-                for record in records:
-                    print(FormatRecord(PatientId, record))
+            for PatientId, record in Records:
+                print(FormatRecord(PatientId, record))
         else:
             print("No records found based on the selected criteria.")
 
         break  # End the while loop to avoid repeated prompts
 
-def CalculateTurnaroundTimes(MedicalRecords) -> Dict[str, List[int]]:
+# Function to walk (TestName, Result, turnaround minutes or None) of every record
+def IterSummaryValues(MedicalRecords) -> Iterator[Tuple[str, float, Optional[int]]]:
+    if isinstance(MedicalRecords, Mapping):
+        Store = AsRecordStore(MedicalRecords)
+        TestNames = Store.Tests.Strings
+        for RowId in Store.IterRows():
+            yield TestNames[Store.TestCodes[RowId]], Store.Results[RowId], RowTurnaroundMinutes(Store, RowId)
+    else:
+        for PatientId, record in MedicalRecords:
+            yield record['TestName'], float(record['Result']), RecordTurnaroundMinutes(record)
+
+# Function to collect the (TestName, turnaround minutes) of the completed records of a record stream
+# by patient, the kernel of the sharded scan. Every patient is listed in the order of their first
+# record, with or without completed records.
+def TurnaroundTimesOf(Records) -> Dict[str, List[Tuple[str, int]]]:
+    Patients = {}
+    for PatientId, record in Records:
+        Times = Patients.get(PatientId)
+        if Times is None:
+            Times = Patients[PatientId] = []
+        TurnaroundTimeMinutes = RecordTurnaroundMinutes(record)
+        if TurnaroundTimeMinutes is not None:
+            Times.append((record['TestName'], TurnaroundTimeMinutes))
+    return Patients
+
+# Function to append the turnaround minutes of a later part of the records to Patients
+def MergeTurnaroundTimes(Patients: Dict[str, List[Tuple[str, int]]],
+                         Other: Dict[str, List[Tuple[str, int]]]) -> Dict[str, List[Tuple[str, int]]]:
+    for PatientId, Times in Other.items():
+        Patients.setdefault(PatientId, []).extend(Times)
+    return Patients
+
+# Function to group the turnaround minutes of every patient by test, patient by patient
+def TurnaroundTimesByTest(Patients: Dict[str, List[Tuple[str, int]]]) -> Dict[str, List[int]]:
     TurnaroundTimes = {}
-    
-    for PatientId, records in MedicalRecords.items():
-        for record in records:
-            if 'CompletionTime' in record and record['Status'] == 'Completed':
-                TestDateTime = datetime.strptime(record['DateTime'], "%Y-%m-%d %H:%M")
-                CompletionTime = datetime.strptime(record['CompletionTime'], "%Y-%m-%d %H:%M")
-                TurnaroundTime = CompletionTime - TestDateTime
-                TurnaroundTimeMinutes = TurnaroundTime.days * 24 * 60 + TurnaroundTime.seconds // 60
-                
-                TestName = record['TestName']
-                if TestName not in TurnaroundTimes:
-                    TurnaroundTimes[TestName] = []
-                TurnaroundTimes[TestName].append(TurnaroundTimeMinutes)
-                
+    for Times in Patients.values():
+        for TestName, TurnaroundTimeMinutes in Times:
+            if TestName not in TurnaroundTimes:
+                TurnaroundTimes[TestName] = []
+            TurnaroundTimes[TestName].append(TurnaroundTimeMinutes)
     return TurnaroundTimes
 
-def GenerateSummaryReport(MedicalRecords):
-    TestValues = {}
-    TurnaroundTimes = CalculateTurnaroundTimes(MedicalRecords)
-    
-    for PatientId, records in MedicalRecords.items():
-        for record in records:
-            TestName = record['TestName']
+# Function to get the turnaround minutes of the completed rows of a store by test, patient by patient
+def StoreTurnaroundTimes(Store: RecordStore) -> Dict[str, List[int]]:
+    RowIds = array('I')
+    for Rows in Store.PatientRows.values():
+        RowIds.extend(Rows)
+    CompletedCode = Store.Statuses.Encode('Completed')
+    if np is None or not RowIds:
+        TurnaroundTimes = {}
+        for RowId in RowIds:
+            CompletionTime = Store.CompletionTimes[RowId]
+            if CompletionTime != MissingTime and Store.StatusCodes[RowId] == CompletedCode:
+                TestName = Store.Tests.Strings[Store.TestCodes[RowId]]
+                if TestName not in TurnaroundTimes:
+                    TurnaroundTimes[TestName] = []
+                TurnaroundTimes[TestName].append(CompletionTime - Store.DateTimes[RowId])
+        return TurnaroundTimes
+    RowIds = ColumnView(RowIds)
+    CompletionTimes = ColumnView(Store.CompletionTimes)[RowIds]
+    Completed = (ColumnView(Store.StatusCodes)[RowIds] == CompletedCode) & (CompletionTimes != MissingTime)
+    RowIds = RowIds[Completed]
+    Times = CompletionTimes[Completed] - ColumnView(Store.DateTimes)[RowIds]
+    TestCodes = ColumnView(Store.TestCodes)[RowIds]
+    # Tests in the order of their first completed row, as the records are walked
+    Codes, Firsts = np.unique(TestCodes, return_index=True)
+    return {Store.Tests.Strings[int(TestCode)]: Times[TestCodes == TestCode].tolist()
+            for TestCode in Codes[np.argsort(Firsts)]}
+
+# Function to get the turnaround minutes of the completed records of every test. The tests come in
+# the order of their first completed record and the minutes in record order, patient by patient,
+# for a RecordStore, a record stream and a StorageBackend alike. A backend that streams from
+# records files is read shard by shard, Parallel > 1 in that many processes.
+def CalculateTurnaroundTimes(MedicalRecords, Parallel: int = 1) -> Dict[str, List[int]]:
+    if isinstance(MedicalRecords, Mapping):
+        return StoreTurnaroundTimes(AsRecordStore(MedicalRecords))
+    Shards = MedicalRecords.Shards() if isinstance(MedicalRecords, StorageBackend) else None
+    if Shards is not None:
+        return TurnaroundTimesByTest(MapReduce(TurnaroundTimesOf, Shards, MergeTurnaroundTimes, {}, Parallel=Parallel))
+    return TurnaroundTimesByTest(TurnaroundTimesOf(IterRecordPairs(MedicalRecords)))
+
+
+# Function to get the month 'YYYY-MM' of a DateTime
+def MonthOf(DateTime: str) -> str:
+    if DateTime[4:5] == '-' and DateTime[7:8] == '-':
+        return DateTime[:7]
+    return MinutesToDateTime(DateTimeToMinutes(DateTime))[:7]
+
+
+# Function to get (creating it) the pair of sketches of a test and month
+def SketchesOf(Sketches: SummarySketchTable, TestName: str, Month: str) -> List[QuantileSketch]:
+    Months = Sketches.get(TestName)
+    if Months is None:
+        Months = Sketches[TestName] = {}
+    Pair = Months.get(Month)
+    if Pair is None:
+        Pair = Months[Month] = [QuantileSketch(), QuantileSketch()]
+    return Pair
+
+
+# Function to merge the sketches of Other (e.g. another file or worker) into Sketches
+def MergeSummarySketches(Sketches: SummarySketchTable, Other: SummarySketchTable) -> SummarySketchTable:
+    for TestName, Months in Other.items():
+        for Month, (Results, Turnarounds) in Months.items():
+            Pair = SketchesOf(Sketches, TestName, Month)
+            Pair[0].Merge(Results)
+            Pair[1].Merge(Turnarounds)
+    return Sketches
+
+
+# Function to sketch a stream of (PatientId, record) pairs in one pass; records with unreadable
+# values are skipped
+def SketchRecords(Records) -> SummarySketchTable:
+    Sketches = {}
+    for PatientId, record in Records:
+        try:
             Result = float(record['Result'])
-            
-            if TestName not in TestValues:
-                TestValues[TestName] = []
-            TestValues[TestName].append(Result)
+            Month = MonthOf(record['DateTime'])
+            TurnaroundTimeMinutes = RecordTurnaroundMinutes(record)
+        except ValueError:
+            continue
+        Pair = SketchesOf(Sketches, record['TestName'], Month)
+        Pair[0].Add(Result)
+        if TurnaroundTimeMinutes is not None:
+            Pair[1].Add(TurnaroundTimeMinutes)
+    return Sketches
+
+# Function to sketch a stream like SketchRecords and list the tests of every patient in the order
+# they first come up, the kernel of the sharded summary
+def SketchPatientRecords(Records) -> Tuple[SummarySketchTable, Dict[str, List[str]]]:
+    PatientTests = {}
+
+    def Walk():
+        for PatientId, record in Records:
+            Tests = PatientTests.get(PatientId)
+            if Tests is None:
+                Tests = PatientTests[PatientId] = []
+            if record['TestName'] not in Tests:
+                Tests.append(record['TestName'])
+            yield PatientId, record
+
+    return SketchRecords(Walk()), PatientTests
+
+# Function to merge the results of SketchPatientRecords on a later part of the records into Total
+def MergePatientSketches(Total, Part):
+    MergeSummarySketches(Total[0], Part[0])
+    for PatientId, Tests in Part[1].items():
+        Known = Total[1].setdefault(PatientId, [])
+        for TestName in Tests:
+            if TestName not in Known:
+                Known.append(TestName)
+    return Total
+
+# Function to get the test names of a store in the order of their first row, patient by patient
+def StoreTestOrder(Store: RecordStore) -> List[str]:
+    Seen = {}
+    for Rows in Store.PatientRows.values():
+        Seen.update(dict.fromkeys(map(Store.TestCodes.__getitem__, Rows)))
+        if len(Seen) == len(Store.Tests.Strings):
+            break
+    return [Store.Tests.Strings[TestCode] for TestCode in Seen]
+
+
+# Function to get the quantile sketches of every test and month, the tests in the order of their first
+# record patient by patient. A RecordStore answers from its quantile index; a backend that streams
+# from records files is sketched shard by shard (Parallel > 1 in that many processes) and the
+# sketches merged in shard order; anything else is sketched in one pass over its records.
+def SummarySketches(MedicalRecords, Parallel: int = 1) -> SummarySketchTable:
+    if isinstance(MedicalRecords, Mapping):
+        Store = AsRecordStore(MedicalRecords)
+        Sketches = Store.GetIndex('Quantiles', QuantileIndex).Table()
+        Order = StoreTestOrder(Store)
+    else:
+        Shards = MedicalRecords.Shards() if isinstance(MedicalRecords, StorageBackend) else None
+        if Shards is not None:
+            Sketches, PatientTests = MapReduce(SketchPatientRecords, Shards, MergePatientSketches, ({}, {}),
+                                               Parallel=Parallel)
+        else:
+            Sketches, PatientTests = SketchPatientRecords(IterRecordPairs(MedicalRecords))
+        Order = dict.fromkeys(chain.from_iterable(PatientTests.values()))
+    return {TestName: Sketches[TestName] for TestName in Order if TestName in Sketches}
+
+
+# Function to merge the monthly sketches of a test into one pair for all of its history
+def OverallSketches(Months: Dict[str, List[QuantileSketch]]) -> List[QuantileSketch]:
+    Pair = [QuantileSketch(), QuantileSketch()]
+    for Results, Turnarounds in Months.values():
+        Pair[0].Merge(Results)
+        Pair[1].Merge(Turnarounds)
+    return Pair
+
+
+# Function to get the summary statistics of every test: TestName -> ([count, sum, min, max] of
+# results, same of turnaround minutes). A RecordStore answers from its running statistics, a
+# StorageBackend from its own aggregates, a record stream is aggregated in one pass.
+def SummaryStats(MedicalRecords) -> Dict[str, Tuple[List, List]]:
+    if isinstance(MedicalRecords, StorageBackend):
+        return MedicalRecords.Summary()
+    if isinstance(MedicalRecords, Mapping):
+        Store = AsRecordStore(MedicalRecords)
+        return Store.GetIndex('Summary', SummaryIndex).Stats()
 
-    for TestName, Results in TestValues.items():
-        MinValue = min(Results)
-        MaxValue = max(Results)
-        AvgValue = sum(Results) / len(Results)
+    TestValues = {}
+    for TestName, Result, TurnaroundTimeMinutes in IterSummaryValues(MedicalRecords):
+        Values = TestValues.get(TestName)
+        if Values is None:
+            Values = TestValues[TestName] = ([0, 0, 0, 0], [0, 0, 0, 0])
+        UpdateRunningStats(Values[0], Result)
+        if TurnaroundTimeMinutes is not None:
+            UpdateRunningStats(Values[1], TurnaroundTimeMinutes)
+    return TestValues
+
+# Function to format the median, 90th and 99th percentile of a sketch
+def FormatPercentiles(Sketch: QuantileSketch, Unit: str = '', Digits: int = 2) -> str:
+    Median, P90, P99 = Sketch.Quantiles([0.5, 0.9, 0.99])
+    return f"Median: {Median:.{Digits}f}{Unit}\t 90th Percentile: {P90:.{Digits}f}{Unit}\t 99th Percentile: {P99:.{Digits}f}{Unit}"
+
+# Function to print a histogram of a sketch as bars
+def PrintHistogram(Sketch: QuantileSketch, Bins: int = 10):
+    Histogram = Sketch.Histogram(Bins)
+    Largest = max(Count for _, _, Count in Histogram) or 1
+    for Low, High, Count in Histogram:
+        print(f"   {Low:10.2f} - {High:<10.2f} {'#' * round(Count / Largest * 40):40} {Count}")
+
+# MedicalRecords can also be a record stream such as IterMedicalRecords(file) or a StorageBackend,
+# memory stays proportional to the number of tests, months and patients. Percentiles come from quantile
+# sketches (exact up to 1024 values, within about 1% beyond); Monthly adds them per month, Histogram adds histograms.
+# Parallel > 1 sketches the shards of a file backed storage in that many processes, with the same result.
+@Instrumented()
+def GenerateSummaryReport(MedicalRecords, Monthly: bool = False, Histogram: bool = False, Parallel: int = 1):
+    if isinstance(MedicalRecords, Mapping):
+        Stats = SummaryStats(MedicalRecords)
+        Sketches = SummarySketches(MedicalRecords)
+        # The tests in the order of their first record, patient by patient
+        TestValues = {TestName: Stats[TestName] for TestName in StoreTestOrder(AsRecordStore(MedicalRecords))
+                      if TestName in Stats}
+    else:
+        # One pass over the records gives the sketches, and the sketches keep exact counts and bounds
+        Sketches = SummarySketches(MedicalRecords, Parallel)
+        TestValues = {}
+        for TestName, Months in Sketches.items():
+            Results, Turnarounds = OverallSketches(Months)
+            TestValues[TestName] = ([Results.Count, Results.Sum, Results.Min, Results.Max],
+                                    [Turnarounds.Count, Turnarounds.Sum, Turnarounds.Min, Turnarounds.Max]
+                                    if Turnarounds.Count else [0, 0, 0, 0])
+
+    for TestName, (Results, Turnaround) in TestValues.items():
+        Count, Total, MinValue, MaxValue = Results
+        CountOperationRows(Count)
+        AvgValue = Total / Count
         
         # Calculate turnaround time statistics
-        if TestName in TurnaroundTimes:
-            Turnaround = TurnaroundTimes[TestName]
-            MinTurnaround = min(Turnaround)
-            MaxTurnaround = max(Turnaround)
-            AvgTurnaround = sum(Turnaround) / len(Turnaround)
+        if Turnaround[0]:
+            MinTurnaround = Turnaround[2]
+            MaxTurnaround = Turnaround[3]
+            AvgTurnaround = Turnaround[1] / Turnaround[0]
         else:
             MinTurnaround = MaxTurnaround = AvgTurnaround = 0
         
         print(f"--------------------------\t{TestName}\t--------------------------")
         print(f" Min Result: {MinValue:.2f}\t Max Result: {MaxValue:.2f}\t Average: {AvgValue:.2f}")
         print(f" Min Turnaround Time: {MinTurnaround} minutes\t Max Turnaround Time: {MaxTurnaround} minutes\t Average Turnaround Time: {AvgTurnaround:.2f} minutes")
+
+        Months = Sketches.get(TestName, {})
+        ResultSketch, TurnaroundSketch = OverallSketches(Months)
+        if ResultSketch.Count:
+            print(f" Result {FormatPercentiles(ResultSketch)}")
+        if TurnaroundSketch.Count:
+            print(f" Turnaround Time {FormatPercentiles(TurnaroundSketch, ' minutes', 0)}")
+        if Histogram and ResultSketch.Count:
+            print(" Results:")
+            PrintHistogram(ResultSketch)
+            if TurnaroundSketch.Count:
+                print(" Turnaround Times (minutes):")
+                PrintHistogram(TurnaroundSketch)
+        if Monthly:
+            for Month, (MonthResults, MonthTurnarounds) in sorted(Months.items()):
+                Line = f" {Month}: {MonthResults.Count} results\t {FormatPercentiles(MonthResults)}"
+                if MonthTurnarounds.Count:
+                    Line += f"\t Median Turnaround Time: {MonthTurnarounds.Quantile(0.5):.0f} minutes"
+                print(Line)
         print()
 
-def AddRecord(MedicalRecords: Dict[str, List[Dict[str, str]]], MedicalTestsFile: str, MedicalRecordFile: str):
-    # Read the test names from the MedicalTests file
-    test_names = set()
-    with open(MedicalTestsFile, 'r') as file:
-        for line in file:
-            line = line.strip()
-            if line:
-                parts = line.split(';')
-                name_part = parts[0].split(':')[1].strip()
-                # Extract the abbreviation inside the parentheses using regex
-                match = re.search(r'\((.*?)\)', name_part)
-                short_name = match.group(1) if match else name_part
-                test_names.add(short_name)
+# Function to find the completed records that took longer than their test's turnaround in the
+# tests file (or than Threshold minutes, when given). Returns TestName -> (allowed minutes,
+# completed records, {day 'YYYY-MM-DD' -> overdue row ids by DateTime}); tests without a
+# configured turnaround are left out unless a Threshold is given.
+def OverdueRecords(MedicalRecords, MedicalTests, TestName: Optional[str] = None,
+                   Threshold: Optional[int] = None) -> Dict[str, Tuple[int, int, Dict[str, List[int]]]]:
+    Store = AsRecordStore(MedicalRecords)
+    Index = Store.GetIndex('Turnaround', TurnaroundIndex)
+    DateTimes = Store.DateTimes
+    Overdue = {}
+    for TestCode in sorted(Index.Values):
+        Name = Store.Tests.Strings[TestCode]
+        if TestName is not None and Name != TestName:
+            continue
+        Allowed = Threshold
+        if Allowed is None:
+            test = MedicalTests.get(Name)
+            if test is None or test['turnaround_minutes'] is None:
+                continue
+            Allowed = test['turnaround_minutes']
+        Days: Dict[str, List[int]] = {}
+        for RowId in sorted(Index.RowsOver(TestCode, Allowed), key=lambda RowId: (DateTimes[RowId], RowId)):
+            Days.setdefault(MinutesToDateTime(DateTimes[RowId])[:10], []).append(RowId)
+        Overdue[Name] = (Allowed, Index.TestCount(TestCode), Days)
+    return Overdue
+
+# Function to print the records over their test's turnaround, by test and by day
+@Instrumented()
+def GenerateSLAReport(MedicalRecords, MedicalTests, TestName: Optional[str] = None, Threshold: Optional[int] = None):
+    Store = AsRecordStore(MedicalRecords)
+    Overdue = OverdueRecords(Store, MedicalTests, TestName, Threshold)
+    if not Overdue:
+        print("No completed records of tests with a turnaround time.")
+        return
+
+    for Name, (Allowed, Completed, Days) in Overdue.items():
+        Late = sum(len(Rows) for Rows in Days.values())
+        CountOperationRows(Completed)
+        Share = Late / Completed * 100 if Completed else 0
+        print(f"--------------------------\t{Name} (turnaround {Allowed} minutes)\t--------------------------")
+        print(f" Completed: {Completed}\t Over turnaround: {Late} ({Share:.2f}%)")
+        for Day, Rows in Days.items():
+            print(f" {Day}: {len(Rows)} over turnaround")
+            for RowId in Rows:
+                Turnaround = Store.CompletionTimes[RowId] - Store.DateTimes[RowId]
+                print(f"   {Store.FormatLine(RowId)} ({Turnaround - Allowed} minutes late)")
+        print()
+
+# MedicalRecordFile is the records file name or a StorageBackend
+def AddRecord(MedicalRecords: Optional[RecordStore], MedicalTests, MedicalRecordFile):
+    MedicalTests = AsTestCatalog(MedicalTests)
 
     # Loop for each input to validate and collect data
     while True:
@@ -773,7 +1279,7 @@ def AddRecord(MedicalRecords: Dict[str, List[Dict[str, str]]], MedicalTestsFile:
         # Validate Test Name
         while True:
             TestName = input("Enter Test Name: ").strip()
-            if TestName in test_names:
+            if MedicalTests.HasShortName(TestName):
                 break
             else:
                 print("Invalid Test Name! Please enter a valid test name from the list.")
@@ -841,114 +1347,562 @@ def AddRecord(MedicalRecords: Dict[str, List[Dict[str, str]]], MedicalTestsFile:
         if CompletionTime:
             record["CompletionTime"] = CompletionTime
 
-        # Add record to dictionary
-        if PatientId not in MedicalRecords:
-            MedicalRecords[PatientId] = []
-        MedicalRecords[PatientId].append(record)
-
-        # Append the new record to the MedicalRecord file
-        with open(MedicalRecordFile, 'a') as file:
-            record_line = f"{PatientId}: {TestName}, {DateTime}, {Result}, {Unit}, {Status}"
-            if CompletionTime:
-                record_line += f", {CompletionTime}"
-            file.write(record_line + "\n")
+        # Add record to the store and save it
+        AppendRecordsToStorage(MedicalRecords, MedicalRecordFile, [(PatientId, record)])
 
         print("--Record added successfully!")
         break  # Exit loop after adding record
 
 
-def ExportMedicalRecordsToCSV(MedicalRecords: Dict[str, List[Dict[str, str]]], OutputFile: str) -> None:
+ExportChunkSize = 10000  # Rows handed to writerows at a time
+ExportPartCheckRows = 1000  # Rows written between two checks of the part size
+
+
+# Function to turn records into CSV rows; CompletionTime is only exported for Completed records
+def IterExportRows(MedicalRecords) -> Iterator[List[str]]:
+    if isinstance(MedicalRecords, RecordStore):
+        Store = MedicalRecords
+        Completed = Store.Statuses.Lookup('Completed')
+        for RowId in Store.IterRows():
+            Done = Store.StatusCodes[RowId] == Completed and Store.CompletionTimes[RowId] != MissingTime
+            yield [Store.PatientIdOf(RowId), Store.GetField(RowId, 'TestName'), Store.GetField(RowId, 'DateTime'),
+                   Store.GetField(RowId, 'Result'), Store.GetField(RowId, 'Unit'), Store.GetField(RowId, 'Status'),
+                   Store.GetField(RowId, 'CompletionTime') if Done else ""]
+        return
+
+    for PatientID, Test in IterRecordPairs(MedicalRecords):
+        # Extract CompletionTime if status is "Completed"
+        completion_time = Test.get("CompletionTime", "") if Test["Status"] == "Completed" else ""
+        yield [PatientID, Test["TestName"], Test["DateTime"], Test["Result"], Test["Unit"], Test["Status"],
+               completion_time]
+
+
+# Function to name part number Part of an export: 'records.csv.gz' -> 'records-0001.csv.gz'
+def ExportPartFileName(OutputFile: str, Part: int) -> str:
+    Base, Suffix = OutputFile, ''
+    if Base.endswith('.gz'):
+        Base, Suffix = Base[:-3], '.gz'
+    Base, Extension = os.path.splitext(Base)
+    return f"{Base}-{Part:04d}{Extension}{Suffix}"
+
+
+# MedicalRecords can be a RecordStore, a query result (list of (PatientId, record)) or a record
+# stream such as IterMedicalRecords(file); rows are written ExportChunkSize at a time, so memory
+# stays bounded. Compress writes gzip (default: when OutputFile ends with '.gz'). With MaxPartSize
+# (bytes) the output is split into part files, each with the header. The size is checked every
+# ExportPartCheckRows rows, so a part ends at the first check past MaxPartSize and is larger by
+# up to ExportPartCheckRows rows (for gzip, the compressed bytes of those rows). When everything fits in one
+# part it keeps the name OutputFile. Returns the files written.
+@Instrumented()
+def ExportMedicalRecordsToCSV(MedicalRecords, OutputFile: str, Compress: Optional[bool] = None,
+                              MaxPartSize: Optional[int] = None) -> List[str]:
+    if Compress is None:
+        Compress = OutputFile.endswith('.gz')
    
     # Define the header for the CSV file
     csvHeader = ["PatientID", "TestName", "DateTime", "Result", "Unit", "Status", "CompletionTime"]
+    Rows = IterExportRows(MedicalRecords)
+    Written = []
 
     try:
-        # Open the output file in write mode
-        with open(OutputFile, mode='w', newline='') as file:
-            writer = csv.writer(file)
-
-            # Write the header to the CSV file
-            writer.writerow(csvHeader)
-
-            # Write each record to the CSV file
-            for PatientID, Tests in MedicalRecords.items():
-                for Test in Tests:
-                    # Extract CompletionTime if status is "Completed"
-                    completion_time = Test.get("CompletionTime", "") if Test["Status"] == "Completed" else ""
-                    
-                    writer.writerow([
-                        PatientID,
-                        Test["TestName"],
-                        Test["DateTime"],
-                        Test["Result"],
-                        Test["Unit"],
-                        Test["Status"],
-                        completion_time
-                    ])
-        print(f"--Medical records successfully exported to {OutputFile}.")
+        Chunk = list(islice(Rows, ExportChunkSize))
+        while True:
+            FileName = ExportPartFileName(OutputFile, len(Written) + 1) if MaxPartSize else OutputFile
+            Written.append(FileName)
+            with open(FileName, 'wb') as Raw:
+                Stream = gzip.GzipFile(fileobj=Raw, mode='wb') if Compress else Raw
+                with io.TextIOWrapper(Stream, newline='') as file:
+                    writer = csv.writer(file)
+
+                    # Write the header, then the records chunk by chunk
+                    writer.writerow(csvHeader)
+                    while Chunk:
+                        if MaxPartSize:
+                            Slice, Chunk = Chunk[:ExportPartCheckRows], Chunk[ExportPartCheckRows:]
+                        else:
+                            Slice, Chunk = Chunk, []
+                        writer.writerows(Slice)
+                        CountOperationRows(len(Slice))
+                        if not Chunk:
+                            Chunk = list(islice(Rows, ExportChunkSize))
+                        if MaxPartSize and Chunk:
+                            # A sync flush pushes out what the compressor holds, so the count is exact
+                            file.flush()
+                            if Compress:
+                                Stream.flush()
+                            if Raw.tell() >= MaxPartSize:
+                                break
+            if not Chunk:
+                break
+
+        if len(Written) == 1:
+            if Written[0] != OutputFile:
+                os.replace(Written[0], OutputFile)  # A single part needs no part number
+                Written = [OutputFile]
+            print(f"--Medical records successfully exported to {Written[0]}.")
+        else:
+            print(f"--Medical records successfully exported to {len(Written)} files: {Written[0]} ... {Written[-1]}.")
 
     except IOError as e:
         print(f"An error occurred while writing to the file: {e}")
-
-def ImportCSVToMedicalRecord(CSVFile: str, MedicalRecordFile: str):
+        return []
+    return Written
+
+ImportColumns = ('Patient ID', 'Test Name', 'Test DateTime', 'Result Value', 'Results Unit', 'Status', 'Results DateTime')
+
+
+# Function to stream a lab CSV file into the records file and the live store.
+# Rows are checked with ValidateRecord against the test catalog, rows whose (patient, test, DateTime)
+# is already in the store (or earlier in the file) are skipped, so importing a file twice adds
+# nothing the second time. Accepted rows are appended BatchSize at a time with one write and fsync.
+# MedicalRecordFile is the records file name or a StorageBackend. Without MedicalRecords the records
+# are loaded first; without MedicalTests the MedicalTests.txt next to the records is used.
+# Returns (imported, duplicates, rejected).
+@Instrumented(Rows=sum)
+def ImportCSVToMedicalRecord(CSVFile: str, MedicalRecordFile, MedicalRecords: Optional[RecordStore] = None,
+                             MedicalTests=None, BatchSize: int = 10000) -> Tuple[int, int, int]:
+    Storage = AsStorageBackend(MedicalRecordFile)
+    if MedicalTests is None:
+        MedicalTests = os.path.join(os.path.dirname(Storage.FileName), 'MedicalTests.txt')
+    MedicalTests = AsTestCatalog(MedicalTests)
+    Imported = Duplicates = Rejected = 0
    
     try:
-        with open(CSVFile, 'r') as csvfile:
+        if MedicalRecords is None:
+            MedicalRecords = Storage.Load()
+        with open(CSVFile, 'r', newline='') as csvfile:
             reader = csv.DictReader(csvfile)
-            RecordsToAppend = []
-            
-            # Reading the CSV file
+            Missing = [Column for Column in ImportColumns if Column not in (reader.fieldnames or [])]
+            if Missing:
+                print(f"Missing expected column in CSV: {', '.join(Missing)}")
+                return Imported, Duplicates, Rejected
+
+            Batch = []
+            BatchKeys = set()  # Keys of the rows waiting in Batch, not in the store yet
             for row in reader:
+                PatientId = (row['Patient ID'] or '').strip()
+                record = {"TestName": (row['Test Name'] or '').strip(), "DateTime": (row['Test DateTime'] or '').strip(),
+                          "Result": (row['Result Value'] or '').strip(), "Unit": (row['Results Unit'] or '').strip(),
+                          "Status": (row['Status'] or '').strip().capitalize()}
+                if (row['Results DateTime'] or '').strip():
+                    record["CompletionTime"] = row['Results DateTime'].strip()
+
                 try:
-                    # Assuming the CSV columns are: Patient ID, Test Name, Test DateTime, Result Value, Results Unit, Status, Results DateTime
-                    PatientId = row['Patient ID']
-                    TestName = row['Test Name']
-                    DateTime = row['Test DateTime']
-                    Result = row['Result Value']
-                    Unit = row['Results Unit']
-                    Status = row['Status']
-                    ResultsDateTime = row['Results DateTime']
-
-                    # Validate the date formats
-                    try:
-                        checkdatetime = datetime.strptime(DateTime, '%Y-%m-%d %H:%M')
-                        if ResultsDateTime:
-                            checkresultsdatetime = datetime.strptime(ResultsDateTime, '%Y-%m-%d %H:%M')
-                    except ValueError:
-                        print(f"Invalid date format in record: {row}")
-                        continue
+                    ValidateRecord(PatientId, record, MedicalTests)
+                except ValueError as e:
+                    print(f"Invalid record in line {reader.line_num}: {e}")
+                    Rejected += 1
+                    continue
 
-                    # Prepare the record for appending
-                    RecordLine = f"{PatientId}: {TestName}, {DateTime}, {Result}, {Unit}, {Status}"
-                    if ResultsDateTime:
-                        RecordLine += f", {ResultsDateTime}"
-                    
-                    RecordsToAppend.append(RecordLine)
+                # Skip records that are already there
+                Key = (PatientId, record['TestName'], DateTimeToMinutes(record['DateTime']))
+                if Key in BatchKeys or MedicalRecords.HasRecordKey(*Key):
+                    Duplicates += 1
+                    continue
 
-                except KeyError as e:
-                    print(f"Missing expected column in CSV: {e}")
-                except Exception as e:
-                    print(f"Error processing row: {row}, Error: {e}")
-        
-        # Appending to the MedicalRecord file
-        with open(MedicalRecordFile, 'a') as file:
-            for record in RecordsToAppend:
-                file.write(record + "\n")
-        
-        print("--Records imported successfully.")
+                Batch.append((PatientId, record))
+                BatchKeys.add(Key)
+                if len(Batch) >= BatchSize:
+                    Imported += len(AppendRecordsToStorage(MedicalRecords, Storage, Batch))
+                    Batch = []
+                    BatchKeys = set()
+            if Batch:
+                Imported += len(AppendRecordsToStorage(MedicalRecords, Storage, Batch))
+
+        print(f"--Records imported successfully: {Imported} added, {Duplicates} already present, {Rejected} rejected.")
     
-    except FileNotFoundError:
-        print(f"File not found: {CSVFile}")
-    except Exception as e:
+    except FileNotFoundError as e:
+        print(f"File not found: {e.filename}")
+    except (OSError, csv.Error) as e:
         print(f"An error occurred: {e}")
+    return Imported, Duplicates, Rejected
+
+
+#------------------------------
+# Batch operations behind the command line subcommands (add-records, update-status, query,
+# report, export), for scripts that load or read many records without the menu.
+
+RecordStatuses = ('Pending', 'Completed', 'Reviewed')
+
+
+# Function to check a record with the rules of AddRecord, raises ValueError with the reason
+def ValidateRecord(PatientId: str, record, MedicalTests):
+    if not (PatientId.isdigit() and len(PatientId) == 7):
+        raise ValueError("Invalid Patient ID! Please enter a 7-digit ID.")
+    if record['TestName'] not in MedicalTests:
+        raise ValueError(f"Invalid Test Name '{record['TestName']}'!")
+    try:
+        checkdatetime = DateTimeToMinutes(record['DateTime'])
+    except ValueError:
+        raise ValueError("Invalid Date and Time!")
+    try:
+        float(record['Result'])
+    except ValueError:
+        raise ValueError("Invalid Result! Please enter a numeric value.")
+    if not record['Unit'].strip():
+        raise ValueError("Invalid Unit!")
+    if record['Status'] not in RecordStatuses:
+        raise ValueError("Invalid Status!")
+
+    CompletionTime = record.get('CompletionTime', '')
+    if record['Status'] == 'Completed' or CompletionTime:
+        if record['Status'] != 'Completed':
+            raise ValueError("Only Completed records have a Completion Time!")
+        try:
+            checkcompletiontime = DateTimeToMinutes(CompletionTime)
+        except ValueError:
+            raise ValueError("Invalid Completion Time!")
+        if checkcompletiontime <= checkdatetime:
+            raise ValueError("Completion Time must be later than Date and Time!")
+
+
+# Function to read one JSON line {"PatientId": ..., "TestName": ..., ...} into (PatientId, record)
+def ParseJsonRecord(Line: str) -> Tuple[str, Dict[str, str]]:
+    Data = json.loads(Line)
+    if not isinstance(Data, dict):
+        raise ValueError("Expected a JSON object")
+    PatientId = str(Data.get('PatientId', '')).strip()
+    record = {Field: str(Data[Field]).strip() for Field in RecordFields if Data.get(Field) not in (None, '')}
+    Missing = [Field for Field in RecordFields[:5] if Field not in record]
+    if not PatientId:
+        Missing.insert(0, 'PatientId')
+    if Missing:
+        raise ValueError(f"Missing {', '.join(Missing)}")
+    record['Status'] = record['Status'].capitalize()
+    return PatientId, record
+
+
+# Function to add validated records to the store and save them with one append
+# (one buffered write and fsync for the flat file, one transaction for SQLite).
+# Returns their row ids; without a store (lazy mode) the records are only saved.
+def AppendRecordsToStorage(MedicalRecords: Optional[RecordStore], Storage,
+                           Records: List[Tuple[str, Dict[str, str]]]) -> List[int]:
+    RowIds = MedicalRecords.AppendRecords(Records) if MedicalRecords is not None else []
+    AsStorageBackend(Storage).Append(Records)
+    return RowIds
+
+
+# Function to add the records of a JSON lines file in batches of BatchSize, returns (added, rejected)
+@Instrumented(Rows=sum)
+def AddRecordsFromJsonLines(MedicalRecords: RecordStore, MedicalTests, Storage, JsonFile: str,
+                            BatchSize: int = 10000) -> Tuple[int, int]:
+    Added = Rejected = 0
+    Batch = []
+    with open(JsonFile, 'r') as file:
+        for LineNumber, Line in enumerate(file, start=1):
+            if not Line.strip():
+                continue
+            try:
+                PatientId, record = ParseJsonRecord(Line)
+                ValidateRecord(PatientId, record, MedicalTests)
+            except ValueError as e:
+                print(f"{JsonFile}:{LineNumber}: {e}")
+                Rejected += 1
+                continue
+            Batch.append((PatientId, record))
+            if len(Batch) >= BatchSize:
+                Added += len(AppendRecordsToStorage(MedicalRecords, Storage, Batch))
+                Batch = []
+    if Batch:
+        Added += len(AppendRecordsToStorage(MedicalRecords, Storage, Batch))
+    return Added, Rejected
+
+
+# Function to set the status of many records (by record id) with one save, returns the number changed.
+# Completed needs CompletionTime; any other status removes the CompletionTime.
+def UpdateRecordStatuses(MedicalRecords: RecordStore, Storage, RecordIds: List[int], Status: str,
+                         CompletionTime: Optional[str] = None) -> int:
+    Status = Status.capitalize()
+    if Status not in RecordStatuses:
+        raise ValueError("Invalid Status!")
+    if Status == 'Completed':
+        if not CompletionTime:
+            raise ValueError("Completed records need a Completion Time!")
+        CompletionMinutes = DateTimeToMinutes(CompletionTime)
+    else:
+        CompletionTime = ''
+
+    Storage = AsStorageBackend(Storage)
+    Saved = {}
+    for RecordId in RecordIds:
+        RowId = Storage.RowIdOf(RecordId)
+        if RowId is None or not 0 <= RowId < MedicalRecords.RowCount or RowId in MedicalRecords.Deleted:
+            print(f"No record with id {RecordId}.")
+            continue
+        if Status == 'Completed' and CompletionMinutes <= MedicalRecords.DateTimes[RowId]:
+            print(f"Record {RecordId}: Completion Time must be later than Date and Time!")
+            continue
+        record = RecordView(MedicalRecords, RowId)
+        Changes = {Field: Value for Field, Value in (('Status', Status), ('CompletionTime', CompletionTime))
+                   if record.get(Field, '') != Value}
+        for Field, Value in Changes.items():
+            MedicalRecords.SetField(RowId, Field, Value)
+        if Changes:
+            Saved[RecordId] = Changes
+
+    if Saved:
+        Storage.Update(Saved)
+        Storage.Compact(MedicalRecords)
+    return len(Saved)
+
+
+# Function to read --start and --end (YYYY-MM-DD) into the start of the first day and the end of the last
+def DateRangeFromArguments(Arguments) -> Tuple[Optional[datetime], Optional[datetime]]:
+    StartDate = datetime.strptime(Arguments.start, "%Y-%m-%d") if Arguments.start else None
+    EndDate = None
+    if Arguments.end:
+        EndDate = datetime.strptime(Arguments.end, "%Y-%m-%d") + timedelta(days=1) - timedelta(seconds=1)
+    return StartDate, EndDate
+
+
+# Function to read --part-size into bytes: MiB, fractions allowed ('512', '0.5'), or bytes with a
+# 'B' suffix ('250000B')
+def PartSizeArgument(Text: str) -> int:
+    try:
+        Size = int(Text[:-1]) if Text.upper().endswith('B') else round(float(Text) * 2**20)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid part size {Text!r}, expected MiB (e.g. 512 or 0.5) or bytes (e.g. 250000B)")
+    if Size <= 0:
+        raise argparse.ArgumentTypeError("the part size must be positive")
+    return Size
+
+
+# Function to build a Query from the options of the query subcommand (raises ValueError)
+def QueryFromArguments(Arguments) -> Query:
+    Criteria = Query(PatientId=Arguments.patient, TestName=Arguments.test, Abnormal=Arguments.abnormal)
+    if Arguments.status:
+        Criteria.Status = Arguments.status.capitalize()
+    Criteria.StartDate, Criteria.EndDate = DateRangeFromArguments(Arguments)
+    if Arguments.min_turnaround:
+        Criteria.MinTurnaround = TurnaroundTimeToMinutes(Arguments.min_turnaround)
+    if Arguments.max_turnaround:
+        Criteria.MaxTurnaround = TurnaroundTimeToMinutes(Arguments.max_turnaround)
+    Criteria.MinResult = Arguments.min_result
+    Criteria.MaxResult = Arguments.max_result
+    return Criteria
+
+
+# Function to add the subcommands to the argument parser of the program
+def AddBatchCommands(Parser: argparse.ArgumentParser):
+    Commands = Parser.add_subparsers(dest='command', metavar='command',
+                                     help="Run one operation and exit instead of showing the menu")
+
+    AddParser = Commands.add_parser('add-records', help="Add records from a JSON lines file")
+    AddParser.add_argument('--from', dest='source', required=True,
+                           help='JSON lines file, one {"PatientId", "TestName", "DateTime", "Result", "Unit", '
+                                '"Status", "CompletionTime"} object per line')
+    AddParser.add_argument('--batch-size', type=int, default=10000, help="Records written per append (default: 10000)")
+
+    UpdateParser = Commands.add_parser('update-status', help="Set the status of records by record id")
+    UpdateParser.add_argument('--ids', type=int, nargs='+', required=True, help="Record ids, as shown by query --with-ids")
+    UpdateParser.add_argument('--status', required=True, choices=RecordStatuses)
+    UpdateParser.add_argument('--completion-time', help="YYYY-MM-DD HH:MM, required with --status Completed")
+
+    QueryParser = Commands.add_parser('query', help="Print the records matching all the given criteria")
+    AddQueryArguments(QueryParser)
+    QueryParser.add_argument('--with-ids', action='store_true', help="Start every line with the record id")
+
+    ImportParser = Commands.add_parser('import-csv', help="Import a lab CSV file, skipping records already present")
+    ImportParser.add_argument('--from', dest='source', required=True,
+                              help="CSV file with the columns " + ', '.join(ImportColumns))
+    ImportParser.add_argument('--batch-size', type=int, default=10000, help="Records written per append (default: 10000)")
+
+    ReportParser = Commands.add_parser('report', help="Print the summary report")
+    ReportParser.add_argument('--monthly', action='store_true', help="Add the percentiles of every month")
+    ReportParser.add_argument('--histogram', action='store_true', help="Add histograms of results and turnaround times")
+    ReportParser.add_argument('--stream', action='store_true',
+                              help="Read MedicalRecord.txt line by line instead of loading it (with --workers N "
+                                   "in N processes)")
+    ReportParser.add_argument('--start', help="Only records from this day on, YYYY-MM-DD")
+    ReportParser.add_argument('--end', help="Only records up to this day, YYYY-MM-DD")
+
+    HistoryParser = Commands.add_parser('history', help="Print a patient's results by test, oldest first")
+    HistoryParser.add_argument('--patient', required=True, help="7 digit Patient ID")
+    HistoryParser.add_argument('--test', help="Only this test short name")
+    HistoryParser.add_argument('--start', help="First day, YYYY-MM-DD")
+    HistoryParser.add_argument('--end', help="Last day, YYYY-MM-DD")
+    HistoryParser.add_argument('--last', type=int, help="Only the most recent N results of each test")
+
+    OutliersParser = Commands.add_parser('outliers', help="Print the results furthest outside their test's range")
+    OutliersParser.add_argument('--test', help="Only this test short name")
+    OutliersParser.add_argument('--count', type=int, default=100, help="Number of results (default: 100)")
+
+    SLAParser = Commands.add_parser('sla', help="List the completed records over their test's turnaround time")
+    SLAParser.add_argument('--test', help="Only this test short name")
+    SLAParser.add_argument('--over', help="DD-hh-mm, use this turnaround instead of the one in the tests file")
+
+    PartitionParser = Commands.add_parser('partition', help="Split a records file into one file per month in "
+                                                            "--partition-dir, for --backend partitioned")
+    PartitionParser.add_argument('--from', dest='source', default='MedicalRecord.txt',
+                                 help="Records file to split (default: MedicalRecord.txt)")
+
+    ConvertParser = Commands.add_parser('convert', help="Write a records file in the compact format, or back as "
+                                                        "text")
+    ConvertParser.add_argument('--from', dest='source', default='MedicalRecord.txt',
+                               help="Records file to convert (default: MedicalRecord.txt)")
+    ConvertParser.add_argument('--output', help="File to write (default: the --from file, converted in place)")
+    ConvertParser.add_argument('--format', choices=RecordFileFormats, default='zlib',
+                               help="zlib (default) or lzma blocks, smaller and slower to write, or text")
+
+    ExportParser = Commands.add_parser('export', help="Export the records (or those matching the criteria) "
+                                                      "to a comma separated file")
+    ExportParser.add_argument('--output', default="medical_records.csv", help="Output file, gzip when it ends with .gz")
+    ExportParser.add_argument('--gzip', action='store_true', help="Compress the output with gzip")
+    ExportParser.add_argument('--part-size', type=PartSizeArgument,
+                              help="Split the output into part files of about this many MiB (e.g. 512 or 0.5), "
+                                   "or bytes with a B suffix (e.g. 250000B)")
+    ExportParser.add_argument('--stream', action='store_true',
+                              help="Read MedicalRecord.txt line by line instead of loading it (no criteria)")
+    AddQueryArguments(ExportParser)
+
+
+# Function to add the record criteria options of the query and export subcommands
+def AddQueryArguments(Parser: argparse.ArgumentParser):
+    Parser.add_argument('--patient', help="7 digit Patient ID")
+    Parser.add_argument('--test', help="Test short name")
+    Parser.add_argument('--status', choices=RecordStatuses)
+    Parser.add_argument('--start', help="First day, YYYY-MM-DD")
+    Parser.add_argument('--end', help="Last day, YYYY-MM-DD")
+    Parser.add_argument('--abnormal', action='store_true', help="Only results outside the test range")
+    Parser.add_argument('--min-turnaround', help="DD-hh-mm")
+    Parser.add_argument('--max-turnaround', help="DD-hh-mm")
+    Parser.add_argument('--min-result', type=float, help="Lowest result value")
+    Parser.add_argument('--max-result', type=float, help="Highest result value")
+
+
+# Function to run the subcommand chosen on the command line, returns the exit status.
+# MedicalRecords is the loaded store, or the StorageBackend itself for commands it answers alone.
+def RunBatchCommand(Arguments, MedicalRecords, MedicalTests, Storage: StorageBackend) -> int:
+    try:
+        if Arguments.command == 'add-records':
+            Added, Rejected = AddRecordsFromJsonLines(MedicalRecords, MedicalTests, Storage,
+                                                      Arguments.source, Arguments.batch_size)
+            print(f"--{Added} records added, {Rejected} rejected.")
+            return 1 if Rejected else 0
+        if Arguments.command == 'import-csv':
+            Imported, Duplicates, Rejected = ImportCSVToMedicalRecord(Arguments.source, Storage, MedicalRecords,
+                                                                      MedicalTests, Arguments.batch_size)
+            return 1 if Rejected else 0
+        if Arguments.command == 'update-status':
+            Updated = UpdateRecordStatuses(MedicalRecords, Storage, Arguments.ids, Arguments.status,
+                                           Arguments.completion_time)
+            print(f"--{Updated} records updated.")
+            return 0
+        if Arguments.command == 'query':
+            for RecordId, PatientId, record in Storage.QueryRecords(QueryFromArguments(Arguments), MedicalTests):
+                Line = FormatRecord(PatientId, record)
+                print(f"{RecordId}\t{Line}" if Arguments.with_ids else Line)
+            return 0
+        if Arguments.command == 'report':
+            Source = MedicalRecords
+            if Arguments.start or Arguments.end:
+                StartDate, EndDate = DateRangeFromArguments(Arguments)
+                Source = FilterRecordsByQuery(MedicalRecords, Query(StartDate=StartDate, EndDate=EndDate))
+            GenerateSummaryReport(Source, Arguments.monthly, Arguments.histogram, Arguments.workers)
+            return 0
+        if Arguments.command == 'partition':
+            Target = Storage if isinstance(Storage, PartitionedBackend) else PartitionedBackend(Arguments.partition_dir)
+            Written = PartitionMedicalRecordFile(Arguments.source, Target)
+            print(f"--{Written} records written to {len(Target.Manifest)} partitions in {Target.FileName}.")
+            return 0
+        if Arguments.command == 'convert':
+            OutputFile = Arguments.output or Arguments.source
+            Before = os.path.getsize(Arguments.source)
+            Written = ConvertMedicalRecordFile(Arguments.source, OutputFile, Arguments.format)
+            print(f"--{Written} records written to {OutputFile} as {Arguments.format}: "
+                  f"{Before} bytes -> {os.path.getsize(OutputFile)} bytes.")
+            return 0
+        if Arguments.command == 'history':
+            StartDate = datetime.strptime(Arguments.start, "%Y-%m-%d") if Arguments.start else None
+            EndDate = datetime.strptime(Arguments.end, "%Y-%m-%d") if Arguments.end else None
+            PrintPatientHistory(MedicalRecords, Arguments.patient, Arguments.test, StartDate, EndDate, Arguments.last)
+            return 0
+        if Arguments.command == 'outliers':
+            FilterMostAbnormalTests(MedicalRecords, MedicalTests, Arguments.count, Arguments.test)
+            return 0
+        if Arguments.command == 'sla':
+            Threshold = TurnaroundTimeToMinutes(Arguments.over) if Arguments.over else None
+            GenerateSLAReport(MedicalRecords, MedicalTests, Arguments.test, Threshold)
+            return 0
+        if Arguments.command == 'export':
+            Criteria = QueryFromArguments(Arguments)
+            if Arguments.stream:
+                if Criteria.Given():
+                    raise ValueError("--stream exports every record, it cannot be combined with criteria")
+                Source = Storage.IterRecords()
+            elif Criteria.Given():
+                Source = FilterRecordsByQuery(MedicalRecords, Criteria, MedicalTests)
+            else:
+                Source = MedicalRecords
+            Written = ExportMedicalRecordsToCSV(Source, Arguments.output, Arguments.gzip or None, Arguments.part_size)
+            return 0 if Written else 1
+    except BrokenPipeError:
+        # The reader went away (e.g. output piped into head), stop quietly
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 0
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+    return 1
 
 if __name__ == "__main__":
+    Parser = argparse.ArgumentParser(description="Medical Record Management System")
+    Parser.add_argument('--workers', type=int, default=1,
+                        help="Number of processes used to load the medical records and to scan them without "
+                             "loading them (default: 1)")
+    Parser.add_argument('--compact', action='store_true',
+                        help="Fold the edit journal into the medical record file and exit")
+    Parser.add_argument('--backend', choices=('file', 'sqlite', 'partitioned'), default='file',
+                        help="Where the records are kept: MedicalRecord.txt (default), a SQLite database or "
+                             "one file per month")
+    Parser.add_argument('--database', default='MedicalRecord.db', help="SQLite database file (default: MedicalRecord.db)")
+    Parser.add_argument('--partition-dir', default='MedicalRecordPartitions',
+                        help="Directory of the monthly files (default: MedicalRecordPartitions)")
+    Parser.add_argument('--stats-json', help="Write the operation timings to this JSON file on exit")
+    Parser.add_argument('--lazy', action='store_true',
+                        help="Menu: read only the chosen patient's records to add, update and show them, scan "
+                             "the storage for the abnormal tests and the summary report, load everything when "
+                             "another option needs it")
+    AddBatchCommands(Parser)
+    Arguments = Parser.parse_args()
+    if os.environ.get('MEDICAL_RECORDS_TRACEMALLOC'):
+        tracemalloc.start()
+    if Arguments.stats_json:
+        atexit.register(ExportOperationStats, Arguments.stats_json)
     
     MedicalTestsFile = 'MedicalTests.txt'
     MedicalRecordFile = 'MedicalRecord.txt'
-    MedicalRecords = ReadMedicalRecordsFromFile(MedicalRecordFile)
-    MedicalTests = ReadMedicalTests('MedicalTests.txt')
+    MedicalTests = ReadMedicalTests(MedicalTestsFile)
+    if Arguments.backend == 'sqlite':
+        Storage = SQLiteBackend(Arguments.database)
+        if Storage.RecordCount() == 0 and os.path.exists(MedicalRecordFile):
+            print(f"Copying {MedicalRecordFile} into {Arguments.database}...")
+            Storage.AppendStore(ReadMedicalRecordsFromFile(MedicalRecordFile, Workers=Arguments.workers))
+    elif Arguments.backend == 'partitioned':
+        Storage = PartitionedBackend(Arguments.partition_dir, Workers=Arguments.workers, UseSnapshot=True)
+        if not Storage.Manifest and os.path.exists(MedicalRecordFile) and Arguments.command != 'partition':
+            print(f"Splitting {MedicalRecordFile} into {Arguments.partition_dir}...")
+            PartitionMedicalRecordFile(MedicalRecordFile, Storage)
+    else:
+        Storage = FlatFileBackend(MedicalRecordFile, Workers=Arguments.workers, UseSnapshot=True)
+
+    # Reads that the database (or the partitions, the streamed file, the offset index) answer without
+    # loading the records
+    if (Arguments.command in ('partition', 'convert', 'history')
+            or Arguments.command == 'query' and Arguments.patient is not None
+            or Arguments.command in ('query', 'report', 'export') and (
+                Arguments.backend != 'file' or getattr(Arguments, 'stream', False))):
+        raise SystemExit(RunBatchCommand(Arguments, Storage, MedicalTests, Storage))
+
+    # In lazy mode the menu starts without the records, see LazyChoices
+    MedicalRecords = None if Arguments.lazy and Arguments.command is None and not Arguments.compact else Storage.Load()
+    if Arguments.compact:
+        Storage.Compact(MedicalRecords, Force=True)
+        print("Medical records compacted.")
+        raise SystemExit
+    if Arguments.command is not None:
+        raise SystemExit(RunBatchCommand(Arguments, MedicalRecords, MedicalTests, Storage))
     OutputFile = "medical_records.csv"
+    LazyChoices = ('1', '2', '3', '4', '5', '7', '11', '12', '0')  # Menu options that work without loading the records
 
     
     print ("\n--------------Medical Record Management System--------------")
@@ -963,28 +1917,58 @@ if __name__ == "__main__":
                        "  7: Generate Summary Report\n"
                        "  8: Export medical records to a comma separated file\n"
                        "  9: Import medical records from a comma separated file\n"
+                       " 10: Turnaround SLA Report\n"
+                       " 11: Operation Timings\n"
+                       " 12: Patient History\n"
+                       " 13: Most Abnormal Results\n"
                        "  0: Quit\n"
                        "Enter your choice: ")
+        MedicalTests.Refresh()  # Pick up edits made to the tests file outside the program
+        if MedicalRecords is None and choice not in LazyChoices:
+            MedicalRecords = Storage.Load()
         if choice == '1':
-            AddRecord(MedicalRecords, MedicalTestsFile, MedicalRecordFile)    
+            AddRecord(MedicalRecords, MedicalTests, Storage)    
         elif choice == '2':
-            AddTestToFile(MedicalTestsFile) 
+            AddTestToFile(MedicalTests) 
         elif choice == '3':
-            UpdateRecord(MedicalRecords, MedicalTestsFile, MedicalRecordFile)
+            UpdateRecord(MedicalRecords, MedicalTests, Storage)
         elif choice == '4':
-            UpdateTest(MedicalTestsFile)        
+            UpdateTest(MedicalTests)        
         elif choice == '5':
-            FilterRecordsByAbnormalTests(MedicalRecords, MedicalTests) 
+            # In lazy mode the storage is scanned instead, in --workers processes
+            FilterRecordsByAbnormalTests(MedicalRecords if MedicalRecords is not None else Storage, MedicalTests,
+                                         Arguments.workers)
         elif choice == '6':
             FilterRecordsByMultipleCriteria(MedicalRecords, MedicalTests)
         elif choice == '7':
-            GenerateSummaryReport(MedicalRecords) 
+            GenerateSummaryReport(MedicalRecords if MedicalRecords is not None else Storage, Parallel=Arguments.workers)
         elif choice == '8':
             ExportMedicalRecordsToCSV(MedicalRecords, OutputFile)  
         elif choice == '9':
-            ImportCSVToMedicalRecord('medicalRecordImport.csv', 'MedicalRecord.txt')       
+            ImportCSVToMedicalRecord('medicalRecordImport.csv', Storage, MedicalRecords, MedicalTests)       
+        elif choice == '10':
+            GenerateSLAReport(MedicalRecords, MedicalTests)
+        elif choice == '11':
+            PrintOperationStats()
+            StatsFile = input("Save as JSON to (leave empty to skip): ").strip()
+            if StatsFile:
+                ExportOperationStats(StatsFile)
+                print(f"--Operation timings saved to {StatsFile}.")
+        elif choice == '12':
+            PatientId = input("Enter Patient ID (7 digits): ").strip()
+            if PatientId.isdigit() and len(PatientId) == 7:
+                TestName = input("Enter Test Name (leave empty for all tests): ").strip() or None
+                Last = input("Show the last N results of each test (leave empty for all): ").strip()
+                PrintPatientHistory(MedicalRecords if MedicalRecords is not None else Storage, PatientId, TestName,
+                                    Last=int(Last) if Last.isdigit() else None)
+            else:
+                print("Invalid Patient ID! Please enter a 7-digit ID.")
+        elif choice == '13':
+            Count = input("Number of results to show (default 100): ").strip()
+            TestName = input("Enter Test Name (leave empty for all tests): ").strip() or None
+            FilterMostAbnormalTests(MedicalRecords, MedicalTests, int(Count) if Count.isdigit() else 100, TestName)
         elif choice == '0':
             print("Exiting the program.")
             break
         else:
-            print("Invalid choice. Please enter a valid option.")
\ No newline at end of file
+            print("Invalid choice. Please enter a valid option.")
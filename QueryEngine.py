@@ -0,0 +1,349 @@
+from array import array
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import os
+import sys
+
+try:
+    import numpy as np
+except ImportError:  # Optional, the scans fall back to plain Python loops
+    np = None
+
+from OperationStats import QueryCacheStatistics
+from RecordColumns import ColumnView, LiveRowMask, MinutesSinceEpoch, MissingTime
+from RecordIndexes import DateIndex, ResultIndex, RowIndex, TurnaroundIndex
+from RecordStore import RecordStore
+
+
+# Function to get the (low, high) range of every test code of the store, None for unknown tests
+def RangesByTestCode(Store: RecordStore, medical_tests) -> List[Optional[Tuple[Optional[float], Optional[float]]]]:
+    Ranges = []
+    for TestName in Store.Tests.Strings:
+        if TestName in medical_tests:
+            TestRange = medical_tests[TestName]['range']
+            Ranges.append((TestRange.get('low'), TestRange.get('high')))
+        else:
+            Ranges.append(None)
+    return Ranges
+
+# Function to check a row against the range of its test
+def IsAbnormalRow(Store: RecordStore, Ranges, RowId: int) -> bool:
+    TestRange = Ranges[Store.TestCodes[RowId]]
+    if TestRange is None:
+        return False
+    Low, High = TestRange
+    Result = Store.Results[RowId]
+    return (Low is not None and Result < Low) or (High is not None and Result > High)
+
+
+#--------------------------------------------
+# Vectorized scans. With NumPy installed the columns of the store are read in place with
+# numpy.frombuffer and whole columns are tested at once; without it the same scans run as loops.
+# The NumPy views only live inside these functions, the store arrays cannot grow while one exists.
+
+# Function to get per test code arrays of low and high bounds, NaN where a bound is missing
+def BuildRangeArrays(Store: RecordStore, medical_tests):
+    Low = np.full(len(Store.Tests), np.nan)
+    High = np.full(len(Store.Tests), np.nan)
+    for TestCode, TestRange in enumerate(RangesByTestCode(Store, medical_tests)):
+        if TestRange is not None:
+            if TestRange[0] is not None:
+                Low[TestCode] = TestRange[0]
+            if TestRange[1] is not None:
+                High[TestCode] = TestRange[1]
+    return Low, High
+
+# Function to scan all rows, returns the row ids (in file order) that meet every given predicate:
+# Result between MinResult and MaxResult, DateTime and CompletionTime between epoch minute bounds,
+# and, when medical_tests is given, a Result outside the range of the row's test.
+def ScanRows(Store: RecordStore, MinResult: Optional[float] = None, MaxResult: Optional[float] = None,
+             StartMinutes: Optional[int] = None, EndMinutes: Optional[int] = None,
+             CompletedAfter: Optional[int] = None, CompletedBefore: Optional[int] = None,
+             medical_tests=None) -> List[int]:
+    if Store.RowCount == 0:
+        return []
+
+    if np is None:
+        Ranges = RangesByTestCode(Store, medical_tests) if medical_tests is not None else None
+        Results, DateTimes, CompletionTimes = Store.Results, Store.DateTimes, Store.CompletionTimes
+        Rows = []
+        for RowId in range(Store.RowCount):
+            if RowId in Store.Deleted:
+                continue
+            if MinResult is not None and not Results[RowId] >= MinResult:
+                continue
+            if MaxResult is not None and not Results[RowId] <= MaxResult:
+                continue
+            if StartMinutes is not None and DateTimes[RowId] < StartMinutes:
+                continue
+            if EndMinutes is not None and DateTimes[RowId] > EndMinutes:
+                continue
+            if CompletedAfter is not None and (CompletionTimes[RowId] == MissingTime or CompletionTimes[RowId] < CompletedAfter):
+                continue
+            if CompletedBefore is not None and (CompletionTimes[RowId] == MissingTime or CompletionTimes[RowId] > CompletedBefore):
+                continue
+            if Ranges is not None and not IsAbnormalRow(Store, Ranges, RowId):
+                continue
+            Rows.append(RowId)
+        return Rows
+
+    Mask = LiveRowMask(Store)
+    Results = ColumnView(Store.Results)
+    if MinResult is not None:
+        Mask &= Results >= MinResult
+    if MaxResult is not None:
+        Mask &= Results <= MaxResult
+    if StartMinutes is not None or EndMinutes is not None:
+        DateTimes = ColumnView(Store.DateTimes)
+        if StartMinutes is not None:
+            Mask &= DateTimes >= StartMinutes
+        if EndMinutes is not None:
+            Mask &= DateTimes <= EndMinutes
+        del DateTimes
+    if CompletedAfter is not None or CompletedBefore is not None:
+        CompletionTimes = ColumnView(Store.CompletionTimes)
+        Mask &= CompletionTimes != MissingTime
+        if CompletedAfter is not None:
+            Mask &= CompletionTimes >= CompletedAfter
+        if CompletedBefore is not None:
+            Mask &= CompletionTimes <= CompletedBefore
+        del CompletionTimes
+    if medical_tests is not None:
+        Low, High = BuildRangeArrays(Store, medical_tests)
+        TestCodes = ColumnView(Store.TestCodes)
+        # Comparisons with NaN are False, so missing bounds and unknown tests never flag a row
+        Mask &= (Results < Low[TestCodes]) | (Results > High[TestCodes])
+        del TestCodes
+    del Results
+    return np.flatnonzero(Mask).tolist()
+
+
+# Non-interactive description of a multi-criteria filter. Criteria left as None (or False) are not
+# applied; dates are inclusive datetimes, turnaround bounds are inclusive minutes and result bounds
+# are inclusive values.
+class Query:
+    def __init__(self, PatientId: Optional[str] = None, TestName: Optional[str] = None,
+                 Status: Optional[str] = None, StartDate: Optional[datetime] = None,
+                 EndDate: Optional[datetime] = None, Abnormal: bool = False,
+                 MinTurnaround: Optional[int] = None, MaxTurnaround: Optional[int] = None,
+                 MinResult: Optional[float] = None, MaxResult: Optional[float] = None):
+        self.PatientId = PatientId
+        self.TestName = TestName
+        self.Status = Status
+        self.StartDate = StartDate
+        self.EndDate = EndDate
+        self.Abnormal = Abnormal
+        self.MinTurnaround = MinTurnaround
+        self.MaxTurnaround = MaxTurnaround
+        self.MinResult = MinResult
+        self.MaxResult = MaxResult
+
+    # Criteria that are set, by name
+    def Given(self) -> Dict:
+        return {Name: Value for Name, Value in vars(self).items() if Value is not None and Value is not False}
+
+    def __repr__(self):
+        Criteria = ', '.join(f"{Name}={Value!r}" for Name, Value in self.Given().items())
+        return f"Query({Criteria})"
+
+
+# One predicate of a query plan. Fetch() returns the candidate rows from an index (None when the
+# predicate has no index), Size is the number of rows it lets through (estimated for scans),
+# Check(RowId) tests a single row and Scan(), when given, tests all rows at once.
+class QueryStep:
+    def __init__(self, Name: str, Size: int, Check, Fetch=None, Scan=None):
+        self.Name = Name
+        self.Size = Size
+        self.Check = Check
+        self.Fetch = Fetch
+        self.Scan = Scan
+
+    def __repr__(self):
+        return f"{self.Name} ({'index' if self.Fetch else 'scan'}, {self.Size} rows)"
+
+
+# Function to turn a Query into steps, most selective index-backed predicate first, scans last
+def PlanQuery(Store: RecordStore, Criteria: Query, MedicalTests=None) -> List[QueryStep]:
+    IndexSteps = []
+    ScanSteps = []
+
+    if Criteria.PatientId is not None:
+        PatientCode = Store.Patients.Lookup(Criteria.PatientId)
+        PatientCodes = Store.PatientCodes
+        PatientRows = Store.RowsOf(Criteria.PatientId)
+        IndexSteps.append(QueryStep('Patient ID', len(PatientRows), lambda RowId: PatientCodes[RowId] == PatientCode,
+                                    lambda: PatientRows))
+
+    if Criteria.TestName is not None:
+        TestCode = Store.Tests.Lookup(Criteria.TestName)
+        TestCodes = Store.TestCodes
+        TestRows = Store.RowsWithTest(Criteria.TestName)
+        IndexSteps.append(QueryStep('Test Name', len(TestRows), lambda RowId: TestCodes[RowId] == TestCode,
+                                    lambda: TestRows))
+
+    if Criteria.Status is not None:
+        StatusCode = Store.Statuses.Lookup(Criteria.Status)
+        StatusCodes = Store.StatusCodes
+        StatusRows = Store.RowsWithStatus(Criteria.Status)
+        IndexSteps.append(QueryStep('Status', len(StatusRows), lambda RowId: StatusCodes[RowId] == StatusCode,
+                                    lambda: StatusRows))
+
+    if Criteria.StartDate is not None or Criteria.EndDate is not None:
+        StartMinutes = MinutesSinceEpoch(Criteria.StartDate) if Criteria.StartDate is not None else MissingTime
+        EndMinutes = MinutesSinceEpoch(Criteria.EndDate) if Criteria.EndDate is not None else -MissingTime - 1
+        DateTimes = Store.DateTimes
+        Index = Store.GetIndex('DateTime', DateIndex)
+        IndexSteps.append(QueryStep('Date Range', Index.Count(StartMinutes, EndMinutes),
+                                    lambda RowId: StartMinutes <= DateTimes[RowId] <= EndMinutes,
+                                    lambda: Index.Rows(StartMinutes, EndMinutes)))
+
+    if Criteria.MinTurnaround is not None or Criteria.MaxTurnaround is not None:
+        MinTurnaround = Criteria.MinTurnaround if Criteria.MinTurnaround is not None else 0
+        MaxTurnaround = Criteria.MaxTurnaround if Criteria.MaxTurnaround is not None else -MissingTime - 1
+        TurnaroundRows = Store.GetIndex('Turnaround', TurnaroundIndex)
+
+        def CheckTurnaround(RowId):
+            TurnaroundTimeMinutes = TurnaroundRows.TurnaroundOf(RowId)
+            return TurnaroundTimeMinutes is not None and MinTurnaround <= TurnaroundTimeMinutes <= MaxTurnaround
+        IndexSteps.append(QueryStep('Turnaround Time', TurnaroundRows.Count(MinTurnaround, MaxTurnaround),
+                                    CheckTurnaround, lambda: TurnaroundRows.Rows(MinTurnaround, MaxTurnaround)))
+
+    if Criteria.MinResult is not None or Criteria.MaxResult is not None:
+        MinResult = Criteria.MinResult if Criteria.MinResult is not None else float('-inf')
+        MaxResult = Criteria.MaxResult if Criteria.MaxResult is not None else float('inf')
+        ResultTestCode = Store.Tests.Lookup(Criteria.TestName) if Criteria.TestName is not None else None
+        Results = Store.Results
+        ResultRows = Store.GetIndex('Result', ResultIndex)
+        IndexSteps.append(QueryStep('Result Range', ResultRows.Count(MinResult, MaxResult, ResultTestCode),
+                                    lambda RowId: MinResult <= Results[RowId] <= MaxResult,
+                                    lambda: ResultRows.Rows(MinResult, MaxResult, ResultTestCode)))
+
+    if Criteria.Abnormal:
+        if MedicalTests is None:
+            raise ValueError("The Abnormal criterion needs the medical tests")
+        Ranges = RangesByTestCode(Store, MedicalTests)
+        ScanSteps.append(QueryStep('Abnormal Tests', Store.RowCount, lambda RowId: IsAbnormalRow(Store, Ranges, RowId),
+                                   Scan=lambda: ScanRows(Store, medical_tests=MedicalTests)))
+
+    IndexSteps.sort(key=lambda Step: Step.Size)
+    ScanSteps.sort(key=lambda Step: Step.Scan is None)
+    return IndexSteps + ScanSteps
+
+
+QueryCacheSize = int(os.environ.get('MEDICAL_RECORDS_QUERY_CACHE_MB', 64)) * 2**20  # Per store, 0 turns it off
+
+
+# LRU cache of query results (row ids) of a store, bounded by the memory the results take. Every
+# entry carries the generation it was computed at: the generation of its test for queries of one
+# test, else the generation of the whole store. The store bumps them through the index hooks on
+# every append, change and deletion, so adding, updating and importing records invalidate exactly
+# the entries of the tests they touch. The ranges of the tests are part of the key, so an edited
+# test range stops matching the entries computed with the old one.
+class QueryCache(RowIndex):
+    def __init__(self, Store: RecordStore):
+        self.Store = Store
+        self.Generation = 0
+        self.TestGenerations: Dict[int, int] = {}  # TestCode -> generation
+        self.Entries: OrderedDict = OrderedDict()  # Key -> (generation, row ids, bytes), least recently used first
+        self.Size = 0
+
+    def AddRow(self, RowId: int):
+        self.Generation += 1
+        TestCode = self.Store.TestCodes[RowId]
+        self.TestGenerations[TestCode] = self.TestGenerations.get(TestCode, 0) + 1
+
+    def AddRows(self, RowIds):
+        if len(RowIds):
+            self.Generation += 1
+            TestCodes = self.Store.TestCodes
+            for TestCode in {TestCodes[RowId] for RowId in RowIds}:
+                self.TestGenerations[TestCode] = self.TestGenerations.get(TestCode, 0) + 1
+
+    RemoveRow = AddRow
+
+    # Function to get the generation that results about a test (or about every test) depend on
+    def GenerationOf(self, TestName: Optional[str]) -> Tuple:
+        TestCode = self.Store.Tests.Lookup(TestName) if TestName is not None else None
+        if TestCode is None:  # All tests, or a test without rows that an append may create
+            return (None, self.Generation)
+        return (TestCode, self.TestGenerations.get(TestCode, 0))
+
+    # Function to get the rows of a query from the cache, Compute() them on a miss
+    def Lookup(self, Key: Tuple, TestName: Optional[str], Compute) -> List[int]:
+        Generation = self.GenerationOf(TestName)
+        Entry = self.Entries.get(Key)
+        if Entry is not None:
+            if Entry[0] == Generation:
+                QueryCacheStatistics['hits'] += 1
+                self.Entries.move_to_end(Key)
+                return Entry[1].tolist()
+            QueryCacheStatistics['invalidations'] += 1
+            self.Discard(Key)
+        QueryCacheStatistics['misses'] += 1
+
+        Rows = Compute()
+        Cached = array('I', Rows)
+        Size = sys.getsizeof(Cached) + sys.getsizeof(Key)
+        if Size <= QueryCacheSize:
+            self.Entries[Key] = (Generation, Cached, Size)
+            self.Size += Size
+            while self.Size > QueryCacheSize:
+                QueryCacheStatistics['evictions'] += 1
+                self.Discard(next(iter(self.Entries)))
+        return Rows
+
+    def Discard(self, Key: Tuple):
+        self.Size -= self.Entries.pop(Key)[2]
+
+
+# Function to normalize a query into a cache key: the criteria with dates as epoch minutes and, for
+# the Abnormal criterion, the ranges of the tests it covers as the test catalog has them now
+def QueryCacheKey(Store: RecordStore, Criteria: Query, MedicalTests=None) -> Tuple:
+    Key = tuple(MinutesSinceEpoch(Value) if isinstance(Value, datetime) else Value
+                for Value in vars(Criteria).values())
+    if Criteria.Abnormal and MedicalTests is not None:
+        TestNames = [Criteria.TestName] if Criteria.TestName is not None else Store.Tests.Strings
+        Ranges = []
+        for TestName in TestNames:
+            if TestName in MedicalTests:
+                TestRange = MedicalTests[TestName]['range']
+                Ranges.append((TestName, TestRange.get('low'), TestRange.get('high')))
+        Key += (tuple(Ranges),)
+    return Key
+
+
+# Function to run a Query, returns the matching row ids patient by patient. The result stays in the
+# store's query cache until a change touches the rows it covers.
+def ExecuteQuery(Store: RecordStore, Criteria: Query, MedicalTests=None) -> List[int]:
+    if not QueryCacheSize:
+        return RunQuery(Store, Criteria, MedicalTests)
+    Cache = Store.GetIndex('QueryCache', QueryCache)
+    return Cache.Lookup(QueryCacheKey(Store, Criteria, MedicalTests), Criteria.TestName,
+                        lambda: RunQuery(Store, Criteria, MedicalTests))
+
+
+# Function to plan and run a Query without the cache
+def RunQuery(Store: RecordStore, Criteria: Query, MedicalTests=None) -> List[int]:
+    Steps = PlanQuery(Store, Criteria, MedicalTests)
+    if any(Step.Fetch is not None and Step.Size == 0 for Step in Steps):
+        return []
+
+    if not Steps:
+        Candidates = Store.IterRows()
+    elif Steps[0].Fetch is None:
+        # Nothing indexed: test whole columns at once when the step can, else walk all rows
+        Candidates = Steps[0].Scan() if Steps[0].Scan is not None else Store.IterRows()
+        Steps = Steps[1:] if Steps[0].Scan is not None else Steps
+    else:
+        Candidates = Steps[0].Fetch()
+        Steps = Steps[1:]
+        # Intersect with the other index results while they are about as small as the candidates,
+        # afterwards checking the remaining rows one by one is cheaper than building sets
+        while Steps and Steps[0].Fetch is not None and Steps[0].Size <= 4 * len(Candidates):
+            Candidates = set(Candidates).intersection(Steps[0].Fetch())
+            Steps = Steps[1:]
+
+    Checks = [Step.Check for Step in Steps]
+    Rows = [RowId for RowId in Candidates if all(Check(RowId) for Check in Checks)]
+    return Store.InPatientOrder(Rows)
@@ -0,0 +1,149 @@
+from __future__ import annotations
+from array import array
+from datetime import date, datetime
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # Optional, the scans fall back to plain Python loops
+    np = None
+
+if TYPE_CHECKING:
+    from RecordStore import RecordStore
+
+
+DateTimeFormat = '%Y-%m-%d %H:%M'
+EpochOrdinal = date(1970, 1, 1).toordinal()
+MissingTime = -(2 ** 63)  # Stored in CompletionTimes when a record has no CompletionTime
+RecordFields = ("TestName", "DateTime", "Result", "Unit", "Status", "CompletionTime")
+
+_DayMinutes: Dict[str, int] = {}  # 'YYYY-MM-DD' -> minutes since epoch, dates repeat a lot
+_DayStrings: Dict[int, str] = {}  # reverse of _DayMinutes
+
+
+# Function to parse 'YYYY-MM-DD HH:MM' into minutes since 1970-01-01 (raises ValueError).
+# Also tells whether the text is in the canonical layout, i.e. MinutesToDateTime gives it back.
+def ParseDateTime(DateTime: str) -> Tuple[int, bool]:
+    if len(DateTime) == 16 and DateTime[10] == ' ' and DateTime[13] == ':':
+        Hours = DateTime[11:13]
+        Minutes = DateTime[14:16]
+        if Hours.isdigit() and Minutes.isdigit() and int(Hours) < 24 and int(Minutes) < 60:
+            Day = _DayMinutes.get(DateTime[:10])
+            if Day is None:
+                Parsed = datetime.strptime(DateTime[:10], '%Y-%m-%d')
+                Day = (Parsed.toordinal() - EpochOrdinal) * 1440
+                if Parsed.date().isoformat() == DateTime[:10]:
+                    _DayMinutes[DateTime[:10]] = Day
+                else:
+                    return Day + int(Hours) * 60 + int(Minutes), False
+            return Day + int(Hours) * 60 + int(Minutes), True
+    # Not in the canonical layout, let strptime decide
+    Parsed = datetime.strptime(DateTime, DateTimeFormat)
+    return (Parsed.toordinal() - EpochOrdinal) * 1440 + Parsed.hour * 60 + Parsed.minute, False
+
+
+# Function to convert 'YYYY-MM-DD HH:MM' into minutes since 1970-01-01 (raises ValueError)
+def DateTimeToMinutes(DateTime: str) -> int:
+    return ParseDateTime(DateTime)[0]
+
+
+# Function to convert minutes since 1970-01-01 back into 'YYYY-MM-DD HH:MM'
+def MinutesToDateTime(Minutes: int) -> str:
+    Day, Minute = divmod(Minutes, 1440)
+    DayString = _DayStrings.get(Day)
+    if DayString is None:
+        DayString = date.fromordinal(Day + EpochOrdinal).isoformat()
+        _DayStrings[Day] = DayString
+    return f"{DayString} {Minute // 60:02d}:{Minute % 60:02d}"
+
+
+# Function to format a stored result the way it is usually written in the file
+def FormatResult(Value: float) -> str:
+    if Value.is_integer() and abs(Value) < 1e15:
+        return str(int(Value))
+    return repr(Value)
+
+
+# Function to parse a result (raises ValueError), also telling whether FormatResult gives the text back
+def ParseResult(Result: str) -> Tuple[float, bool]:
+    Value = float(Result)
+    if Result.isdigit() and (Result[0] != '0' or len(Result) == 1):
+        return Value, True
+    return Value, FormatResult(Value) == Result
+
+
+# Dictionary encoding: every distinct string is stored once and referenced by an integer code
+class StringTable:
+    def __init__(self, Strings=()):
+        self.Strings: List[str] = []
+        self.Codes: Dict[str, int] = {}
+        for Value in Strings:
+            self.Encode(Value)
+
+    def Encode(self, Value: str) -> int:
+        Code = self.Codes.get(Value)
+        if Code is None:
+            Code = len(self.Strings)
+            self.Strings.append(Value)
+            self.Codes[Value] = Code
+        return Code
+
+    def Decode(self, Code: int) -> str:
+        return self.Strings[Code]
+
+    def Lookup(self, Value: str) -> Optional[int]:
+        return self.Codes.get(Value)
+
+    def __len__(self):
+        return len(self.Strings)
+
+
+# Function to check and convert record fields into column values (raises ValueError).
+# Returns (Result, DateTime, CompletionTime, original text of the fields that do not round trip).
+def EncodeRecordFields(record) -> Tuple[float, int, int, Dict[str, str]]:
+    Overrides = {}
+    Result, Canonical = ParseResult(record['Result'])
+    if not Canonical:
+        Overrides['Result'] = record['Result']
+
+    DateTime, Canonical = ParseDateTime(record['DateTime'])
+    if not Canonical:
+        Overrides['DateTime'] = record['DateTime']
+
+    CompletionText = record.get('CompletionTime', '')
+    CompletionTime = MissingTime
+    if CompletionText:
+        CompletionTime, Canonical = ParseDateTime(CompletionText)
+        if not Canonical:
+            Overrides['CompletionTime'] = CompletionText
+
+    return Result, DateTime, CompletionTime, Overrides
+
+
+# Function to format records
+def FormatRecord(PatientId, record):
+    FormattedRecord = (f"{PatientId}: {record['TestName']}, "
+                        f"{record['DateTime']}, "
+                        f"{record['Result']}, "
+                        f"{record['Unit']}, "
+                        f"{record['Status']}")
+    if 'CompletionTime' in record:
+        FormattedRecord += f", {record['CompletionTime']}"
+    return FormattedRecord
+
+
+# Function to convert a datetime object into minutes since 1970-01-01
+def MinutesSinceEpoch(Value: datetime) -> int:
+    return (Value.toordinal() - EpochOrdinal) * 1440 + Value.hour * 60 + Value.minute
+
+
+# Function to get a NumPy view of a store column
+def ColumnView(Column: array):
+    return np.frombuffer(Column, dtype=np.dtype(Column.typecode))
+
+# Function to get a boolean NumPy mask of the rows that are not deleted
+def LiveRowMask(Store: RecordStore):
+    Mask = np.ones(Store.RowCount, dtype=bool)
+    if Store.Deleted:
+        Mask[np.fromiter(Store.Deleted, dtype=np.int64, count=len(Store.Deleted))] = False
+    return Mask
@@ -0,0 +1,1050 @@
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate, chain, compress, filterfalse, islice, repeat
+from typing import Dict, Iterator, List, Optional, Tuple
+import hashlib
+import json
+import mmap
+import operator
+import os
+import struct
+import sys
+import tempfile
+
+try:
+    import numpy as np
+except ImportError:  # Optional, the scans fall back to plain Python loops
+    np = None
+
+from OperationStats import Instrumented
+from RecordColumns import EncodeRecordFields, MissingTime, ParseDateTime, ParseResult, StringTable
+from RecordStore import RecordStore
+from RecordJournal import (AppendJournalEntries, ApplyOverlay, BlockSize, FileHash, JournalCompactionSize,
+                           JournalFileOf, JournalOverlay, ReadJournal, ReadRecordIdMap, RecordIdMap, ReplaceFile,
+                           ReplayJournal, WriteRecordIdMap)
+from CompactFormat import (CompactRecordCodec, CompactRecordWriter, CompactShardRows, IsCompactRecordFile,
+                           IterCompactRecords, ReadCompactIndex, ReadCompactPatientRecords, ReadCompactRecordFile)
+
+
+# Function to split one line of MedicalRecord.txt into (PatientId, record), None if it is malformed
+def ParseRecordLine(Line: str) -> Optional[Tuple[str, Dict[str, str]]]:
+    # Split line into parts based on colon and comma separation
+    parts = Line.split(': ', 1)
+    if len(parts) != 2:
+        return None
+
+    RecordData = parts[1].split(', ')
+    if len(RecordData) not in (5, 6):
+        return None
+
+    record = {
+        "TestName": RecordData[0],
+        "DateTime": RecordData[1],
+        "Result": RecordData[2],
+        "Unit": RecordData[3],
+        "Status": RecordData[4]
+    }
+
+    # Add CompletionTime if it exists
+    if len(RecordData) == 6:
+        record["CompletionTime"] = RecordData[5]
+    return parts[0], record
+
+
+# Default handler for malformed lines
+def ReportMalformedLine(Offset: int, Line: str):
+    print(f"Skipping malformed record at byte {Offset}: {Line}")
+
+
+# Function to walk a file through mmap one block at a time. Yields (byte offset, block) where every
+# block ends after a complete line (or at the end of the range), so never more than one block is held.
+# Start and End limit the walk to a byte range whose bounds are at line starts.
+def IterRecordFileBlocks(RecordsFile: str, Start: int = 0, End: Optional[int] = None) -> Iterator[Tuple[int, bytes]]:
+    with open(RecordsFile, 'rb') as file:
+        Size = os.fstat(file.fileno()).st_size
+        if End is not None:
+            Size = min(Size, End)
+        if Size <= Start:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as Mapped:
+            Offset = Start
+            while Offset < Size:
+                # Cut the block after the last complete line it contains
+                BlockEnd = min(Offset + BlockSize, Size)
+                if BlockEnd < Size:
+                    Newline = Mapped.rfind(b'\n', Offset, BlockEnd)
+                    if Newline < 0:  # A single line longer than the block
+                        Newline = Mapped.find(b'\n', BlockEnd)
+                    BlockEnd = Size if Newline < 0 else Newline + 1
+                yield Offset, Mapped[Offset:BlockEnd]
+                Offset = BlockEnd
+
+
+# Function to walk the non-empty lines of a block from IterRecordFileBlocks as (byte offset, line)
+def IterBlockLines(Offset: int, Block: bytes) -> Iterator[Tuple[int, str]]:
+    if Block.isascii():
+        # One character per byte, decode the whole block at once
+        for Line in Block.decode('ascii').split('\n'):
+            Stripped = Line.strip()
+            if Stripped:
+                yield Offset, Stripped
+            Offset += len(Line) + 1
+    else:
+        for RawLine in Block.split(b'\n'):
+            Line = RawLine.decode('utf-8', errors='replace').strip()
+            if Line:
+                yield Offset, Line
+            Offset += len(RawLine) + 1
+
+
+# Function to walk the non-empty lines of a file through mmap, one block at a time.
+# Yields (byte offset, line) and never holds more than one block of the file.
+# Start and End limit the walk to a byte range whose bounds are at line starts.
+def IterRecordFileLines(RecordsFile: str, Start: int = 0, End: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+    for Offset, Block in IterRecordFileBlocks(RecordsFile, Start, End):
+        yield from IterBlockLines(Offset, Block)
+
+
+# Function to stream (PatientId, record) pairs from a records file in constant memory.
+# Lines that cannot be parsed, or whose Result or dates are unreadable, go to OnMalformed(offset, line).
+# Edits and deletions waiting in the journal are applied on the way (only when the whole file is read,
+# Start and End limit the stream to a byte range like IterRecordFileLines).
+# Compact records files are read block by block, their byte range selects the blocks that start in it.
+def IterMedicalRecords(RecordsFile: str, OnMalformed=ReportMalformedLine, Start: int = 0,
+                       End: Optional[int] = None) -> Iterator[Tuple[str, Dict[str, str]]]:
+    Overlay = JournalOverlay(RecordsFile) if Start == 0 and End is None else {}
+    if IsCompactRecordFile(RecordsFile):
+        Records = IterCompactRecords(RecordsFile, Start, End)
+    else:
+        Records = IterParsedRecords(RecordsFile, OnMalformed, Start, End)
+    for RowId, Parsed in enumerate(Records):
+        if RowId in Overlay:
+            if Overlay[RowId] is None:
+                continue
+            ApplyOverlay(Parsed[1], Overlay[RowId])
+        yield Parsed
+
+
+# Function to parse the (PatientId, record) pairs of the lines of a byte range of a text records file
+def IterParsedRecords(RecordsFile: str, OnMalformed=ReportMalformedLine, Start: int = 0,
+                      End: Optional[int] = None) -> Iterator[Tuple[str, Dict[str, str]]]:
+    for Offset, Line in IterRecordFileLines(RecordsFile, Start, End):
+        Parsed = ParseRecordLine(Line)
+        if Parsed is not None:
+            record = Parsed[1]
+            try:
+                ParseResult(record['Result'])
+                ParseDateTime(record['DateTime'])
+                if record.get('CompletionTime'):
+                    ParseDateTime(record['CompletionTime'])
+            except ValueError:
+                Parsed = None
+        if Parsed is None:
+            if OnMalformed is not None:
+                OnMalformed(Offset, Line)
+            continue
+        yield Parsed
+
+
+# Function to stream records in lists of BatchSize (PatientId, record) pairs
+def IterMedicalRecordBatches(RecordsFile: str, BatchSize: int = 10000,
+                             OnMalformed=ReportMalformedLine) -> Iterator[List[Tuple[str, Dict[str, str]]]]:
+    Batch = []
+    for Pair in IterMedicalRecords(RecordsFile, OnMalformed):
+        Batch.append(Pair)
+        if len(Batch) >= BatchSize:
+            yield Batch
+            Batch = []
+    if Batch:
+        yield Batch
+
+
+# Function to cut a file into about Count byte ranges that start and end on line boundaries
+def SplitFileByLines(RecordsFile: str, Count: int) -> List[Tuple[int, int]]:
+    Size = os.path.getsize(RecordsFile)
+    Bounds = [0]
+    with open(RecordsFile, 'rb') as file:
+        for Index in range(1, Count):
+            Position = max(Size * Index // Count, Bounds[-1])
+            file.seek(Position)
+            file.readline()  # Move to the start of the next line
+            Position = min(file.tell(), Size)
+            if Position > Bounds[-1]:
+                Bounds.append(Position)
+    if Size > Bounds[-1]:
+        Bounds.append(Size)
+    return list(zip(Bounds, Bounds[1:]))
+
+
+# Function to parse one byte range of a records file into its own RecordStore.
+# Returns the store and the malformed (offset, line) pairs, runs inside loader processes.
+def LoadRecordRange(RecordsFile: str, Start: int, End: int) -> Tuple[RecordStore, List[Tuple[int, str]]]:
+    Malformed = []
+    Store = ReadMedicalRecordsFromFile(RecordsFile, lambda Offset, Line: Malformed.append((Offset, Line)),
+                                       Start=Start, End=End)
+    return Store, Malformed
+
+
+ParallelLoadMinimumSize = 8 * 2**20  # Smaller files load faster in a single process
+
+
+# Function to read medical records from a file and load into a RecordStore.
+# With Workers > 1 the file is cut into line aligned byte ranges that are parsed by a pool of
+# processes and merged back in file order.
+# With UseSnapshot a current binary snapshot next to the file replaces the parse, and the
+# snapshot is (re)written after a parse. A records file in the compact format is decoded instead.
+@Instrumented(Rows=lambda Store: Store.LiveRowCount)
+def ReadMedicalRecordsFromFile(RecordsFile: str, OnMalformed=ReportMalformedLine, Workers: int = 1,
+                               Start: int = 0, End: Optional[int] = None, UseSnapshot: bool = False) -> RecordStore:
+    WholeFile = Start == 0 and End is None
+    if IsCompactRecordFile(RecordsFile):
+        # No snapshot: it would be several times the size of the compact file
+        MedicalRecords = ReadCompactRecordFile(RecordsFile, Start, End)
+    else:
+        MedicalRecords = LoadSnapshot(RecordsFile, OnMalformed) if UseSnapshot and WholeFile else None
+
+    if MedicalRecords is None:
+        MedicalRecords = RecordStore()
+        Before = os.stat(RecordsFile)
+        if Workers > 1 and End is None and Before.st_size >= ParallelLoadMinimumSize:
+            # A few ranges per worker keeps the processes busy when some ranges parse slower
+            Ranges = SplitFileByLines(RecordsFile, Workers * 4)
+            with ProcessPoolExecutor(max_workers=Workers) as Executor:
+                for Part, Malformed in Executor.map(LoadRecordRange, repeat(RecordsFile), *zip(*Ranges)):
+                    MedicalRecords.Extend(Part)
+                    if OnMalformed is not None:
+                        for Offset, Line in Malformed:
+                            OnMalformed(Offset, Line)
+        else:
+            AppendRecordLines(MedicalRecords, RecordsFile, OnMalformed, Start, End)
+
+        # The snapshot holds the file as parsed, the journal is replayed on top of it
+        After = os.stat(RecordsFile)
+        if UseSnapshot and WholeFile and (After.st_size, After.st_mtime_ns) == (Before.st_size, Before.st_mtime_ns):
+            WriteSnapshot(MedicalRecords, RecordsFile)
+
+    # Apply the edits made since the last compaction (only when the whole file was read)
+    if WholeFile:
+        ReplayJournal(MedicalRecords, RecordsFile)
+    return MedicalRecords
+
+
+# Minutes of the ':MM' ending of a DateTime
+MinuteOfEnding = {f":{Minute:02d}": Minute for Minute in range(60)}
+
+HourOfDateTime = operator.itemgetter(slice(None, -3))  # 'YYYY-MM-DD HH' of a canonical DateTime
+EndingOfDateTime = operator.itemgetter(slice(-3, None))  # ':MM'
+ShapedCommaCounts = {4, 5}  # ', ' in a usual line without and with a CompletionTime
+CompletionPadding = (', ', '')  # Empty CompletionTime field added to a line without one
+
+# Byte positions of the digits and of the separators in 'YYYY-MM-DD HH:MM'
+DateTimeDigitColumns = [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15]
+DateTimeSeparatorColumns = [4, 7, 10, 13]
+DateTimeSeparators = [ord('-'), ord('-'), ord(' '), ord(':')]
+DaysInMonth = [0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31] + [0] * 87  # Indexed by the two month digits
+
+
+# Function to get the minutes of a column of DateTimes at once with NumPy, with Empty for empty texts.
+# Gives None unless every text is canonical (or empty, with Empty given), then the caller goes one by one.
+# The fields are read from the digits; the days since the epoch come from the civil calendar formula,
+# as converting the texts with astype('datetime64[m]') can crash some NumPy versions.
+def ColumnMinutes(Texts: List[str], Empty: Optional[int] = None) -> Optional[List[int]]:
+    if not Texts or max(map(len, Texts)) > 16:
+        return None
+    Bytes = np.array(Texts, dtype='S16').view(np.uint8).reshape(-1, 16)
+    Digits = Bytes[:, DateTimeDigitColumns].astype(np.int64) - ord('0')
+    Canonical = ((Digits >= 0) & (Digits <= 9)).all(axis=1) & \
+        (Bytes[:, DateTimeSeparatorColumns] == DateTimeSeparators).all(axis=1)
+    Blank = ~Bytes.any(axis=1) if Empty is not None else False  # NumPy drops trailing NULs, count the texts
+    if not (Canonical | Blank).all() or (Empty is not None and Blank.sum() != Texts.count('')):
+        return None
+    Digits[~Canonical] = 0
+    Year = Digits[:, 0] * 1000 + Digits[:, 1] * 100 + Digits[:, 2] * 10 + Digits[:, 3]
+    Month, Day, Hour, Minute = (Digits[:, Column] * 10 + Digits[:, Column + 1] for Column in (4, 6, 8, 10))
+    Leap = (Year % 4 == 0) & ((Year % 100 != 0) | (Year % 400 == 0))
+    MonthDays = np.array(DaysInMonth)[Month] + (Leap & (Month == 2))
+    Valid = (Year >= 1) & (Day >= 1) & (Day <= MonthDays) & (Hour < 24) & (Minute < 60)  # As strptime checks
+    if not (Valid | Blank).all():
+        return None
+    Shifted = Year - (Month <= 2)  # Years starting in March, so the leap day comes last
+    Era = Shifted // 400
+    YearOfEra = Shifted - Era * 400
+    DayOfYear = (153 * ((Month + 9) % 12) + 2) // 5 + Day - 1
+    Days = Era * 146097 + YearOfEra * 365 + YearOfEra // 4 - YearOfEra // 100 + DayOfYear - 719468
+    Minutes = Days * 1440 + Hour * 60 + Minute
+    if Empty is not None:
+        Minutes[Blank] = Empty
+    return Minutes.tolist()
+
+
+# Parses the lines of a records file straight into the columns of a store, doing what ParseRecordLine
+# and AppendRecord do for every line without building record dictionaries. The hour of a DateTime
+# ('YYYY-MM-DD HH') and the Result texts already seen are looked up instead of parsed again.
+class RecordLineParser:
+    def __init__(self, MedicalRecords: RecordStore, OnMalformed):
+        self.Store = MedicalRecords
+        self.OnMalformed = OnMalformed
+        self.HourMinutes: Dict[str, int] = {}
+        self.ParsedResults: Dict[str, Tuple[float, bool]] = {}
+
+    # Function to parse a DateTime like ParseDateTime, remembering its hour when it is canonical
+    def ParseDateTime(self, DateTime: str) -> Tuple[int, bool]:
+        Minutes, Canonical = ParseDateTime(DateTime)
+        if Canonical:
+            self.HourMinutes[DateTime[:13]] = Minutes - MinuteOfEnding[DateTime[13:]]
+        return Minutes, Canonical
+
+    # Function to parse a Result like ParseResult, remembering the texts already seen
+    def ParseResult(self, ResultText: str) -> Tuple[float, bool]:
+        Parsed = self.ParsedResults.get(ResultText)
+        if Parsed is None:
+            Parsed = ParseResult(ResultText)
+            if len(self.ParsedResults) < 65536:
+                self.ParsedResults[ResultText] = Parsed
+        return Parsed
+
+    # Function to append (byte offset, stripped line) pairs one line at a time
+    def AppendLines(self, Lines):
+        Store = self.Store
+        PatientCodes, PatientRows, Patients = Store.PatientCodes, Store.PatientRows, Store.Patients
+        TestCodes, TestTable = Store.TestCodes, Store.Tests
+        UnitCodes, UnitTable = Store.UnitCodes, Store.Units
+        StatusCodes, StatusTable = Store.StatusCodes, Store.Statuses
+        Results, DateTimes, CompletionTimes = Store.Results, Store.DateTimes, Store.CompletionTimes
+        TextOverrides = Store.TextOverrides
+        HourMinutes = self.HourMinutes
+
+        for Offset, Line in Lines:
+            # Append to the store, records with unreadable values are reported and skipped
+            try:
+                PatientId, Separator, Rest = Line.partition(': ')
+                Fields = Rest.split(', ')
+                if not Separator or not 5 <= len(Fields) <= 6:
+                    raise ValueError(Line)
+                TestName, DateTimeText, ResultText, Unit, Status = Fields[:5]
+                Overrides = None
+
+                Parsed = self.ParseResult(ResultText)
+                if not Parsed[1]:
+                    Overrides = {'Result': ResultText}
+                Hour = HourMinutes.get(DateTimeText[:13])
+                Minute = MinuteOfEnding.get(DateTimeText[13:])
+                if Hour is not None and Minute is not None:
+                    DateTime = Hour + Minute
+                else:
+                    DateTime, Canonical = self.ParseDateTime(DateTimeText)
+                    if not Canonical:
+                        Overrides = dict(Overrides or {}, DateTime=DateTimeText)
+                CompletionTime = MissingTime
+                if len(Fields) == 6 and Fields[5]:
+                    CompletionText = Fields[5]
+                    Hour = HourMinutes.get(CompletionText[:13])
+                    Minute = MinuteOfEnding.get(CompletionText[13:])
+                    if Hour is not None and Minute is not None:
+                        CompletionTime = Hour + Minute
+                    else:
+                        CompletionTime, Canonical = self.ParseDateTime(CompletionText)
+                        if not Canonical:
+                            Overrides = dict(Overrides or {}, CompletionTime=CompletionText)
+            except ValueError:
+                if self.OnMalformed is not None:
+                    self.OnMalformed(Offset, Line)
+                continue
+
+            RowId = len(PatientCodes)
+            PatientCode = Patients.Codes.get(PatientId)
+            if PatientCode is None:
+                PatientCode = Patients.Encode(PatientId)
+                PatientRows[PatientCode] = array('I')
+            PatientCodes.append(PatientCode)
+            Code = TestTable.Codes.get(TestName)
+            TestCodes.append(TestTable.Encode(TestName) if Code is None else Code)
+            Code = UnitTable.Codes.get(Unit)
+            UnitCodes.append(UnitTable.Encode(Unit) if Code is None else Code)
+            Code = StatusTable.Codes.get(Status)
+            StatusCodes.append(StatusTable.Encode(Status) if Code is None else Code)
+            Results.append(Parsed[0])
+            DateTimes.append(DateTime)
+            CompletionTimes.append(CompletionTime)
+            if Overrides:
+                TextOverrides[RowId] = Overrides
+            PatientRows[PatientCode].append(RowId)
+
+    # Function to get the minutes of canonical DateTimes, None for the others. With Empty given, empty texts
+    # get Empty, unless other texts have an empty hour too (':05'): then all of them get None.
+    def CanonicalMinutes(self, Texts: List[str], Empty: Optional[int] = None) -> List[Optional[int]]:
+        if np is not None:
+            Minutes = ColumnMinutes(Texts, Empty)
+            if Minutes is not None:
+                return Minutes
+        HourMinutes = self.HourMinutes
+        Hours = list(map(HourOfDateTime, Texts))
+        for Hour in set(Hours).difference(HourMinutes):
+            try:
+                self.ParseDateTime(Hour + ':00')
+            except ValueError:
+                pass
+        Endings = MinuteOfEnding
+        if Empty is not None and Hours.count('') == Texts.count(''):
+            HourMinutes, Endings = {**HourMinutes, '': Empty}, {**MinuteOfEnding, '': 0}
+        HourValues = list(map(HourMinutes.get, Hours))
+        Minutes = list(map(Endings.get, map(EndingOfDateTime, Texts)))
+        if None not in HourValues and None not in Minutes:
+            return list(map(operator.add, HourValues, Minutes))
+        return [None if Hour is None or Minute is None else Hour + Minute for Hour, Minute in zip(HourValues, Minutes)]
+
+    # Function to append a block of text (whole lines, from byte Offset of the file) column by column.
+    # The lines in the usual layout ('PatientId: TestName, DateTime, Result, Unit, Status[, CompletionTime]'
+    # with canonical dates and readable results) are cut into columns with a few passes over the
+    # block; any other line goes through AppendLines in its place, so the rows keep the file order.
+    def AppendText(self, Offset: int, Text: str):
+        Lines = Text.split('\n')
+        Stripped = list(map(str.strip, Lines))
+        Commas = list(map(str.count, Stripped, repeat(', ')))
+        # One ': ' before the first of 4 or 5 ', ': the ': ' can then become one more ', '
+        Shaped = list(map(operator.and_,
+                          map(operator.and_, map((1).__eq__, map(str.count, Stripped, repeat(': '))),
+                              map(ShapedCommaCounts.__contains__, Commas)),
+                          map(operator.lt, map(str.find, Stripped, repeat(': ')), map(str.find, Stripped, repeat(', ')))))
+        LineNumbers = list(compress(range(len(Lines)), Shaped))
+        Count = len(LineNumbers)
+        Bad = set()
+        if Count:
+            # Lines without a CompletionTime get an empty one, so every line has seven fields
+            HasCompletion = list(map((5).__eq__, compress(Commas, Shaped)))
+            Fields = ', '.join(map(operator.add, compress(Stripped, Shaped),
+                                   map(CompletionPadding.__getitem__, HasCompletion))).replace(': ', ', ').split(', ')
+            if len(Fields) != 7 * Count:  # Cannot happen for lines of that shape; parse them one by one
+                self.AppendLines(IterBlockLines(Offset, Text.encode('ascii')))
+                return
+            PatientIds, TestNames, DateTimeTexts, ResultTexts, Units, Statuses = (Fields[Field::7] for Field in range(6))
+
+            Parsed = {}
+            for ResultText in set(ResultTexts):
+                try:
+                    Parsed[ResultText] = self.ParseResult(ResultText)
+                except ValueError:
+                    Parsed[ResultText] = None
+            ResultValues = list(map(Parsed.__getitem__, ResultTexts))
+            DateTimes = self.CanonicalMinutes(DateTimeTexts)
+            CompletionTimes = self.CanonicalMinutes(Fields[6::7], MissingTime)
+            for Values in (ResultValues, DateTimes, CompletionTimes):
+                if None in Values:
+                    Bad.update(Row for Row, Value in enumerate(Values) if Value is None)
+            Columns = (PatientIds, TestNames, Units, Statuses, ResultTexts, ResultValues, DateTimes, CompletionTimes)
+
+        # Runs of good rows go in at once, the other non-empty lines one by one between them
+        Others = sorted({Line for Line in compress(range(len(Lines)), map(operator.not_, Shaped)) if Stripped[Line]} |
+                        {LineNumbers[Row] for Row in Bad})
+        LineOffsets = list(accumulate(chain((Offset,), map(len, Lines)), lambda Total, Length: Total + Length + 1)) \
+            if Others else None
+        First = 0
+        for Line in Others:
+            Row = bisect_left(LineNumbers, Line)
+            if First < Row:
+                self.AppendColumns(*(Column[First:Row] for Column in Columns))
+            self.AppendLines([(LineOffsets[Line], Stripped[Line])])
+            First = Row + 1 if Row < Count and LineNumbers[Row] == Line else Row
+        if First < Count:
+            self.AppendColumns(*(Column[First:] if First else Column for Column in Columns))
+
+    # Function to append rows given as columns of field texts and parsed values
+    def AppendColumns(self, PatientIds, TestNames, Units, Statuses, ResultTexts, ResultValues, DateTimes,
+                      CompletionTimes):
+        Store = self.Store
+        FirstRow = Store.RowCount
+        PatientRows = Store.PatientRows
+        for Table, Codes, Texts in ((Store.Patients, Store.PatientCodes, PatientIds),
+                                    (Store.Tests, Store.TestCodes, TestNames), (Store.Units, Store.UnitCodes, Units),
+                                    (Store.Statuses, Store.StatusCodes, Statuses)):
+            # New texts are given codes in first-seen order
+            for Text in dict.fromkeys(filterfalse(Table.Codes.__contains__, Texts)):
+                Code = Table.Encode(Text)
+                if Table is Store.Patients:
+                    PatientRows[Code] = array('I')
+            Codes.extend(array(Codes.typecode, map(Table.Codes.__getitem__, Texts)))
+        Store.Results.extend(array('d', map(operator.itemgetter(0), ResultValues)))
+        Store.DateTimes.extend(array('q', DateTimes))
+        Store.CompletionTimes.extend(array('q', CompletionTimes))
+        if not all(map(operator.itemgetter(1), ResultValues)):
+            for RowId, (Value, Canonical) in enumerate(ResultValues, FirstRow):
+                if not Canonical:
+                    Store.TextOverrides[RowId] = {'Result': ResultTexts[RowId - FirstRow]}
+        for RowId, PatientCode in enumerate(Store.PatientCodes[FirstRow:], FirstRow):
+            PatientRows[PatientCode].append(RowId)
+
+
+# Function to parse the lines of a byte range of a records file into a store, block by block
+def AppendRecordLines(MedicalRecords: RecordStore, RecordsFile: str, OnMalformed, Start: int = 0,
+                      End: Optional[int] = None):
+    FirstRow = MedicalRecords.RowCount
+    Parser = RecordLineParser(MedicalRecords, OnMalformed)
+    for Offset, Block in IterRecordFileBlocks(RecordsFile, Start, End):
+        if Block.isascii():
+            Parser.AppendText(Offset, Block.decode('ascii'))
+        else:
+            Parser.AppendLines(IterBlockLines(Offset, Block))
+
+    for Index in MedicalRecords.Indexes.values():
+        Index.AddRows(range(FirstRow, MedicalRecords.RowCount))
+
+# Map-reduce over the records of a backend. The records are cut into shards: byte ranges of about
+# ShardSize of a records file, cut at line boundaries, or the whole file while its journal has pending
+# edits (only a pass over the whole file knows the positions the journal refers to). A kernel runs on
+# the records of every shard, in a pool of processes when asked, and the partial results come back in
+# shard order. The shards do not depend on the number of processes, so the merged result is the same
+# with any number of them.
+ShardSize = 16 * 2**20
+
+# (records file, start, end) of a shard; an end of None stands for the whole file with its journal
+RecordShard = Tuple[str, int, Optional[int]]
+
+
+# Function to cut a records file into shards
+def FileShards(RecordsFile: str) -> List[RecordShard]:
+    if ReadJournal(RecordsFile):
+        return [(RecordsFile, 0, None)]
+    if IsCompactRecordFile(RecordsFile):
+        return CompactShards(RecordsFile)
+    Count = -(-os.path.getsize(RecordsFile) // ShardSize)
+    return [(RecordsFile, Start, End) for Start, End in SplitFileByLines(RecordsFile, Count)]
+
+
+# Function to run Kernel(records of the shard, *Arguments) on one shard. Returns the kernel's result and
+# the malformed (offset, line) pairs of the shard; runs inside worker processes.
+def RunShardKernel(Kernel, RecordsFile: str, Start: int, End: Optional[int], Arguments: Tuple):
+    Malformed = []
+    Records = IterMedicalRecords(RecordsFile, lambda Offset, Line: Malformed.append((Offset, Line)), Start, End)
+    return Kernel(Records, *Arguments), Malformed
+
+
+# Function to hand the malformed lines of every shard to OnMalformed and yield the kernel results
+def ReportShardResults(Results, OnMalformed) -> Iterator:
+    for Part, Malformed in Results:
+        if OnMalformed is not None:
+            for Offset, Line in Malformed:
+                OnMalformed(Offset, Line)
+        yield Part
+
+
+# Function to run a kernel on every shard and yield its results in shard order. Parallel > 1 runs the
+# shards in that many processes, so the kernel and its arguments must pickle (a module level function).
+# The malformed lines of a shard are reported just before its result.
+def MapShards(Kernel, Shards: List[RecordShard], Arguments: Tuple = (), Parallel: int = 1,
+              OnMalformed=ReportMalformedLine) -> Iterator:
+    if Parallel > 1 and len(Shards) > 1:
+        with ProcessPoolExecutor(max_workers=min(Parallel, len(Shards))) as Executor:
+            yield from ReportShardResults(Executor.map(RunShardKernel, repeat(Kernel), *zip(*Shards),
+                                                       repeat(Arguments)), OnMalformed)
+    else:
+        yield from ReportShardResults((RunShardKernel(Kernel, *Shard, Arguments) for Shard in Shards), OnMalformed)
+
+
+# Function to run a kernel on every shard and fold the results, in shard order, with
+# Merge(total, part) -> total
+def MapReduce(Kernel, Shards: List[RecordShard], Merge, Initial, Arguments: Tuple = (), Parallel: int = 1):
+    Total = Initial
+    for Part in MapShards(Kernel, Shards, Arguments, Parallel):
+        Total = Merge(Total, Part)
+    return Total
+
+
+# Function to write the given rows of a store, in order, as a new records file and drop its journal.
+# The new file is written next to the old one and renamed over it, so a crash leaves either the
+# old file and journal or the new file. Format is 'text' or a compact codec ('zlib', 'lzma'),
+# by default the one of the current file. Ids are the record ids of the new file, when the rows left
+# out change them (they are saved with the journal marker first, see ReadRecordIdMap).
+def ReplaceMedicalRecordFile(MedicalRecords: RecordStore, RecordsFile: str, RowIds, Format: Optional[str] = None,
+                             Ids: Optional[RecordIdMap] = None):
+    if Format is None:
+        Format = CompactRecordCodec(RecordsFile) or 'text'
+    Directory = os.path.dirname(os.path.abspath(RecordsFile))
+    Hash = hashlib.sha256()
+    Rows = iter(RowIds)
+    with tempfile.NamedTemporaryFile('w' if Format == 'text' else 'wb', dir=Directory, prefix='.compact-',
+                                     delete=False) as file:
+        TemporaryFile = file.name
+        if Format == 'text':
+            while True:
+                Text = ''.join(MedicalRecords.FormatLine(RowId) + "\n" for RowId in islice(Rows, 10000))
+                if not Text:
+                    break
+                file.write(Text)
+                Hash.update(Text.encode())
+        else:
+            Writer = CompactRecordWriter(file, Format)
+            Writer.AddRows(MedicalRecords, Rows)
+            Writer.Close()
+        file.flush()
+        os.fsync(file.fileno())
+
+    Marker = {"Op": "Compacted", "Hash": Hash.hexdigest() if Format == 'text' else FileHash(TemporaryFile)}
+    if Ids is not None:
+        Marker["Dropped"] = Ids.Ranges()
+    AppendJournalEntries(RecordsFile, [Marker])
+    ReplaceFile(TemporaryFile, RecordsFile)
+    if Ids is not None:
+        WriteRecordIdMap(RecordsFile, Ids)
+    os.remove(JournalFileOf(RecordsFile))
+    if os.path.exists(OffsetIndexFileOf(RecordsFile)):
+        os.remove(OffsetIndexFileOf(RecordsFile))  # The lines moved
+
+
+# Function to write the live records of a store loaded from RecordsFile as a new records file and
+# drop the journal. The ids of the deleted records are dropped, the others keep theirs.
+def CompactMedicalRecordFile(MedicalRecords: RecordStore, RecordsFile: str, Format: Optional[str] = None):
+    Ids = ReadRecordIdMap(RecordsFile)
+    Ids.Drop([Ids.RecordIdOf(RowId) for RowId in MedicalRecords.Deleted])
+    ReplaceMedicalRecordFile(MedicalRecords, RecordsFile,
+                             (RowId for RowId in range(MedicalRecords.RowCount) if RowId not in MedicalRecords.Deleted),
+                             Format, Ids)
+    MedicalRecords.DropDeleted()
+
+
+# Function to compact once the journal has grown past JournalCompactionSize
+def CompactIfNeeded(MedicalRecords: RecordStore, RecordsFile: str):
+    JournalFile = JournalFileOf(RecordsFile)
+    if os.path.exists(JournalFile) and os.path.getsize(JournalFile) >= JournalCompactionSize:
+        CompactMedicalRecordFile(MedicalRecords, RecordsFile)
+
+
+#------------------------------
+# Binary snapshot. '<records file>.snapshot' holds the store as parsed from the records file:
+# a header, JSON metadata (source size, mtime and hash, string tables, text overrides and the
+# position of every column) and the packed column arrays, loaded back through mmap.
+
+SnapshotMagic = b'MRSNAP'
+SnapshotVersion = 1
+SnapshotHeader = struct.Struct('<6sHQ')  # Magic, version, metadata length
+
+
+def SnapshotFileOf(RecordsFile: str) -> str:
+    return RecordsFile + '.snapshot'
+
+
+# Function to write the snapshot of a store freshly parsed from RecordsFile (before any journal replay)
+def WriteSnapshot(MedicalRecords: RecordStore, RecordsFile: str):
+    Source = os.stat(RecordsFile)
+    EndsWithNewline = True
+    if Source.st_size:
+        with open(RecordsFile, 'rb') as file:
+            file.seek(-1, os.SEEK_END)
+            EndsWithNewline = file.read(1) == b'\n'
+
+    # Row ids of every patient one after the other, in patient code order
+    PatientRows = array('I')
+    PatientRowCounts = array('I')
+    for PatientCode in range(len(MedicalRecords.Patients)):
+        Rows = MedicalRecords.PatientRows.get(PatientCode, array('I'))
+        PatientRows.extend(Rows)
+        PatientRowCounts.append(len(Rows))
+
+    Columns = [(Name, getattr(MedicalRecords, Name)) for Name in MedicalRecords.ColumnNames]
+    Columns += [('PatientRows', PatientRows), ('PatientRowCounts', PatientRowCounts)]
+    Layout = {}
+    Offset = 0
+    for Name, Column in Columns:
+        Layout[Name] = [Column.typecode, Column.itemsize, Offset, len(Column)]
+        Offset += len(Column) * Column.itemsize
+        Offset += -Offset % 8  # Keep every column 8 byte aligned
+
+    Metadata = json.dumps({
+        "Size": Source.st_size, "MTime": Source.st_mtime_ns, "Hash": FileHash(RecordsFile, Source.st_size),
+        "EndsWithNewline": EndsWithNewline, "ByteOrder": sys.byteorder, "Rows": MedicalRecords.RowCount,
+        "Patients": MedicalRecords.Patients.Strings, "Tests": MedicalRecords.Tests.Strings,
+        "Units": MedicalRecords.Units.Strings, "Statuses": MedicalRecords.Statuses.Strings,
+        "TextOverrides": {str(RowId): Overrides for RowId, Overrides in MedicalRecords.TextOverrides.items()},
+        "Columns": Layout}).encode()
+    Metadata += b' ' * (-(SnapshotHeader.size + len(Metadata)) % 8)
+
+    # Written next to the snapshot and renamed over it, readers never see half a snapshot
+    # The snapshot is only a cache, failing to write it must not stop the program
+    SnapshotFile = SnapshotFileOf(RecordsFile)
+    Directory = os.path.dirname(os.path.abspath(SnapshotFile))
+    TemporaryFile = None
+    try:
+        with tempfile.NamedTemporaryFile('wb', dir=Directory, prefix='.snapshot-', delete=False) as file:
+            TemporaryFile = file.name
+            file.write(SnapshotHeader.pack(SnapshotMagic, SnapshotVersion, len(Metadata)))
+            file.write(Metadata)
+            for Name, Column in Columns:
+                file.write(Column.tobytes())
+                file.write(b'\0' * (-len(Column) * Column.itemsize % 8))
+        ReplaceFile(TemporaryFile, SnapshotFile)
+    except OSError as e:
+        print(f"Could not write the snapshot {SnapshotFile}: {e}")
+        if TemporaryFile is not None and os.path.exists(TemporaryFile):
+            os.remove(TemporaryFile)
+
+
+# Function to read a snapshot file into (store, metadata), None when it is missing or unusable
+def ReadSnapshot(SnapshotFile: str) -> Optional[Tuple[RecordStore, Dict]]:
+    try:
+        with open(SnapshotFile, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as Mapped:
+            Magic, Version, MetadataLength = SnapshotHeader.unpack_from(Mapped)
+            if Magic != SnapshotMagic or Version != SnapshotVersion:
+                return None
+            Metadata = json.loads(Mapped[SnapshotHeader.size:SnapshotHeader.size + MetadataLength])
+            if Metadata['ByteOrder'] != sys.byteorder:
+                return None
+
+            Base = SnapshotHeader.size + MetadataLength
+            Columns = {}
+            for Name, (TypeCode, ItemSize, Offset, Length) in Metadata['Columns'].items():
+                Column = array(TypeCode)
+                if Column.itemsize != ItemSize:
+                    return None
+                Column.frombytes(Mapped[Base + Offset:Base + Offset + Length * ItemSize])
+                if len(Column) != Length:
+                    return None
+                Columns[Name] = Column
+    except (OSError, ValueError, KeyError, TypeError, struct.error):
+        return None
+
+    MedicalRecords = RecordStore()
+    MedicalRecords.Patients = StringTable(Metadata['Patients'])
+    MedicalRecords.Tests = StringTable(Metadata['Tests'])
+    MedicalRecords.Units = StringTable(Metadata['Units'])
+    MedicalRecords.Statuses = StringTable(Metadata['Statuses'])
+    for Name in RecordStore.ColumnNames:
+        if len(Columns[Name]) != Metadata['Rows']:
+            return None
+        setattr(MedicalRecords, Name, Columns[Name])
+    MedicalRecords.TextOverrides = {int(RowId): Overrides for RowId, Overrides in Metadata['TextOverrides'].items()}
+
+    Start = 0
+    PatientRows = Columns['PatientRows']
+    for PatientCode, Count in enumerate(Columns['PatientRowCounts']):
+        MedicalRecords.PatientRows[PatientCode] = PatientRows[Start:Start + Count]
+        Start += Count
+    return MedicalRecords, Metadata
+
+
+# Function to load a store from the snapshot of RecordsFile when the snapshot still describes it.
+# A records file that only had lines appended since the snapshot is loaded by parsing just the
+# new tail; None means the snapshot cannot be used and the file must be parsed.
+def LoadSnapshot(RecordsFile: str, OnMalformed=ReportMalformedLine) -> Optional[RecordStore]:
+    Snapshot = ReadSnapshot(SnapshotFileOf(RecordsFile))
+    if Snapshot is None:
+        return None
+    MedicalRecords, Metadata = Snapshot
+    try:
+        Source = os.stat(RecordsFile)
+    except OSError:
+        return None
+
+    # Size and mtime unchanged: trust the snapshot without reading the records file
+    if (Source.st_size, Source.st_mtime_ns) == (Metadata['Size'], Metadata['MTime']):
+        return MedicalRecords
+    if Source.st_size < Metadata['Size'] or FileHash(RecordsFile, Metadata['Size']) != Metadata['Hash']:
+        return None
+    if Source.st_size > Metadata['Size']:
+        # Lines appended after the snapshot, unless the last line of the snapshot was cut
+        if not Metadata['EndsWithNewline']:
+            return None
+        AppendRecordLines(MedicalRecords, RecordsFile, OnMalformed, Start=Metadata['Size'])
+    WriteSnapshot(MedicalRecords, RecordsFile)
+    return MedicalRecords
+
+
+# Function to cut a compact records file into shards of whole blocks
+def CompactShards(RecordsFile: str) -> List[RecordShard]:
+    with open(RecordsFile, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as Mapped:
+        Blocks = ReadCompactIndex(Mapped)['Blocks']
+    Shards = []
+    Rows = 0
+    for Block in Blocks:
+        if not Shards or Rows >= CompactShardRows:
+            Shards.append([RecordsFile, Block['Offset'], None])
+            Rows = 0
+        Shards[-1][2] = Block['Offset'] + 1
+        Rows += Block['Rows']
+    return [tuple(Shard) for Shard in Shards]
+
+
+#------------------------------
+# Patient offset index. '<records file>.offsets' maps every patient to the byte offsets and positions
+# of its lines, so one patient's records are read through mmap without parsing the rest of the file.
+# Layout: a header, JSON metadata (source size, mtime and fingerprint, number of records, key width
+# and the position of every section), the patient ids sorted and padded to the key width, where the
+# entries of each patient start, and the offsets and positions of all entries, patient by patient.
+# Lines appended after the index was written are scanned on each lookup until they pass
+# OffsetIndexTailSize, then the index is extended with them.
+
+OffsetIndexMagic = b'MROFFS'
+OffsetIndexVersion = 1
+OffsetIndexTailSize = 2**20
+PatientOffsets = Dict[str, Tuple[array, array]]  # PatientId -> (line offsets, positions)
+
+
+def OffsetIndexFileOf(RecordsFile: str) -> str:
+    return RecordsFile + '.offsets'
+
+
+# Function to get a quick fingerprint of the first Size bytes of a file (the size and the hash of the
+# first and last 64 KiB), enough to tell that lines were only appended since
+def FileFingerprint(FileName: str, Size: int) -> str:
+    Hash = hashlib.sha256(str(Size).encode())
+    with open(FileName, 'rb') as file:
+        Hash.update(file.read(min(Size, 2**16)))
+        file.seek(max(Size - 2**16, 0))
+        Hash.update(file.read(min(Size, 2**16)))
+    return Hash.hexdigest()
+
+
+# Function to collect the offsets and positions (counted from 0) of the lines of a byte range that
+# the loader accepts, by patient. Returns them with the number of such lines; runs inside worker processes.
+def ScanPatientOffsets(RecordsFile: str, Start: int = 0, End: Optional[int] = None) -> Tuple[PatientOffsets, int]:
+    Entries: PatientOffsets = {}
+    Rows = 0
+    for Offset, Line in IterRecordFileLines(RecordsFile, Start, End):
+        Parsed = ParseRecordLine(Line)
+        try:
+            if Parsed is None:
+                continue
+            EncodeRecordFields(Parsed[1])
+        except ValueError:
+            continue
+        Entry = Entries.get(Parsed[0])
+        if Entry is None:
+            Entry = Entries[Parsed[0]] = (array('Q'), array('I'))
+        Entry[0].append(Offset)
+        Entry[1].append(Rows)
+        Rows += 1
+    return Entries, Rows
+
+
+# Function to add the entries of the lines after the first RowBase records to Entries
+def MergePatientOffsets(Entries: PatientOffsets, Other: PatientOffsets, RowBase: int):
+    for PatientId, (Offsets, RowIds) in Other.items():
+        Entry = Entries.get(PatientId)
+        if Entry is None:
+            Entry = Entries[PatientId] = (array('Q'), array('I'))
+        Entry[0].extend(Offsets)
+        Entry[1].extend(array('I', [RowBase + RowId for RowId in RowIds]))
+
+
+# Function to read the header and metadata of a mapped offset index: (metadata, start of the sections)
+def ReadOffsetIndexHeader(Mapped) -> Optional[Tuple[Dict, int]]:
+    Magic, Version, MetadataLength = SnapshotHeader.unpack_from(Mapped)
+    if Magic != OffsetIndexMagic or Version != OffsetIndexVersion:
+        return None
+    Metadata = json.loads(Mapped[SnapshotHeader.size:SnapshotHeader.size + MetadataLength])
+    if Metadata['ByteOrder'] != sys.byteorder:
+        return None
+    return Metadata, SnapshotHeader.size + MetadataLength
+
+
+# Function to read items Start to Stop of a section of a mapped offset index
+def ReadOffsetSection(Mapped, Metadata: Dict, Base: int, Name: str, Start: int = 0, Stop: Optional[int] = None) -> array:
+    TypeCode, Offset, Length = Metadata['Sections'][Name]
+    Section = array(TypeCode)
+    Stop = Length if Stop is None else Stop
+    Section.frombytes(Mapped[Base + Offset + Start * Section.itemsize:Base + Offset + Stop * Section.itemsize])
+    return Section
+
+
+# Function to look a patient up in an offset index by binary search over the mapped keys.
+# Returns (metadata, offsets, positions), None when the index is missing or unusable.
+def LookupOffsetIndex(IndexFile: str, PatientId: str) -> Optional[Tuple[Dict, array, array]]:
+    try:
+        with open(IndexFile, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as Mapped:
+            Header = ReadOffsetIndexHeader(Mapped)
+            if Header is None:
+                return None
+            Metadata, Base = Header
+            Width = Metadata['KeyWidth']
+            KeysStart = Base + Metadata['Sections']['Keys'][1]
+            Key = PatientId.encode().ljust(Width, b'\0')
+            Low, High = 0, Metadata['Patients']
+            while Low < High:
+                Middle = (Low + High) // 2
+                if Mapped[KeysStart + Middle * Width:KeysStart + (Middle + 1) * Width] < Key:
+                    Low = Middle + 1
+                else:
+                    High = Middle
+            if Low == Metadata['Patients'] or Mapped[KeysStart + Low * Width:KeysStart + (Low + 1) * Width] != Key:
+                return Metadata, array('Q'), array('I')
+            Start, Stop = ReadOffsetSection(Mapped, Metadata, Base, 'Starts', Low, Low + 2)
+            return (Metadata, ReadOffsetSection(Mapped, Metadata, Base, 'Offsets', Start, Stop),
+                    ReadOffsetSection(Mapped, Metadata, Base, 'RowIds', Start, Stop))
+    except (OSError, ValueError, KeyError, TypeError, struct.error):
+        return None
+
+
+# Function to read all entries of an offset index: (metadata, entries), None when it is unusable
+def ReadOffsetIndex(IndexFile: str) -> Optional[Tuple[Dict, PatientOffsets]]:
+    try:
+        with open(IndexFile, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as Mapped:
+            Header = ReadOffsetIndexHeader(Mapped)
+            if Header is None:
+                return None
+            Metadata, Base = Header
+            Width = Metadata['KeyWidth']
+            Keys = ReadOffsetSection(Mapped, Metadata, Base, 'Keys').tobytes()
+            Starts = ReadOffsetSection(Mapped, Metadata, Base, 'Starts')
+            Offsets = ReadOffsetSection(Mapped, Metadata, Base, 'Offsets')
+            RowIds = ReadOffsetSection(Mapped, Metadata, Base, 'RowIds')
+    except (OSError, ValueError, KeyError, TypeError, struct.error):
+        return None
+    return Metadata, {Keys[Index * Width:(Index + 1) * Width].rstrip(b'\0').decode():
+                      (Offsets[Starts[Index]:Starts[Index + 1]], RowIds[Starts[Index]:Starts[Index + 1]])
+                      for Index in range(Metadata['Patients'])}
+
+
+# Function to write the offset index of the first Size bytes of a records file
+def WriteOffsetIndex(RecordsFile: str, Entries: PatientOffsets, Rows: int, Size: int, MTime: int):
+    Keys = sorted(PatientId.encode() for PatientId in Entries)
+    Width = max(map(len, Keys), default=1)
+    Starts = array('Q', [0])
+    Offsets = array('Q')
+    RowIds = array('I')
+    for Key in Keys:
+        LineOffsets, LineRowIds = Entries[Key.decode()]
+        Offsets.extend(LineOffsets)
+        RowIds.extend(LineRowIds)
+        Starts.append(len(Offsets))
+    EndsWithNewline = True
+    if Size:
+        with open(RecordsFile, 'rb') as file:
+            file.seek(Size - 1)
+            EndsWithNewline = file.read(1) == b'\n'
+
+    Sections = [('Keys', array('B', b''.join(Key.ljust(Width, b'\0') for Key in Keys))),
+                ('Starts', Starts), ('Offsets', Offsets), ('RowIds', RowIds)]
+    Layout = {}
+    Offset = 0
+    for Name, Section in Sections:
+        Layout[Name] = [Section.typecode, Offset, len(Section)]
+        Offset += len(Section) * Section.itemsize
+        Offset += -Offset % 8
+    Metadata = json.dumps({
+        "Size": Size, "MTime": MTime, "Fingerprint": FileFingerprint(RecordsFile, Size),
+        "EndsWithNewline": EndsWithNewline, "ByteOrder": sys.byteorder, "Rows": Rows,
+        "Patients": len(Keys), "KeyWidth": Width, "Sections": Layout}).encode()
+    Metadata += b' ' * (-(SnapshotHeader.size + len(Metadata)) % 8)
+
+    # Like the snapshot: written next to the index and renamed over it, and only a cache
+    IndexFile = OffsetIndexFileOf(RecordsFile)
+    TemporaryFile = None
+    try:
+        with tempfile.NamedTemporaryFile('wb', dir=os.path.dirname(os.path.abspath(IndexFile)), prefix='.offsets-',
+                                         delete=False) as file:
+            TemporaryFile = file.name
+            file.write(SnapshotHeader.pack(OffsetIndexMagic, OffsetIndexVersion, len(Metadata)))
+            file.write(Metadata)
+            for Name, Section in Sections:
+                file.write(Section.tobytes())
+                file.write(b'\0' * (-len(Section) * Section.itemsize % 8))
+        ReplaceFile(TemporaryFile, IndexFile)
+    except OSError as e:
+        print(f"Could not write the offset index {IndexFile}: {e}")
+        if TemporaryFile is not None and os.path.exists(TemporaryFile):
+            os.remove(TemporaryFile)
+
+
+# Function to tell whether index metadata still describes the start of a records file: the file is
+# unchanged, or lines were only appended after the indexed part
+def OffsetIndexCovers(RecordsFile: str, Metadata: Dict, Source: os.stat_result) -> bool:
+    if (Source.st_size, Source.st_mtime_ns) == (Metadata['Size'], Metadata['MTime']):
+        return True
+    return (Source.st_size > Metadata['Size'] and Metadata['EndsWithNewline']
+            and FileFingerprint(RecordsFile, Metadata['Size']) == Metadata['Fingerprint'])
+
+
+# Function to bring the offset index of a records file up to date: extended with the appended lines
+# when it still covers the start of the file, else built in one pass (in Workers processes for big files)
+@Instrumented(Rows=int)
+def UpdateOffsetIndex(RecordsFile: str, Workers: int = 1) -> int:
+    Source = os.stat(RecordsFile)
+    Index = ReadOffsetIndex(OffsetIndexFileOf(RecordsFile))
+    if Index is not None and OffsetIndexCovers(RecordsFile, Index[0], Source):
+        Metadata, Entries = Index
+        Tail, TailRows = ScanPatientOffsets(RecordsFile, Metadata['Size'], Source.st_size)
+        MergePatientOffsets(Entries, Tail, Metadata['Rows'])
+        Rows = Metadata['Rows'] + TailRows
+    elif Workers > 1 and Source.st_size >= ParallelLoadMinimumSize:
+        Entries, Rows = {}, 0
+        Ranges = [(Start, min(End, Source.st_size)) for Start, End in SplitFileByLines(RecordsFile, Workers * 4)]
+        with ProcessPoolExecutor(max_workers=Workers) as Executor:
+            for Part, PartRows in Executor.map(ScanPatientOffsets, repeat(RecordsFile), *zip(*Ranges)):
+                MergePatientOffsets(Entries, Part, Rows)
+                Rows += PartRows
+    else:
+        Entries, Rows = ScanPatientOffsets(RecordsFile, 0, Source.st_size)
+    WriteOffsetIndex(RecordsFile, Entries, Rows, Source.st_size, Source.st_mtime_ns)
+    return Rows
+
+
+# Function to get (position, line offset) of every line of a patient, from the offset index (brought
+# up to date first when it does not cover the file or too much was appended) and the lines after it
+def PatientLineOffsets(RecordsFile: str, PatientId: str, Workers: int = 1) -> List[Tuple[int, int]]:
+    Source = os.stat(RecordsFile)
+    Found = LookupOffsetIndex(OffsetIndexFileOf(RecordsFile), PatientId)
+    if (Found is None or not OffsetIndexCovers(RecordsFile, Found[0], Source)
+            or Source.st_size - Found[0]['Size'] > OffsetIndexTailSize):
+        UpdateOffsetIndex(RecordsFile, Workers)
+        Found = LookupOffsetIndex(OffsetIndexFileOf(RecordsFile), PatientId)
+        if Found is None:  # The index could not be written, scan the whole file instead
+            Entries, _ = ScanPatientOffsets(RecordsFile)
+            Offsets, RowIds = Entries.get(PatientId, (array('Q'), array('I')))
+            return list(zip(RowIds, Offsets))
+
+    Metadata, Offsets, RowIds = Found
+    Lines = list(zip(RowIds, Offsets))
+    if Source.st_size > Metadata['Size']:
+        Tail, _ = ScanPatientOffsets(RecordsFile, Metadata['Size'], Source.st_size)
+        TailOffsets, TailRowIds = Tail.get(PatientId, (array('Q'), array('I')))
+        Lines.extend((Metadata['Rows'] + RowId, Offset) for RowId, Offset in zip(TailRowIds, TailOffsets))
+    return Lines
+
+
+# Function to read one patient's records (with the changes in the journal) without loading the file.
+# Returns a store holding just those records and the record id of each of its rows.
+@Instrumented(Rows=lambda Result: Result[0].LiveRowCount)
+def ReadPatientRecords(RecordsFile: str, PatientId: str, Workers: int = 1) -> Tuple[RecordStore, List[int]]:
+    Store = RecordStore()
+    RecordIds = []
+    if not os.path.exists(RecordsFile):
+        return Store, RecordIds
+    if IsCompactRecordFile(RecordsFile):
+        Store, Positions = ApplyJournalToPatientRecords(RecordsFile, *ReadCompactPatientRecords(RecordsFile, PatientId))
+        Ids = ReadRecordIdMap(RecordsFile)
+        return Store, [Ids.RecordIdOf(Position) for Position in Positions]
+    Lines = PatientLineOffsets(RecordsFile, PatientId, Workers)
+    if not Lines:
+        return Store, RecordIds
+    Overlay = JournalOverlay(RecordsFile)
+    Ids = ReadRecordIdMap(RecordsFile)
+    with open(RecordsFile, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as Mapped:
+        for Position, Offset in Lines:
+            Fields = Overlay.get(Position, {})
+            if Fields is None:  # Deleted
+                continue
+            End = Mapped.find(b'\n', Offset)
+            _, record = ParseRecordLine(Mapped[Offset:End if End >= 0 else len(Mapped)].decode('utf-8', errors='replace').strip())
+            ApplyOverlay(record, Fields)
+            Store.AppendRecord(PatientId, record)
+            RecordIds.append(Ids.RecordIdOf(Position))
+    return Store, RecordIds
+
+
+# Function to apply the journal of a records file to one patient's records read from it, given
+# with the position of each of its rows in the file
+def ApplyJournalToPatientRecords(RecordsFile: str, Store: RecordStore,
+                                 Positions: List[int]) -> Tuple[RecordStore, List[int]]:
+    Overlay = JournalOverlay(RecordsFile)
+    if not Overlay:
+        return Store, Positions
+    Patched = RecordStore()
+    PatchedPositions = []
+    for RowId, Position in enumerate(Positions):
+        Fields = Overlay.get(Position, {})
+        if Fields is None:  # Deleted
+            continue
+        record = Store.GetRecord(RowId)
+        ApplyOverlay(record, Fields)
+        Patched.AppendRecord(Store.PatientIdOf(RowId), record)
+        PatchedPositions.append(Position)
+    return Patched, PatchedPositions
@@ -0,0 +1,704 @@
+from __future__ import annotations
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+import math
+
+try:
+    import numpy as np
+except ImportError:  # Optional, the scans fall back to plain Python loops
+    np = None
+
+from RecordColumns import ColumnView, LiveRowMask, MinutesToDateTime, MissingTime
+
+if TYPE_CHECKING:
+    from RecordStore import RecordStore
+
+
+# Base of the secondary indexes of a RecordStore. The store calls RemoveRow before a row
+# changes and AddRow once it has changed or has just been appended.
+class RowIndex:
+    def AddRow(self, RowId: int):
+        raise NotImplementedError
+
+    # New rows in increasing row id order; indexes that can merge a batch faster override this
+    def AddRows(self, RowIds):
+        for RowId in RowIds:
+            self.AddRow(RowId)
+
+    def RemoveRow(self, RowId: int):
+        raise NotImplementedError
+
+
+# Hash index from a dictionary-encoded column (test, status) to the sorted row ids holding each code
+class CodeIndex(RowIndex):
+    def __init__(self, Store: RecordStore, Column: str):
+        self.Codes = getattr(Store, Column)
+        self.Buckets: Dict[int, array] = {}
+        for RowId, Code in enumerate(self.Codes):
+            if RowId in Store.Deleted:
+                continue
+            Bucket = self.Buckets.get(Code)
+            if Bucket is None:
+                Bucket = self.Buckets[Code] = array('I')
+            Bucket.append(RowId)
+
+    def Rows(self, Code: int) -> array:
+        return self.Buckets.get(Code, array('I'))
+
+    def AddRow(self, RowId: int):
+        Bucket = self.Buckets.get(self.Codes[RowId])
+        if Bucket is None:
+            Bucket = self.Buckets[self.Codes[RowId]] = array('I')
+        if not Bucket or Bucket[-1] < RowId:
+            Bucket.append(RowId)
+        else:
+            insort(Bucket, RowId)
+
+    def RemoveRow(self, RowId: int):
+        Bucket = self.Buckets[self.Codes[RowId]]
+        del Bucket[bisect_left(Bucket, RowId)]
+
+
+# Sorted index of DateTime: parallel arrays of times and row ids, ranges are found with bisect
+class DateIndex(RowIndex):
+    def __init__(self, Store: RecordStore):
+        self.DateTimes = Store.DateTimes
+        Order = sorted((RowId for RowId in range(Store.RowCount) if RowId not in Store.Deleted),
+                       key=Store.DateTimes.__getitem__)
+        self.Times = array('q', map(Store.DateTimes.__getitem__, Order))
+        self.RowIds = array('I', Order)
+
+    def Rows(self, StartMinutes: int, EndMinutes: int) -> array:
+        return self.RowIds[bisect_left(self.Times, StartMinutes):bisect_right(self.Times, EndMinutes)]
+
+    def Count(self, StartMinutes: int, EndMinutes: int) -> int:
+        return max(bisect_right(self.Times, EndMinutes) - bisect_left(self.Times, StartMinutes), 0)
+
+    def AddRow(self, RowId: int):
+        Time = self.DateTimes[RowId]
+        Position = bisect_right(self.Times, Time)
+        self.Times.insert(Position, Time)
+        self.RowIds.insert(Position, RowId)
+
+    # Merge the sorted new rows into the arrays in one pass instead of one insert per row
+    def AddRows(self, RowIds):
+        if len(RowIds) < 16:
+            return super().AddRows(RowIds)
+        Times = array('q')
+        Rows = array('I')
+        Start = 0
+        for RowId in sorted(RowIds, key=self.DateTimes.__getitem__):
+            Time = self.DateTimes[RowId]
+            Position = bisect_right(self.Times, Time, Start)
+            Times.extend(self.Times[Start:Position])
+            Rows.extend(self.RowIds[Start:Position])
+            Times.append(Time)
+            Rows.append(RowId)
+            Start = Position
+        Times.extend(self.Times[Start:])
+        Rows.extend(self.RowIds[Start:])
+        self.Times = Times
+        self.RowIds = Rows
+
+    def RemoveRow(self, RowId: int):
+        Time = self.DateTimes[RowId]
+        Position = bisect_left(self.Times, Time)
+        while self.RowIds[Position] != RowId:
+            Position += 1
+        del self.Times[Position]
+        del self.RowIds[Position]
+
+
+# Sorted index of one value per row, kept per test as parallel arrays of values and row ids, so the
+# rows of a test within a value range are found with bisect. ValueOf(RowId) gives the value, None
+# for rows left out of the index; LiveValues() gives (row ids, values) of all indexed rows as NumPy
+# arrays for the initial build. The value of a row is worked out once, when the row enters the index.
+class TestValueIndex(RowIndex):
+    TypeCode = 'd'
+
+    def __init__(self, Store: RecordStore):
+        self.Store = Store
+        self.Values: Dict[int, array] = {}  # TestCode -> sorted values
+        self.RowIds: Dict[int, array] = {}  # TestCode -> row ids in the same order
+
+        if np is not None and Store.RowCount:
+            RowIds, Values = self.LiveValues()
+            TestCodes = ColumnView(Store.TestCodes)[RowIds]
+            Order = np.lexsort((RowIds, Values, TestCodes))
+            RowIds, TestCodes, Values = RowIds[Order], TestCodes[Order], Values[Order]
+            Bounds = (np.flatnonzero(np.diff(TestCodes)) + 1).tolist()
+            for Start, End in zip([0, *Bounds], [*Bounds, len(RowIds)]):
+                if Start < End:
+                    TestCode = int(TestCodes[Start])
+                    self.Values[TestCode] = array(self.TypeCode, Values[Start:End].tolist())
+                    self.RowIds[TestCode] = array('I', RowIds[Start:End].tolist())
+            return
+
+        Pairs: Dict[int, List[Tuple[float, int]]] = {}
+        for RowId in range(Store.RowCount):
+            Value = self.ValueOf(RowId)
+            if Value is not None and RowId not in Store.Deleted:
+                Pairs.setdefault(Store.TestCodes[RowId], []).append((Value, RowId))
+        for TestCode, TestPairs in Pairs.items():
+            self.SetPairs(TestCode, sorted(TestPairs))
+
+    def ValueOf(self, RowId: int):
+        raise NotImplementedError
+
+    def LiveValues(self):
+        raise NotImplementedError
+
+    def SetPairs(self, TestCode: int, Pairs: List[Tuple[float, int]]):
+        self.Values[TestCode] = array(self.TypeCode, [Value for Value, _ in Pairs])
+        self.RowIds[TestCode] = array('I', [RowId for _, RowId in Pairs])
+
+    # Function to get the rows with Low <= value <= High, of one test or of all tests
+    def Rows(self, Low, High, TestCode: Optional[int] = None) -> array:
+        Rows = array('I')
+        for Code in (self.Values if TestCode is None else [TestCode]):
+            Values = self.Values.get(Code)
+            if Values:
+                Rows.extend(self.RowIds[Code][bisect_left(Values, Low):bisect_right(Values, High)])
+        return Rows
+
+    def Count(self, Low, High, TestCode: Optional[int] = None) -> int:
+        Count = 0
+        for Code in (self.Values if TestCode is None else [TestCode]):
+            Values = self.Values.get(Code)
+            if Values:
+                Count += max(bisect_right(Values, High) - bisect_left(Values, Low), 0)
+        return Count
+
+    # Function to get the number of indexed rows of a test
+    def TestCount(self, TestCode: int) -> int:
+        return len(self.Values.get(TestCode, ()))
+
+    def AddRow(self, RowId: int):
+        Value = self.ValueOf(RowId)
+        if Value is None:
+            return
+        TestCode = self.Store.TestCodes[RowId]
+        Values = self.Values.get(TestCode)
+        if Values is None:
+            Values = self.Values[TestCode] = array(self.TypeCode)
+            self.RowIds[TestCode] = array('I')
+        Position = bisect_right(Values, Value)
+        Values.insert(Position, Value)
+        self.RowIds[TestCode].insert(Position, RowId)
+
+    # Re-sort the tests that got many new rows instead of inserting them one by one
+    def AddRows(self, RowIds):
+        if len(RowIds) < 16:
+            return super().AddRows(RowIds)
+        NewPairs: Dict[int, List[Tuple[float, int]]] = {}
+        for RowId in RowIds:
+            Value = self.ValueOf(RowId)
+            if Value is not None:
+                NewPairs.setdefault(self.Store.TestCodes[RowId], []).append((Value, RowId))
+        for TestCode, Pairs in NewPairs.items():
+            Pairs.extend(zip(self.Values.get(TestCode, ()), self.RowIds.get(TestCode, ())))
+            self.SetPairs(TestCode, sorted(Pairs))
+
+    def RemoveRow(self, RowId: int):
+        Value = self.ValueOf(RowId)
+        if Value is None:
+            return
+        TestCode = self.Store.TestCodes[RowId]
+        Values = self.Values[TestCode]
+        Rows = self.RowIds[TestCode]
+        Position = bisect_left(Values, Value)
+        while Rows[Position] != RowId:
+            Position += 1
+        del Values[Position]
+        del Rows[Position]
+
+
+# Turnaround minutes of the completed rows, by test; the rows over a threshold are found with bisect
+class TurnaroundIndex(TestValueIndex):
+    TypeCode = 'q'
+
+    def __init__(self, Store: RecordStore):
+        self.CompletedCode = Store.Statuses.Encode('Completed')
+        super().__init__(Store)
+
+    def ValueOf(self, RowId: int) -> Optional[int]:
+        CompletionTime = self.Store.CompletionTimes[RowId]
+        if CompletionTime == MissingTime or self.Store.StatusCodes[RowId] != self.CompletedCode:
+            return None
+        return CompletionTime - self.Store.DateTimes[RowId]
+
+    TurnaroundOf = ValueOf
+
+    def LiveValues(self):
+        Store = self.Store
+        CompletionTimes = ColumnView(Store.CompletionTimes)
+        Completed = LiveRowMask(Store) & (ColumnView(Store.StatusCodes) == self.CompletedCode) & \
+            (CompletionTimes != MissingTime)
+        RowIds = np.flatnonzero(Completed)
+        return RowIds, CompletionTimes[RowIds] - ColumnView(Store.DateTimes)[RowIds]
+
+    # Function to get the rows of a test whose turnaround is over Minutes, quickest first
+    def RowsOver(self, TestCode: int, Minutes: int) -> array:
+        Values = self.Values.get(TestCode)
+        if not Values:
+            return array('I')
+        return self.RowIds[TestCode][bisect_right(Values, Minutes):]
+
+
+# Numeric results by test (NaN results are left out), for value ranges and the most extreme values
+class ResultIndex(TestValueIndex):
+    def ValueOf(self, RowId: int) -> Optional[float]:
+        Result = self.Store.Results[RowId]
+        return Result if Result == Result else None
+
+    def LiveValues(self):
+        Results = ColumnView(self.Store.Results)
+        RowIds = np.flatnonzero(LiveRowMask(self.Store) & ~np.isnan(Results))
+        return RowIds, Results[RowIds]
+
+
+# Index of every patient's history: per patient and test, the DateTimes in order with their row
+# ids. The latest record of a (patient, test) is the last entry, time windows are found with bisect.
+class PatientHistoryIndex(RowIndex):
+    def __init__(self, Store: RecordStore):
+        self.Store = Store
+        # PatientCode -> TestCode -> (sorted DateTimes, row ids in the same order)
+        self.Histories: Dict[int, Dict[int, Tuple[array, array]]] = {}
+
+        if np is not None and Store.RowCount:
+            RowIds = np.flatnonzero(LiveRowMask(Store))
+            PatientCodes = ColumnView(Store.PatientCodes)[RowIds].astype(np.int64)
+            TestCodes = ColumnView(Store.TestCodes)[RowIds].astype(np.int64)
+            DateTimes = ColumnView(Store.DateTimes)[RowIds]
+            Order = np.lexsort((RowIds, DateTimes, TestCodes, PatientCodes))
+            RowIds, PatientCodes, TestCodes, DateTimes = RowIds[Order], PatientCodes[Order], TestCodes[Order], DateTimes[Order]
+            Keys = (PatientCodes << 16) | TestCodes
+            Bounds = (np.flatnonzero(np.diff(Keys)) + 1).tolist()
+            for Start, End in zip([0, *Bounds], [*Bounds, len(RowIds)]):
+                if Start < End:
+                    self.Histories.setdefault(int(PatientCodes[Start]), {})[int(TestCodes[Start])] = (
+                        array('q', DateTimes[Start:End].tolist()), array('I', RowIds[Start:End].tolist()))
+            return
+
+        Pairs: Dict[Tuple[int, int], List[Tuple[int, int]]] = {}
+        for RowId in range(Store.RowCount):
+            if RowId not in Store.Deleted:
+                Pairs.setdefault((Store.PatientCodes[RowId], Store.TestCodes[RowId]), []).append(
+                    (Store.DateTimes[RowId], RowId))
+        for (PatientCode, TestCode), TestPairs in Pairs.items():
+            self.SetPairs(PatientCode, TestCode, sorted(TestPairs))
+
+    def SetPairs(self, PatientCode: int, TestCode: int, Pairs: List[Tuple[int, int]]):
+        self.Histories.setdefault(PatientCode, {})[TestCode] = (
+            array('q', [DateTime for DateTime, _ in Pairs]), array('I', [RowId for _, RowId in Pairs]))
+
+    # Function to get the row of the latest record of a patient's test, None if there is none
+    def Latest(self, PatientCode: int, TestCode: int) -> Optional[int]:
+        History = self.Histories.get(PatientCode, {}).get(TestCode)
+        return History[1][-1] if History and History[1] else None
+
+    # Function to get the rows of a patient's test between two epoch minutes (inclusive), oldest first;
+    # with Last only the Last most recent of them
+    def Rows(self, PatientCode: int, TestCode: int, StartMinutes: int = MissingTime,
+             EndMinutes: int = -MissingTime - 1, Last: Optional[int] = None) -> array:
+        History = self.Histories.get(PatientCode, {}).get(TestCode)
+        if not History:
+            return array('I')
+        Times, RowIds = History
+        Start = bisect_left(Times, StartMinutes)
+        End = bisect_right(Times, EndMinutes)
+        if Last is not None:
+            Start = max(Start, End - Last)
+        return RowIds[Start:End]
+
+    # Function to get the test codes a patient has records of
+    def TestsOf(self, PatientCode: int) -> List[int]:
+        return [TestCode for TestCode, (Times, _) in self.Histories.get(PatientCode, {}).items() if Times]
+
+    def AddRow(self, RowId: int):
+        Tests = self.Histories.setdefault(self.Store.PatientCodes[RowId], {})
+        TestCode = self.Store.TestCodes[RowId]
+        History = Tests.get(TestCode)
+        if History is None:
+            History = Tests[TestCode] = (array('q'), array('I'))
+        Times, RowIds = History
+        DateTime = self.Store.DateTimes[RowId]
+        # Records usually arrive newest last, so appending is the common case
+        if not Times or (Times[-1], RowIds[-1]) < (DateTime, RowId):
+            Times.append(DateTime)
+            RowIds.append(RowId)
+            return
+        Position = bisect_right(Times, DateTime)
+        Times.insert(Position, DateTime)
+        RowIds.insert(Position, RowId)
+
+    # Re-sort the histories that got many new rows instead of inserting them one by one
+    def AddRows(self, RowIds):
+        if len(RowIds) < 16:
+            return super().AddRows(RowIds)
+        Store = self.Store
+        NewPairs: Dict[Tuple[int, int], List[Tuple[int, int]]] = {}
+        for RowId in RowIds:
+            NewPairs.setdefault((Store.PatientCodes[RowId], Store.TestCodes[RowId]), []).append(
+                (Store.DateTimes[RowId], RowId))
+        for (PatientCode, TestCode), Pairs in NewPairs.items():
+            History = self.Histories.get(PatientCode, {}).get(TestCode)
+            if History is not None:
+                Pairs.extend(zip(*History))
+            self.SetPairs(PatientCode, TestCode, sorted(Pairs))
+
+    def RemoveRow(self, RowId: int):
+        Times, RowIds = self.Histories[self.Store.PatientCodes[RowId]][self.Store.TestCodes[RowId]]
+        Position = bisect_left(Times, self.Store.DateTimes[RowId])
+        while RowIds[Position] != RowId:
+            Position += 1
+        del Times[Position]
+        del RowIds[Position]
+
+
+# Function to pack (patient code, test code, DateTime minutes) into one integer
+def RecordKey(PatientCode: int, TestCode: int, DateTime: int) -> int:
+    return (PatientCode << 56) | (TestCode << 40) | (DateTime & 0xFFFFFFFFFF)
+
+
+# Index of the (patient, test, DateTime) keys of the live rows -> number of rows with that key.
+# Tells whether an imported record is already in the store.
+class RecordKeyIndex(RowIndex):
+    def __init__(self, Store: RecordStore):
+        self.Store = Store
+        self.Counts = Counter(map(RecordKey, Store.PatientCodes, Store.TestCodes, Store.DateTimes))
+        for RowId in Store.Deleted:
+            self.RemoveRow(RowId)
+
+    def KeyOf(self, RowId: int) -> int:
+        return RecordKey(self.Store.PatientCodes[RowId], self.Store.TestCodes[RowId], self.Store.DateTimes[RowId])
+
+    def AddRow(self, RowId: int):
+        self.Counts[self.KeyOf(RowId)] += 1
+
+    def RemoveRow(self, RowId: int):
+        Key = self.KeyOf(RowId)
+        self.Counts[Key] -= 1
+        if not self.Counts[Key]:
+            del self.Counts[Key]
+
+
+# Function to add a value to running [count, sum, min, max] statistics
+def UpdateRunningStats(Stats: List, Value):
+    if Stats[0] == 0:
+        Stats[:] = [1, Value, Value, Value]
+    else:
+        Stats[0] += 1
+        Stats[1] += Value
+        Stats[2] = min(Stats[2], Value)
+        Stats[3] = max(Stats[3], Value)
+
+# Function to take a value back out of running [count, sum, min, max] statistics.
+# Returns False when the value may have been the min or max, which then has to be recomputed.
+def RetractRunningStats(Stats: List, Value) -> bool:
+    Stats[0] -= 1
+    if Stats[0] == 0:
+        Stats[:] = [0, 0, 0, 0]
+        return True
+    Stats[1] -= Value
+    return Stats[2] < Value < Stats[3]
+
+# Function to compute [count, sum, min, max] per code with NumPy, Codes and Values are arrays
+def GroupedRunningStats(Codes, Values) -> Dict[int, List]:
+    if len(Codes) == 0:
+        return {}
+    Order = np.argsort(Codes, kind='stable')
+    SortedCodes = Codes[Order]
+    SortedValues = Values[Order]
+    Starts = np.flatnonzero(np.r_[True, SortedCodes[1:] != SortedCodes[:-1]])
+    Counts = np.diff(np.r_[Starts, len(SortedCodes)])
+    Sums = np.add.reduceat(SortedValues, Starts)
+    Mins = np.minimum.reduceat(SortedValues, Starts)
+    Maxs = np.maximum.reduceat(SortedValues, Starts)
+    return {int(SortedCodes[Start]): [int(Count), Total.item(), Low.item(), High.item()]
+            for Start, Count, Total, Low, High in zip(Starts, Counts, Sums, Mins, Maxs)}
+
+# Per-test running statistics of results and turnaround times, kept up to date by the store.
+# A change that removes the current min or max marks the test stale, and only that test is
+# recomputed the next time it is read.
+class SummaryIndex(RowIndex):
+    def __init__(self, Store: RecordStore):
+        self.Store = Store
+        self.CompletedCode = Store.Statuses.Encode('Completed')
+        self.Results: Dict[int, List] = {}  # TestCode -> [count, sum, min, max]
+        self.Turnarounds: Dict[int, List] = {}  # TestCode -> [count, sum, min, max] in minutes
+        self.Stale = set()
+
+        if np is None or Store.RowCount == 0:
+            for RowId in range(Store.RowCount):
+                if RowId not in Store.Deleted:
+                    self.AddRow(RowId)
+            return
+        Live = LiveRowMask(Store)
+        TestCodes = ColumnView(Store.TestCodes)[Live]
+        DateTimes = ColumnView(Store.DateTimes)[Live]
+        CompletionTimes = ColumnView(Store.CompletionTimes)[Live]
+        Completed = (ColumnView(Store.StatusCodes)[Live] == self.CompletedCode) & (CompletionTimes != MissingTime)
+        self.Results = GroupedRunningStats(TestCodes, ColumnView(Store.Results)[Live])
+        self.Turnarounds = GroupedRunningStats(TestCodes[Completed], (CompletionTimes - DateTimes)[Completed])
+
+    def TurnaroundOf(self, RowId: int) -> Optional[int]:
+        CompletionTime = self.Store.CompletionTimes[RowId]
+        if CompletionTime == MissingTime or self.Store.StatusCodes[RowId] != self.CompletedCode:
+            return None
+        return CompletionTime - self.Store.DateTimes[RowId]
+
+    def AddRow(self, RowId: int):
+        TestCode = self.Store.TestCodes[RowId]
+        Stats = self.Results.get(TestCode)
+        if Stats is None:
+            Stats = self.Results[TestCode] = [0, 0, 0, 0]
+        UpdateRunningStats(Stats, self.Store.Results[RowId])
+        Turnaround = self.TurnaroundOf(RowId)
+        if Turnaround is not None:
+            Stats = self.Turnarounds.get(TestCode)
+            if Stats is None:
+                Stats = self.Turnarounds[TestCode] = [0, 0, 0, 0]
+            UpdateRunningStats(Stats, Turnaround)
+
+    def RemoveRow(self, RowId: int):
+        TestCode = self.Store.TestCodes[RowId]
+        if not RetractRunningStats(self.Results[TestCode], self.Store.Results[RowId]):
+            self.Stale.add(TestCode)
+        Turnaround = self.TurnaroundOf(RowId)
+        if Turnaround is not None and not RetractRunningStats(self.Turnarounds[TestCode], Turnaround):
+            self.Stale.add(TestCode)
+
+    # Function to rebuild the statistics of one test from its rows
+    def Recompute(self, TestCode: int):
+        Results = self.Results[TestCode] = [0, 0, 0, 0]
+        Turnarounds = self.Turnarounds[TestCode] = [0, 0, 0, 0]
+        for RowId in self.Store.RowsWithTest(self.Store.Tests.Strings[TestCode]):
+            UpdateRunningStats(Results, self.Store.Results[RowId])
+            Turnaround = self.TurnaroundOf(RowId)
+            if Turnaround is not None:
+                UpdateRunningStats(Turnarounds, Turnaround)
+        self.Stale.discard(TestCode)
+
+    # Function to get ([count, sum, min, max] of results, same of turnaround) for every test with records
+    def Stats(self) -> Dict[str, Tuple[List, List]]:
+        for TestCode in list(self.Stale):
+            self.Recompute(TestCode)
+        return {self.Store.Tests.Strings[TestCode]: (Stats, self.Turnarounds.get(TestCode, [0, 0, 0, 0]))
+                for TestCode, Stats in sorted(self.Results.items()) if Stats[0]}
+
+# Mergeable streaming quantile sketch. The first K values are kept as they are and give exact
+# quantiles; past that the values are counted in buckets whose bounds grow by a factor of Gamma, so
+# a quantile is within Accuracy (1%) of the true value and a sketch holds a few hundred buckets.
+# What a sketch holds only depends on which values it has seen, not on their order or on how they
+# were split between sketches, so sketches of different files, months or workers merge into the
+# same answers as one sketch of all the values. Count, sum, min and max are exact.
+class QuantileSketch:
+    def __init__(self, K: int = 1024, Accuracy: float = 0.01):
+        self.K = K
+        self.Gamma = (1 + Accuracy) / (1 - Accuracy)
+        self.LogGamma = math.log(self.Gamma)
+        self.Values: Optional[List[float]] = []  # None once the values are counted in buckets
+        self.Buckets: Dict[Tuple[int, int], int] = {}  # (sign, bucket) -> count
+        self.Count = 0
+        self.Sum = 0.0
+        self.Min: Optional[float] = None
+        self.Max: Optional[float] = None
+
+    # Function to get the bucket of a value, ordered like the values: negative values by falling
+    # magnitude, then zero, then positive values by rising magnitude
+    def BucketOf(self, Value: float) -> Tuple[int, int]:
+        if abs(Value) < 1e-9:
+            return (0, 0)
+        Bucket = math.ceil(math.log(abs(Value)) / self.LogGamma)
+        return (1, Bucket) if Value > 0 else (-1, -Bucket)
+
+    # Function to get the value a bucket stands for, the middle of its bounds relative to the error
+    def BucketValue(self, Key: Tuple[int, int]) -> float:
+        Sign, Bucket = Key
+        if Sign == 0:
+            return 0.0
+        return Sign * 2 * self.Gamma ** (Sign * Bucket) / (self.Gamma + 1)
+
+    def CountInBuckets(self, Values):
+        Buckets = self.Buckets
+        # Counting the distinct values first keeps the logarithms to one per distinct value
+        for Value, Count in Counter(Values).items():
+            Key = self.BucketOf(Value)
+            Buckets[Key] = Buckets.get(Key, 0) + Count
+
+    def Bucketize(self):
+        if self.Values is not None:
+            self.CountInBuckets(self.Values)
+            self.Values = None
+
+    def Add(self, Value: float):
+        self.Count += 1
+        self.Sum += Value
+        if self.Min is None or Value < self.Min:
+            self.Min = Value
+        if self.Max is None or Value > self.Max:
+            self.Max = Value
+        if self.Values is None:
+            Key = self.BucketOf(Value)
+            self.Buckets[Key] = self.Buckets.get(Key, 0) + 1
+        else:
+            self.Values.append(Value)
+            if self.Count > self.K:
+                self.Bucketize()
+
+    def Extend(self, Values: List[float]):
+        if not Values:
+            return
+        self.Count += len(Values)
+        self.Sum += sum(Values)
+        Low, High = min(Values), max(Values)
+        self.Min = Low if self.Min is None else min(self.Min, Low)
+        self.Max = High if self.Max is None else max(self.Max, High)
+        if self.Values is not None and self.Count <= self.K:
+            self.Values.extend(Values)
+        else:
+            self.Bucketize()
+            self.CountInBuckets(Values)
+
+    # Function to add the values seen by another sketch to this one
+    def Merge(self, Other: 'QuantileSketch'):
+        if not Other.Count:
+            return
+        self.Count += Other.Count
+        self.Sum += Other.Sum
+        for Value in (Other.Min, Other.Max):
+            self.Min = Value if self.Min is None else min(self.Min, Value)
+            self.Max = Value if self.Max is None else max(self.Max, Value)
+        if self.Values is not None and Other.Values is not None and self.Count <= self.K:
+            self.Values.extend(Other.Values)
+            return
+        self.Bucketize()
+        if Other.Values is not None:
+            self.CountInBuckets(Other.Values)
+        else:
+            for Key, Count in Other.Buckets.items():
+                self.Buckets[Key] = self.Buckets.get(Key, 0) + Count
+
+    # Function to get the held values with their weights, by value
+    def WeightedValues(self) -> List[Tuple[float, int]]:
+        if self.Values is not None:
+            return [(Value, 1) for Value in sorted(self.Values)]
+        return [(self.BucketValue(Key), Count) for Key, Count in sorted(self.Buckets.items())]
+
+    # Function to estimate the value at quantile Q (0 to 1), None for an empty sketch
+    def Quantile(self, Q: float) -> Optional[float]:
+        return self.Quantiles([Q])[0]
+
+    def Quantiles(self, Qs: List[float]) -> List[Optional[float]]:
+        Items = self.WeightedValues()
+        if not Items:
+            return [None] * len(Qs)
+        Answers = []
+        for Q in Qs:
+            Target = Q * self.Count
+            Seen = 0
+            Answer = Items[-1][0]
+            for Value, Weight in Items:
+                Seen += Weight
+                if Seen >= Target:
+                    Answer = Value
+                    break
+            Answers.append(min(max(Answer, self.Min), self.Max))
+        return Answers
+
+    # Function to estimate how many values fall in each of Bins equal-width bins between min and max,
+    # as (low, high, count)
+    def Histogram(self, Bins: int = 10) -> List[Tuple[float, float, int]]:
+        if not self.Count:
+            return []
+        Width = (self.Max - self.Min) / Bins or 1
+        Weights = [0] * Bins
+        for Value, Weight in self.WeightedValues():
+            Weights[min(int((Value - self.Min) / Width), Bins - 1)] += Weight
+        Scale = self.Count / sum(Weights)
+        return [(self.Min + Bin * Width, self.Min + (Bin + 1) * Width, round(Weights[Bin] * Scale))
+                for Bin in range(Bins)]
+
+
+# TestName -> month 'YYYY-MM' -> [sketch of the results, sketch of the turnaround minutes]
+SummarySketchTable = Dict[str, Dict[str, List[QuantileSketch]]]
+
+
+# Quantile sketches of results and turnaround times per test and month, kept up to date by the
+# store. Sketches cannot forget a value, so a removed row marks its (test, month) stale and those
+# sketches are rebuilt from the rows the next time they are read.
+class QuantileIndex(RowIndex):
+    def __init__(self, Store: RecordStore):
+        self.Store = Store
+        self.CompletedCode = Store.Statuses.Encode('Completed')
+        self.Sketches: Dict[Tuple[int, str], List[QuantileSketch]] = {}  # (TestCode, month) -> sketches
+        self.Stale = set()
+
+        if np is None or Store.RowCount == 0:
+            for RowId in range(Store.RowCount):
+                if RowId not in Store.Deleted:
+                    self.AddRow(RowId)
+            return
+        # Group the live rows by test and month and hand every group to its sketches at once
+        RowIds = np.flatnonzero(LiveRowMask(Store))
+        Days = ColumnView(Store.DateTimes)[RowIds] // 1440
+        UniqueDays, DayNumbers = np.unique(Days, return_inverse=True)
+        Months = sorted({MinutesToDateTime(int(Day) * 1440)[:7] for Day in UniqueDays})
+        MonthNumbers = np.array([Months.index(MinutesToDateTime(int(Day) * 1440)[:7]) for Day in UniqueDays],
+                                dtype=np.int64)[DayNumbers]
+        TestCodes = ColumnView(Store.TestCodes)[RowIds].astype(np.int64)
+        Keys = TestCodes * len(Months) + MonthNumbers
+        Order = np.argsort(Keys, kind='stable')
+        RowIds, Keys = RowIds[Order], Keys[Order]
+        Results = ColumnView(Store.Results)[RowIds]
+        CompletionTimes = ColumnView(Store.CompletionTimes)[RowIds]
+        Completed = (ColumnView(Store.StatusCodes)[RowIds] == self.CompletedCode) & (CompletionTimes != MissingTime)
+        Turnarounds = CompletionTimes - ColumnView(Store.DateTimes)[RowIds]
+        Bounds = (np.flatnonzero(np.diff(Keys)) + 1).tolist()
+        for Start, End in zip([0, *Bounds], [*Bounds, len(RowIds)]):
+            if Start < End:
+                TestCode, MonthNumber = divmod(int(Keys[Start]), len(Months))
+                Pair = self.Sketches[(TestCode, Months[MonthNumber])] = [QuantileSketch(), QuantileSketch()]
+                Pair[0].Extend(Results[Start:End].tolist())
+                Pair[1].Extend(Turnarounds[Start:End][Completed[Start:End]].tolist())
+
+    def KeyOf(self, RowId: int) -> Tuple[int, str]:
+        return self.Store.TestCodes[RowId], MinutesToDateTime(self.Store.DateTimes[RowId])[:7]
+
+    def AddRow(self, RowId: int):
+        Key = self.KeyOf(RowId)
+        Pair = self.Sketches.get(Key)
+        if Pair is None:
+            Pair = self.Sketches[Key] = [QuantileSketch(), QuantileSketch()]
+        Store = self.Store
+        Pair[0].Add(Store.Results[RowId])
+        if Store.StatusCodes[RowId] == self.CompletedCode and Store.CompletionTimes[RowId] != MissingTime:
+            Pair[1].Add(Store.CompletionTimes[RowId] - Store.DateTimes[RowId])
+
+    def RemoveRow(self, RowId: int):
+        self.Stale.add(self.KeyOf(RowId))
+
+    # Function to rebuild the sketches of the stale (test, month) pairs from their rows
+    def Rebuild(self):
+        Stale = self.Stale
+        self.Stale = set()
+        for Key in Stale:
+            self.Sketches.pop(Key, None)
+        Store = self.Store
+        for TestCode in {TestCode for TestCode, _ in Stale}:
+            for RowId in Store.RowsWithTest(Store.Tests.Strings[TestCode]):
+                if self.KeyOf(RowId) in Stale:
+                    self.AddRow(RowId)
+
+    # Function to get the sketches by test name and month
+    def Table(self) -> SummarySketchTable:
+        if self.Stale:
+            self.Rebuild()
+        Sketches = {}
+        for (TestCode, Month), Pair in sorted(self.Sketches.items()):
+            if Pair[0].Count:
+                Sketches.setdefault(self.Store.Tests.Strings[TestCode], {})[Month] = Pair
+        return Sketches
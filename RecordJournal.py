@@ -0,0 +1,215 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import chain
+from typing import Dict, List, Optional
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from RecordStore import RecordStore
+
+
+# Change journal. Edits and deletions are appended to '<records file>.journal' as JSON lines
+# keyed by the record id. Loading replays the journal; compaction folds it into a new records file.
+# Record ids are numbered in the order records are added and never change: compaction drops deleted
+# records from the file, and '<records file>.ids' lists the ids it dropped (see RecordIdMap), so the
+# record at position N (among the valid records of the file) has the N-th id that was not dropped.
+
+JournalCompactionSize = 4 * 2**20  # Journal size in bytes that triggers a compaction
+BlockSize = 4 * 2**20  # Bytes read from a file or memory map at a time
+
+
+def JournalFileOf(RecordsFile: str) -> str:
+    return RecordsFile + '.journal'
+
+
+# Function to get the SHA-256 of a file, or of its first Size bytes
+def FileHash(FileName: str, Size: Optional[int] = None) -> str:
+    Hash = hashlib.sha256()
+    with open(FileName, 'rb') as file:
+        Left = Size
+        while Left is None or Left > 0:
+            Block = file.read(BlockSize if Left is None else min(BlockSize, Left))
+            if not Block:
+                break
+            Hash.update(Block)
+            if Left is not None:
+                Left -= len(Block)
+    return Hash.hexdigest()
+
+
+# Function to rename a finished temporary file over TargetFile. Temporary files are only readable by
+# their owner, so the new file takes the permissions of the file it replaces, or those of any new
+# file (0666 less the umask).
+def ReplaceFile(TemporaryFile: str, TargetFile: str):
+    if os.path.exists(TargetFile):
+        shutil.copymode(TargetFile, TemporaryFile)
+    else:
+        Umask = os.umask(0)
+        os.umask(Umask)
+        os.chmod(TemporaryFile, 0o666 & ~Umask)
+    os.replace(TemporaryFile, TargetFile)
+
+
+# Function to append entries to the journal with a single write and fsync
+def AppendJournalEntries(RecordsFile: str, Entries: List[Dict]):
+    with open(JournalFileOf(RecordsFile), 'a') as file:
+        file.write(''.join(json.dumps(Entry) + "\n" for Entry in Entries))
+        file.flush()
+        os.fsync(file.fileno())
+
+
+# Record ids of the positions of a records file: ids that compaction dropped are skipped.
+# Without dropped ids (a file that never lost a record) the record id is the position.
+class RecordIdMap:
+    def __init__(self, Dropped=()):
+        self.Dropped = array('q', sorted(set(Dropped)))
+
+    # Function to get the record id of the record at a position
+    def RecordIdOf(self, Position: int) -> int:
+        RecordId = Position
+        while True:
+            Next = Position + bisect_right(self.Dropped, RecordId)
+            if Next == RecordId:
+                return RecordId
+            RecordId = Next
+
+    # Function to get the position of a record id, None when it was dropped
+    def PositionOf(self, RecordId: int) -> Optional[int]:
+        Index = bisect_left(self.Dropped, RecordId)
+        if RecordId < 0 or Index < len(self.Dropped) and self.Dropped[Index] == RecordId:
+            return None
+        return RecordId - Index
+
+    def Drop(self, RecordIds):
+        self.Dropped = array('q', sorted(set(self.Dropped).union(RecordIds)))
+
+    # Function to get the dropped ids as [start, stop) ranges, the way they are saved
+    def Ranges(self) -> List[List[int]]:
+        Ranges = []
+        for RecordId in self.Dropped:
+            if Ranges and Ranges[-1][1] == RecordId:
+                Ranges[-1][1] += 1
+            else:
+                Ranges.append([RecordId, RecordId + 1])
+        return Ranges
+
+
+def RecordIdFileOf(RecordsFile: str) -> str:
+    return RecordsFile + '.ids'
+
+
+# Function to build a RecordIdMap from saved [start, stop) ranges
+def RecordIdMapFromRanges(Ranges) -> RecordIdMap:
+    return RecordIdMap(chain.from_iterable(range(Start, Stop) for Start, Stop in Ranges))
+
+
+# Function to save the dropped ids of a records file, through a temporary file
+def WriteRecordIdMap(RecordsFile: str, Ids: RecordIdMap):
+    IdFile = RecordIdFileOf(RecordsFile)
+    if not Ids.Dropped:
+        if os.path.exists(IdFile):
+            os.remove(IdFile)
+        return
+    Directory = os.path.dirname(os.path.abspath(RecordsFile))
+    with tempfile.NamedTemporaryFile('w', dir=Directory, prefix='.ids-', delete=False) as file:
+        json.dump({"Dropped": Ids.Ranges()}, file)
+        file.flush()
+        os.fsync(file.fileno())
+    ReplaceFile(file.name, IdFile)
+
+
+# Function to read the record ids of a records file. A compaction that replaced the records file but
+# stopped before saving the ids it dropped left them in its journal marker; they are saved now.
+def ReadRecordIdMap(RecordsFile: str) -> RecordIdMap:
+    Marker = None
+    JournalFile = JournalFileOf(RecordsFile)
+    if os.path.exists(JournalFile):
+        with open(JournalFile, 'r') as file:
+            for Line in file:
+                if '"Compacted"' in Line:
+                    try:
+                        Marker = json.loads(Line)
+                    except ValueError:
+                        pass
+    try:
+        with open(RecordIdFileOf(RecordsFile), 'r') as file:
+            Ids = RecordIdMapFromRanges(json.load(file)['Dropped'])
+    except FileNotFoundError:
+        Ids = RecordIdMap()
+    if Marker is not None and 'Dropped' in Marker and Marker['Dropped'] != Ids.Ranges() \
+            and FileHash(RecordsFile) == Marker['Hash']:
+        Ids = RecordIdMapFromRanges(Marker['Dropped'])
+        WriteRecordIdMap(RecordsFile, Ids)
+    return Ids
+
+
+# Function to read the entries of the journal that still apply to the records file
+def ReadJournal(RecordsFile: str) -> List[Dict]:
+    JournalFile = JournalFileOf(RecordsFile)
+    if not os.path.exists(JournalFile):
+        return []
+    Entries = []
+    with open(JournalFile, 'r') as file:
+        for Line in file:
+            try:
+                Entries.append(json.loads(Line))
+            except ValueError:
+                print(f"Skipping unreadable journal entry: {Line.strip()}")  # e.g. torn by a crash
+
+    # A compaction that replaced the records file but stopped before removing the journal
+    # leaves its marker: the entries before it are already part of the records file
+    for Index in range(len(Entries) - 1, -1, -1):
+        if Entries[Index].get('Op') == 'Compacted':
+            if FileHash(RecordsFile) == Entries[Index]['Hash']:
+                Entries = Entries[Index + 1:]
+            break
+    return [Entry for Entry in Entries if Entry.get('Op') != 'Compacted']
+
+
+# Function to apply one journal entry to a store, at the row of its record (None when there is none)
+def ApplyJournalEntry(MedicalRecords: RecordStore, Entry: Dict, RowId: Optional[int]):
+    if RowId is None or not 0 <= RowId < MedicalRecords.RowCount or RowId in MedicalRecords.Deleted:
+        print(f"Skipping journal entry for unknown record {Entry['RecordId']}.")
+        return
+    if Entry['Op'] == 'Delete':
+        MedicalRecords.DeleteRow(RowId)
+    elif Entry['Op'] == 'Update':
+        for Field, Value in Entry['Fields'].items():
+            MedicalRecords.SetField(RowId, Field, Value)
+
+
+# Function to replay the journal of a records file into a store loaded from that file
+def ReplayJournal(MedicalRecords: RecordStore, RecordsFile: str):
+    Entries = ReadJournal(RecordsFile)
+    Ids = ReadRecordIdMap(RecordsFile) if Entries else None
+    for Entry in Entries:
+        try:
+            ApplyJournalEntry(MedicalRecords, Entry, Ids.PositionOf(Entry['RecordId']))
+        except (KeyError, ValueError) as e:
+            print(f"Skipping invalid journal entry {Entry}: {e}")
+
+
+# Function to fold the journal into a position -> final fields (None when deleted) overlay
+def JournalOverlay(RecordsFile: str) -> Dict[int, Optional[Dict[str, str]]]:
+    Overlay = {}
+    Entries = ReadJournal(RecordsFile)
+    Ids = ReadRecordIdMap(RecordsFile) if Entries else None
+    for Entry in Entries:
+        RowId = Ids.PositionOf(Entry['RecordId'])
+        if RowId is None:
+            continue
+        if Entry['Op'] == 'Delete':
+            Overlay[RowId] = None
+        elif Entry['Op'] == 'Update' and Overlay.get(RowId, {}) is not None:
+            Overlay.setdefault(RowId, {}).update(Entry['Fields'])
+    return Overlay
+
+
+# Function to apply the journaled fields of a record to its parsed fields ('' removes CompletionTime)
+def ApplyOverlay(record: Dict[str, str], Fields: Dict[str, str]):
+    record.update(Fields)
+    if not record.get('CompletionTime'):
+        record.pop('CompletionTime', None)
@@ -0,0 +1,409 @@
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping, MutableMapping, Sequence
+from typing import Dict, Iterator, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # Optional, the scans fall back to plain Python loops
+    np = None
+
+from RecordColumns import (EncodeRecordFields, FormatRecord, FormatResult, MinutesToDateTime, MissingTime,
+                           ParseDateTime, ParseResult, RecordFields, StringTable)
+from RecordIndexes import CodeIndex, DateIndex, PatientHistoryIndex, RecordKey, RecordKeyIndex, RowIndex
+
+
+# Columnar in-memory store for medical records.
+# Every record is a row; strings are dictionary encoded, Result is a float64 column and
+# DateTime/CompletionTime are minutes since the epoch. Rows keep the order of the file.
+# The store also behaves like the old Dict[str, List[Dict[str, str]]] (PatientId -> records)
+# so code written against that layout keeps working.
+class RecordStore(Mapping):
+    ColumnNames = ('PatientCodes', 'TestCodes', 'UnitCodes', 'StatusCodes', 'Results', 'DateTimes', 'CompletionTimes')
+
+    def __init__(self):
+        self.Patients = StringTable()
+        self.Tests = StringTable()
+        self.Units = StringTable()
+        self.Statuses = StringTable(['Pending', 'Completed', 'Reviewed'])
+
+        self.PatientCodes = array('I')
+        self.TestCodes = array('H')
+        self.UnitCodes = array('H')
+        self.StatusCodes = array('H')
+        self.Results = array('d')
+        self.DateTimes = array('q')
+        self.CompletionTimes = array('q')
+
+        # Original text of fields that do not survive the round trip (e.g. Result '12.50')
+        self.TextOverrides: Dict[int, Dict[str, str]] = {}
+        # PatientCode -> row ids of that patient, in file order
+        self.PatientRows: Dict[int, array] = {}
+        # Secondary indexes by name, built on first use and kept up to date by every change
+        self.Indexes: Dict[str, 'RowIndex'] = {}
+        # Deleted rows keep their row id (and their column slots) until DropDeleted
+        self.Deleted = set()
+
+    # Number of row ids in use, deleted rows included
+    @property
+    def RowCount(self) -> int:
+        return len(self.PatientCodes)
+
+    @property
+    def LiveRowCount(self) -> int:
+        return len(self.PatientCodes) - len(self.Deleted)
+
+    # Function to check and convert record fields into column values (raises ValueError)
+    def EncodeFields(self, record) -> Tuple[float, int, int, Dict[str, str]]:
+        return EncodeRecordFields(record)
+
+    # Function to add one record, returns its row id (raises ValueError on bad values)
+    def AppendRecord(self, PatientId: str, record) -> int:
+        RowId = self.AppendRow(PatientId, record)
+        for Index in self.Indexes.values():
+            Index.AddRow(RowId)
+        return RowId
+
+    # Function to add many (PatientId, record) pairs, the indexes take the new rows in one go.
+    # Rows before a bad record stay added when it raises ValueError.
+    def AppendRecords(self, Records) -> List[int]:
+        RowIds = []
+        try:
+            for PatientId, record in Records:
+                RowIds.append(self.AppendRow(PatientId, record))
+        finally:
+            for Index in self.Indexes.values():
+                Index.AddRows(RowIds)
+        return RowIds
+
+    # Function to add the columns of one record without telling the indexes
+    def AppendRow(self, PatientId: str, record) -> int:
+        Result, DateTime, CompletionTime, Overrides = self.EncodeFields(record)
+
+        RowId = len(self.PatientCodes)
+        PatientCode = self.Patients.Codes.get(PatientId)
+        if PatientCode is None:
+            PatientCode = self.Patients.Encode(PatientId)
+            self.PatientRows[PatientCode] = array('I')
+        self.PatientCodes.append(PatientCode)
+        self.TestCodes.append(self.Tests.Encode(record['TestName']))
+        self.UnitCodes.append(self.Units.Encode(record['Unit']))
+        self.StatusCodes.append(self.Statuses.Encode(record['Status']))
+        self.Results.append(Result)
+        self.DateTimes.append(DateTime)
+        self.CompletionTimes.append(CompletionTime)
+        if Overrides:
+            self.TextOverrides[RowId] = Overrides
+
+        self.PatientRows[PatientCode].append(RowId)
+        return RowId
+
+    # Function to delete a row; its row id is not reused
+    def DeleteRow(self, RowId: int):
+        if RowId in self.Deleted:
+            return
+        for Index in self.Indexes.values():
+            Index.RemoveRow(RowId)
+        Rows = self.PatientRows[self.PatientCodes[RowId]]
+        del Rows[bisect_left(Rows, RowId)]
+        self.Deleted.add(RowId)
+
+    # Function to remove deleted rows for good; the remaining rows get consecutive row ids
+    def DropDeleted(self):
+        if not self.Deleted:
+            return
+        Keep = [RowId for RowId in range(self.RowCount) if RowId not in self.Deleted]
+        NewIds = array('q', [-1]) * self.RowCount
+        for NewId, RowId in enumerate(Keep):
+            NewIds[RowId] = NewId
+
+        for Name in self.ColumnNames:
+            Column = getattr(self, Name)
+            setattr(self, Name, array(Column.typecode, map(Column.__getitem__, Keep)))
+        self.TextOverrides = {NewIds[RowId]: Overrides for RowId, Overrides in self.TextOverrides.items()
+                              if NewIds[RowId] >= 0}
+        for PatientCode, Rows in self.PatientRows.items():
+            self.PatientRows[PatientCode] = array('I', map(NewIds.__getitem__, Rows))
+        self.Deleted = set()
+        self.Indexes.clear()
+
+    # Function to append all rows of another store after the rows of this one
+    def Extend(self, Other: 'RecordStore'):
+        Base = self.RowCount
+        PatientMap = array('I', map(self.Patients.Encode, Other.Patients.Strings))
+
+        # Translate the codes of the other store into the codes of this one
+        for Table, Columns, OtherTable, OtherColumns in (
+                (self.Tests, self.TestCodes, Other.Tests, Other.TestCodes),
+                (self.Units, self.UnitCodes, Other.Units, Other.UnitCodes),
+                (self.Statuses, self.StatusCodes, Other.Statuses, Other.StatusCodes)):
+            CodeMap = [Table.Encode(Value) for Value in OtherTable.Strings]
+            if CodeMap == list(range(len(CodeMap))):
+                Columns.extend(OtherColumns)
+            else:
+                Columns.extend(array(Columns.typecode, map(CodeMap.__getitem__, OtherColumns)))
+
+        self.PatientCodes.extend(array('I', map(PatientMap.__getitem__, Other.PatientCodes)))
+        self.Results.extend(Other.Results)
+        self.DateTimes.extend(Other.DateTimes)
+        self.CompletionTimes.extend(Other.CompletionTimes)
+        for RowId, Overrides in Other.TextOverrides.items():
+            self.TextOverrides[Base + RowId] = dict(Overrides)
+        self.Deleted.update(Base + RowId for RowId in Other.Deleted)
+
+        for PatientCode, Rows in Other.PatientRows.items():
+            Target = self.PatientRows.get(PatientMap[PatientCode])
+            if Target is None:
+                Target = self.PatientRows[PatientMap[PatientCode]] = array('I')
+            Target.extend(array('I', [Base + RowId for RowId in Rows]) if Base else Rows)
+
+        # Small merges update the indexes, big ones let them rebuild on next use
+        if Other.RowCount <= max(Base // 10, 1000):
+            Added = [RowId for RowId in range(Base, self.RowCount) if RowId not in self.Deleted]
+            for Index in self.Indexes.values():
+                Index.AddRows(Added)
+        else:
+            self.Indexes.clear()
+
+    def PatientIdOf(self, RowId: int) -> str:
+        return self.Patients.Strings[self.PatientCodes[RowId]]
+
+    def HasField(self, RowId: int, Field: str) -> bool:
+        if Field == 'CompletionTime':
+            return self.CompletionTimes[RowId] != MissingTime
+        return Field in RecordFields
+
+    # Function to read one field of a row back as the string stored in the file
+    def GetField(self, RowId: int, Field: str) -> str:
+        Overrides = self.TextOverrides.get(RowId)
+        if Overrides and Field in Overrides:
+            return Overrides[Field]
+        if Field == 'TestName':
+            return self.Tests.Strings[self.TestCodes[RowId]]
+        if Field == 'DateTime':
+            return MinutesToDateTime(self.DateTimes[RowId])
+        if Field == 'Result':
+            return FormatResult(self.Results[RowId])
+        if Field == 'Unit':
+            return self.Units.Strings[self.UnitCodes[RowId]]
+        if Field == 'Status':
+            return self.Statuses.Strings[self.StatusCodes[RowId]]
+        if Field == 'CompletionTime' and self.CompletionTimes[RowId] != MissingTime:
+            return MinutesToDateTime(self.CompletionTimes[RowId])
+        raise KeyError(Field)
+
+    # Function to change one field of a row (raises ValueError on bad values)
+    def SetField(self, RowId: int, Field: str, Value: str):
+        # Check the new value before the row is touched
+        if Field == 'Result':
+            NewValue, Canonical = ParseResult(Value)
+        elif Field in ('DateTime', 'CompletionTime'):
+            NewValue, Canonical = ParseDateTime(Value) if Value else (MissingTime, True)
+        elif Field in ('TestName', 'Unit', 'Status'):
+            NewValue, Canonical = Value, True
+        else:
+            raise KeyError(Field)
+        Text = None if Canonical else Value
+
+        for Index in self.Indexes.values():
+            Index.RemoveRow(RowId)
+
+        if Field == 'TestName':
+            self.TestCodes[RowId] = self.Tests.Encode(NewValue)
+        elif Field == 'Unit':
+            self.UnitCodes[RowId] = self.Units.Encode(NewValue)
+        elif Field == 'Status':
+            self.StatusCodes[RowId] = self.Statuses.Encode(NewValue)
+        elif Field == 'Result':
+            self.Results[RowId] = NewValue
+        elif Field == 'DateTime':
+            self.DateTimes[RowId] = NewValue
+        else:
+            self.CompletionTimes[RowId] = NewValue
+
+        Overrides = self.TextOverrides.get(RowId)
+        if Text is not None:
+            self.TextOverrides.setdefault(RowId, {})[Field] = Text
+        elif Overrides and Field in Overrides:
+            del Overrides[Field]
+            if not Overrides:
+                del self.TextOverrides[RowId]
+
+        for Index in self.Indexes.values():
+            Index.AddRow(RowId)
+
+    def RemoveCompletionTime(self, RowId: int):
+        self.SetField(RowId, 'CompletionTime', '')
+
+    # Function to get a row as a plain record dictionary
+    def GetRecord(self, RowId: int) -> Dict[str, str]:
+        record = {Field: self.GetField(RowId, Field) for Field in RecordFields[:5]}
+        if self.CompletionTimes[RowId] != MissingTime:
+            record['CompletionTime'] = self.GetField(RowId, 'CompletionTime')
+        return record
+
+    # Function to format a row as a line of MedicalRecord.txt
+    def FormatLine(self, RowId: int) -> str:
+        return FormatRecord(self.PatientIdOf(RowId), self.GetRecord(RowId))
+
+    def RowsOf(self, PatientId: str) -> array:
+        PatientCode = self.Patients.Lookup(PatientId)
+        if PatientCode is None:
+            return array('I')
+        return self.PatientRows.get(PatientCode, array('I'))
+
+    # Function to walk all rows patient by patient, like iterating the old dictionary
+    def IterRows(self) -> Iterator[int]:
+        for Rows in self.PatientRows.values():
+            yield from Rows
+
+    # Function to put row ids in the order IterRows would give them
+    def InPatientOrder(self, Rows) -> List[int]:
+        if np is not None and len(Rows) > 1000:
+            RowIds = np.asarray(Rows, dtype=np.int64)
+            PatientCodes = np.frombuffer(self.PatientCodes, dtype=np.uint32)[RowIds]
+            return RowIds[np.lexsort((RowIds, PatientCodes))].tolist()
+        PatientCodes = self.PatientCodes
+        return sorted(Rows, key=lambda RowId: (PatientCodes[RowId], RowId))
+
+    # Function to get a secondary index, Factory(store) builds it the first time
+    def GetIndex(self, Name: str, Factory) -> 'RowIndex':
+        Index = self.Indexes.get(Name)
+        if Index is None:
+            Index = self.Indexes[Name] = Factory(self)
+        return Index
+
+    # Function to get the row ids of a test, in file order
+    def RowsWithTest(self, TestName: str) -> array:
+        TestCode = self.Tests.Lookup(TestName)
+        if TestCode is None:
+            return array('I')
+        return self.GetIndex('TestName', lambda Store: CodeIndex(Store, 'TestCodes')).Rows(TestCode)
+
+    # Function to get the row ids with a status, in file order
+    def RowsWithStatus(self, Status: str) -> array:
+        StatusCode = self.Statuses.Lookup(Status)
+        if StatusCode is None:
+            return array('I')
+        return self.GetIndex('Status', lambda Store: CodeIndex(Store, 'StatusCodes')).Rows(StatusCode)
+
+    # Function to get the row ids whose DateTime is between two epoch minutes (inclusive), by date
+    def RowsBetween(self, StartMinutes: int, EndMinutes: int) -> array:
+        return self.GetIndex('DateTime', DateIndex).Rows(StartMinutes, EndMinutes)
+
+    # Function to get the row of the latest record of a patient's test, None if there is none
+    def LatestRow(self, PatientId: str, TestName: str) -> Optional[int]:
+        PatientCode = self.Patients.Lookup(PatientId)
+        TestCode = self.Tests.Lookup(TestName)
+        if PatientCode is None or TestCode is None:
+            return None
+        return self.GetIndex('PatientHistory', PatientHistoryIndex).Latest(PatientCode, TestCode)
+
+    # Function to get a patient's rows between two epoch minutes (inclusive), oldest first, of one
+    # test or of all tests; with Last only the Last most recent rows of each test
+    def PatientHistory(self, PatientId: str, TestName: Optional[str] = None, StartMinutes: int = MissingTime,
+                       EndMinutes: int = -MissingTime - 1, Last: Optional[int] = None) -> List[int]:
+        PatientCode = self.Patients.Lookup(PatientId)
+        if PatientCode is None:
+            return []
+        Index = self.GetIndex('PatientHistory', PatientHistoryIndex)
+        if TestName is not None:
+            TestCode = self.Tests.Lookup(TestName)
+            if TestCode is None:
+                return []
+            return Index.Rows(PatientCode, TestCode, StartMinutes, EndMinutes, Last).tolist()
+        Rows = []
+        for TestCode in Index.TestsOf(PatientCode):
+            Rows.extend(Index.Rows(PatientCode, TestCode, StartMinutes, EndMinutes, Last))
+        DateTimes = self.DateTimes
+        return sorted(Rows, key=lambda RowId: (DateTimes[RowId], RowId))
+
+    # Function to check whether a live row has this patient, test and DateTime (epoch minutes)
+    def HasRecordKey(self, PatientId: str, TestName: str, DateTime: int) -> bool:
+        PatientCode = self.Patients.Lookup(PatientId)
+        TestCode = self.Tests.Lookup(TestName)
+        if PatientCode is None or TestCode is None:
+            return False
+        return RecordKey(PatientCode, TestCode, DateTime) in self.GetIndex('RecordKey', RecordKeyIndex).Counts
+
+    # --- Compatibility view: PatientId -> list of records ---
+    def __getitem__(self, PatientId: str) -> 'PatientRecordsView':
+        if not self.RowsOf(PatientId):
+            raise KeyError(PatientId)
+        return PatientRecordsView(self, PatientId)
+
+    # Patients whose records were all deleted are left out
+    def __iter__(self):
+        Strings = self.Patients.Strings
+        for PatientCode, Rows in self.PatientRows.items():
+            if Rows:
+                yield Strings[PatientCode]
+
+    def __len__(self):
+        return sum(1 for Rows in self.PatientRows.values() if Rows)
+
+    def copy(self) -> Dict[str, List['RecordView']]:
+        return {PatientId: list(Records) for PatientId, Records in self.items()}
+
+
+# A record of the store seen as a dictionary; reads and writes go straight to the columns
+class RecordView(MutableMapping):
+    __slots__ = ('Store', 'RowId')
+
+    def __init__(self, Store: RecordStore, RowId: int):
+        self.Store = Store
+        self.RowId = RowId
+
+    def __getitem__(self, Field):
+        if not self.Store.HasField(self.RowId, Field):
+            raise KeyError(Field)
+        return self.Store.GetField(self.RowId, Field)
+
+    def __setitem__(self, Field, Value):
+        self.Store.SetField(self.RowId, Field, Value)
+
+    def __delitem__(self, Field):
+        if Field != 'CompletionTime' or not self.Store.HasField(self.RowId, Field):
+            raise KeyError(Field)
+        self.Store.RemoveCompletionTime(self.RowId)
+
+    def __iter__(self):
+        return (Field for Field in RecordFields if self.Store.HasField(self.RowId, Field))
+
+    def __len__(self):
+        return 6 if self.Store.HasField(self.RowId, 'CompletionTime') else 5
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+# The records of one patient seen as a list of RecordView
+class PatientRecordsView(Sequence):
+    __slots__ = ('Store', 'PatientId')
+
+    def __init__(self, Store: RecordStore, PatientId: str):
+        self.Store = Store
+        self.PatientId = PatientId
+
+    def __getitem__(self, Index):
+        Rows = self.Store.RowsOf(self.PatientId)
+        if isinstance(Index, slice):
+            return [RecordView(self.Store, RowId) for RowId in Rows[Index]]
+        return RecordView(self.Store, Rows[Index])
+
+    def __len__(self):
+        return len(self.Store.RowsOf(self.PatientId))
+
+    def append(self, record):
+        self.Store.AppendRecord(self.PatientId, record)
+
+
+# Function to wrap an old style Dict[str, List[Dict[str, str]]] into a RecordStore
+def AsRecordStore(MedicalRecords) -> RecordStore:
+    if isinstance(MedicalRecords, RecordStore):
+        return MedicalRecords
+    Store = RecordStore()
+    for PatientId, records in MedicalRecords.items():
+        for record in records:
+            Store.AppendRecord(PatientId, record)
+    return Store
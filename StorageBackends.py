@@ -0,0 +1,748 @@
+from array import array
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, Optional, Tuple
+import json
+import os
+import re
+import sqlite3
+import tempfile
+
+from OperationStats import Instrumented
+from RecordColumns import (DateTimeToMinutes, EncodeRecordFields, FormatRecord, FormatResult, MinutesSinceEpoch,
+                           MinutesToDateTime, MissingTime, StringTable)
+from RecordIndexes import SummaryIndex
+from RecordStore import RecordStore, RecordView
+from QueryEngine import ExecuteQuery, Query
+from RecordJournal import (AppendJournalEntries, JournalCompactionSize, JournalFileOf, ReadJournal, ReadRecordIdMap,
+                           RecordIdMap, ReplaceFile, WriteRecordIdMap)
+from CompactFormat import AppendCompactRecords, IsCompactRecordFile, WriteCompactRecordFile
+from RecordFiles import (CompactIfNeeded, CompactMedicalRecordFile, FileShards, IterMedicalRecordBatches,
+                         IterMedicalRecords, OffsetIndexFileOf, ReadMedicalRecordsFromFile, ReadPatientRecords,
+                         RecordShard, ReplaceMedicalRecordFile, SnapshotFileOf)
+
+
+# Function to walk (PatientId, record) pairs of a RecordStore, an old style dictionary, a StorageBackend
+# or a record stream
+def IterRecordPairs(MedicalRecords) -> Iterator[Tuple[str, Dict[str, str]]]:
+    if isinstance(MedicalRecords, StorageBackend):
+        yield from MedicalRecords.IterRecords()
+    elif isinstance(MedicalRecords, RecordStore):
+        for RowId in MedicalRecords.IterRows():
+            yield MedicalRecords.PatientIdOf(RowId), RecordView(MedicalRecords, RowId)
+    elif isinstance(MedicalRecords, Mapping):
+        for PatientId, records in MedicalRecords.items():
+            for record in records:
+                yield PatientId, record
+    else:
+        yield from MedicalRecords
+
+
+#------------------------------
+# Storage backends. Everything that reads or writes the records goes through one of these:
+# FlatFileBackend keeps MedicalRecord.txt and its journal, SQLiteBackend keeps a SQLite database.
+# Records are addressed by record id, which stays the same for the life of a record; RecordIdOf and
+# RowIdOf translate between it and the row id in the store returned by Load.
+
+class StorageBackend:
+    FileName = ''
+
+    # Function to read every record into a RecordStore (deleted records become deleted rows)
+    def Load(self) -> RecordStore:
+        raise NotImplementedError
+
+    # Function to read one patient's records alone: (store of those records, record id of each of its rows)
+    def LoadPatient(self, PatientId: str) -> Tuple[RecordStore, List[int]]:
+        raise NotImplementedError
+
+    # Function to save new records; they get the next record ids, in order
+    def Append(self, Records: List[Tuple[str, Dict[str, str]]]):
+        raise NotImplementedError
+
+    # Function to save changed fields: {record id: {Field: new value}}, '' removes CompletionTime
+    def Update(self, Changes: Dict[int, Dict[str, str]]):
+        raise NotImplementedError
+
+    def Delete(self, RecordIds: List[int]):
+        raise NotImplementedError
+
+    # Function to run a Query, returns (record id, PatientId, record) patient by patient
+    def QueryRecords(self, Criteria: 'Query', MedicalTests=None) -> List[Tuple[int, str, Dict[str, str]]]:
+        raise NotImplementedError
+
+    # Function to get the record id of a row of the store returned by Load
+    def RecordIdOf(self, RowId: int) -> int:
+        return RowId
+
+    # Function to get the row of a record id in the store returned by Load, None when there is none
+    def RowIdOf(self, RecordId: int) -> Optional[int]:
+        return RecordId
+
+    # Function to get the summary statistics, same layout as SummaryStats
+    def Summary(self) -> Dict[str, Tuple[List, List]]:
+        raise NotImplementedError
+
+    # Function to stream every live (PatientId, record)
+    def IterRecords(self) -> Iterator[Tuple[str, Dict[str, str]]]:
+        raise NotImplementedError
+
+    # Function to get the shards of the files IterRecords reads, in its order, for MapShards; None when
+    # the records do not stream from records files
+    def Shards(self) -> Optional[List[RecordShard]]:
+        return None
+
+    # Function to tidy the storage after changes; Force asks for it even when it is not due yet.
+    # MedicalRecords is None when only single patients were read (lazy mode).
+    def Compact(self, MedicalRecords: Optional[RecordStore], Force: bool = False):
+        pass
+
+    # Function to run a Query that names a patient on that patient's records alone
+    def QueryPatientRecords(self, Criteria: 'Query', MedicalTests=None) -> List[Tuple[int, str, Dict[str, str]]]:
+        Store, RecordIds = self.LoadPatient(Criteria.PatientId)
+        return [(RecordIds[RowId], Store.PatientIdOf(RowId), RecordView(Store, RowId))
+                for RowId in ExecuteQuery(Store, Criteria, MedicalTests)]
+
+
+# MedicalRecord.txt: appends go to the end of the file, changes to the journal.
+# Queries and aggregates run on the store returned by Load (loaded on first use).
+class FlatFileBackend(StorageBackend):
+    def __init__(self, RecordsFile: str, Workers: int = 1, UseSnapshot: bool = False,
+                 Store: Optional[RecordStore] = None):
+        self.FileName = RecordsFile
+        self.Workers = Workers
+        self.UseSnapshot = UseSnapshot
+        self.Store = Store
+        self.Ids = None
+
+    @Instrumented(Rows=lambda Store: Store.LiveRowCount)
+    def Load(self) -> RecordStore:
+        self.Store = ReadMedicalRecordsFromFile(self.FileName, Workers=self.Workers, UseSnapshot=self.UseSnapshot)
+        self.Ids = None
+        return self.Store
+
+    # Function to get the record ids of the file, read once until the next compaction
+    def IdMap(self) -> RecordIdMap:
+        if self.Ids is None:
+            self.Ids = ReadRecordIdMap(self.FileName)
+        return self.Ids
+
+    def RecordIdOf(self, RowId: int) -> int:
+        return self.IdMap().RecordIdOf(RowId)
+
+    def RowIdOf(self, RecordId: int) -> Optional[int]:
+        return self.IdMap().PositionOf(RecordId)
+
+    def LoadPatient(self, PatientId: str) -> Tuple[RecordStore, List[int]]:
+        return ReadPatientRecords(self.FileName, PatientId, self.Workers)
+
+    def Append(self, Records: List[Tuple[str, Dict[str, str]]]):
+        if IsCompactRecordFile(self.FileName):
+            AppendCompactRecords(self.FileName, Records)
+            return
+        with open(self.FileName, 'a') as file:
+            file.write(''.join(FormatRecord(PatientId, record) + "\n" for PatientId, record in Records))
+            file.flush()
+            os.fsync(file.fileno())
+
+    def Update(self, Changes: Dict[int, Dict[str, str]]):
+        AppendJournalEntries(self.FileName, [{"Op": "Update", "RecordId": RecordId, "Fields": Fields}
+                                             for RecordId, Fields in Changes.items() if Fields])
+
+    def Delete(self, RecordIds: List[int]):
+        AppendJournalEntries(self.FileName, [{"Op": "Delete", "RecordId": RecordId} for RecordId in RecordIds])
+
+    @Instrumented(Rows=len)
+    def QueryRecords(self, Criteria: 'Query', MedicalTests=None) -> List[Tuple[int, str, Dict[str, str]]]:
+        if self.Store is None and Criteria.PatientId is not None:
+            return self.QueryPatientRecords(Criteria, MedicalTests)
+        Store = self.Store if self.Store is not None else self.Load()
+        Ids = self.IdMap()
+        return [(Ids.RecordIdOf(RowId), Store.PatientIdOf(RowId), RecordView(Store, RowId))
+                for RowId in ExecuteQuery(Store, Criteria, MedicalTests)]
+
+    def Summary(self) -> Dict[str, Tuple[List, List]]:
+        Store = self.Store if self.Store is not None else self.Load()
+        return Store.GetIndex('Summary', SummaryIndex).Stats()
+
+    def IterRecords(self) -> Iterator[Tuple[str, Dict[str, str]]]:
+        if self.Store is not None:
+            return IterRecordPairs(self.Store)
+        return IterMedicalRecords(self.FileName)
+
+    def Shards(self) -> Optional[List[RecordShard]]:
+        return FileShards(self.FileName) if self.Store is None else None
+
+    def Compact(self, MedicalRecords: Optional[RecordStore], Force: bool = False):
+        self.Ids = None
+        if MedicalRecords is None:
+            # Lazy mode: the whole file is only read when the journal is due
+            JournalFile = JournalFileOf(self.FileName)
+            if Force or os.path.exists(JournalFile) and os.path.getsize(JournalFile) >= JournalCompactionSize:
+                CompactMedicalRecordFile(ReadMedicalRecordsFromFile(self.FileName, Workers=self.Workers), self.FileName)
+        elif Force:
+            CompactMedicalRecordFile(MedicalRecords, self.FileName)
+        else:
+            CompactIfNeeded(MedicalRecords, self.FileName)
+
+
+SQLiteColumns = "record_id, patient_id, test_name, datetime, result, unit, status, completion_time, text_overrides"
+
+
+# Function to turn one row of the records table back into (record id, PatientId, record)
+def RecordFromSQLiteRow(Row) -> Tuple[int, str, Dict[str, str]]:
+    RecordId, PatientId, TestName, DateTime, Result, Unit, Status, CompletionTime, Overrides = Row
+    record = {"TestName": TestName, "DateTime": MinutesToDateTime(DateTime), "Result": FormatResult(Result),
+              "Unit": Unit, "Status": Status}
+    if CompletionTime is not None:
+        record["CompletionTime"] = MinutesToDateTime(CompletionTime)
+    if Overrides:
+        record.update(json.loads(Overrides))
+    return RecordId, PatientId, record
+
+
+# Local SQLite database in WAL mode. DateTime and CompletionTime are epoch minutes and Result a
+# number, like the columns of RecordStore, so filters and aggregates run as SQL on the indexes
+# without loading the records. Deleted records are flagged, which keeps record ids stable.
+class SQLiteBackend(StorageBackend):
+    def __init__(self, DatabaseFile: str):
+        self.FileName = DatabaseFile
+        self.Connection = sqlite3.connect(DatabaseFile)
+        self.Connection.execute("PRAGMA journal_mode=WAL")
+        self.Connection.execute("PRAGMA synchronous=NORMAL")
+        with self.Connection:
+            self.Connection.executescript("""
+                CREATE TABLE IF NOT EXISTS records (
+                    record_id INTEGER PRIMARY KEY,
+                    patient_id TEXT NOT NULL,
+                    test_name TEXT NOT NULL,
+                    datetime INTEGER NOT NULL,
+                    result REAL NOT NULL,
+                    unit TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    completion_time INTEGER,
+                    text_overrides TEXT,
+                    deleted INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS records_patient ON records (patient_id);
+                CREATE INDEX IF NOT EXISTS records_test_datetime ON records (test_name, datetime);
+                CREATE INDEX IF NOT EXISTS records_status ON records (status);
+            """)
+
+    def RecordCount(self) -> int:
+        return self.Connection.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    @Instrumented(Rows=lambda Store: Store.LiveRowCount)
+    def Load(self) -> RecordStore:
+        MedicalRecords = RecordStore()
+        Deleted = []
+        for Row in self.Connection.execute(f"SELECT {SQLiteColumns}, deleted FROM records ORDER BY record_id"):
+            RecordId, PatientId, record = RecordFromSQLiteRow(Row[:-1])
+            if MedicalRecords.AppendRecord(PatientId, record) != RecordId:
+                raise ValueError(f"Record ids of {self.FileName} are not consecutive at {RecordId}")
+            if Row[-1]:
+                Deleted.append(RecordId)
+        for RowId in Deleted:
+            MedicalRecords.DeleteRow(RowId)
+        return MedicalRecords
+
+    def LoadPatient(self, PatientId: str) -> Tuple[RecordStore, List[int]]:
+        Store = RecordStore()
+        RecordIds = []
+        for Row in self.Connection.execute(f"SELECT {SQLiteColumns} FROM records WHERE patient_id = ? AND deleted = 0 "
+                                           "ORDER BY record_id", (PatientId,)):
+            RecordId, _, record = RecordFromSQLiteRow(Row)
+            Store.AppendRecord(PatientId, record)
+            RecordIds.append(RecordId)
+        return Store, RecordIds
+
+    # Function to turn a record into the values of the columns after record_id
+    def RowValues(self, PatientId: str, record) -> Tuple:
+        Result, DateTime, CompletionTime, Overrides = EncodeRecordFields(record)
+        return (PatientId, record['TestName'], DateTime, Result, record['Unit'], record['Status'],
+                None if CompletionTime == MissingTime else CompletionTime, json.dumps(Overrides) if Overrides else None)
+
+    def Append(self, Records: List[Tuple[str, Dict[str, str]]]):
+        with self.Connection:
+            Next = self.Connection.execute("SELECT COALESCE(MAX(record_id) + 1, 0) FROM records").fetchone()[0]
+            self.Connection.executemany(f"INSERT INTO records ({SQLiteColumns}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                        [(Next + Index,) + self.RowValues(PatientId, record)
+                                         for Index, (PatientId, record) in enumerate(Records)])
+
+    # Function to copy all rows of a store, deleted rows included, into an empty database
+    def AppendStore(self, MedicalRecords: RecordStore):
+        with self.Connection:
+            self.Connection.executemany(
+                f"INSERT INTO records ({SQLiteColumns}, deleted) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                ((RowId,) + self.RowValues(MedicalRecords.PatientIdOf(RowId), MedicalRecords.GetRecord(RowId))
+                 + (int(RowId in MedicalRecords.Deleted),) for RowId in range(MedicalRecords.RowCount)))
+
+    def Update(self, Changes: Dict[int, Dict[str, str]]):
+        with self.Connection:
+            for RecordId, Fields in Changes.items():
+                Row = self.Connection.execute(f"SELECT {SQLiteColumns} FROM records WHERE record_id = ?",
+                                              (RecordId,)).fetchone()
+                if Row is None:
+                    raise KeyError(RecordId)
+                _, PatientId, record = RecordFromSQLiteRow(Row)
+                record.update(Fields)
+                if not record.get('CompletionTime'):
+                    record.pop('CompletionTime', None)
+                self.Connection.execute(
+                    "UPDATE records SET patient_id = ?, test_name = ?, datetime = ?, result = ?, unit = ?, status = ?, "
+                    "completion_time = ?, text_overrides = ? WHERE record_id = ?",
+                    self.RowValues(PatientId, record) + (RecordId,))
+
+    def Delete(self, RecordIds: List[int]):
+        with self.Connection:
+            self.Connection.executemany("UPDATE records SET deleted = 1 WHERE record_id = ?",
+                                        [(RecordId,) for RecordId in RecordIds])
+
+    # Function to translate a Query into a WHERE clause and its parameters
+    def QueryWhere(self, Criteria: 'Query', MedicalTests=None) -> Tuple[str, List]:
+        Where = ["deleted = 0"]
+        Parameters = []
+        if Criteria.PatientId is not None:
+            Where.append("patient_id = ?")
+            Parameters.append(Criteria.PatientId)
+        if Criteria.TestName is not None:
+            Where.append("test_name = ?")
+            Parameters.append(Criteria.TestName)
+        if Criteria.Status is not None:
+            Where.append("status = ?")
+            Parameters.append(Criteria.Status)
+        if Criteria.StartDate is not None or Criteria.EndDate is not None:
+            Where.append("datetime BETWEEN ? AND ?")
+            Parameters.append(MinutesSinceEpoch(Criteria.StartDate) if Criteria.StartDate is not None else MissingTime)
+            Parameters.append(MinutesSinceEpoch(Criteria.EndDate) if Criteria.EndDate is not None else -MissingTime - 1)
+        if Criteria.MinTurnaround is not None or Criteria.MaxTurnaround is not None:
+            Where.append("status = 'Completed' AND completion_time IS NOT NULL "
+                         "AND completion_time - datetime BETWEEN ? AND ?")
+            Parameters.append(Criteria.MinTurnaround if Criteria.MinTurnaround is not None else 0)
+            Parameters.append(Criteria.MaxTurnaround if Criteria.MaxTurnaround is not None else -MissingTime - 1)
+        if Criteria.MinResult is not None or Criteria.MaxResult is not None:
+            Where.append("result BETWEEN ? AND ?")
+            Parameters.append(Criteria.MinResult if Criteria.MinResult is not None else float('-inf'))
+            Parameters.append(Criteria.MaxResult if Criteria.MaxResult is not None else float('inf'))
+        if Criteria.Abnormal:
+            if MedicalTests is None:
+                raise ValueError("The Abnormal criterion needs the medical tests")
+            Outside = []
+            for TestName, test in MedicalTests.items():
+                Bounds = [f"result {Operator} ?" for Operator, Key in (('<', 'low'), ('>', 'high')) if Key in test['range']]
+                if Bounds:
+                    Outside.append(f"(test_name = ? AND ({' OR '.join(Bounds)}))")
+                    Parameters.append(TestName)
+                    Parameters.extend(test['range'][Key] for Key in ('low', 'high') if Key in test['range'])
+            Where.append(f"({' OR '.join(Outside)})" if Outside else "0")
+        return ' AND '.join(Where), Parameters
+
+    @Instrumented(Rows=len)
+    def QueryRecords(self, Criteria: 'Query', MedicalTests=None) -> List[Tuple[int, str, Dict[str, str]]]:
+        Where, Parameters = self.QueryWhere(Criteria, MedicalTests)
+        # Patients in order of their first record, like RecordStore.InPatientOrder
+        Rows = self.Connection.execute(
+            f"SELECT {SQLiteColumns} FROM records WHERE {Where} ORDER BY "
+            f"(SELECT MIN(record_id) FROM records AS first WHERE first.patient_id = records.patient_id), record_id",
+            Parameters)
+        return [RecordFromSQLiteRow(Row) for Row in Rows]
+
+    def Summary(self) -> Dict[str, Tuple[List, List]]:
+        TestValues = {}
+        for TestName, Count, Total, MinValue, MaxValue in self.Connection.execute(
+                "SELECT test_name, COUNT(*), SUM(result), MIN(result), MAX(result) FROM records WHERE deleted = 0 "
+                "GROUP BY test_name ORDER BY (SELECT MIN(record_id) FROM records AS first "
+                "WHERE first.test_name = records.test_name)"):
+            TestValues[TestName] = ([Count, Total, MinValue, MaxValue], [0, 0, 0, 0])
+        for TestName, Count, Total, MinValue, MaxValue in self.Connection.execute(
+                "SELECT test_name, COUNT(*), SUM(turnaround), MIN(turnaround), MAX(turnaround) FROM "
+                "(SELECT test_name, completion_time - datetime AS turnaround FROM records WHERE deleted = 0 "
+                "AND status = 'Completed' AND completion_time IS NOT NULL) GROUP BY test_name"):
+            TestValues[TestName][1][:] = [Count, Total, MinValue, MaxValue]
+        return TestValues
+
+    def IterRecords(self) -> Iterator[Tuple[str, Dict[str, str]]]:
+        for Row in self.Connection.execute(f"SELECT {SQLiteColumns} FROM records WHERE deleted = 0 ORDER BY record_id"):
+            _, PatientId, record = RecordFromSQLiteRow(Row)
+            yield PatientId, record
+
+    def Compact(self, MedicalRecords: Optional[RecordStore], Force: bool = False):
+        if Force:
+            self.Connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+#------------------------------
+# Partitioned storage. A directory with one records file per month of DateTime ('2024-03.txt', each
+# with its own journal and snapshot) and 'manifest.json' with the row count, size and first and last
+# DateTime of every partition. Queries over a period only read the partitions that overlap it.
+# A record id is the month followed by the record id within the partition file (202403000000012 is
+# record 12 of '2024-03.txt'), so it stays the same when records are added to other months.
+
+ManifestVersion = 1
+PartitionFileName = re.compile(r'^(\d{4}-\d{2})\.txt$')
+PartitionRecordIdScale = 10 ** 9  # Record ids within a partition stay below this
+
+
+def ManifestFileOf(Directory: str) -> str:
+    return os.path.join(Directory, 'manifest.json')
+
+
+# Function to get the partition ('YYYY-MM') of a DateTime in minutes
+def PartitionOf(Minutes: int) -> str:
+    return MinutesToDateTime(Minutes)[:7]
+
+
+# Function to get the record id of the record with id LocalId in the partition of a month
+def PartitionRecordId(Month: str, LocalId: int) -> int:
+    return int(Month[:4] + Month[5:]) * PartitionRecordIdScale + LocalId
+
+
+# Function to split a record id into (month, record id within the partition)
+def SplitPartitionRecordId(RecordId: int) -> Tuple[str, int]:
+    Month, LocalId = divmod(RecordId, PartitionRecordIdScale)
+    return f"{Month // 100:04d}-{Month % 100:02d}", LocalId
+
+
+# Function to read the manifest of a partition directory: month -> {'Rows', 'Size', 'MinTime', 'MaxTime'}
+def ReadManifest(Directory: str) -> Dict[str, Dict[str, int]]:
+    try:
+        with open(ManifestFileOf(Directory), 'r') as file:
+            Data = json.load(file)
+    except FileNotFoundError:
+        return {}
+    if Data.get('Version') != ManifestVersion:
+        raise ValueError(f"{ManifestFileOf(Directory)} has an unknown version")
+    return {Month: {'Rows': Entry['Rows'], 'Size': Entry['Size'], 'MinTime': DateTimeToMinutes(Entry['MinDateTime']),
+                    'MaxTime': DateTimeToMinutes(Entry['MaxDateTime'])}
+            for Month, Entry in Data['Partitions'].items()}
+
+
+# Function to write the manifest next to the old one and rename it over it
+def WriteManifest(Directory: str, Manifest: Dict[str, Dict[str, int]]):
+    Data = {"Version": ManifestVersion,
+            "Partitions": {Month: {"Rows": Entry['Rows'], "Size": Entry['Size'],
+                                   "MinDateTime": MinutesToDateTime(Entry['MinTime']),
+                                   "MaxDateTime": MinutesToDateTime(Entry['MaxTime'])}
+                           for Month, Entry in sorted(Manifest.items())}}
+    with tempfile.NamedTemporaryFile('w', dir=Directory, prefix='.manifest-', delete=False) as file:
+        json.dump(Data, file, indent=1)
+        file.flush()
+        os.fsync(file.fileno())
+    ReplaceFile(file.name, ManifestFileOf(Directory))
+
+
+# Function to get the manifest entry of the rows of a store
+def PartitionEntry(MedicalRecords: RecordStore, RowIds, Size: int, Month: str) -> Dict[str, int]:
+    Times = [MedicalRecords.DateTimes[RowId] for RowId in RowIds] or [DateTimeToMinutes(Month + '-01 00:00')]
+    return {'Rows': len(RowIds), 'Size': Size, 'MinTime': min(Times), 'MaxTime': max(Times)}
+
+
+# One records file per month, see above. Appends go to the partition of their DateTime, changes to the
+# journal of the partition holding the record (a changed DateTime does not move it, the manifest
+# widens instead). Load concatenates the partitions; QueryRecords without a loaded store reads only
+# the partitions that overlap the period of the query.
+class PartitionedBackend(StorageBackend):
+    def __init__(self, Directory: str, Workers: int = 1, UseSnapshot: bool = False):
+        self.FileName = os.path.normpath(Directory)
+        self.Workers = Workers
+        self.UseSnapshot = UseSnapshot
+        self.Store: Optional[RecordStore] = None
+        # Partition (code in Months) and position in the partition file of every row of the loaded
+        # store, and the rows of every partition in the order of their positions
+        self.Months = StringTable()
+        self.RowPartitions = array('H')
+        self.RowLocals = array('I')
+        self.MonthRows: List[array] = []
+        self.Ids: Dict[str, RecordIdMap] = {}
+        self.Manifest = ReadManifest(self.FileName)
+        if os.path.isdir(self.FileName):
+            self.CheckManifest()
+
+    def PartitionFile(self, Month: str) -> str:
+        return os.path.join(self.FileName, Month + '.txt')
+
+    def RecordCount(self) -> int:
+        return sum(Entry['Rows'] for Entry in self.Manifest.values())
+
+    # Function to measure again the partitions that the manifest does not describe, after a crash
+    # between writing a partition and the manifest or an edit by hand
+    def CheckManifest(self):
+        Changed = False
+        Files = {Match.group(1) for Match in map(PartitionFileName.match, os.listdir(self.FileName)) if Match}
+        for Month in set(self.Manifest) - Files:
+            print(f"Partition {self.PartitionFile(Month)} is missing, its records are left out.")
+            del self.Manifest[Month]
+            Changed = True
+        for Month in Files:
+            Size = os.path.getsize(self.PartitionFile(Month))
+            if Month not in self.Manifest or self.Manifest[Month]['Size'] != Size:
+                Part = ReadMedicalRecordsFromFile(self.PartitionFile(Month), UseSnapshot=self.UseSnapshot)
+                self.Manifest[Month] = PartitionEntry(Part, range(Part.RowCount), Size, Month)
+                Changed = True
+        if Changed:
+            WriteManifest(self.FileName, self.Manifest)
+
+    # Function to list the months of the partitions that overlap a period
+    def Partitions(self, StartMinutes: int = MissingTime, EndMinutes: int = -MissingTime - 1) -> List[str]:
+        return [Month for Month, Entry in sorted(self.Manifest.items())
+                if Entry['MinTime'] <= EndMinutes and Entry['MaxTime'] >= StartMinutes]
+
+    # Function to get the record ids of a partition file, read once until its next compaction
+    def IdMap(self, Month: str) -> RecordIdMap:
+        if Month not in self.Ids:
+            self.Ids[Month] = ReadRecordIdMap(self.PartitionFile(Month))
+        return self.Ids[Month]
+
+    def RecordIdOf(self, RowId: int) -> int:
+        Month = self.Months.Decode(self.RowPartitions[RowId])
+        return PartitionRecordId(Month, self.IdMap(Month).RecordIdOf(self.RowLocals[RowId]))
+
+    def RowIdOf(self, RecordId: int) -> Optional[int]:
+        Month, LocalId = SplitPartitionRecordId(RecordId)
+        Code = self.Months.Codes.get(Month)
+        if Code is None or RecordId < 0:
+            return None
+        Position = self.IdMap(Month).PositionOf(LocalId)
+        if Position is None or Position >= len(self.MonthRows[Code]):
+            return None
+        return self.MonthRows[Code][Position]
+
+    @Instrumented(Rows=lambda Store: Store.LiveRowCount)
+    def Load(self) -> RecordStore:
+        self.Store = RecordStore()
+        self.Months = StringTable()
+        self.RowPartitions = array('H')
+        self.RowLocals = array('I')
+        self.MonthRows = []
+        self.Ids = {}
+        for Month in sorted(self.Manifest):
+            Part = ReadMedicalRecordsFromFile(self.PartitionFile(Month), Workers=self.Workers,
+                                              UseSnapshot=self.UseSnapshot)
+            self.MonthRows.append(array('I', range(self.Store.RowCount, self.Store.RowCount + Part.RowCount)))
+            self.Store.Extend(Part)
+            self.RowPartitions.extend(array('H', [self.Months.Encode(Month)]) * Part.RowCount)
+            self.RowLocals.extend(range(Part.RowCount))
+        return self.Store
+
+    def LoadPatient(self, PatientId: str) -> Tuple[RecordStore, List[int]]:
+        if self.Store is not None:
+            # The loaded store holds the records added since too
+            RowIds = list(self.Store.RowsOf(PatientId))
+            Store = RecordStore()
+            Store.AppendRecords((PatientId, RecordView(self.Store, RowId)) for RowId in RowIds)
+            return Store, [self.RecordIdOf(RowId) for RowId in RowIds]
+        Store = RecordStore()
+        RecordIds = []
+        for Month in self.Partitions():
+            Part, PartIds = ReadPatientRecords(self.PartitionFile(Month), PatientId)
+            Store.Extend(Part)
+            RecordIds.extend(PartitionRecordId(Month, LocalId) for LocalId in PartIds)
+        return Store, RecordIds
+
+    def Append(self, Records: List[Tuple[str, Dict[str, str]]]):
+        MonthRecords: Dict[str, List[Tuple[str, Dict[str, str]]]] = {}
+        for PatientId, record in Records:
+            Minutes = DateTimeToMinutes(record['DateTime'])
+            Month = PartitionOf(Minutes)
+            Entry = self.Manifest.setdefault(Month, {'Rows': 0, 'Size': 0, 'MinTime': Minutes, 'MaxTime': Minutes})
+            if self.Store is not None:
+                Code = self.Months.Encode(Month)
+                if Code == len(self.MonthRows):
+                    self.MonthRows.append(array('I'))
+                self.MonthRows[Code].append(len(self.RowPartitions))
+                self.RowPartitions.append(Code)
+                self.RowLocals.append(Entry['Rows'])
+            Entry['Rows'] += 1
+            Entry['MinTime'] = min(Entry['MinTime'], Minutes)
+            Entry['MaxTime'] = max(Entry['MaxTime'], Minutes)
+            MonthRecords.setdefault(Month, []).append((PatientId, record))
+
+        # The partitions are written before the manifest that counts their new rows
+        os.makedirs(self.FileName, exist_ok=True)
+        for Month, Added in MonthRecords.items():
+            FlatFileBackend(self.PartitionFile(Month)).Append(Added)
+            self.Manifest[Month]['Size'] = os.path.getsize(self.PartitionFile(Month))
+        WriteManifest(self.FileName, self.Manifest)
+
+    # Function to append {record id: entry} to the journals of the partitions holding the records
+    def AppendJournals(self, Entries: Dict[int, Dict]):
+        Journals: Dict[str, List[Dict]] = {}
+        Widened = False
+        for RecordId, Entry in Entries.items():
+            Month, LocalId = SplitPartitionRecordId(RecordId)
+            if Month not in self.Manifest:
+                raise ValueError(f"No record with id {RecordId}")
+            Journals.setdefault(Month, []).append(dict(Entry, RecordId=LocalId))
+            if Entry.get('Fields', {}).get('DateTime'):
+                Minutes = DateTimeToMinutes(Entry['Fields']['DateTime'])
+                Partition = self.Manifest[Month]
+                if not Partition['MinTime'] <= Minutes <= Partition['MaxTime']:
+                    Partition['MinTime'] = min(Partition['MinTime'], Minutes)
+                    Partition['MaxTime'] = max(Partition['MaxTime'], Minutes)
+                    Widened = True
+        for Month, MonthEntries in Journals.items():
+            AppendJournalEntries(self.PartitionFile(Month), MonthEntries)
+        if Widened:
+            WriteManifest(self.FileName, self.Manifest)
+
+    def Update(self, Changes: Dict[int, Dict[str, str]]):
+        self.AppendJournals({RecordId: {"Op": "Update", "Fields": Fields}
+                             for RecordId, Fields in Changes.items() if Fields})
+
+    def Delete(self, RecordIds: List[int]):
+        self.AppendJournals({RecordId: {"Op": "Delete"} for RecordId in RecordIds})
+
+    @Instrumented(Rows=len)
+    def QueryRecords(self, Criteria: 'Query', MedicalTests=None) -> List[Tuple[int, str, Dict[str, str]]]:
+        if self.Store is not None:
+            return [(self.RecordIdOf(RowId), self.Store.PatientIdOf(RowId), RecordView(self.Store, RowId))
+                    for RowId in ExecuteQuery(self.Store, Criteria, MedicalTests)]
+
+        StartMinutes = MinutesSinceEpoch(Criteria.StartDate) if Criteria.StartDate is not None else MissingTime
+        EndMinutes = MinutesSinceEpoch(Criteria.EndDate) if Criteria.EndDate is not None else -MissingTime - 1
+        Matches = []
+        PatientOrder: Dict[str, int] = {}
+        for Month in self.Partitions(StartMinutes, EndMinutes):
+            # A query for one patient reads only that patient's lines, through the offset index
+            if Criteria.PatientId is not None:
+                Part, LocalIds = ReadPatientRecords(self.PartitionFile(Month), Criteria.PatientId)
+                LocalIdOf = LocalIds.__getitem__
+            else:
+                Part = ReadMedicalRecordsFromFile(self.PartitionFile(Month), UseSnapshot=self.UseSnapshot)
+                LocalIdOf = self.IdMap(Month).RecordIdOf
+            for PatientId in Part.Patients.Strings:
+                PatientOrder.setdefault(PatientId, len(PatientOrder))
+            Matches.extend((PartitionRecordId(Month, LocalIdOf(RowId)), Part.PatientIdOf(RowId), RecordView(Part, RowId))
+                           for RowId in ExecuteQuery(Part, Criteria, MedicalTests))
+        # Patient by patient across the partitions
+        Matches.sort(key=lambda Match: (PatientOrder[Match[1]], Match[0]))
+        return Matches
+
+    def Summary(self) -> Dict[str, Tuple[List, List]]:
+        Store = self.Store if self.Store is not None else self.Load()
+        return Store.GetIndex('Summary', SummaryIndex).Stats()
+
+    def IterRecords(self) -> Iterator[Tuple[str, Dict[str, str]]]:
+        if self.Store is not None:
+            yield from IterRecordPairs(self.Store)
+            return
+        for Month in self.Partitions():
+            yield from IterMedicalRecords(self.PartitionFile(Month))
+
+    def Shards(self) -> Optional[List[RecordShard]]:
+        if self.Store is not None:
+            return None
+        return [Shard for Month in self.Partitions() for Shard in FileShards(self.PartitionFile(Month))]
+
+    # Function to fold the journals of all partitions that have one into new partition files, once one
+    # of them has grown past JournalCompactionSize; the store loses its deleted rows like a flat file's
+    def Compact(self, MedicalRecords: Optional[RecordStore], Force: bool = False):
+        Journals = [Month for Month in sorted(self.Manifest) if os.path.exists(JournalFileOf(self.PartitionFile(Month)))]
+        if not Journals or not Force and all(os.path.getsize(JournalFileOf(self.PartitionFile(Month)))
+                                             < JournalCompactionSize for Month in Journals):
+            return
+        if MedicalRecords is None:
+            # Lazy mode: no rows to number again, each partition is compacted on its own
+            for Month in Journals:
+                PartitionFile = self.PartitionFile(Month)
+                Part = ReadMedicalRecordsFromFile(PartitionFile)
+                CompactMedicalRecordFile(Part, PartitionFile)
+                self.Ids.pop(Month, None)
+                self.Manifest[Month] = PartitionEntry(Part, range(Part.RowCount), os.path.getsize(PartitionFile), Month)
+            WriteManifest(self.FileName, self.Manifest)
+            return
+        if MedicalRecords is not self.Store:
+            raise ValueError("Only the store loaded from the partitions can be compacted")
+
+        Compacted = {self.Months.Encode(Month) for Month in Journals}
+        Rows: Dict[int, List[int]] = {Code: [] for Code in Compacted}
+        for RowId, Code in enumerate(self.RowPartitions):
+            if Code in Compacted and RowId not in MedicalRecords.Deleted:
+                Rows[Code].append(RowId)
+        # A partition left empty is kept, with the ids of its records dropped, so they are not reused
+        for Month in Journals:
+            PartitionRows = Rows[self.Months.Encode(Month)]
+            PartitionFile = self.PartitionFile(Month)
+            Ids = ReadRecordIdMap(PartitionFile)
+            Ids.Drop([Ids.RecordIdOf(self.RowLocals[RowId]) for RowId in self.MonthRows[self.Months.Encode(Month)]
+                      if RowId in MedicalRecords.Deleted])
+            ReplaceMedicalRecordFile(MedicalRecords, PartitionFile, PartitionRows, None, Ids)
+            self.Ids.pop(Month, None)
+            self.Manifest[Month] = PartitionEntry(MedicalRecords, PartitionRows, os.path.getsize(PartitionFile), Month)
+        WriteManifest(self.FileName, self.Manifest)
+
+        # The rows left keep their order, so they are numbered again one partition at a time
+        RowPartitions = array('H')
+        RowLocals = array('I')
+        MonthRows = [array('I') for _ in self.MonthRows]
+        for RowId, Code in enumerate(self.RowPartitions):
+            if RowId not in MedicalRecords.Deleted:
+                RowLocals.append(len(MonthRows[Code]))
+                MonthRows[Code].append(len(RowPartitions))
+                RowPartitions.append(Code)
+        self.RowPartitions = RowPartitions
+        self.RowLocals = RowLocals
+        self.MonthRows = MonthRows
+        MedicalRecords.DropDeleted()
+
+
+# Function to split a records file (with the changes in its journal) into partitions, returns the
+# number of records written. Storage is the PartitionedBackend or its directory, which must be empty.
+@Instrumented(Rows=int)
+def PartitionMedicalRecordFile(RecordsFile: str, Storage, BatchSize: int = 100000) -> int:
+    if not isinstance(Storage, PartitionedBackend):
+        Storage = PartitionedBackend(Storage)
+    if Storage.Manifest:
+        raise ValueError(f"{Storage.FileName} already holds partitions")
+    Written = 0
+    for Batch in IterMedicalRecordBatches(RecordsFile, BatchSize):
+        Storage.Append(Batch)
+        Written += len(Batch)
+    return Written
+
+
+RecordFileFormats = ('zlib', 'lzma', 'text')
+
+
+# Function to write a records file (with the changes in its journal) in another format: 'text' or a
+# compact codec. Returns the number of records written. Converting a file in place goes through a
+# compaction, so a crash leaves the old file and its journal or the new file.
+@Instrumented(Rows=int)
+def ConvertMedicalRecordFile(SourceFile: str, OutputFile: str, Format: str) -> int:
+    if Format not in RecordFileFormats:
+        raise ValueError(f"Unknown records file format {Format}, expected one of {', '.join(RecordFileFormats)}")
+    if os.path.abspath(SourceFile) == os.path.abspath(OutputFile):
+        MedicalRecords = ReadMedicalRecordsFromFile(SourceFile)
+        CompactMedicalRecordFile(MedicalRecords, SourceFile, Format)
+        Written = MedicalRecords.RowCount
+    elif Format == 'text':
+        Directory = os.path.dirname(os.path.abspath(OutputFile))
+        Written = 0
+        with tempfile.NamedTemporaryFile('w', dir=Directory, prefix='.compact-', delete=False) as file:
+            for Batch in IterMedicalRecordBatches(SourceFile):
+                file.write(''.join(FormatRecord(PatientId, record) + "\n" for PatientId, record in Batch))
+                Written += len(Batch)
+            file.flush()
+            os.fsync(file.fileno())
+        ReplaceFile(file.name, OutputFile)
+    else:
+        Written = WriteCompactRecordFile(IterMedicalRecords(SourceFile), OutputFile, Format)
+
+    # The sidecar files of the output described the file it replaced
+    for FileName in (JournalFileOf(OutputFile), OffsetIndexFileOf(OutputFile), SnapshotFileOf(OutputFile)):
+        if os.path.exists(FileName):
+            os.remove(FileName)
+    if os.path.abspath(SourceFile) != os.path.abspath(OutputFile):
+        # The records keep their ids; the ones deleted in the journal were left out
+        Ids = ReadRecordIdMap(SourceFile)
+        Ids.Drop([Entry['RecordId'] for Entry in ReadJournal(SourceFile)
+                  if Entry['Op'] == 'Delete' and Ids.PositionOf(Entry['RecordId']) is not None])
+        WriteRecordIdMap(OutputFile, Ids)
+    return Written
+
+
+# Function to get the backend for a records file name (flat file) or partition directory, or the backend itself
+def AsStorageBackend(Storage) -> StorageBackend:
+    if isinstance(Storage, StorageBackend):
+        return Storage
+    if os.path.isdir(Storage):
+        return PartitionedBackend(Storage)
+    return FlatFileBackend(Storage)
@@ -0,0 +1,83 @@
+from contextlib import redirect_stdout
+from datetime import datetime
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+RepositoryDirectory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RepositoryDirectory)
+
+from GenerateData import RecordGenerator, WriteRecordsFile, WriteTestsFile
+from Project2 import ReadMedicalTests
+from RecordColumns import FormatRecord
+from RecordFiles import ReadMedicalRecordsFromFile
+from RecordStore import RecordStore
+from QueryEngine import Query
+from StorageBackends import IterRecordPairs
+
+# Lines whose text does not survive the columns as is, and lines that cannot be read at all
+OddLines = ["1300500: Hgb, 2024-01-01 14:10, 12.50, g/dL, Completed, 2024-01-01 15:30",
+            "1300500: Hgb, 2024-1-01 14:10, 012, g/dL, Completed, 2024-01-01 15:3",
+            "1300500: Hgb, 2024-02-30 14:10, 1e3, g/dL, Pending",
+            "1300500: Hgb, 2024-01-01 14:60, 5, g/dL, Pending",
+            "1300500: Hgb, 2024-01-01 14:10, x, g/dL, Pending",
+            "not a record"]
+
+
+# Handler that drops malformed lines
+def Quiet(Offset, Line):
+    pass
+
+
+# Function to get the lines of a store, patient by patient
+def StoreLines(Store: RecordStore):
+    return [FormatRecord(PatientId, record) for PatientId, record in IterRecordPairs(Store)]
+
+
+# Function to get {record id: line} of everything a backend holds
+def BackendLines(Storage):
+    return {RecordId: FormatRecord(PatientId, record) for RecordId, PatientId, record in Storage.QueryRecords(Query())}
+
+
+# Queries a backend must answer like the store loaded from the same records
+def AgreementQueries(Store: RecordStore):
+    PatientId = Store.PatientIdOf(0)
+    return [Query(), Query(TestName='Hgb'), Query(Status='Completed'), Query(Abnormal=True),
+            Query(PatientId=PatientId), Query(PatientId=PatientId, Abnormal=True),
+            Query(StartDate=datetime(2024, 3, 1), EndDate=datetime(2024, 4, 30, 23, 59)),
+            Query(TestName='LDL', MinResult=100, MaxResult=150), Query(MinTurnaround=60, MaxTurnaround=600)]
+
+
+# Function to capture what a function prints
+def Printed(Function, *Arguments, **Options) -> str:
+    Output = io.StringIO()
+    with redirect_stdout(Output):
+        Function(*Arguments, **Options)
+    return Output.getvalue()
+
+
+# Every test gets its own directory with a generated records file and tests file
+class StorageTestCase(unittest.TestCase):
+    Rows = 2000
+    MalformedRate = 0.0
+
+    def setUp(self):
+        self.Directory = tempfile.mkdtemp()
+        self.RecordsFile = os.path.join(self.Directory, 'MedicalRecord.txt')
+        self.TestsFile = os.path.join(self.Directory, 'MedicalTests.txt')
+        WriteRecordsFile(self.RecordsFile, self.Rows, RecordGenerator(3, Rows=self.Rows, MalformedRate=self.MalformedRate))
+        WriteTestsFile(self.TestsFile)
+        self.MedicalTests = ReadMedicalTests(self.TestsFile)
+
+    def tearDown(self):
+        shutil.rmtree(self.Directory)
+
+    def Load(self, RecordsFile=None, **Options) -> RecordStore:
+        return ReadMedicalRecordsFromFile(RecordsFile or self.RecordsFile, OnMalformed=Quiet, **Options)
+
+    def AppendLines(self, Lines):
+        with open(self.RecordsFile, 'a') as file:
+            file.write('\n'.join(Lines) + '\n')
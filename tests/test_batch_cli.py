@@ -0,0 +1,57 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+from common import RepositoryDirectory, StorageTestCase, StoreLines
+
+
+class BatchCommandTests(StorageTestCase):
+    Rows = 300
+
+    # Function to run Project2.py in the test directory, returns (exit status, output)
+    def Run(self, *Arguments):
+        Finished = subprocess.run([sys.executable, os.path.join(RepositoryDirectory, 'Project2.py'), *Arguments],
+                                  cwd=self.Directory, capture_output=True, text=True, timeout=120)
+        return Finished.returncode, Finished.stdout + Finished.stderr
+
+    def testAddQueryAndUpdate(self):
+        Source = os.path.join(self.Directory, 'new.jsonl')
+        with open(Source, 'w') as file:
+            file.write(json.dumps({"PatientId": "1300500", "TestName": "Hgb", "DateTime": "2024-05-01 10:00",
+                                   "Result": "15", "Unit": "g/dL", "Status": "Pending"}) + '\n')
+            file.write(json.dumps({"PatientId": "13005", "TestName": "Hgb"}) + '\n')
+        Status, Output = self.Run('add-records', '--from', Source)
+        self.assertEqual(Status, 1)
+        self.assertIn('1 records added, 1 rejected', Output)
+
+        Status, Output = self.Run('query', '--patient', '1300500', '--with-ids')
+        self.assertEqual((Status, Output), (0, f"{self.Rows}\t1300500: Hgb, 2024-05-01 10:00, 15, g/dL, Pending\n"))
+        Status, Output = self.Run('update-status', '--ids', str(self.Rows), '--status', 'Completed',
+                                  '--completion-time', '2024-05-01 12:00')
+        self.assertEqual(Status, 0)
+        self.assertEqual(StoreLines(self.Load())[-1], "1300500: Hgb, 2024-05-01 10:00, 15, g/dL, Completed, 2024-05-01 12:00")
+
+    def testQueryMatchesStore(self):
+        Store = self.Load()
+        Status, Output = self.Run('query', '--test', 'Hgb', '--status', 'Completed')
+        self.assertEqual(Status, 0)
+        self.assertEqual(Output.splitlines(), [Line for Line in StoreLines(Store) if ': Hgb, ' in Line and
+                                               Line.split(', ')[4] == 'Completed'])
+
+    def testBadArguments(self):
+        Status, Output = self.Run('query', '--start', '2024-13-01')
+        self.assertEqual(Status, 1)
+        self.assertIn('Error', Output)
+        Status, _ = self.Run('update-status', '--ids', '1', '--status', 'Done')
+        self.assertEqual(Status, 2)
+
+    def testReportRuns(self):
+        Status, Output = self.Run('report')
+        self.assertEqual(Status, 0)
+        self.assertIn('\tHgb\t', Output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from common import RepositoryDirectory
+import Project2
+from Project2 import FormatTestLine, ParseTestLine, ReadMedicalTests
+
+
+class CatalogTests(unittest.TestCase):
+    def setUp(self):
+        self.Directory = tempfile.mkdtemp()
+        self.TestsFile = os.path.join(self.Directory, 'MedicalTests.txt')
+        shutil.copy(os.path.join(RepositoryDirectory, 'MedicalTests.txt'), self.TestsFile)
+
+    def tearDown(self):
+        shutil.rmtree(self.Directory)
+
+    def testLinesRoundTrip(self):
+        with open(self.TestsFile, 'r') as file:
+            Lines = [line.strip() for line in file if line.strip()]
+        for line in Lines + ["Name: Ferritin; Range: > 30; Unit: ng/mL, 01-00-00", "Name: Ferritin; Range: > 30; Unit: ng/mL"]:
+            self.assertEqual(FormatTestLine(ParseTestLine(line)), line)
+
+    def testPartiallyValidTestsAreKept(self):
+        test = ParseTestLine("Name: Hemoglobin (Hgb); Range: > 13.8, < 17.2; Unit: g/dL, soon")
+        self.assertEqual(test['range'], {'low': 13.8, 'high': 17.2})
+        self.assertIsNone(test['turnaround_minutes'])
+        test = ParseTestLine("Name: Hemoglobin (Hgb); Range: > high; Unit: g/dL, 00-03-04")
+        self.assertEqual(test['range'], {})
+        self.assertEqual(test['turnaround_minutes'], 184)
+        self.assertIsNone(ParseTestLine("Hemoglobin, g/dL"))
+
+    def testLookupsAndSharing(self):
+        Catalog = ReadMedicalTests(self.TestsFile)
+        self.assertIs(ReadMedicalTests(self.TestsFile), Catalog)
+        self.assertEqual(Catalog['Hgb']['unit'], 'g/dL')
+        self.assertIs(Catalog.Lookup('Hemoglobin'), Catalog['Hgb'])
+        self.assertTrue(Catalog.HasName('Hemoglobin'))
+        self.assertFalse(Catalog.HasShortName('Hemoglobin'))
+        self.assertEqual(Catalog['Hgb']['range'], {'low': 13.8, 'high': 17.2})
+
+    def testChangesOnDiskAreReadAgain(self):
+        Catalog = ReadMedicalTests(self.TestsFile)
+        with open(self.TestsFile, 'a') as file:
+            file.write("Name: Ferritin (FER); Range: > 30; Unit: ng/mL, 01-00-00\n")
+        self.assertNotIn('FER', Catalog)
+        self.assertIs(ReadMedicalTests(self.TestsFile), Catalog)
+        self.assertEqual(Catalog['FER']['turnaround_minutes'], 1440)
+
+    def testSaveKeepsLinesAsRead(self):
+        with open(self.TestsFile, 'a') as file:
+            file.write("not a test\nName: Ferritin; Range: > 30; Unit: ng/mL\n")
+        with open(self.TestsFile, 'r') as file:
+            Before = file.read()
+        Catalog = Project2.TestCatalog(self.TestsFile)  # Not imported by name, pytest would collect it
+        Catalog.Save()
+        with open(self.TestsFile, 'r') as file:
+            self.assertEqual(file.read(), Before)
+        Catalog.Append(ParseTestLine("Name: Vitamin D (VITD); Range: > 20, < 50; Unit: ng/mL, 02-00-00"))
+        self.assertEqual(Catalog['VITD']['range'], {'low': 20.0, 'high': 50.0})
+        self.assertIn('Ferritin', Catalog)
+
+
+if __name__ == '__main__':
+    unittest.main()
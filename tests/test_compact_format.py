@@ -0,0 +1,99 @@
+from unittest import mock
+import os
+import stat
+import unittest
+
+from common import BackendLines, OddLines, Printed, Quiet, StorageTestCase, StoreLines
+import CompactFormat
+import RecordFiles
+from CompactFormat import CompactRecordCodec, IsCompactRecordFile
+from Project2 import FilterRecordsByAbnormalTests
+from RecordColumns import FormatRecord
+from RecordFiles import IterMedicalRecords, ReadPatientRecords
+from StorageBackends import ConvertMedicalRecordFile, FlatFileBackend
+
+
+class CompactFormatTests(StorageTestCase):
+    MalformedRate = 0.01
+
+    def setUp(self):
+        super().setUp()
+        self.AppendLines(OddLines)
+        self.Packed = os.path.join(self.Directory, 'Packed.txt')
+
+    def testRoundTrip(self):
+        Expected = self.Load()
+        Lines = [FormatRecord(PatientId, record) for PatientId, record in IterMedicalRecords(self.RecordsFile, Quiet)]
+        for Format in ('zlib', 'lzma'):
+            Text = os.path.join(self.Directory, f'Text-{Format}.txt')
+            self.assertEqual(ConvertMedicalRecordFile(self.RecordsFile, self.Packed, Format), Expected.RowCount)
+            self.assertTrue(IsCompactRecordFile(self.Packed))
+            self.assertEqual(CompactRecordCodec(self.Packed), Format)
+            self.assertLess(os.path.getsize(self.Packed), os.path.getsize(self.RecordsFile) / 2)
+            Loaded = self.Load(self.Packed)
+            self.assertEqual(StoreLines(Loaded), StoreLines(Expected))
+            self.assertEqual(Loaded.TextOverrides, Expected.TextOverrides)
+            ConvertMedicalRecordFile(self.Packed, Text, 'text')
+            self.assertFalse(IsCompactRecordFile(Text))
+            with open(Text, 'r') as file:
+                self.assertEqual(file.read().splitlines(), Lines)
+
+    def testSmallBlocksAndShards(self):
+        with mock.patch.object(CompactFormat, 'CompactBlockRows', 100), \
+                mock.patch.object(RecordFiles, 'CompactShardRows', 300):
+            ConvertMedicalRecordFile(self.RecordsFile, self.Packed, 'zlib')
+            Storage = FlatFileBackend(self.Packed)
+            self.assertGreater(len(Storage.Shards()), 1)
+            Expected = self.Load()
+            self.assertEqual(StoreLines(self.Load(self.Packed)), StoreLines(Expected))
+            self.assertEqual(Printed(FilterRecordsByAbnormalTests, Storage, self.MedicalTests, 2),
+                             Printed(FilterRecordsByAbnormalTests, Expected, self.MedicalTests))
+            PatientId = Expected.PatientIdOf(0)
+            Part, RecordIds = ReadPatientRecords(self.Packed, PatientId)
+            self.assertEqual(RecordIds, list(Expected.RowsOf(PatientId)))
+            self.assertEqual([Part.FormatLine(RowId) for RowId in range(Part.RowCount)],
+                             [Expected.FormatLine(RowId) for RowId in Expected.RowsOf(PatientId)])
+
+    def testConvertKeepsRecordIds(self):
+        Storage = FlatFileBackend(self.RecordsFile)
+        Before = BackendLines(Storage)
+        Storage.Delete([10])
+        ConvertMedicalRecordFile(self.RecordsFile, self.Packed, 'zlib')
+        del Before[10]
+        self.assertEqual(BackendLines(FlatFileBackend(self.Packed)), Before)
+
+    def testChangesToACompactFile(self):
+        ConvertMedicalRecordFile(self.RecordsFile, self.Packed, 'lzma')
+        Storage = FlatFileBackend(self.Packed)
+        Before = BackendLines(Storage)
+        Record = {"TestName": "Hgb", "DateTime": "2024-05-01 10:00", "Result": "15", "Unit": "g/dL", "Status": "Pending"}
+        Storage.Append([('1300500', Record)])
+        Storage.Update({3: {'Result': '99.5'}})
+        Storage.Delete([4])
+        Expected = dict(Before)
+        del Expected[4]
+        Fields = Expected[3].split(', ')
+        Expected[3] = ', '.join(Fields[:2] + ['99.5'] + Fields[3:])
+        Expected[max(Before) + 1] = FormatRecord('1300500', Record)
+        self.assertEqual(BackendLines(FlatFileBackend(self.Packed)), Expected)
+        self.assertEqual(CompactRecordCodec(self.Packed), 'lzma')
+        # In place conversion goes through a compaction and keeps the ids
+        ConvertMedicalRecordFile(self.Packed, self.Packed, 'zlib')
+        self.assertEqual(CompactRecordCodec(self.Packed), 'zlib')
+        self.assertEqual(BackendLines(FlatFileBackend(self.Packed)), Expected)
+
+    def testNewFilesGetTheUmaskPermissions(self):
+        Umask = os.umask(0o027)
+        try:
+            ConvertMedicalRecordFile(self.RecordsFile, self.Packed, 'zlib')
+        finally:
+            os.umask(Umask)
+        self.assertEqual(stat.S_IMODE(os.stat(self.Packed).st_mode), 0o640)
+        # A converted file keeps the permissions of the file it replaces
+        os.chmod(self.Packed, 0o604)
+        ConvertMedicalRecordFile(self.RecordsFile, self.Packed, 'lzma')
+        self.assertEqual(stat.S_IMODE(os.stat(self.Packed).st_mode), 0o604)
+
+
+if __name__ == '__main__':
+    unittest.main()
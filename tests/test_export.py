@@ -0,0 +1,86 @@
+from unittest import mock
+import csv
+import gzip
+import os
+import unittest
+
+from common import Printed, Quiet, StorageTestCase
+import Project2
+from Project2 import ExportMedicalRecordsToCSV, FilterRecordsByQuery
+from RecordFiles import IterMedicalRecords
+from QueryEngine import Query
+
+
+class ExportTests(StorageTestCase):
+    # Function to read the rows of an exported file, header included
+    def ReadRows(self, FileName):
+        Opener = gzip.open if FileName.endswith('.gz') else open
+        with Opener(FileName, 'rt', newline='') as file:
+            return list(csv.reader(file))
+
+    def Export(self, Source, Name, **Options):
+        OutputFile = os.path.join(self.Directory, Name)
+        Written = []
+        Printed(lambda: Written.extend(ExportMedicalRecordsToCSV(Source, OutputFile, **Options)))
+        return OutputFile, Written
+
+    def Expected(self, Store):
+        Rows = [["PatientID", "TestName", "DateTime", "Result", "Unit", "Status", "CompletionTime"]]
+        for RowId in Store.IterRows():
+            record = Store.GetRecord(RowId)
+            Rows.append([Store.PatientIdOf(RowId), record['TestName'], record['DateTime'], record['Result'],
+                         record['Unit'], record['Status'],
+                         record.get('CompletionTime', '') if record['Status'] == 'Completed' else ''])
+        return Rows
+
+    def testStoreAndStreamExport(self):
+        Store = self.Load()
+        OutputFile, Written = self.Export(Store, 'records.csv')
+        self.assertEqual(Written, [OutputFile])
+        self.assertEqual(self.ReadRows(OutputFile), self.Expected(Store))
+        # The stream comes in file order, the store patient by patient
+        StreamFile, _ = self.Export(IterMedicalRecords(self.RecordsFile, Quiet), 'stream.csv')
+        Streamed = self.ReadRows(StreamFile)
+        self.assertEqual(Streamed[0], self.Expected(Store)[0])
+        self.assertEqual(sorted(Streamed[1:]), sorted(self.Expected(Store)[1:]))
+
+    def testGzip(self):
+        Store = self.Load()
+        OutputFile, Written = self.Export(Store, 'records.csv.gz')
+        self.assertEqual(self.ReadRows(OutputFile), self.Expected(Store))
+        OtherFile, _ = self.Export(Store, 'records.csv', Compress=True)
+        with gzip.open(OtherFile, 'rt', newline='') as file:
+            self.assertEqual(list(csv.reader(file)), self.Expected(Store))
+
+    def testQueryResultExport(self):
+        Store = self.Load()
+        Pairs = FilterRecordsByQuery(Store, Query(TestName='Hgb'))
+        OutputFile, _ = self.Export(Pairs, 'hgb.csv')
+        self.assertEqual(self.ReadRows(OutputFile)[1:], [Row for Row in self.Expected(Store)[1:] if Row[1] == 'Hgb'])
+
+    def testParts(self):
+        Store = self.Load()
+        Expected = self.Expected(Store)
+        for Name in ('parts.csv', 'parts.csv.gz'):
+            with mock.patch.object(Project2, 'ExportPartCheckRows', 50), mock.patch.object(Project2, 'ExportChunkSize', 120):
+                OutputFile, Written = self.Export(Store, Name, MaxPartSize=8000)
+            self.assertGreater(len(Written), 2)
+            self.assertEqual(Written[0], Project2.ExportPartFileName(OutputFile, 1))
+            Rows = [Expected[0]]
+            for FileName in Written:
+                PartRows = self.ReadRows(FileName)
+                self.assertEqual(PartRows[0], Expected[0])
+                Rows.extend(PartRows[1:])
+            self.assertEqual(Rows, Expected)
+            # A part ends at the first size check past the limit
+            for FileName in Written[:-1]:
+                self.assertGreaterEqual(os.path.getsize(FileName), 8000)
+                self.assertLess(os.path.getsize(FileName), 8000 + 50 * 100)
+        # Everything in one part keeps the name asked for
+        OutputFile, Written = self.Export(Store, 'single.csv', MaxPartSize=10 ** 9)
+        self.assertEqual(Written, [OutputFile])
+        self.assertEqual(self.ReadRows(OutputFile), Expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
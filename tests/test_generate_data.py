@@ -0,0 +1,40 @@
+import unittest
+
+from common import OddLines, StorageTestCase
+from GenerateData import MalformedLines, RecordGenerator
+from RecordFiles import ParseRecordLine
+
+
+class GenerateDataTests(StorageTestCase):
+    MalformedRate = 0.05
+
+    def testSameSeedSameRecords(self):
+        First = RecordGenerator(7, Rows=500, MalformedRate=0.05)
+        Second = RecordGenerator(7, Rows=500, MalformedRate=0.05)
+        Lines = [First.Line() for _ in range(500)]
+        self.assertEqual(Lines, [Second.Line() for _ in range(500)])
+        self.assertNotEqual(Lines, [RecordGenerator(8, Rows=500, MalformedRate=0.05).Line() for _ in range(500)])
+
+    def testRecordsAreValid(self):
+        Generator = RecordGenerator(4, Rows=2000)
+        for _ in range(2000):
+            PatientId, record = Generator.Record()
+            self.assertEqual('CompletionTime' in record, record['Status'] == 'Completed')
+            if 'CompletionTime' in record:
+                self.assertGreater(record['CompletionTime'], record['DateTime'])
+            Line = f"{PatientId}: {', '.join(record.values())}"
+            self.assertEqual(ParseRecordLine(Line), (PatientId, record))
+
+    def testMalformedLinesAreSkipped(self):
+        with open(self.RecordsFile, 'r') as file:
+            Lines = file.read().split('\n')[:-1]
+        self.assertEqual(len(Lines), self.Rows)
+        Good = [Line for Line in Lines if Line not in MalformedLines]
+        self.assertLess(len(Good), self.Rows)
+        self.assertEqual(self.Load().LiveRowCount, len(Good))
+        self.AppendLines(OddLines[-1:])
+        self.assertEqual(self.Load().LiveRowCount, len(Good))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import csv
+import os
+import unittest
+
+from common import Printed, StorageTestCase, StoreLines
+from GenerateData import RecordGenerator, WriteImportFile
+from Project2 import ImportCSVToMedicalRecord, ImportColumns
+
+
+class ImportTests(StorageTestCase):
+    def Import(self, CSVFile, Store, **Options):
+        Counts = []
+        Printed(lambda: Counts.append(ImportCSVToMedicalRecord(CSVFile, self.RecordsFile, Store, self.MedicalTests,
+                                                               **Options)))
+        return Counts[0]
+
+    def testImportTwiceAddsOnce(self):
+        CSVFile = os.path.join(self.Directory, 'lab.csv')
+        WriteImportFile(CSVFile, 500, RecordGenerator(11, Rows=500))
+        Store = self.Load()
+        Before = Store.LiveRowCount
+        Imported, Duplicates, Rejected = self.Import(CSVFile, Store, BatchSize=64)
+        self.assertEqual((Imported + Duplicates, Rejected), (500, 0))
+        self.assertGreater(Imported, 0)
+        self.assertEqual(Store.LiveRowCount, Before + Imported)
+        # The file and the live store hold the same records
+        self.assertEqual(StoreLines(self.Load()), StoreLines(Store))
+        self.assertEqual(self.Import(CSVFile, Store), (0, 500, 0))
+        self.assertEqual(self.Import(CSVFile, None), (0, 500, 0))
+
+    def testRejectedAndRepeatedRows(self):
+        CSVFile = os.path.join(self.Directory, 'lab.csv')
+        Good = ['1300500', 'Hgb', '2031-01-01 10:00', '15', 'g/dL', 'completed', '2031-01-01 12:00']
+        with open(CSVFile, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(ImportColumns)
+            writer.writerow(Good)
+            writer.writerow(Good)  # Same patient, test and DateTime
+            writer.writerow(['1300500', 'Unknown', '2031-01-01 10:00', '15', 'g/dL', 'Pending', ''])
+            writer.writerow(['1300500', 'Hgb', '2031-01-02 10:00', 'high', 'g/dL', 'Pending', ''])
+            writer.writerow(['13005', 'Hgb', '2031-01-02 10:00', '15', 'g/dL', 'Pending', ''])
+        Store = self.Load()
+        self.assertEqual(self.Import(CSVFile, Store), (1, 1, 3))
+        self.assertEqual(Store.FormatLine(Store.RowCount - 1),
+                         '1300500: Hgb, 2031-01-01 10:00, 15, g/dL, Completed, 2031-01-01 12:00')
+
+    def testMissingColumns(self):
+        CSVFile = os.path.join(self.Directory, 'lab.csv')
+        with open(CSVFile, 'w') as file:
+            file.write('Patient ID,Test Name\n1300500,Hgb\n')
+        self.assertEqual(self.Import(CSVFile, self.Load()), (0, 0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+from datetime import datetime
+import unittest
+
+from common import StorageTestCase
+from Project2 import FilterByStatus, FilterByTestName, FilterRecordsByDates
+from RecordColumns import MinutesSinceEpoch
+from RecordStore import RecordStore
+
+
+class SecondaryIndexTests(StorageTestCase):
+    Start = MinutesSinceEpoch(datetime(2024, 3, 1))
+    End = MinutesSinceEpoch(datetime(2024, 4, 15, 23, 59))
+
+    def assertIndexesMatchColumns(self, Store: RecordStore):
+        Live = [RowId for RowId in range(Store.RowCount) if RowId not in Store.Deleted]
+        for TestName in Store.Tests.Strings:
+            self.assertEqual(list(Store.RowsWithTest(TestName)),
+                             [RowId for RowId in Live if Store.GetField(RowId, 'TestName') == TestName], TestName)
+        for Status in Store.Statuses.Strings:
+            self.assertEqual(list(Store.RowsWithStatus(Status)),
+                             [RowId for RowId in Live if Store.GetField(RowId, 'Status') == Status], Status)
+        self.assertEqual(sorted(Store.RowsBetween(self.Start, self.End)),
+                         [RowId for RowId in Live if self.Start <= Store.DateTimes[RowId] <= self.End])
+
+    def testIndexesFollowChanges(self):
+        Store = self.Load()
+        self.assertIndexesMatchColumns(Store)
+        Store.SetField(3, 'TestName', 'LDL')
+        Store.SetField(5, 'Status', 'Reviewed')
+        Store.SetField(8, 'DateTime', '2024-03-02 10:00')
+        Store.DeleteRow(11)
+        Store.AppendRecords([('1300500', {"TestName": "Hgb", "DateTime": "2024-04-01 10:00", "Result": "15",
+                                          "Unit": "g/dL", "Status": "Pending"})] * 3)
+        Store.AppendRecord('1300501', {"TestName": "NEW", "DateTime": "2024-03-01 00:00", "Result": "1",
+                                       "Unit": "mg/dL", "Status": "Completed", "CompletionTime": "2024-03-01 01:00"})
+        self.assertIndexesMatchColumns(Store)
+        self.assertEqual(len(Store.RowsWithTest('Missing')), 0)
+
+    def testFiltersMatchRecordLoops(self):
+        Store = self.Load()
+        Pairs = [(PatientId, record) for PatientId, Records in Store.items() for record in Records]
+        self.assertEqual(FilterByTestName(Store, 'Hgb'),
+                         [(PatientId, record) for PatientId, record in Pairs if record['TestName'] == 'Hgb'])
+        self.assertEqual(FilterByStatus(Store, 'Pending'),
+                         [(PatientId, record) for PatientId, record in Pairs if record['Status'] == 'Pending'])
+        Found = FilterRecordsByDates(Store, datetime(2024, 3, 1), datetime(2024, 4, 15))
+        self.assertEqual(Found, [(PatientId, record) for PatientId, record in Pairs
+                                 if '2024-03-01 00:00' <= record['DateTime'] <= '2024-04-15 23:59'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+from unittest import mock
+import os
+import stat
+import unittest
+
+from common import BackendLines, Printed, Quiet, StorageTestCase
+import RecordFiles
+from Project2 import UpdateRecord
+from RecordColumns import FormatRecord
+from RecordFiles import IterMedicalRecords, ParseRecordLine, ReplaceMedicalRecordFile
+from RecordJournal import JournalFileOf, ReadRecordIdMap, RecordIdFileOf
+from RecordStore import RecordView
+from StorageBackends import FlatFileBackend
+
+
+class JournalTests(StorageTestCase):
+    def testReplayAppliesUpdatesAndDeletes(self):
+        Storage = FlatFileBackend(self.RecordsFile)
+        Storage.Update({5: {'Status': 'Reviewed', 'CompletionTime': ''}, 9: {'Result': '12.50'}})
+        Storage.Delete([7])
+        Store = self.Load()
+        self.assertEqual(RecordView(Store, 5)['Status'], 'Reviewed')
+        self.assertNotIn('CompletionTime', RecordView(Store, 5))
+        self.assertEqual(RecordView(Store, 9)['Result'], '12.50')
+        self.assertIn(7, Store.Deleted)
+        # Streaming applies the journal the same way, in file order
+        Streamed = [FormatRecord(PatientId, record) for PatientId, record in IterMedicalRecords(self.RecordsFile, Quiet)]
+        self.assertEqual(Streamed, [Store.FormatLine(RowId) for RowId in range(Store.RowCount) if RowId not in Store.Deleted])
+
+    def testCompactionKeepsRecordIds(self):
+        Storage = FlatFileBackend(self.RecordsFile)
+        Before = BackendLines(Storage)
+        Store = Storage.Load()
+        Deleted = [0, 1, 2, 500, 1999]
+        Storage.Delete(Deleted)
+        for RecordId in Deleted:
+            Store.DeleteRow(RecordId)
+        Storage.Compact(Store, Force=True)
+        self.assertFalse(os.path.exists(JournalFileOf(self.RecordsFile)))
+        self.assertTrue(os.path.exists(RecordIdFileOf(self.RecordsFile)))
+
+        Storage = FlatFileBackend(self.RecordsFile)
+        After = BackendLines(Storage)
+        self.assertEqual(After, {RecordId: Line for RecordId, Line in Before.items() if RecordId not in Deleted})
+        self.assertIsNone(Storage.RowIdOf(500))
+        # An id printed before the compaction still addresses its record
+        Storage.Update({501: {'Status': 'Reviewed', 'CompletionTime': ''}})
+        self.assertTrue(BackendLines(FlatFileBackend(self.RecordsFile))[501].endswith('Reviewed'))
+        # Lazy reads of one patient give the same ids
+        PatientId = Before[501].split(':')[0]
+        _, RecordIds = Storage.LoadPatient(PatientId)
+        self.assertEqual(RecordIds, [RecordId for RecordId, Line in After.items() if Line.startswith(PatientId + ':')])
+        # New records never reuse a dropped id
+        Storage.Append([ParseRecordLine(Before[0])])
+        self.assertEqual(max(BackendLines(FlatFileBackend(self.RecordsFile))), 2000)
+
+    def testInterruptedCompactionRecoversIds(self):
+        Storage = FlatFileBackend(self.RecordsFile)
+        Before = BackendLines(Storage)
+        Storage.Delete([3, 4])
+        Store = self.Load()
+        Ids = ReadRecordIdMap(self.RecordsFile)
+        Ids.Drop([3, 4])
+        Rows = (RowId for RowId in range(Store.RowCount) if RowId not in Store.Deleted)
+        # Stop after the records file was replaced, before the dropped ids were saved
+        with mock.patch.object(RecordFiles, 'WriteRecordIdMap', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                ReplaceMedicalRecordFile(Store, self.RecordsFile, Rows, None, Ids)
+        self.assertFalse(os.path.exists(RecordIdFileOf(self.RecordsFile)))
+        self.assertEqual(BackendLines(FlatFileBackend(self.RecordsFile)),
+                         {RecordId: Line for RecordId, Line in Before.items() if RecordId not in (3, 4)})
+        self.assertTrue(os.path.exists(RecordIdFileOf(self.RecordsFile)))
+
+    def testCompactionKeepsPermissions(self):
+        os.chmod(self.RecordsFile, 0o664)
+        Storage = FlatFileBackend(self.RecordsFile)
+        Storage.Delete([1])
+        Storage.Compact(Storage.Load(), Force=True)
+        self.assertEqual(stat.S_IMODE(os.stat(self.RecordsFile).st_mode), 0o664)
+
+    def testMenuDeleteOnlyAppendsToTheJournal(self):
+        Store = self.Load()
+        PatientId = Store.PatientIdOf(0)
+        with open(self.RecordsFile, 'rb') as file:
+            Content = file.read()
+        with mock.patch('builtins.input', side_effect=[PatientId, '1', '5', 'yes']):
+            Printed(UpdateRecord, Store, self.MedicalTests, self.RecordsFile)
+        with open(self.RecordsFile, 'rb') as file:
+            self.assertEqual(file.read(), Content)
+        self.assertTrue(os.path.exists(JournalFileOf(self.RecordsFile)))
+        self.assertIn(0, Store.Deleted)
+        self.assertIn(0, self.Load().Deleted)
+
+    def testMenuUpdateWithoutLoadedRecords(self):
+        PatientId = self.Load().PatientIdOf(0)
+        with mock.patch('builtins.input', side_effect=[PatientId, '1', '2', '12.50', '4']):
+            Printed(UpdateRecord, None, self.MedicalTests, self.RecordsFile)
+        self.assertEqual(RecordView(self.Load(), 0)['Result'], '12.50')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+from contextlib import redirect_stdout
+from unittest import mock
+import io
+import os
+import subprocess
+import sys
+import unittest
+
+from common import OddLines, Printed, RepositoryDirectory, StorageTestCase
+import RecordFiles
+from Project2 import PrintPatientHistory
+from RecordFiles import OffsetIndexFileOf, ReadOffsetIndex, ReadPatientRecords, UpdateOffsetIndex
+from RecordJournal import ReadRecordIdMap
+from StorageBackends import FlatFileBackend
+
+
+class OffsetIndexTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.AppendLines(OddLines)
+
+    # Function to check ReadPatientRecords against the loaded store for a few patients
+    def assertPatientsRead(self, PatientIds=None):
+        Store = self.Load()
+        Ids = ReadRecordIdMap(self.RecordsFile)
+        for PatientId in PatientIds or Store.Patients.Strings[:30] + ['1300500', '0000000']:
+            Part, RecordIds = ReadPatientRecords(self.RecordsFile, PatientId)
+            self.assertEqual(RecordIds, [Ids.RecordIdOf(RowId) for RowId in Store.RowsOf(PatientId)], PatientId)
+            self.assertEqual([Part.FormatLine(RowId) for RowId in range(Part.RowCount)],
+                             [Store.FormatLine(RowId) for RowId in Store.RowsOf(PatientId)], PatientId)
+
+    def testPatientReadsMatchLoadedStore(self):
+        self.assertFalse(os.path.exists(OffsetIndexFileOf(self.RecordsFile)))
+        self.assertPatientsRead()
+        self.assertTrue(os.path.exists(OffsetIndexFileOf(self.RecordsFile)))
+        Metadata, Entries = ReadOffsetIndex(OffsetIndexFileOf(self.RecordsFile))
+        self.assertEqual(Metadata['Rows'], self.Load().RowCount)
+        self.assertEqual(sum(len(RowIds) for _, RowIds in Entries.values()), Metadata['Rows'])
+
+    def testAppendedLinesAndJournal(self):
+        self.assertPatientsRead()
+        Size = ReadOffsetIndex(OffsetIndexFileOf(self.RecordsFile))[0]['Size']
+        Store = self.Load()
+        PatientId = Store.PatientIdOf(0)
+        self.AppendLines([f"{PatientId}: Hgb, 2024-06-01 10:00, 15, g/dL, Pending", "1300500: LDL, 2024-06-01 10:00, x"])
+        # A small tail is scanned, the index is left as it is
+        self.assertPatientsRead([PatientId, '1300500'])
+        self.assertEqual(ReadOffsetIndex(OffsetIndexFileOf(self.RecordsFile))[0]['Size'], Size)
+        self.assertEqual(UpdateOffsetIndex(self.RecordsFile), Store.RowCount + 1)
+        self.assertEqual(ReadOffsetIndex(OffsetIndexFileOf(self.RecordsFile))[0]['Size'],
+                         os.path.getsize(self.RecordsFile))
+        Storage = FlatFileBackend(self.RecordsFile)
+        Storage.Update({Store.RowsOf(PatientId)[0]: {'Result': '99.5'}})
+        Storage.Delete([Store.RowsOf(PatientId)[-1]])
+        self.assertPatientsRead([PatientId])
+
+    def testRewrittenFileRebuildsTheIndex(self):
+        self.assertPatientsRead()
+        Store = self.Load()
+        Storage = FlatFileBackend(self.RecordsFile)
+        with redirect_stdout(io.StringIO()):
+            Loaded = Storage.Load()
+        Storage.Delete([0, 1, 2])
+        for RowId in (0, 1, 2):
+            Loaded.DeleteRow(RowId)
+        Storage.Compact(Loaded, Force=True)
+        self.assertEqual(ReadRecordIdMap(self.RecordsFile).RecordIdOf(0), 3)
+        self.assertPatientsRead(Store.Patients.Strings[:30])
+
+    def testParallelBuildMatches(self):
+        UpdateOffsetIndex(self.RecordsFile)
+        Expected = ReadOffsetIndex(OffsetIndexFileOf(self.RecordsFile))[1]
+        os.remove(OffsetIndexFileOf(self.RecordsFile))
+        with mock.patch.object(RecordFiles, 'ParallelLoadMinimumSize', 0):
+            UpdateOffsetIndex(self.RecordsFile, Workers=2)
+        self.assertEqual(ReadOffsetIndex(OffsetIndexFileOf(self.RecordsFile))[1], Expected)
+
+
+class LazyCommandTests(StorageTestCase):
+    Rows = 300
+
+    # Function to run Project2.py in the test directory with its standard input, returns the output
+    def Run(self, *Arguments, Input=None):
+        Finished = subprocess.run([sys.executable, os.path.join(RepositoryDirectory, 'Project2.py'), *Arguments],
+                                  cwd=self.Directory, input=Input, capture_output=True, text=True, timeout=120)
+        self.assertEqual(Finished.returncode, 0, Finished.stderr)
+        return Finished.stdout
+
+    def testHistoryAndQueryMatchLoadedStore(self):
+        Store = self.Load()
+        PatientId = max(Store.Patients.Strings, key=lambda PatientId: len(Store.RowsOf(PatientId)))
+        self.assertEqual(self.Run('history', '--patient', PatientId, '--last', '2'),
+                         Printed(PrintPatientHistory, Store, PatientId, Last=2))
+        self.assertEqual(self.Run('query', '--patient', PatientId).splitlines(),
+                         [Store.FormatLine(RowId) for RowId in Store.RowsOf(PatientId)])
+        self.assertTrue(os.path.exists(OffsetIndexFileOf(self.RecordsFile)))
+
+    def testLazyMenuMatchesLoadedMenu(self):
+        PatientId = self.Load().PatientIdOf(0)
+        Input = f"12\n{PatientId}\n\n\n12\n{PatientId}\nHgb\n1\n5\n7\n0\n"
+        self.assertEqual(self.Run('--lazy', Input=Input), self.Run(Input=Input))
+
+
+if __name__ == '__main__':
+    unittest.main()
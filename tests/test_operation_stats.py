@@ -0,0 +1,100 @@
+from unittest import mock
+import json
+import os
+import tracemalloc
+import unittest
+
+from common import Printed, StorageTestCase
+import OperationStats
+from OperationStats import (CountOperationRows, ExportOperationStats, HistogramBounds, Instrumented, Operation,
+                            OperationStatistics, PrintOperationStats)
+from Project2 import FilterByStatus, FilterByTestName
+
+
+class OperationStatsTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        Patcher = mock.patch.dict(OperationStatistics, clear=True)
+        Patcher.start()
+        self.addCleanup(Patcher.stop)
+
+    def testInstrumentedFunctionsCountCallsAndRows(self):
+        Store = self.Load()
+        Rows = len(FilterByTestName(Store, 'Hgb')) + len(FilterByTestName(Store, 'LDL'))
+        FilterByStatus(Store, 'Pending')
+        self.assertEqual(OperationStatistics['ReadMedicalRecordsFromFile'].Rows, Store.LiveRowCount)
+        Stats = OperationStatistics['FilterByTestName']
+        self.assertEqual((Stats.Calls, Stats.Rows), (2, Rows))
+        self.assertEqual(sum(Stats.WallHistogram), 2)
+        self.assertEqual(sum(Stats.CPUHistogram), 2)
+        self.assertEqual(OperationStatistics['FilterByStatus'].Calls, 1)
+        self.assertIsNone(Stats.PeakMemory)
+
+    def testNestedOperations(self):
+        @Instrumented(Rows=len)
+        def Inner(Count):
+            CountOperationRows(1)
+            return [None] * Count
+
+        with Operation('Outer') as Current:
+            Inner(3)
+            Inner(4)
+            CountOperationRows(5)
+            self.assertEqual(Current.Rows, 5)
+        CountOperationRows(6)  # Outside of any operation nothing is counted
+        self.assertEqual(OperationStatistics['Outer'].Rows, 5)
+        InnerStats = OperationStatistics[Inner.__qualname__]
+        self.assertEqual((InnerStats.Calls, InnerStats.Rows), (2, 9))
+        self.assertGreaterEqual(OperationStatistics['Outer'].WallTime, InnerStats.WallTime)
+
+    def testPeakMemoryIncludesInnerOperations(self):
+        tracemalloc.start()
+        try:
+            with Operation('Outer'):
+                with Operation('Inner'):
+                    Block = bytearray(4 * 2**20)
+                    del Block
+        finally:
+            tracemalloc.stop()
+        self.assertGreaterEqual(OperationStatistics['Inner'].PeakMemory, 4 * 2**20)
+        self.assertGreaterEqual(OperationStatistics['Outer'].PeakMemory, 4 * 2**20)
+
+    def testHistogramBuckets(self):
+        Stats = OperationStats.OperationStats('Test')
+        Stats.Record(0.0005, 0.0, 1, None)
+        Stats.Record(0.001, 0.003, 1, 10)
+        Stats.Record(1000.0, 0.003, 1, 5)
+        self.assertEqual(Stats.WallHistogram[0], 2)
+        self.assertEqual(Stats.WallHistogram[-1], 1)
+        self.assertEqual(Stats.CPUHistogram[HistogramBounds.index(0.005)], 2)
+        self.assertEqual(Stats.PeakMemory, 10)
+
+    def testPrintAndExport(self):
+        self.assertIn("No operations timed yet.", Printed(PrintOperationStats))
+        Store = self.Load()
+        FilterByTestName(Store, 'Hgb')
+        Report = Printed(PrintOperationStats)
+        self.assertIn('FilterByTestName', Report)
+        self.assertIn('ReadMedicalRecordsFromFile', Report)
+        OutputFile = os.path.join(self.Directory, 'Stats.json')
+        ExportOperationStats(OutputFile)
+        with open(OutputFile, 'r') as file:
+            Exported = json.load(file)
+        self.assertEqual(Exported['FilterByTestName']['calls'], 1)
+        self.assertEqual(Exported['ReadMedicalRecordsFromFile']['rows'], Store.LiveRowCount)
+        self.assertEqual(sum(Exported['FilterByTestName']['wall_histogram'].values()), 1)
+
+    def testProfileDumps(self):
+        Directory = os.path.join(self.Directory, 'profiles')
+        with mock.patch.object(OperationStats, 'ProfileDirectory', Directory), \
+                mock.patch.object(OperationStats, '_ProfileCount', OperationStats.Counter()):
+            with Operation('Outer'):
+                with Operation('Inner'):
+                    pass
+            with Operation('Outer'):
+                pass
+        self.assertEqual(sorted(os.listdir(Directory)), ['Outer-0001.prof', 'Outer-0002.prof'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+from unittest import mock
+import unittest
+
+from common import OddLines, StorageTestCase, StoreLines
+import RecordFiles
+from RecordFiles import SplitFileByLines
+
+
+class ParallelLoadTests(StorageTestCase):
+    MalformedRate = 0.01
+
+    def testRangesEndOnLines(self):
+        with open(self.RecordsFile, 'rb') as file:
+            Content = file.read()
+        Ranges = SplitFileByLines(self.RecordsFile, 7)
+        self.assertEqual(Ranges[0][0], 0)
+        self.assertEqual(Ranges[-1][1], len(Content))
+        for (_, End), (Start, _) in zip(Ranges, Ranges[1:]):
+            self.assertEqual(End, Start)
+            self.assertEqual(Content[Start - 1:Start], b'\n')
+
+    def testWorkersGiveTheSameStore(self):
+        self.AppendLines(OddLines)
+        Malformed = []
+        Expected = self.Load()
+        with mock.patch.object(RecordFiles, 'ParallelLoadMinimumSize', 0):
+            Store = RecordFiles.ReadMedicalRecordsFromFile(self.RecordsFile, lambda *Line: Malformed.append(Line),
+                                                           Workers=3)
+        self.assertEqual(StoreLines(Store), StoreLines(Expected))
+        self.assertEqual(Store.TextOverrides, Expected.TextOverrides)
+        self.assertEqual([Line for _, Line in Malformed][-1], 'not a record')
+        self.assertEqual([Offset for Offset, _ in Malformed], sorted(Offset for Offset, _ in Malformed))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+from datetime import datetime
+from unittest import mock
+import os
+import unittest
+
+from common import AgreementQueries, BackendLines, StorageTestCase
+import StorageBackends
+from RecordColumns import FormatRecord, MinutesSinceEpoch
+from QueryEngine import Query, RunQuery
+from StorageBackends import PartitionedBackend, PartitionMedicalRecordFile
+
+
+class PartitionTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.Partitions = os.path.join(self.Directory, 'Partitions')
+        self.Written = PartitionMedicalRecordFile(self.RecordsFile, self.Partitions, BatchSize=300)
+
+    def testPartitionsAgreeWithStore(self):
+        Store = self.Load()
+        self.assertEqual(self.Written, Store.LiveRowCount)
+        Loaded = PartitionedBackend(self.Partitions)
+        Loaded.Load()
+        for Storage in (PartitionedBackend(self.Partitions), Loaded):
+            for Criteria in AgreementQueries(Store):
+                Found = sorted(FormatRecord(PatientId, record)
+                               for _, PatientId, record in Storage.QueryRecords(Criteria, self.MedicalTests))
+                Expected = sorted(Store.FormatLine(RowId) for RowId in RunQuery(Store, Criteria, self.MedicalTests))
+                self.assertEqual(Found, Expected, Criteria)
+        with self.assertRaises(ValueError):
+            PartitionMedicalRecordFile(self.RecordsFile, self.Partitions)
+
+    def testPartitionsHoldTheirMonths(self):
+        Storage = PartitionedBackend(self.Partitions)
+        self.assertEqual(Storage.RecordCount(), self.Written)
+        for Month in Storage.Partitions():
+            with open(Storage.PartitionFile(Month), 'r') as file:
+                self.assertTrue(all(Line.split(', ')[1].startswith(Month) for Line in file))
+        Start, End = MinutesSinceEpoch(datetime(2024, 3, 10)), MinutesSinceEpoch(datetime(2024, 4, 2))
+        self.assertEqual(Storage.Partitions(Start, End), ['2024-03', '2024-04'])
+        # A period query reads only the partitions that overlap it
+        Read = []
+        Reader = StorageBackends.ReadMedicalRecordsFromFile
+        with mock.patch.object(StorageBackends, 'ReadMedicalRecordsFromFile',
+                               lambda File, **Options: Read.append(os.path.basename(File)) or Reader(File, **Options)):
+            Storage.QueryRecords(Query(StartDate=datetime(2024, 3, 10), EndDate=datetime(2024, 4, 2)))
+        self.assertEqual(Read, ['2024-03.txt', '2024-04.txt'])
+
+    def testPartitionIdsSurviveInsertsAndCompaction(self):
+        Storage = PartitionedBackend(self.Partitions)
+        Before = BackendLines(Storage)
+        Store = Storage.Load()
+        Deleted = sorted(Before)[:3]
+        Storage.Delete(Deleted)
+        for RecordId in Deleted:
+            Store.DeleteRow(Storage.RowIdOf(RecordId))
+        Storage.Compact(Store, Force=True)
+        # A record added to the first month does not move the ids of the later ones
+        Storage.Append([("1300500", {"TestName": "Hgb", "DateTime": "2024-01-01 00:00", "Result": "15",
+                                     "Unit": "g/dL", "Status": "Pending"})])
+        After = BackendLines(PartitionedBackend(self.Partitions))
+        self.assertEqual({RecordId: Line for RecordId, Line in After.items() if RecordId in Before},
+                         {RecordId: Line for RecordId, Line in Before.items() if RecordId not in Deleted})
+        self.assertEqual(len(After), len(Before) - len(Deleted) + 1)
+
+    def testJournaledChangesAndLazyCompaction(self):
+        Storage = PartitionedBackend(self.Partitions)
+        Before = BackendLines(Storage)
+        Changed, Deleted = sorted(Before)[5], sorted(Before)[-1]
+        Storage.Update({Changed: {'Result': '99.5'}})
+        Storage.Delete([Deleted])
+        Expected = dict(Before)
+        del Expected[Deleted]
+        Fields = Expected[Changed].split(', ')
+        Expected[Changed] = ', '.join(Fields[:2] + ['99.5'] + Fields[3:])
+        self.assertEqual(BackendLines(PartitionedBackend(self.Partitions)), Expected)
+        Storage.Compact(None, Force=True)
+        self.assertEqual(BackendLines(PartitionedBackend(self.Partitions)), Expected)
+        self.assertEqual(PartitionedBackend(self.Partitions).RecordCount(), len(Expected))
+
+    def testLoadPatient(self):
+        Store = self.Load()
+        PatientId = Store.PatientIdOf(0)
+        Expected = sorted(Store.FormatLine(RowId) for RowId in Store.RowsOf(PatientId))
+        Storage = PartitionedBackend(self.Partitions)
+        for _ in range(2):
+            Part, RecordIds = Storage.LoadPatient(PatientId)
+            self.assertEqual(sorted(Part.FormatLine(RowId) for RowId in range(Part.RowCount)), Expected)
+            Lines = BackendLines(Storage)
+            self.assertEqual([Lines[RecordId] for RecordId in RecordIds],
+                             [Part.FormatLine(RowId) for RowId in range(Part.RowCount)])
+            Storage.Load()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+from datetime import datetime
+from unittest import mock
+import unittest
+
+from common import Printed, StorageTestCase
+import RecordIndexes
+from Project2 import PrintPatientHistory
+from RecordColumns import MinutesSinceEpoch, MissingTime
+
+
+class PatientHistoryTests(StorageTestCase):
+    # Function to get a patient's history by checking every row
+    def Expected(self, Store, PatientId, TestName=None, StartMinutes=MissingTime, EndMinutes=-MissingTime - 1,
+                 Last=None):
+        Rows = {}
+        for RowId in Store.IterRows():
+            if Store.PatientIdOf(RowId) == PatientId and TestName in (None, Store.GetField(RowId, 'TestName')) \
+                    and StartMinutes <= Store.DateTimes[RowId] <= EndMinutes:
+                Rows.setdefault(Store.GetField(RowId, 'TestName'), []).append(RowId)
+        Found = []
+        for TestRows in Rows.values():
+            TestRows.sort(key=lambda RowId: (Store.DateTimes[RowId], RowId))
+            Found.extend(TestRows[-Last:] if Last is not None else TestRows)
+        return sorted(Found, key=lambda RowId: (Store.DateTimes[RowId], RowId))
+
+    def assertHistories(self, Store):
+        Start, End = MinutesSinceEpoch(datetime(2024, 3, 1)), MinutesSinceEpoch(datetime(2024, 8, 31, 23, 59))
+        for PatientId in Store.Patients.Strings[:40]:
+            for TestName in (None, 'Hgb', 'LDL'):
+                self.assertEqual(Store.PatientHistory(PatientId, TestName), self.Expected(Store, PatientId, TestName))
+                self.assertEqual(Store.PatientHistory(PatientId, TestName, Start, End),
+                                 self.Expected(Store, PatientId, TestName, Start, End))
+                self.assertEqual(Store.PatientHistory(PatientId, TestName, Start, End, Last=2),
+                                 self.Expected(Store, PatientId, TestName, Start, End, 2))
+                if TestName is not None:
+                    Rows = self.Expected(Store, PatientId, TestName)
+                    self.assertEqual(Store.LatestRow(PatientId, TestName), Rows[-1] if Rows else None)
+
+    def testHistoryMatchesRows(self):
+        self.assertHistories(self.Load())
+        with mock.patch.object(RecordIndexes, 'np', None):
+            self.assertHistories(self.Load())
+
+    def testHistoryFollowsChanges(self):
+        Store = self.Load()
+        Store.PatientHistory(Store.PatientIdOf(0))
+        PatientId = Store.PatientIdOf(0)
+        for RowId in Store.RowsOf(PatientId)[:3]:
+            Store.SetField(RowId, 'DateTime', '2025-06-01 10:00')
+        Store.DeleteRow(Store.RowsOf(PatientId)[-1])
+        Store.SetField(Store.RowsOf(PatientId)[0], 'TestName', 'TSH')
+        for Day in (2, 1, 3):
+            Store.AppendRecord(PatientId, {'TestName': 'Hgb', 'DateTime': f'2024-01-0{Day} 08:00', 'Result': '14',
+                                           'Unit': 'g/dL', 'Status': 'Pending'})
+        Store.AppendRecord('1999999', {'TestName': 'LDL', 'DateTime': '2024-05-05 08:00', 'Result': '140',
+                                       'Unit': 'mg/dL', 'Status': 'Pending'})
+        self.assertHistories(Store)
+        self.assertEqual(Store.PatientHistory('1999999'), [Store.RowCount - 1])
+        self.assertEqual(Store.PatientHistory('0000000'), [])
+        self.assertEqual(Store.PatientHistory(PatientId, 'Unknown'), [])
+        self.assertIsNone(Store.LatestRow(PatientId, 'Unknown'))
+
+    def testPrintPatientHistory(self):
+        Store = self.Load()
+        PatientId = max(Store.Patients.Strings, key=lambda PatientId: len(Store.RowsOf(PatientId)))
+        Output = Printed(PrintPatientHistory, Store, PatientId, Last=1)
+        TestNames = sorted({Store.GetField(RowId, 'TestName') for RowId in Store.RowsOf(PatientId)})
+        for TestName in TestNames:
+            Latest = Store.GetRecord(Store.LatestRow(PatientId, TestName))
+            self.assertIn(f" {TestName}: latest {Latest['Result']} {Latest['Unit']} on {Latest['DateTime']}", Output)
+        self.assertEqual(Output.count('\n   '), len(TestNames))
+        Output = Printed(PrintPatientHistory, Store, PatientId, 'Hgb', datetime(2024, 3, 1), datetime(2024, 8, 31))
+        Rows = self.Expected(Store, PatientId, 'Hgb', MinutesSinceEpoch(datetime(2024, 3, 1)),
+                             MinutesSinceEpoch(datetime(2024, 8, 31, 23, 59)))
+        self.assertTrue(Rows)
+        self.assertEqual([Line.split(', ')[0].strip() for Line in Output.split('\n') if Line.startswith('   ')],
+                         [Store.GetField(RowId, 'DateTime') for RowId in Rows])
+        self.assertEqual(Printed(PrintPatientHistory, Store, PatientId, 'Unknown'),
+                         f"No Unknown records found for Patient ID {PatientId}.\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+from unittest import mock
+import math
+import random
+import statistics
+import unittest
+
+from common import StorageTestCase
+import RecordIndexes
+from RecordIndexes import QuantileIndex, QuantileSketch
+
+Percentiles = [Percent / 100 for Percent in range(1, 100)]
+
+
+# Function to get a sketch of the values, added one by one or in blocks
+def Sketched(Values, Block=None, **Options) -> QuantileSketch:
+    Sketch = QuantileSketch(**Options)
+    if Block is None:
+        for Value in Values:
+            Sketch.Add(Value)
+    else:
+        for Start in range(0, len(Values), Block):
+            Sketch.Extend(Values[Start:Start + Block])
+    return Sketch
+
+
+class QuantileSketchTests(unittest.TestCase):
+    def setUp(self):
+        Random = random.Random(11)
+        self.Samples = {'lognormal': [Random.lognormvariate(3, 1) for _ in range(20000)],
+                        'results': [round(Random.gauss(1.0, 0.3), 2) for _ in range(20000)],
+                        'signed': [Random.gauss(0, 50) for _ in range(5000)] + [0.0] * 100}
+
+    # The sketch answers with a value within Accuracy of an order statistic next to the one
+    # statistics.quantiles interpolates between
+    def assertWithinBound(self, Sketch: QuantileSketch, Values, Accuracy=0.01):
+        Sorted = sorted(Values)
+        Last = len(Sorted) - 1
+        References = statistics.quantiles(Values, n=100, method='inclusive')
+        for Q, Reference, Estimate in zip(Percentiles, References, Sketch.Quantiles(Percentiles)):
+            Rank = Q * Last
+            Low, High = Sorted[max(math.floor(Rank) - 1, 0)], Sorted[min(math.ceil(Rank) + 1, Last)]
+            self.assertTrue(Low - 1e-9 <= Reference <= High + 1e-9)
+            self.assertGreaterEqual(Estimate, Low - Accuracy * abs(Low) - 1e-9, (Q, Reference))
+            self.assertLessEqual(Estimate, High + Accuracy * abs(High) + 1e-9, (Q, Reference))
+
+    def testErrorBound(self):
+        for Name, Values in self.Samples.items():
+            with self.subTest(Name):
+                self.assertWithinBound(Sketched(Values), Values)
+                self.assertWithinBound(Sketched(Values, 3000), Values)
+                self.assertWithinBound(Sketched(Values, Accuracy=0.05), Values, 0.05)
+
+    def testSmallSketchesAreExact(self):
+        Values = self.Samples['lognormal'][:1000]
+        Sketch = Sketched(Values)
+        self.assertIsNotNone(Sketch.Values)
+        Sorted = sorted(Values)
+        self.assertEqual(Sketch.Quantiles(Percentiles), [Sorted[math.ceil(Q * len(Sorted)) - 1] for Q in Percentiles])
+        self.assertEqual((Sketch.Quantile(0), Sketch.Quantile(1)), (Sorted[0], Sorted[-1]))
+        self.assertEqual(QuantileSketch().Quantiles([0.5, 0.9]), [None, None])
+
+    def testMergeAndOrderIndependence(self):
+        for Name, Values in self.Samples.items():
+            with self.subTest(Name):
+                Expected = Sketched(Values)
+                Shuffled = Values[:]
+                random.Random(2).shuffle(Shuffled)
+                Merged = QuantileSketch()
+                for Start in range(0, len(Shuffled), 700):
+                    Merged.Merge(Sketched(Shuffled[Start:Start + 700], 100))
+                Merged.Merge(QuantileSketch())
+                for Sketch in (Sketched(Shuffled), Sketched(Shuffled, 5000), Merged):
+                    self.assertEqual(Sketch.Buckets, Expected.Buckets)
+                    self.assertEqual(Sketch.Quantiles(Percentiles), Expected.Quantiles(Percentiles))
+                    self.assertEqual((Sketch.Count, Sketch.Min, Sketch.Max), (len(Values), min(Values), max(Values)))
+                    self.assertAlmostEqual(Sketch.Sum, math.fsum(Values), delta=1e-6 * math.fsum(map(abs, Values)))
+
+    def testHistogram(self):
+        Values = self.Samples['results']
+        for Sketch in (Sketched(Values[:500]), Sketched(Values)):
+            Bins = Sketch.Histogram(8)
+            self.assertEqual(len(Bins), 8)
+            self.assertEqual((Bins[0][0], Bins[-1][1]), (Sketch.Min, Sketch.Max))
+            self.assertAlmostEqual(sum(Count for _, _, Count in Bins), Sketch.Count, delta=8)
+        self.assertEqual(QuantileSketch().Histogram(), [])
+
+
+class QuantileIndexTests(StorageTestCase):
+    # Function to get the quantiles of every (test, month) of an index
+    def Quantiles(self, Index: QuantileIndex):
+        return {(TestName, Month): [Sketch.Quantiles(Percentiles) for Sketch in Pair]
+                for TestName, Months in Index.Table().items() for Month, Pair in Months.items()}
+
+    def testIndexFollowsChanges(self):
+        Store = self.Load()
+        Index = Store.GetIndex('Quantile', QuantileIndex)
+        self.Quantiles(Index)
+        with mock.patch.object(RecordIndexes, 'np', None):
+            self.assertEqual(self.Quantiles(QuantileIndex(Store)), self.Quantiles(Index))
+        for RowId in range(0, 300, 7):
+            Store.SetField(RowId, 'Result', '250')
+        Store.DeleteRow(301)
+        Store.SetField(302, 'DateTime', '2025-02-01 10:00')
+        Store.AppendRecord('1999999', {'TestName': 'Hgb', 'DateTime': '2024-05-05 08:00', 'Result': '14',
+                                       'Unit': 'g/dL', 'Status': 'Completed', 'CompletionTime': '2024-05-05 09:00'})
+        self.assertEqual(self.Quantiles(Index), self.Quantiles(QuantileIndex(Store)))
+
+
+if __name__ == '__main__':
+    unittest.main()
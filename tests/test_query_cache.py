@@ -0,0 +1,99 @@
+from datetime import datetime
+from unittest import mock
+import unittest
+
+from common import StorageTestCase
+import QueryEngine
+from OperationStats import QueryCacheStatistics
+from QueryEngine import ExecuteQuery, Query, QueryCache, RunQuery
+from RecordStore import RecordStore
+
+
+class QueryCacheTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        Patcher = mock.patch.dict(QueryCacheStatistics, clear=True)
+        Patcher.start()
+        self.addCleanup(Patcher.stop)
+
+    def assertFresh(self, Store: RecordStore, Criteria: Query):
+        self.assertEqual(ExecuteQuery(Store, Criteria, self.MedicalTests), RunQuery(Store, Criteria, self.MedicalTests))
+
+    def testRepeatedQueryIsCached(self):
+        Store = self.Load()
+        Criteria = Query(TestName='Hgb', Status='Pending')
+        ExecuteQuery(Store, Criteria)
+        self.assertFresh(Store, Criteria)
+        # Dates are part of the key as minutes, so equal periods share an entry
+        ExecuteQuery(Store, Query(StartDate=datetime(2024, 3, 1)))
+        self.assertFresh(Store, Query(StartDate=datetime(2024, 3, 1, 0, 0, 30)))
+        self.assertEqual((QueryCacheStatistics['hits'], QueryCacheStatistics['misses']), (2, 2))
+
+    def testChangesInvalidateCachedResults(self):
+        Store = self.Load()
+        Pending = Query(TestName='Hgb', Status='Pending')
+        Everything = Query(Status='Pending')
+        for Criteria in (Pending, Everything):
+            ExecuteQuery(Store, Criteria, self.MedicalTests)
+        RowId = RunQuery(Store, Pending)[0]
+
+        Store.SetField(RowId, 'Status', 'Reviewed')
+        self.assertFresh(Store, Pending)
+        self.assertFresh(Store, Everything)
+        Store.AppendRecord('1300500', {"TestName": "Hgb", "DateTime": "2024-05-01 10:00", "Result": "15",
+                                       "Unit": "g/dL", "Status": "Pending"})
+        self.assertFresh(Store, Pending)
+        self.assertFresh(Store, Everything)
+        Store.DeleteRow(RunQuery(Store, Pending)[0])
+        self.assertFresh(Store, Pending)
+        self.assertFresh(Store, Everything)
+        self.assertEqual(QueryCacheStatistics['invalidations'], 6)
+
+    def testChangesKeepOtherTestsCached(self):
+        Store = self.Load()
+        LDL = Query(TestName='LDL', MinResult=100)
+        ExecuteQuery(Store, LDL)
+        Store.SetField(Store.RowsWithTest('Hgb')[0], 'Result', '20')
+        Store.AppendRecord('1300500', {"TestName": "TSH", "DateTime": "2024-05-01 10:00", "Result": "2",
+                                       "Unit": "mIU/L", "Status": "Pending"})
+        self.assertFresh(Store, LDL)
+        self.assertEqual((QueryCacheStatistics['hits'], QueryCacheStatistics['invalidations']), (1, 0))
+        # A test without records gets its first one
+        New = Query(TestName='New')
+        self.assertEqual(ExecuteQuery(Store, New), [])
+        Store.AppendRecord('1300500', {"TestName": "New", "DateTime": "2024-05-01 10:00", "Result": "2",
+                                       "Unit": "mg/dL", "Status": "Pending"})
+        self.assertEqual(ExecuteQuery(Store, New), [Store.RowCount - 1])
+
+    def testRangeChangeInvalidatesAbnormalResults(self):
+        Store = self.Load()
+        Criteria = Query(TestName='Hgb', Abnormal=True)
+        Before = ExecuteQuery(Store, Criteria, self.MedicalTests)
+        Range = self.MedicalTests['Hgb']['range']
+        with mock.patch.dict(Range, {'high': Range['high'] + 1.0}):
+            Narrower = ExecuteQuery(Store, Criteria, self.MedicalTests)
+            self.assertEqual(Narrower, RunQuery(Store, Criteria, self.MedicalTests))
+            self.assertLess(len(Narrower), len(Before))
+        self.assertEqual(ExecuteQuery(Store, Criteria, self.MedicalTests), Before)
+
+    def testCacheIsBoundedByMemory(self):
+        Store = self.Load()
+        Queries = [Query(TestName=TestName) for TestName in Store.Tests.Strings]
+        with mock.patch.object(QueryEngine, 'QueryCacheSize', 0):
+            self.assertFresh(Store, Queries[0])
+        self.assertIsNone(Store.Indexes.get('QueryCache'))
+        with mock.patch.object(QueryEngine, 'QueryCacheSize', 6000):
+            for Criteria in Queries:
+                self.assertFresh(Store, Criteria)
+                Cache = Store.GetIndex('QueryCache', QueryCache)
+                self.assertLessEqual(Cache.Size, 6000)
+            self.assertGreater(QueryCacheStatistics['evictions'], 0)
+            # The most recent entry is kept, the oldest ones are gone
+            self.assertFresh(Store, Queries[-1])
+            self.assertEqual(QueryCacheStatistics['hits'], 1)
+            self.assertFresh(Store, Queries[0])
+            self.assertEqual(QueryCacheStatistics['hits'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
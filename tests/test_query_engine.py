@@ -0,0 +1,72 @@
+from datetime import datetime
+from itertools import product
+import unittest
+
+from common import StorageTestCase
+from Project2 import FilterRecordsByQuery
+from RecordColumns import MinutesSinceEpoch, MissingTime
+from QueryEngine import PlanQuery, Query, RunQuery
+
+
+class QueryEngineTests(StorageTestCase):
+    # Function to check a row against every criterion of a query, one field at a time
+    def Matches(self, Store, RowId, Criteria: Query) -> bool:
+        record = Store.GetRecord(RowId)
+        DateTime = Store.DateTimes[RowId]
+        Turnaround = None
+        if record['Status'] == 'Completed' and Store.CompletionTimes[RowId] != MissingTime:
+            Turnaround = Store.CompletionTimes[RowId] - DateTime
+        TestRange = self.MedicalTests[record['TestName']]['range'] if record['TestName'] in self.MedicalTests else {}
+        Result = Store.Results[RowId]
+        return ((Criteria.PatientId is None or Store.PatientIdOf(RowId) == Criteria.PatientId) and
+                (Criteria.TestName is None or record['TestName'] == Criteria.TestName) and
+                (Criteria.Status is None or record['Status'] == Criteria.Status) and
+                (Criteria.StartDate is None or DateTime >= MinutesSinceEpoch(Criteria.StartDate)) and
+                (Criteria.EndDate is None or DateTime <= MinutesSinceEpoch(Criteria.EndDate)) and
+                (Criteria.MinTurnaround is None or Turnaround is not None and Turnaround >= Criteria.MinTurnaround) and
+                (Criteria.MaxTurnaround is None or Turnaround is not None and Turnaround <= Criteria.MaxTurnaround) and
+                (Criteria.MinResult is None or Result >= Criteria.MinResult) and
+                (Criteria.MaxResult is None or Result <= Criteria.MaxResult) and
+                (not Criteria.Abnormal or (TestRange.get('low') is not None and Result < TestRange['low']) or
+                 (TestRange.get('high') is not None and Result > TestRange['high'])))
+
+    def Queries(self, Store):
+        PatientId = Store.PatientIdOf(0)
+        Options = [dict(PatientId=PatientId), dict(TestName='Hgb'), dict(TestName='Missing'), dict(Status='Completed'),
+                   dict(StartDate=datetime(2024, 3, 1), EndDate=datetime(2024, 4, 30, 23, 59)),
+                   dict(MinTurnaround=60, MaxTurnaround=600), dict(MinResult=100), dict(MaxResult=5),
+                   dict(Abnormal=True)]
+        yield Query()
+        for First, Second in product(Options, repeat=2):
+            if not set(First) & set(Second):
+                yield Query(**First, **Second)
+
+    def testRunQueryMatchesEveryRow(self):
+        Store = self.Load()
+        Store.DeleteRow(0)
+        for Criteria in self.Queries(Store):
+            Expected = [RowId for RowId in Store.InPatientOrder(list(Store.IterRows()))
+                        if self.Matches(Store, RowId, Criteria)]
+            self.assertEqual(RunQuery(Store, Criteria, self.MedicalTests), Expected, Criteria)
+
+    def testPlanOrder(self):
+        Store = self.Load()
+        Steps = PlanQuery(Store, Query(PatientId=Store.PatientIdOf(0), Status='Completed', TestName='Hgb',
+                                       Abnormal=True), self.MedicalTests)
+        self.assertEqual([Step.Name for Step in Steps], ['Patient ID', 'Test Name', 'Status', 'Abnormal Tests'])
+        Sizes = [Step.Size for Step in Steps if Step.Fetch is not None]
+        self.assertEqual(Sizes, sorted(Sizes))
+        with self.assertRaises(ValueError):
+            PlanQuery(Store, Query(Abnormal=True))
+
+    def testFilterRecordsByQuery(self):
+        Store = self.Load()
+        Criteria = Query(TestName='LDL', Status='Completed', MinResult=100)
+        self.assertEqual(FilterRecordsByQuery(Store, Criteria),
+                         [(PatientId, record) for PatientId, Records in Store.items() for record in Records
+                          if record['TestName'] == 'LDL' and record['Status'] == 'Completed' and
+                          float(record['Result']) >= 100])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+from datetime import datetime
+from unittest import mock
+import random
+import unittest
+
+from common import OddLines, StorageTestCase, StoreLines
+import RecordFiles
+from RecordColumns import MinutesSinceEpoch
+from RecordFiles import ColumnMinutes, ParseRecordLine
+from RecordStore import RecordStore, RecordView
+
+
+class RecordStoreTests(StorageTestCase):
+    # Store built record by record, the way the original loader read the file
+    def AppendedStore(self) -> RecordStore:
+        Expected = RecordStore()
+        with open(self.RecordsFile, 'r') as file:
+            for Line in file:
+                Parsed = ParseRecordLine(Line.strip())
+                try:
+                    if Parsed is not None:
+                        Expected.AppendRecord(*Parsed)
+                except ValueError:
+                    pass
+        return Expected
+
+    def assertSameStore(self, Store: RecordStore, Expected: RecordStore):
+        for Name in RecordStore.ColumnNames:
+            self.assertEqual(getattr(Store, Name), getattr(Expected, Name), Name)
+        self.assertEqual(Store.TextOverrides, Expected.TextOverrides)
+        self.assertEqual(StoreLines(Store), StoreLines(Expected))
+
+    def testParseMatchesAppendRecord(self):
+        self.AppendLines(OddLines)
+        Expected = self.AppendedStore()
+        self.assertSameStore(self.Load(), Expected)
+        with mock.patch.object(RecordFiles, 'np', None):
+            self.assertSameStore(self.Load(), Expected)
+
+    def testLinesSurviveTheColumns(self):
+        self.AppendLines(OddLines[:2])
+        Store = self.Load()
+        with open(self.RecordsFile, 'r') as file:
+            Lines = [Line.strip() for Line in file]
+        self.assertEqual([Store.FormatLine(RowId) for RowId in range(Store.RowCount)], Lines)
+
+    def testEditsThroughRecordView(self):
+        Store = self.Load()
+        record = RecordView(Store, 4)
+        record['Result'] = '12.50'
+        record['Status'] = 'Pending'
+        del record['CompletionTime']
+        self.assertEqual(Store.GetRecord(4)['Result'], '12.50')
+        self.assertEqual(Store.Results[4], 12.5)
+        self.assertNotIn('CompletionTime', Store.GetRecord(4))
+        with self.assertRaises(ValueError):
+            record['DateTime'] = '2024-02-30 10:00'
+        PatientId = Store.PatientIdOf(4)
+        Store.DeleteRow(4)
+        self.assertNotIn(4, Store.RowsOf(PatientId))
+        self.assertEqual(Store.LiveRowCount, Store.RowCount - 1)
+
+
+class ColumnMinutesTests(unittest.TestCase):
+    def Reference(self, Text):
+        try:
+            return MinutesSinceEpoch(datetime.strptime(Text, '%Y-%m-%d %H:%M'))
+        except ValueError:
+            return None
+
+    @unittest.skipIf(RecordFiles.np is None, "NumPy is not installed")
+    def testMatchesStrptime(self):
+        Random = random.Random(5)
+        Texts = [f"{Random.choice([Random.randint(0, 9999), Random.randint(1890, 2110)]):04d}-"
+                 f"{Random.randint(0, 14):02d}-{Random.randint(0, 32):02d} "
+                 f"{Random.randint(0, 25):02d}:{Random.randint(0, 61):02d}" for _ in range(20000)]
+        Texts += ['2024-02-29 00:00', '2023-02-29 00:00', '1900-02-29 00:00', '2000-02-29 00:00', '0000-01-01 00:00',
+                  '0001-01-01 00:00', '9999-12-31 23:59', '1969-12-31 23:59']
+        for Text in Texts:
+            Minutes = ColumnMinutes([Text])
+            self.assertEqual(Minutes[0] if Minutes else None, self.Reference(Text), Text)
+        Valid = [Text for Text in Texts if self.Reference(Text) is not None]
+        self.assertEqual(ColumnMinutes(Valid), [self.Reference(Text) for Text in Valid])
+        self.assertEqual(ColumnMinutes(Valid[:3] + [''], -1)[-1], -1)
+        self.assertIsNone(ColumnMinutes(['', '2024-01-01 10:0'], -1))
+
+
+if __name__ == '__main__':
+    unittest.main()
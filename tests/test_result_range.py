@@ -0,0 +1,86 @@
+from unittest import mock
+import unittest
+
+from common import Printed, StorageTestCase
+import RecordIndexes
+from Project2 import FilterMostAbnormalTests, FilterRecordsByResultRange, MostAbnormalRows, RangeDeviation
+
+
+class ResultRangeTests(StorageTestCase):
+    # Function to get the rows of a test in a result range by checking every row
+    def Expected(self, Store, TestName, MinResult, MaxResult):
+        return sorted(RowId for RowId in Store.IterRows() if Store.GetField(RowId, 'TestName') == TestName
+                      and (MinResult is None or Store.Results[RowId] >= MinResult)
+                      and (MaxResult is None or Store.Results[RowId] <= MaxResult))
+
+    # Function to get the deviation of every result outside its range, largest first
+    def Deviations(self, Store, TestName=None):
+        Deviations = []
+        for RowId in Store.IterRows():
+            Name = Store.GetField(RowId, 'TestName')
+            if TestName not in (None, Name) or Name not in self.MedicalTests:
+                continue
+            TestRange, Result = self.MedicalTests[Name]['range'], Store.Results[RowId]
+            if 'low' in TestRange and Result < TestRange['low']:
+                Deviations.append((RangeDeviation(Result, TestRange['low']), RowId))
+            elif 'high' in TestRange and Result > TestRange['high']:
+                Deviations.append((RangeDeviation(Result, TestRange['high']), RowId))
+        return sorted(Deviations, reverse=True)
+
+    def assertRanges(self, Store):
+        for TestName, MinResult, MaxResult in (('LDL', 100, 150), ('Hgb', None, 13.8), ('TSH', 4.0, None),
+                                               ('BGT', None, None), ('Cr', 2, 1), ('Unknown', 0, 1)):
+            Found = FilterRecordsByResultRange(Store, TestName, MinResult, MaxResult)
+            Results = [float(record['Result']) for _, record in Found]
+            self.assertEqual(Results, sorted(Results))
+            self.assertEqual(sorted(record.RowId for _, record in Found),
+                             self.Expected(Store, TestName, MinResult, MaxResult))
+            for PatientId, record in Found:
+                self.assertEqual(PatientId, Store.PatientIdOf(record.RowId))
+
+    def assertMostAbnormal(self, Store, Count, TestName=None):
+        Expected = self.Deviations(Store, TestName)
+        Found = MostAbnormalRows(Store, self.MedicalTests, Count, TestName)
+        self.assertEqual([Deviation for Deviation, _ in Found], [Deviation for Deviation, _ in Expected[:Count]])
+        self.assertEqual(len({RowId for _, RowId in Found}), len(Found))
+        self.assertLessEqual(set(Found), set(Expected))
+
+    def testResultRangeMatchesRows(self):
+        self.assertRanges(self.Load())
+        with mock.patch.object(RecordIndexes, 'np', None):
+            self.assertRanges(self.Load())
+
+    def testMostAbnormalMatchesRows(self):
+        Store = self.Load()
+        for Count in (1, 10, 100, 10 ** 6):
+            self.assertMostAbnormal(Store, Count)
+        self.assertMostAbnormal(Store, 20, 'LDL')
+        self.assertEqual(MostAbnormalRows(Store, self.MedicalTests, 5, 'Unknown'), [])
+
+    def testResultIndexFollowsChanges(self):
+        Store = self.Load()
+        self.assertRanges(Store)
+        self.assertMostAbnormal(Store, 50)
+        LDLRows = Store.RowsWithTest('LDL')
+        Store.SetField(LDLRows[0], 'Result', '999')
+        Store.SetField(LDLRows[1], 'Result', '120')
+        Store.DeleteRow(LDLRows[2])
+        Store.SetField(LDLRows[3], 'TestName', 'Hgb')
+        Store.AppendRecord('1999999', {'TestName': 'Hgb', 'DateTime': '2024-05-05 08:00', 'Result': '0.5',
+                                       'Unit': 'g/dL', 'Status': 'Pending'})
+        self.assertRanges(Store)
+        self.assertMostAbnormal(Store, 50)
+        self.assertEqual(MostAbnormalRows(Store, self.MedicalTests, 1, 'LDL')[0][1], LDLRows[0])
+
+    def testFilterMostAbnormalTests(self):
+        Store = self.Load()
+        Output = Printed(FilterMostAbnormalTests, Store, self.MedicalTests, 3)
+        Lines = [Line for Line in Output.split('\n') if Line.endswith('outside the range)')]
+        self.assertEqual(Lines, [f"{Store.FormatLine(RowId)} ({Deviation:.0%} outside the range)"
+                                 for Deviation, RowId in MostAbnormalRows(Store, self.MedicalTests, 3)])
+        self.assertEqual(Printed(FilterMostAbnormalTests, Store, self.MedicalTests, 3, 'Unknown'),
+                         "No Abnormal Tests Found.\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+from contextlib import redirect_stdout
+from unittest import mock
+import io
+import os
+import unittest
+
+from common import Printed, Quiet, StorageTestCase
+import RecordFiles
+from Project2 import CalculateTurnaroundTimes, FilterRecordsByAbnormalTests, GenerateSummaryReport
+from RecordFiles import IterMedicalRecords
+from StorageBackends import FlatFileBackend, PartitionedBackend, PartitionMedicalRecordFile
+
+
+class ShardedScanTests(StorageTestCase):
+    Rows = 4000
+    MalformedRate = 0.01
+
+    def setUp(self):
+        super().setUp()
+        Patcher = mock.patch.object(RecordFiles, 'ShardSize', 8192)
+        Patcher.start()
+        self.addCleanup(Patcher.stop)
+        self.Store = self.Load()
+        Partitions = os.path.join(self.Directory, 'Partitions')
+        PartitionMedicalRecordFile(self.RecordsFile, Partitions)
+        self.Sources = {'file': FlatFileBackend(self.RecordsFile), 'partitioned': PartitionedBackend(Partitions)}
+        # A partitioned backend holds the records month by month, its loaded store in that order
+        self.Stores = {'file': self.Store, 'partitioned': PartitionedBackend(Partitions).Load()}
+
+    # Function to capture what a scan prints, without the malformed lines it reports
+    def Scanned(self, Function, *Arguments, **Options) -> str:
+        return '\n'.join(Line for Line in Printed(Function, *Arguments, **Options).split('\n')
+                         if not Line.startswith('Skipping malformed record'))
+
+    def testShardsCoverTheFile(self):
+        Shards = self.Sources['file'].Shards()
+        self.assertGreater(len(Shards), 1)
+        self.assertEqual(Shards[0][1], 0)
+        self.assertEqual([End for _, _, End in Shards[:-1]], [Start for _, Start, _ in Shards[1:]])
+        self.assertEqual(Shards[-1][2], os.path.getsize(self.RecordsFile))
+
+    def testAbnormalOutputMatchesLoaded(self):
+        for Name, Storage in self.Sources.items():
+            Expected = Printed(FilterRecordsByAbnormalTests, self.Stores[Name], self.MedicalTests)
+            for Parallel in (1, 2):
+                with self.subTest(Name, Parallel=Parallel):
+                    self.assertEqual(self.Scanned(FilterRecordsByAbnormalTests, Storage, self.MedicalTests, Parallel),
+                                     Expected)
+
+    def testTurnaroundTimesMatchLoaded(self):
+        self.assertEqual(CalculateTurnaroundTimes(IterMedicalRecords(self.RecordsFile, Quiet)),
+                         CalculateTurnaroundTimes(self.Store))
+        for Name, Storage in self.Sources.items():
+            Expected = CalculateTurnaroundTimes(self.Stores[Name])
+            for Parallel in (1, 2):
+                with self.subTest(Name, Parallel=Parallel):
+                    with redirect_stdout(io.StringIO()):
+                        Found = CalculateTurnaroundTimes(Storage, Parallel)
+                    self.assertEqual(list(Found.items()), list(Expected.items()))
+
+    def testSummaryReportMatchesLoaded(self):
+        for Options in ({}, {'Monthly': True, 'Histogram': True}):
+            for Name, Storage in self.Sources.items():
+                Expected = Printed(GenerateSummaryReport, self.Stores[Name], **Options)
+                for Parallel in (1, 2):
+                    with self.subTest(Name, Parallel=Parallel, **Options):
+                        self.assertEqual(self.Scanned(GenerateSummaryReport, Storage, Parallel=Parallel, **Options),
+                                         Expected)
+
+    def testJournaledFileIsOneShard(self):
+        Storage = self.Sources['file']
+        # Not the first record of its patient, which would move the patient in the loaded order
+        Deleted = next(RowId for RowId in range(6, self.Store.RowCount)
+                       if self.Store.RowsOf(self.Store.PatientIdOf(RowId))[0] != RowId)
+        Storage.Update({5: {'Result': '999'}})
+        Storage.Delete([Deleted])
+        self.assertEqual(Storage.Shards(), [(self.RecordsFile, 0, None)])
+        Expected = Printed(FilterRecordsByAbnormalTests, self.Load(), self.MedicalTests)
+        self.assertEqual(self.Scanned(FilterRecordsByAbnormalTests, Storage, self.MedicalTests, 2), Expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
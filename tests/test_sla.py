@@ -0,0 +1,51 @@
+from unittest import mock
+import unittest
+
+from common import Printed, StorageTestCase
+from Project2 import GenerateSLAReport, OverdueRecords, RowTurnaroundMinutes
+from RecordColumns import MinutesToDateTime
+
+
+class SLATests(StorageTestCase):
+    # Function to list the overdue rows of a test by day, checking every row
+    def Expected(self, Store, TestName, Allowed):
+        Completed = []
+        for RowId in Store.IterRows():
+            if Store.GetField(RowId, 'TestName') == TestName and RowTurnaroundMinutes(Store, RowId) is not None:
+                Completed.append(RowId)
+        Days = {}
+        for RowId in sorted(Completed, key=lambda RowId: (Store.DateTimes[RowId], RowId)):
+            if RowTurnaroundMinutes(Store, RowId) > Allowed:
+                Days.setdefault(MinutesToDateTime(Store.DateTimes[RowId])[:10], []).append(RowId)
+        return Allowed, len(Completed), Days
+
+    def testOverdueRecordsUseCatalogTurnaround(self):
+        Store = self.Load()
+        Overdue = OverdueRecords(Store, self.MedicalTests)
+        self.assertEqual(sorted(Overdue), sorted(TestName for TestName in Store.Tests.Strings
+                                                 if self.MedicalTests[TestName]['turnaround_minutes'] is not None))
+        for TestName, Found in Overdue.items():
+            self.assertEqual(Found, self.Expected(Store, TestName, self.MedicalTests[TestName]['turnaround_minutes']))
+        self.assertTrue(any(Days for _, _, Days in Overdue.values()))
+
+    def testThresholdAndTestsWithoutTurnaround(self):
+        Store = self.Load()
+        with mock.patch.dict(self.MedicalTests['Hgb'], {'turnaround_minutes': None}):
+            self.assertNotIn('Hgb', OverdueRecords(Store, self.MedicalTests))
+            self.assertEqual(OverdueRecords(Store, self.MedicalTests, 'Hgb', 120),
+                             {'Hgb': self.Expected(Store, 'Hgb', 120)})
+
+    def testOverdueFollowsChanges(self):
+        Store = self.Load()
+        Allowed = self.MedicalTests['Hgb']['turnaround_minutes']
+        RowId = Store.RowsWithTest('Hgb')[0]
+        Store.SetField(RowId, 'Status', 'Completed')
+        Store.SetField(RowId, 'CompletionTime', MinutesToDateTime(Store.DateTimes[RowId] + Allowed + 1))
+        self.assertEqual(OverdueRecords(Store, self.MedicalTests, 'Hgb'), {'Hgb': self.Expected(Store, 'Hgb', Allowed)})
+        Report = Printed(GenerateSLAReport, Store, self.MedicalTests, 'Hgb')
+        self.assertIn(MinutesToDateTime(Store.DateTimes[RowId])[:10], Report)
+        self.assertIn(Store.FormatLine(RowId).split(': ', 1)[0], Report)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import unittest
+
+from common import OddLines, StorageTestCase, StoreLines
+from RecordFiles import SnapshotFileOf
+from StorageBackends import FlatFileBackend
+
+
+class SnapshotTests(StorageTestCase):
+    MalformedRate = 0.01
+
+    def testSnapshotRoundTrip(self):
+        Parsed = self.Load()
+        self.Load(UseSnapshot=True)
+        self.assertTrue(os.path.exists(SnapshotFileOf(self.RecordsFile)))
+        Snapshot = self.Load(UseSnapshot=True)
+        self.assertEqual(StoreLines(Snapshot), StoreLines(Parsed))
+        self.assertEqual(Snapshot.TextOverrides, Parsed.TextOverrides)
+        # The snapshot store takes changes like a parsed one
+        Snapshot.AppendRecord('1300500', {"TestName": "Hgb", "DateTime": "2024-05-01 10:00", "Result": "15",
+                                          "Unit": "g/dL", "Status": "Pending"})
+        Snapshot.SetField(0, 'Status', 'Reviewed')
+        self.assertEqual(Snapshot.GetField(0, 'Status'), 'Reviewed')
+
+    def testAppendedLinesAndJournal(self):
+        self.Load(UseSnapshot=True)
+        self.AppendLines(OddLines)
+        FlatFileBackend(self.RecordsFile).Update({3: {'Result': '7.25'}})
+        Snapshot = self.Load(UseSnapshot=True)
+        Parsed = self.Load()
+        self.assertEqual(StoreLines(Snapshot), StoreLines(Parsed))
+        self.assertEqual(Snapshot.TextOverrides, Parsed.TextOverrides)
+        self.assertEqual(Snapshot.GetField(3, 'Result'), '7.25')
+
+    def testChangedFileIsParsedAgain(self):
+        self.Load(UseSnapshot=True)
+        with open(self.RecordsFile, 'r') as file:
+            Lines = file.read().splitlines()
+        # Same size, other content: the hash tells them apart
+        Lines[0], Lines[1] = Lines[1], Lines[0]
+        with open(self.RecordsFile, 'w') as file:
+            file.write('\n'.join(Lines) + '\n')
+        self.assertEqual(StoreLines(self.Load(UseSnapshot=True)), StoreLines(self.Load()))
+
+    def testDamagedSnapshotIsIgnored(self):
+        self.Load(UseSnapshot=True)
+        with open(SnapshotFileOf(self.RecordsFile), 'r+b') as file:
+            file.truncate(100)
+        self.assertEqual(StoreLines(self.Load(UseSnapshot=True)), StoreLines(self.Load()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import unittest
+
+from common import AgreementQueries, BackendLines, StorageTestCase, StoreLines
+from RecordColumns import FormatRecord
+from RecordIndexes import SummaryIndex
+from QueryEngine import RunQuery
+from StorageBackends import SQLiteBackend
+
+
+class SQLiteBackendTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.Store = self.Load()
+        self.Store.DeleteRow(10)
+        self.Storage = SQLiteBackend(os.path.join(self.Directory, 'MedicalRecord.db'))
+        self.Storage.AppendStore(self.Store)
+
+    def tearDown(self):
+        self.Storage.Connection.close()
+        super().tearDown()
+
+    def testQueriesAgreeWithStore(self):
+        for Criteria in AgreementQueries(self.Store):
+            Found = sorted(FormatRecord(PatientId, record)
+                           for _, PatientId, record in self.Storage.QueryRecords(Criteria, self.MedicalTests))
+            Expected = sorted(self.Store.FormatLine(RowId) for RowId in RunQuery(self.Store, Criteria, self.MedicalTests))
+            self.assertEqual(Found, Expected, Criteria)
+
+    def testLoadAndSummary(self):
+        Loaded = self.Storage.Load()
+        self.assertEqual(StoreLines(Loaded), StoreLines(self.Store))
+        self.assertEqual(Loaded.Deleted, {10})
+        Expected = SummaryIndex(self.Store).Stats()
+        Summary = self.Storage.Summary()
+        self.assertEqual(sorted(Summary), sorted(Expected))
+        for TestName, (Results, Turnarounds) in Expected.items():
+            for Found, Wanted in zip(Summary[TestName], (Results, Turnarounds)):
+                self.assertEqual([Found[0], Found[2], Found[3]], [Wanted[0], Wanted[2], Wanted[3]], TestName)
+                self.assertAlmostEqual(Found[1], Wanted[1], places=6)
+
+    def testChangesKeepRecordIds(self):
+        Before = BackendLines(self.Storage)
+        self.Storage.Update({5: {'Result': '12.50', 'Status': 'Reviewed', 'CompletionTime': ''}})
+        self.Storage.Delete([6])
+        self.Storage.Append([('1300500', {"TestName": "Hgb", "DateTime": "2024-05-01 10:00", "Result": "15",
+                                          "Unit": "g/dL", "Status": "Pending"})])
+        After = BackendLines(self.Storage)
+        self.assertEqual(After[5].split(', ')[2:], ['12.50', Before[5].split(', ')[3], 'Reviewed'])
+        self.assertNotIn(6, After)
+        self.assertEqual(max(After), self.Store.RowCount)
+        self.assertEqual({RecordId: Line for RecordId, Line in After.items() if RecordId not in (5, self.Store.RowCount)},
+                         {RecordId: Line for RecordId, Line in Before.items() if RecordId not in (5, 6)})
+        Store, RecordIds = self.Storage.LoadPatient('1300500')
+        self.assertEqual(RecordIds[-1], self.Store.RowCount)
+
+
+if __name__ == '__main__':
+    unittest.main()
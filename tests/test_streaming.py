@@ -0,0 +1,43 @@
+from unittest import mock
+import unittest
+
+from common import OddLines, Quiet, StorageTestCase, StoreLines
+import RecordFiles
+from RecordColumns import FormatRecord
+from RecordFiles import IterMedicalRecordBatches, IterMedicalRecords, IterRecordFileLines
+
+
+class StreamingTests(StorageTestCase):
+    MalformedRate = 0.01
+
+    def testStreamMatchesLoadedRecords(self):
+        Malformed = []
+        Streamed = [FormatRecord(PatientId, record) for PatientId, record
+                    in IterMedicalRecords(self.RecordsFile, lambda Offset, Line: Malformed.append((Offset, Line)))]
+        Store = self.Load()
+        self.assertEqual(Streamed, [Store.FormatLine(RowId) for RowId in range(Store.RowCount)])
+        self.assertTrue(Malformed)
+        # Every reported offset is where its line starts in the file
+        with open(self.RecordsFile, 'rb') as file:
+            Content = file.read()
+        for Offset, Line in Malformed:
+            self.assertEqual(Content[Offset:Offset + len(Line)].decode(), Line)
+
+    def testLinesAcrossBlocks(self):
+        self.AppendLines(OddLines)
+        with open(self.RecordsFile, 'r') as file:
+            Expected = [Line.strip() for Line in file if Line.strip()]
+        with mock.patch.object(RecordFiles, 'BlockSize', 100):
+            self.assertEqual([Line for _, Line in IterRecordFileLines(self.RecordsFile)], Expected)
+            Small = self.Load()
+        self.assertEqual(StoreLines(Small), StoreLines(self.Load()))
+
+    def testBatches(self):
+        Streamed = list(IterMedicalRecords(self.RecordsFile, Quiet))
+        Batches = list(IterMedicalRecordBatches(self.RecordsFile, 300, Quiet))
+        self.assertTrue(all(len(Batch) == 300 for Batch in Batches[:-1]))
+        self.assertEqual([Pair for Batch in Batches for Pair in Batch], Streamed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+from datetime import datetime
+from unittest import mock
+import unittest
+
+from common import Printed, Quiet, StorageTestCase
+import RecordFiles
+from Project2 import CalculateTurnaroundTimes, GenerateSummaryReport
+from RecordFiles import IterMedicalRecords
+from RecordIndexes import SummaryIndex
+from StorageBackends import FlatFileBackend
+
+
+# The turnaround minutes of every test as the original CalculateTurnaroundTimes computed them
+def BaselineTurnaroundTimes(MedicalRecords):
+    TurnaroundTimes = {}
+    for PatientId, records in MedicalRecords.items():
+        for record in records:
+            if 'CompletionTime' in record and record['Status'] == 'Completed':
+                Turnaround = (datetime.strptime(record['CompletionTime'], "%Y-%m-%d %H:%M") -
+                              datetime.strptime(record['DateTime'], "%Y-%m-%d %H:%M"))
+                TurnaroundTimes.setdefault(record['TestName'], []).append(Turnaround.days * 1440 +
+                                                                          Turnaround.seconds // 60)
+    return TurnaroundTimes
+
+
+class SummaryTests(StorageTestCase):
+    def testTurnaroundTimesKeepRecordOrder(self):
+        Store = self.Load()
+        Expected = list(BaselineTurnaroundTimes(Store).items())
+        self.assertEqual(list(CalculateTurnaroundTimes(Store).items()), Expected)
+        self.assertEqual(list(CalculateTurnaroundTimes(IterMedicalRecords(self.RecordsFile, Quiet)).items()), Expected)
+        with mock.patch.object(RecordFiles, 'ShardSize', 8192):
+            Storage = FlatFileBackend(self.RecordsFile)
+            self.assertGreater(len(Storage.Shards()), 1)
+            self.assertEqual(list(CalculateTurnaroundTimes(Storage).items()), Expected)
+
+    def testReportListsTestsInRecordOrder(self):
+        Store = self.Load()
+        Tests = list(dict.fromkeys(record['TestName'] for Records in Store.values() for record in Records))
+        Lines = Printed(GenerateSummaryReport, Store).splitlines()
+        self.assertEqual([Line.split('\t')[1] for Line in Lines if Line.startswith('-----')], Tests)
+        Results = [float(record['Result']) for Records in Store.values() for record in Records
+                   if record['TestName'] == Tests[0]]
+        self.assertIn(f" Min Result: {min(Results):.2f}\t Max Result: {max(Results):.2f}\t "
+                      f"Average: {sum(Results) / len(Results):.2f}", Lines)
+
+    def testAggregatesFollowChanges(self):
+        Store = self.Load()
+        Summary = Store.GetIndex('Summary', SummaryIndex)
+        Summary.Stats()
+        Hgb = Store.RowsWithTest('Hgb')
+        Highest = max(Hgb, key=Store.Results.__getitem__)
+        Store.DeleteRow(Highest)  # The maximum has to be found again
+        Store.SetField(Hgb[0], 'Result', '0.5')
+        Store.SetField(Hgb[1], 'Status', 'Pending')
+        Store.AppendRecord('1300500', {"TestName": "Hgb", "DateTime": "2024-05-01 10:00", "Result": "15",
+                                       "Unit": "g/dL", "Status": "Completed", "CompletionTime": "2024-05-01 12:00"})
+        Maintained = Summary.Stats()
+        Rebuilt = SummaryIndex(Store).Stats()
+        self.assertEqual(list(Maintained), list(Rebuilt))
+        for TestName, (Results, Turnarounds) in Rebuilt.items():
+            for Kept, Fresh in zip(Maintained[TestName], (Results, Turnarounds)):
+                self.assertEqual([Kept[0], Kept[2], Kept[3]], [Fresh[0], Fresh[2], Fresh[3]], TestName)
+                self.assertAlmostEqual(Kept[1], Fresh[1], places=6)
+        self.assertEqual(Maintained['Hgb'][0][2], 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+from datetime import datetime
+from unittest import mock
+import unittest
+
+from common import StorageTestCase
+import QueryEngine
+from RecordColumns import MinutesSinceEpoch
+from QueryEngine import ScanRows
+
+
+@unittest.skipIf(QueryEngine.np is None, "NumPy is not installed")
+class VectorizedScanTests(StorageTestCase):
+    def Scans(self):
+        March = MinutesSinceEpoch(datetime(2024, 3, 1))
+        April = MinutesSinceEpoch(datetime(2024, 4, 1))
+        return [{}, dict(medical_tests=self.MedicalTests), dict(MinResult=50, MaxResult=150),
+                dict(StartMinutes=March, EndMinutes=April, medical_tests=self.MedicalTests),
+                dict(CompletedAfter=March), dict(CompletedBefore=April, MaxResult=10)]
+
+    def testNumPyMatchesLoops(self):
+        Store = self.Load()
+        Store.DeleteRow(1)
+        Store.SetField(2, 'Result', '1000')
+        for Options in self.Scans():
+            Vectorized = ScanRows(Store, **Options)
+            with mock.patch.object(QueryEngine, 'np', None):
+                self.assertEqual(Vectorized, ScanRows(Store, **Options), Options)
+        self.assertNotIn(1, ScanRows(Store))
+
+    def testStoreGrowsAfterScan(self):
+        Store = self.Load()
+        ScanRows(Store, medical_tests=self.MedicalTests)
+        # No NumPy view outlives the scan, or the arrays could not grow
+        Store.AppendRecord('1300500', {"TestName": "Hgb", "DateTime": "2024-05-01 10:00", "Result": "99",
+                                       "Unit": "g/dL", "Status": "Pending"})
+        self.assertEqual(ScanRows(Store, MinResult=99, MaxResult=99)[-1], Store.RowCount - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()